@@ -4,7 +4,9 @@ from .models import (
     Account, Transaction, TransactionEntry,
     Budget, BudgetItem, Invoice, InvoiceItem,
     FixedAsset, TaxRate, Payment,
-    RecurringInvoice, RecurringInvoiceItem
+    RecurringInvoice, RecurringInvoiceItem, LedgerPeriodChecksum,
+    PeriodClose, ClosingBalance, NumberSequence, PaymentAllocation, Party,
+    DepreciationRun, ExchangeRate, AllocationRule, AllocationTarget, AllocationRun
 )
 
 @admin.register(Account)
@@ -39,8 +41,8 @@ class TransactionAdmin(admin.ModelAdmin):
     list_display = ('date', 'organization', 'description', 'status', 'total_amount', 'created_by')
     list_filter = ('organization', 'status', 'is_recurring', 'date', 'created_at')
     search_fields = ('description', 'reference')
-    raw_id_fields = ('organization', 'created_by', 'approved_by')
-    readonly_fields = ('created_at', 'updated_at', 'created_by', 'approved_by')
+    raw_id_fields = ('organization', 'created_by', 'approved_by', 'recurrence_source', 'reversal_of')
+    readonly_fields = ('created_at', 'updated_at', 'created_by', 'approved_by', 'next_recurrence_date')
     
     fieldsets = (
         (None, {
@@ -50,7 +52,14 @@ class TransactionAdmin(admin.ModelAdmin):
             'fields': ('status',)
         }),
         (_('Recurrence'), {
-            'fields': ('is_recurring', 'recurrence_type', 'recurrence_end_date'),
+            'fields': (
+                'is_recurring', 'recurrence_type', 'recurrence_end_date',
+                'next_recurrence_date', 'recurrence_source'
+            ),
+            'classes': ('collapse',)
+        }),
+        (_('Reversal'), {
+            'fields': ('reverse_on', 'reversal_of'),
             'classes': ('collapse',)
         }),
         (_('Tags'), {
@@ -106,10 +115,13 @@ class BudgetAdmin(admin.ModelAdmin):
 @admin.register(Invoice)
 class InvoiceAdmin(admin.ModelAdmin):
     list_display = ('number', 'organization', 'type', 'party_name', 'date', 'due_date', 'total', 'status')
-    list_filter = ('organization', 'type', 'status', 'date', 'created_at')
+    list_filter = ('organization', 'type', 'status', 'email_status', 'date', 'created_at')
     search_fields = ('number', 'reference', 'party_name', 'party_tax_id')
-    raw_id_fields = ('organization', 'created_by')
-    readonly_fields = ('created_at', 'updated_at', 'created_by', 'subtotal', 'tax_amount', 'total', 'amount_paid')
+    raw_id_fields = ('organization', 'party', 'created_by')
+    readonly_fields = (
+        'created_at', 'updated_at', 'created_by', 'subtotal', 'tax_amount', 'total', 'amount_paid',
+        'email_status', 'email_sent_at', 'email_attempts', 'email_error'
+    )
     
     fieldsets = (
         (None, {
@@ -119,7 +131,7 @@ class InvoiceAdmin(admin.ModelAdmin):
             'fields': ('date', 'due_date')
         }),
         (_('Party Information'), {
-            'fields': ('party_name', 'party_tax_id', 'party_address', 'party_email', 'party_phone')
+            'fields': ('party', 'party_name', 'party_tax_id', 'party_address', 'party_email', 'party_phone')
         }),
         (_('Amounts'), {
             'fields': ('subtotal', 'tax_amount', 'total', 'amount_paid', 'currency', 'exchange_rate')
@@ -131,6 +143,10 @@ class InvoiceAdmin(admin.ModelAdmin):
         (_('Status'), {
             'fields': ('status',)
         }),
+        (_('Email Delivery'), {
+            'fields': ('email_status', 'email_sent_at', 'email_attempts', 'email_error'),
+            'classes': ('collapse',)
+        }),
         (_('Metadata'), {
             'fields': ('created_by', 'created_at', 'updated_at'),
             'classes': ('collapse',)
@@ -150,8 +166,14 @@ class FixedAssetAdmin(admin.ModelAdmin):
     list_display = ('asset_number', 'name', 'organization', 'purchase_date', 'purchase_cost', 'current_value', 'status')
     list_filter = ('organization', 'status', 'purchase_date', 'created_at')
     search_fields = ('asset_number', 'name', 'description')
-    raw_id_fields = ('organization', 'custodian', 'created_by')
-    readonly_fields = ('created_at', 'updated_at', 'created_by')
+    raw_id_fields = (
+        'organization', 'custodian', 'created_by', 'asset_account',
+        'accumulated_depreciation_account', 'depreciation_expense_account'
+    )
+    readonly_fields = (
+        'created_at', 'updated_at', 'created_by', 'depreciated_through',
+        'disposal_date', 'disposal_proceeds', 'disposal_transaction'
+    )
     
     fieldsets = (
         (None, {
@@ -162,7 +184,11 @@ class FixedAssetAdmin(admin.ModelAdmin):
         }),
         (_('Depreciation'), {
             'fields': ('useful_life_years', 'salvage_value', 'depreciation_method',
-                      'current_value', 'accumulated_depreciation')
+                      'current_value', 'accumulated_depreciation', 'depreciated_through')
+        }),
+        (_('Accounts'), {
+            'fields': ('asset_account', 'accumulated_depreciation_account',
+                      'depreciation_expense_account')
         }),
         (_('Location & Tracking'), {
             'fields': ('location', 'custodian')
@@ -174,12 +200,46 @@ class FixedAssetAdmin(admin.ModelAdmin):
         (_('Status'), {
             'fields': ('status',)
         }),
+        (_('Disposal'), {
+            'fields': ('disposal_date', 'disposal_proceeds', 'disposal_transaction'),
+            'classes': ('collapse',)
+        }),
         (_('Metadata'), {
             'fields': ('created_by', 'created_at', 'updated_at'),
             'classes': ('collapse',)
         }),
     )
 
+@admin.register(DepreciationRun)
+class DepreciationRunAdmin(admin.ModelAdmin):
+    list_display = ('organization', 'period_end', 'asset_count', 'total_amount', 'created_at')
+    list_filter = ('organization', 'period_end')
+    raw_id_fields = ('organization', 'transaction', 'created_by')
+    readonly_fields = ('asset_count', 'total_amount', 'created_at')
+
+@admin.register(AllocationRule)
+class AllocationRuleAdmin(admin.ModelAdmin):
+    list_display = ('name', 'organization', 'source_account', 'method', 'is_active')
+    list_filter = ('organization', 'method', 'is_active')
+    search_fields = ('name', 'description')
+    raw_id_fields = ('organization', 'source_account', 'created_by')
+    readonly_fields = ('created_at', 'updated_at', 'created_by')
+    
+    inlines = [
+        type('AllocationTargetInline', (admin.TabularInline,), {
+            'model': AllocationTarget,
+            'extra': 1,
+            'raw_id_fields': ('account', 'driver_account'),
+        })
+    ]
+
+@admin.register(AllocationRun)
+class AllocationRunAdmin(admin.ModelAdmin):
+    list_display = ('rule', 'organization', 'period_end', 'amount', 'created_at')
+    list_filter = ('organization', 'period_end')
+    raw_id_fields = ('organization', 'rule', 'transaction', 'created_by')
+    readonly_fields = ('amount', 'created_at')
+
 @admin.register(TaxRate)
 class TaxRateAdmin(admin.ModelAdmin):
     list_display = ('name', 'organization', 'rate', 'is_compound', 'is_recoverable', 'is_active')
@@ -202,6 +262,14 @@ class TaxRateAdmin(admin.ModelAdmin):
         }),
     )
 
+@admin.register(ExchangeRate)
+class ExchangeRateAdmin(admin.ModelAdmin):
+    list_display = ('currency', 'date', 'rate', 'organization', 'source')
+    list_filter = ('organization', 'currency')
+    search_fields = ('currency', 'source')
+    raw_id_fields = ('organization',)
+    date_hierarchy = 'date'
+
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
     list_display = ('invoice', 'date', 'amount', 'method', 'status', 'reference')
@@ -241,13 +309,21 @@ class PaymentAdmin(admin.ModelAdmin):
             'classes': ('collapse',)
         }),
     )
+    
+    inlines = [
+        type('PaymentAllocationInline', (admin.TabularInline,), {
+            'model': PaymentAllocation,
+            'extra': 0,
+            'raw_id_fields': ('invoice',),
+        })
+    ]
 
 @admin.register(RecurringInvoice)
 class RecurringInvoiceAdmin(admin.ModelAdmin):
     list_display = ('name', 'organization', 'frequency', 'start_date', 'next_date', 'is_active')
     list_filter = ('organization', 'frequency', 'is_active', 'created_at')
     search_fields = ('name', 'description', 'party_name')
-    raw_id_fields = ('organization', 'created_by')
+    raw_id_fields = ('organization', 'party', 'created_by')
     readonly_fields = ('created_at', 'updated_at', 'created_by')
     
     fieldsets = (
@@ -258,7 +334,7 @@ class RecurringInvoiceAdmin(admin.ModelAdmin):
             'fields': ('start_date', 'end_date', 'frequency', 'next_date')
         }),
         (_('Template Data'), {
-            'fields': ('invoice_type', 'party_name', 'party_tax_id', 'party_address',
+            'fields': ('invoice_type', 'party', 'party_name', 'party_tax_id', 'party_address',
                       'party_email', 'party_phone')
         }),
         (_('Additional Information'), {
@@ -281,3 +357,50 @@ class RecurringInvoiceAdmin(admin.ModelAdmin):
             'raw_id_fields': ('income_account', 'tax_account'),
         })
     ]
+
+@admin.register(LedgerPeriodChecksum)
+class LedgerPeriodChecksumAdmin(admin.ModelAdmin):
+    list_display = ('organization', 'period', 'entry_count', 'total_amount', 'verified_at')
+    list_filter = ('organization',)
+    raw_id_fields = ('organization',)
+    readonly_fields = (
+        'organization', 'period', 'entry_count', 'total_amount', 'id_total',
+        'last_modified', 'digest', 'chain_digest', 'verified_at'
+    )
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(PeriodClose)
+class PeriodCloseAdmin(admin.ModelAdmin):
+    list_display = ('organization', 'period_start', 'period_end', 'closed_by', 'closed_at')
+    list_filter = ('organization',)
+    raw_id_fields = ('organization', 'closed_by')
+    readonly_fields = ('organization', 'period_start', 'period_end', 'closed_by', 'closed_at')
+    
+    inlines = [
+        type('ClosingBalanceInline', (admin.TabularInline,), {
+            'model': ClosingBalance,
+            'extra': 0,
+            'can_delete': False,
+            'readonly_fields': ('account', 'debits', 'credits', 'period_amount'),
+        })
+    ]
+
+    def has_add_permission(self, request):
+        return False
+
+@admin.register(NumberSequence)
+class NumberSequenceAdmin(admin.ModelAdmin):
+    list_display = ('organization', 'series', 'prefix', 'pattern', 'next_value')
+    list_filter = ('organization', 'series')
+    raw_id_fields = ('organization',)
+    readonly_fields = ('created_at', 'updated_at')
+
+@admin.register(Party)
+class PartyAdmin(admin.ModelAdmin):
+    list_display = ('name', 'organization', 'type', 'tax_id', 'email', 'is_active')
+    list_filter = ('organization', 'type', 'is_active')
+    search_fields = ('name', 'tax_id', 'email')
+    raw_id_fields = ('organization',)
+    readonly_fields = ('match_key', 'created_at', 'updated_at')
@@ -0,0 +1,136 @@
+"""
+Cost allocation.
+
+An allocation rule moves the period movement of a source account (rent,
+overhead...) to the accounts of its targets:
+
+* ``percentage`` – each target takes a fixed share; shares adding up to less
+  than 100% leave the rest on the source account;
+* ``driver`` – in proportion to the period movement of each target's driver
+  account (head count, floor space or revenue booked per department...),
+  whatever its sign.
+
+The month-end run evaluates every active rule of an organization at once.
+The period totals of all accounts are read in one pass before anything is
+posted, so rules never feed into each other within a run.  Amounts are
+split in integer cents by ``money.allocate``: the parts always add up to
+what leaves the source account.  Every rule becomes one multi-line journal
+(source credited, targets debited; the other way round for a credit
+movement) and the journals of all rules are written by ``posting.bulk_post``.
+An ``AllocationRun`` per rule and month makes the run idempotent; rules with
+nothing to allocate post nothing and are evaluated again on the next run.
+"""
+import numpy as np
+from django.db import transaction
+from django.utils.translation import gettext as _
+
+from organizations.models import Organization
+
+from . import money
+from .depreciation import month_end, month_index
+from .models import AllocationRule, AllocationRun, Transaction, TransactionEntry
+from .periods import period_totals
+from .posting import bulk_post, check_period_open
+
+
+def net_movements(organization, start_date, end_date):
+    """Net posted movement (debits less credits) in cents per account id between two dates."""
+    totals = period_totals(organization, start_date, end_date)
+    return dict(zip(totals, money.to_cents(debits - credits for debits, credits in totals.values())))
+
+
+def rule_parts(rule, targets, movements):
+    """
+    Cents allocated to each of ``targets`` of ``rule`` given the period
+    ``movements`` (see ``net_movements``); all zero when there is nothing to
+    allocate.
+    """
+    amount = int(movements.get(rule.source_account_id, 0))
+    if not targets or not amount:
+        return np.zeros(len(targets), dtype=np.int64)
+    if rule.method == AllocationRule.Method.DRIVER:
+        weights = np.abs(np.array(
+            [movements.get(target.driver_account_id, 0) for target in targets], dtype=np.int64
+        ))
+        if not weights.any():
+            return np.zeros(len(targets), dtype=np.int64)
+    else:
+        weights = money.basis_points(target.percentage for target in targets)
+        share = min(int(weights.sum()), money.PERCENT_SCALE)
+        amount = int(money.percent(np.array([amount]), np.array([share]))[0])
+    return money.allocate(amount, weights)
+
+
+def build_allocation(organization, rule, targets, parts, period_end, user=None):
+    """The journal of one rule and its entries, unsaved."""
+    label = _("Allocation %(rule)s %(period)s") % {'rule': rule.name, 'period': period_end.strftime('%Y-%m')}
+    journal = Transaction(
+        organization=organization,
+        date=period_end,
+        description=label,
+        reference=f"ALC-{period_end:%Y-%m}",
+        created_by_id=getattr(user, 'pk', user),
+        tags=['allocation']
+    )
+    entries = [
+        TransactionEntry(
+            account_id=account_id,
+            amount=money.from_cents(cents),
+            description=label,
+            currency=organization.currency
+        )
+        for account_id, cents in (
+            (rule.source_account_id, -int(parts.sum())),
+            *((target.account_id, int(part)) for target, part in zip(targets, parts) if part)
+        )
+    ]
+    return journal, entries
+
+
+@transaction.atomic
+def run_allocations(organization, period_end, user=None):
+    """
+    Post every active allocation rule of ``organization`` for the month of
+    ``period_end`` that has not run for it yet.  Returns the created
+    ``AllocationRun`` rows.  ``user`` is a user or user id.
+    """
+    period_end = month_end(month_index(period_end))
+    check_period_open(organization, period_end)
+    rules = list(
+        AllocationRule.objects.select_for_update()
+        .filter(organization=organization, is_active=True)
+        .exclude(runs__period_end=period_end)
+        .prefetch_related('targets')
+        .order_by('pk')
+    )
+    if not rules:
+        return []
+
+    movements = net_movements(organization, period_end.replace(day=1), period_end)
+    journals = []
+    runs = []
+    for rule in rules:
+        targets = list(rule.targets.all())
+        parts = rule_parts(rule, targets, movements)
+        if not parts.any():
+            continue
+        journal, entries = build_allocation(organization, rule, targets, parts, period_end, user)
+        journals.append((journal, entries))
+        runs.append(AllocationRun(
+            organization=organization,
+            rule=rule,
+            period_end=period_end,
+            transaction=journal,
+            amount=money.from_cents(parts.sum()),
+            created_by_id=getattr(user, 'pk', user)
+        ))
+
+    bulk_post(journals)
+    return AllocationRun.objects.bulk_create(runs)
+
+
+def allocation_organizations():
+    """Organizations with active allocation rules."""
+    return Organization.objects.filter(
+        pk__in=AllocationRule.objects.filter(is_active=True).values('organization')
+    ).order_by('pk')
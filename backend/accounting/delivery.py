@@ -0,0 +1,254 @@
+"""
+Invoice delivery by email.
+
+Sending is queued: the send endpoint and the recurring run mark invoices
+``queued`` and hand their ids to a Celery task once the transaction commits.
+The task renders the PDFs once (invoices whose content did not change keep
+their stored file, see ``rendering``; an invoice that cannot be rendered
+fails), splits the invoices of every organization into batches and
+schedules each batch inside the organization's per-minute sending limit.
+
+A batch is delivered over a single connection from ``get_connection()``, so
+a run of thousands of invoices opens one SMTP session per batch instead of
+one per invoice.  An invoice whose message cannot be built (a missing PDF,
+a broken template) or that the server rejects (refused recipient or sender,
+message too large) fails on its own and the batch carries on; only a lost
+connection leaves the rest of the batch queued for a retry with exponential
+backoff.  The outcome of every attempt is written back on the invoices.
+"""
+from collections import defaultdict
+import smtplib
+import socket
+import ssl
+import time
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.mail import EmailMessage, get_connection
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .models import Invoice
+from . import rendering
+
+EMAIL_TEMPLATE = 'accounting/invoices/invoice_email.txt'
+
+DEFAULT_BATCH_SIZE = 100
+DEFAULT_RATE_LIMIT = 300
+
+MAX_RETRIES = 5
+RETRY_BACKOFF = 60
+RETRY_BACKOFF_MAX = 60 * 60
+
+DELIVERY_FIELDS = ['email_status', 'email_sent_at', 'email_attempts', 'email_error']
+
+# Errors of the connection, worth retrying the rest of the batch for
+CONNECTION_ERRORS = (
+    smtplib.SMTPServerDisconnected,
+    smtplib.SMTPConnectError,
+    ConnectionError,
+    TimeoutError,
+    socket.gaierror,
+    ssl.SSLError,
+)
+# Errors concerning one message (checked after the connection errors)
+MESSAGE_ERRORS = (smtplib.SMTPException, OSError)
+
+
+def batch_size():
+    """Invoices sent over one connection."""
+    return getattr(settings, 'INVOICE_EMAIL_BATCH_SIZE', DEFAULT_BATCH_SIZE)
+
+
+def rate_limit():
+    """Invoices an organization may send per minute."""
+    return getattr(settings, 'INVOICE_EMAIL_RATE_LIMIT', DEFAULT_RATE_LIMIT)
+
+
+def retry_countdown(retries):
+    """Seconds before retry number ``retries + 1`` of a batch."""
+    return min(RETRY_BACKOFF * 2 ** retries, RETRY_BACKOFF_MAX)
+
+
+def queue_invoice_emails(invoice_ids):
+    """
+    Queue invoices for delivery; the sending task starts once the current
+    transaction commits.  Invoices without a recipient address fail right
+    away.  Returns the number of invoices queued.
+    """
+    invoices = Invoice.objects.filter(pk__in=invoice_ids)
+    invoices.filter(party_email='').update(
+        email_status=Invoice.EmailStatus.FAILED,
+        email_error=_("The invoice has no recipient email address")
+    )
+    queued = list(invoices.exclude(party_email='').values_list('pk', flat=True))
+    if queued:
+        Invoice.objects.filter(pk__in=queued).update(
+            email_status=Invoice.EmailStatus.QUEUED,
+            email_error=''
+        )
+        from .tasks import send_invoice_emails
+
+        transaction.on_commit(lambda: send_invoice_emails.delay(queued))
+    return len(queued)
+
+
+def render_queued(invoice_ids):
+    """
+    Render the PDFs of the invoices about to be sent.  Should the run fail,
+    the invoices are rendered one at a time and those that still fail are
+    marked failed rather than left queued.  Returns the ids failed.
+    """
+    try:
+        rendering.render_invoice_pdfs(invoice_ids)
+        return []
+    except Exception:
+        pass
+    failed = []
+    for invoice_id in invoice_ids:
+        try:
+            rendering.render_invoice_pdfs([invoice_id])
+        except Exception as exc:
+            fail_deliveries([invoice_id], exc)
+            failed.append(invoice_id)
+    return failed
+
+
+def reserve_send_slot(organization_id, count, limit=None, now=None):
+    """
+    Reserve ``count`` messages of the organization's per-minute budget and
+    return the seconds to wait before sending them: zero when they fit in the
+    current minute, otherwise until the first minute with room.  Counters
+    live in the cache, so every worker shares the same budget.
+    """
+    limit = limit or rate_limit()
+    now = time.time() if now is None else now
+    minute = int(now // 60)
+    offset = 0
+    while True:
+        key = f'accounting:invoice-email:{organization_id}:{minute + offset}'
+        cache.add(key, 0, timeout=(offset + 2) * 60)
+        reserved = cache.incr(key, count)
+        # An empty minute takes any batch, even one over the limit
+        if reserved <= limit or reserved == count:
+            return 0 if offset == 0 else (minute + offset) * 60 - now
+        cache.decr(key, count)
+        offset += 1
+
+
+def schedule_batches(invoice_ids, size=None, limit=None, now=None):
+    """
+    Split the queued invoices of ``invoice_ids`` into per-organization
+    batches.  Returns ``(invoice_ids, countdown)`` pairs, the countdown
+    keeping every organization within its sending limit.
+    """
+    size = size or batch_size()
+    limit = limit or rate_limit()
+    # A batch never takes more than a minute's budget
+    size = min(size, limit)
+    per_organization = defaultdict(list)
+    rows = Invoice.objects.filter(
+        pk__in=invoice_ids,
+        email_status=Invoice.EmailStatus.QUEUED
+    ).order_by('organization', 'pk').values_list('organization', 'pk')
+    for organization_id, pk in rows:
+        per_organization[organization_id].append(pk)
+
+    batches = []
+    for organization_id, ids in per_organization.items():
+        for start in range(0, len(ids), size):
+            batch = ids[start:start + size]
+            batches.append((batch, reserve_send_slot(organization_id, len(batch), limit, now)))
+    return batches
+
+
+def build_message(invoice, connection=None):
+    """The email of an invoice, with its stored PDF attached."""
+    context = rendering.invoice_context(invoice)
+    organization = context['organization']
+    message = EmailMessage(
+        subject=_("%(type)s %(number)s from %(organization)s") % {
+            'type': context['invoice']['type'],
+            'number': invoice.number,
+            'organization': organization['name'],
+        },
+        body=rendering.get_template(EMAIL_TEMPLATE).render(context),
+        from_email=settings.DEFAULT_FROM_EMAIL,
+        to=[invoice.party_email],
+        reply_to=[organization['email']] if organization['email'] else None,
+        connection=connection
+    )
+    if invoice.pdf_file:
+        with invoice.pdf_file.open('rb') as pdf:
+            message.attach(f"{invoice.number}.pdf", pdf.read(), rendering.CONTENT_TYPES[rendering.PDF])
+    return message
+
+
+def send_invoice(invoice, connection):
+    """
+    Send the email of one invoice.  Returns the error that failed this
+    invoice alone, or ``None`` once sent; connection errors propagate.
+    """
+    try:
+        message = build_message(invoice, connection)
+    except Exception as exc:
+        return exc
+    try:
+        connection.send_messages([message])
+    except CONNECTION_ERRORS:
+        raise
+    except MESSAGE_ERRORS as exc:
+        return exc
+    return None
+
+
+def deliver_batch(invoice_ids, connection=None):
+    """
+    Send the queued invoices of ``invoice_ids`` over one connection and
+    record the outcome on them.  Returns the ids left queued by a connection
+    failure together with that error; ``([], None)`` once the batch is done.
+    """
+    invoices = list(
+        rendering.invoices_for_rendering(invoice_ids)
+        .filter(email_status=Invoice.EmailStatus.QUEUED)
+        .order_by('pk')
+    )
+    if not invoices:
+        return [], None
+
+    connection = connection or get_connection()
+    now = timezone.now()
+    delivered, error = 0, None
+    try:
+        with connection:
+            for invoice in invoices:
+                failure = send_invoice(invoice, connection)
+                if failure is not None:
+                    invoice.email_status = Invoice.EmailStatus.FAILED
+                    invoice.email_error = str(failure)
+                else:
+                    invoice.email_status = Invoice.EmailStatus.SENT
+                    invoice.email_sent_at = now
+                    invoice.email_error = ''
+                invoice.email_attempts += 1
+                delivered += 1
+    except (*CONNECTION_ERRORS, *MESSAGE_ERRORS) as exc:
+        # Lost mid-batch, or the connection could not be opened (refused
+        # login...): nothing is wrong with the invoices still pending
+        error = exc
+
+    pending = invoices[delivered:]
+    for invoice in pending:
+        invoice.email_attempts += 1
+        invoice.email_error = str(error)
+    Invoice.objects.bulk_update(invoices, DELIVERY_FIELDS, batch_size=500)
+    return [invoice.pk for invoice in pending], error
+
+
+def fail_deliveries(invoice_ids, error):
+    """Give up on queued invoices once their retries are exhausted."""
+    return Invoice.objects.filter(
+        pk__in=invoice_ids,
+        email_status=Invoice.EmailStatus.QUEUED
+    ).update(email_status=Invoice.EmailStatus.FAILED, email_error=str(error))
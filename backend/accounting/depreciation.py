@@ -0,0 +1,302 @@
+"""
+Vectorized depreciation schedules.
+
+The asset register is loaded into NumPy arrays (one row per asset) and
+depreciation is computed for assets x periods at once, with no Python loop
+over assets.  Periods are calendar months; an asset depreciates a full
+month in the month it was purchased and is fully depreciated (down to its
+salvage value) after ``useful_life_years * 12`` months.
+
+* ``straight_line`` – the depreciable amount spread evenly over the months;
+* ``declining_balance`` – double declining balance (monthly rate
+  ``2 / months``), switching to straight line over the remaining months as
+  soon as that charges at least as much;
+* ``sum_of_years`` – sum of the years' digits, each year's charge spread
+  evenly over its months.
+
+Amounts are integer cents (see ``money``).  Cumulative depreciation is
+computed first and rounded half to even; period charges are differences of rounded
+cumulative amounts, so every schedule adds up to the depreciable amount to
+the cent and ``Decimal`` values are only built at the edges.
+
+The month-end run charges every active asset of an organization the
+difference between its scheduled and its recorded accumulated depreciation
+(so missed months catch up), updates the assets with ``bulk_update`` and
+posts one journal summarized per account.  A ``DepreciationRun`` row per
+organization and month makes the run idempotent.
+"""
+import calendar
+from datetime import date
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from . import money
+from .models import DepreciationRun, FixedAsset
+from .posting import check_period_open, post_journal
+
+STRAIGHT_LINE = 'straight_line'
+DECLINING_BALANCE = 'declining_balance'
+SUM_OF_YEARS = 'sum_of_years'
+METHODS = (STRAIGHT_LINE, DECLINING_BALANCE, SUM_OF_YEARS)
+
+# Assets per block when whole schedules are materialized
+SCHEDULE_CHUNK_SIZE = 2000
+
+REGISTER_FIELDS = (
+    'pk', 'purchase_date', 'purchase_cost', 'salvage_value', 'useful_life_years',
+    'depreciation_method'
+)
+
+
+def month_index(value):
+    """Months since year 0 of the month of a date."""
+    return value.year * 12 + value.month - 1
+
+
+def month_end(index):
+    """Last day of the month with ``month_index`` ``index``."""
+    year, month = divmod(int(index), 12)
+    return date(year, month + 1, calendar.monthrange(year, month + 1)[1])
+
+
+class AssetRegister:
+    """
+    Depreciation parameters of a set of assets as arrays.  ``ids`` keeps
+    the order of the rows; money columns are int64 cents.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.ids = [row[0] for row in rows]
+        self.start = np.array([month_index(row[1]) for row in rows], dtype=np.int64)
+        self.cost = money.to_cents(row[2] for row in rows)
+        salvage = money.to_cents(row[3] for row in rows)
+        self.depreciable = np.maximum(self.cost - salvage, 0)
+        self.months = np.maximum(np.array([row[4] for row in rows], dtype=np.int64) * 12, 1)
+        self.method = np.array([METHODS.index(row[5]) for row in rows], dtype=np.int8)
+        self.switch = self._switch_points(salvage)
+
+    @classmethod
+    def from_assets(cls, assets):
+        return cls(
+            (asset.pk, asset.purchase_date, asset.purchase_cost, asset.salvage_value,
+             asset.useful_life_years, asset.depreciation_method)
+            for asset in assets
+        )
+
+    @classmethod
+    def from_queryset(cls, queryset):
+        """Register of a ``FixedAsset`` queryset, read without model instances."""
+        return cls(queryset.order_by('pk').values_list(*REGISTER_FIELDS).iterator(chunk_size=10000))
+
+    def __len__(self):
+        return len(self.ids)
+
+    def _switch_points(self, salvage):
+        """
+        Month at which declining balance assets switch to straight line: the
+        first month ``m`` where ``(book value - salvage) / (months - m)`` is at
+        least a declining balance charge, ``book value * rate``.  Dividing by
+        the cost gives ``r**m * (1 - rate * (months - m)) >= salvage / cost``,
+        whose left side only grows past half the life, so it is found by a
+        vectorized binary search.
+        """
+        months = self.months.astype(np.float64)
+        rate = 2.0 / months
+        ratio = np.divide(salvage, self.cost, out=np.zeros(len(self), dtype=np.float64), where=self.cost > 0)
+        low = np.ceil(months / 2).astype(np.int64)
+        high = self.months.copy()
+        while np.any(low < high):
+            middle = (low + high) // 2
+            holds = (1 - rate) ** middle * (1 - rate * (months - middle)) >= ratio
+            high = np.where(holds & (low < high), middle, high)
+            low = np.where(~holds & (low < high), middle + 1, low)
+        return low
+
+    def cumulative(self, elapsed, rows=slice(None)):
+        """
+        Accumulated depreciation in cents after ``elapsed`` months, an int
+        array of shape (assets, periods) for the assets selected by ``rows``.
+        """
+        cost = self.cost[rows, None].astype(np.float64)
+        depreciable = self.depreciable[rows, None].astype(np.float64)
+        months = self.months[rows, None]
+        method = self.method[rows, None]
+        elapsed = np.clip(elapsed, 0, months)
+        fraction = elapsed / months
+
+        # Sum of the years' digits: whole years, then months of the current year
+        years = np.maximum(months // 12, 1)
+        whole, partial = elapsed // 12, elapsed % 12
+        digits = whole * years - whole * (whole - 1) / 2 + partial / 12 * (years - whole)
+        sum_of_years = depreciable * digits / (years * (years + 1) / 2)
+
+        # Double declining balance, straight line after the switch month
+        switch = self.switch[rows, None]
+        rate = 2.0 / months
+        declining = np.minimum(cost * (1 - (1 - rate) ** elapsed), depreciable)
+        at_switch = np.minimum(cost * (1 - (1 - rate) ** switch), depreciable)
+        remaining = np.maximum(months - switch, 1)
+        straight = at_switch + (depreciable - at_switch) * (elapsed - switch) / remaining
+        declining = np.where(elapsed <= switch, declining, straight)
+
+        amount = np.select(
+            [method == 0, method == 1],
+            [depreciable * fraction, declining],
+            sum_of_years
+        )
+        amount = money.rint(amount)
+        # Fully depreciated assets land exactly on their salvage value
+        return np.where(elapsed >= months, self.depreciable[rows, None], amount)
+
+    def elapsed(self, first_month, periods, rows=slice(None)):
+        """Months of depreciation at the end of each of ``periods`` months from ``first_month``."""
+        calendar_months = first_month + np.arange(periods, dtype=np.int64)
+        return calendar_months[None, :] - self.start[rows, None] + 1
+
+    def accumulated(self, as_of):
+        """Accumulated depreciation in cents at the end of the month of ``as_of``, per asset."""
+        return self.cumulative(self.elapsed(month_index(as_of), 1))[:, 0]
+
+    def project(self, first_month, periods):
+        """
+        Depreciation charges in cents of every asset for ``periods`` months
+        starting at the month of ``first_month`` (a date): (assets, periods).
+        """
+        start = month_index(first_month)
+        cumulative = self.cumulative(self.elapsed(start - 1, periods + 1))
+        return np.diff(cumulative, axis=1)
+
+    def schedules(self):
+        """
+        Full monthly schedules, from the purchase month to the end of the
+        useful life: ``{asset id: [row, ...]}`` with Decimal amounts.
+        """
+        result = {}
+        for block in range(0, len(self), SCHEDULE_CHUNK_SIZE):
+            rows = slice(block, block + SCHEDULE_CHUNK_SIZE)
+            periods = int(self.months[rows].max())
+            elapsed = np.arange(periods + 1, dtype=np.int64)[None, :].repeat(len(self.ids[rows]), axis=0)
+            cumulative = self.cumulative(elapsed, rows)
+            charges = np.diff(cumulative, axis=1)
+            for offset, asset_id in enumerate(self.ids[rows]):
+                position = block + offset
+                start, cost = self.start[position], self.cost[position]
+                result[asset_id] = [
+                    {
+                        'period': month_end(start + month),
+                        'depreciation': money.from_cents(charges[offset, month]),
+                        'accumulated_depreciation': money.from_cents(cumulative[offset, month + 1]),
+                        'book_value': money.from_cents(cost - cumulative[offset, month + 1]),
+                    }
+                    for month in range(int(self.months[position]))
+                ]
+        return result
+
+
+def schedules(assets):
+    """Monthly schedules of ``FixedAsset`` instances, by asset id."""
+    return AssetRegister.from_assets(assets).schedules()
+
+
+def accumulated_depreciation(assets, as_of):
+    """Accumulated depreciation of ``FixedAsset`` instances at the end of the month of ``as_of``."""
+    register = AssetRegister.from_assets(assets)
+    return {
+        asset_id: money.from_cents(cents)
+        for asset_id, cents in zip(register.ids, register.accumulated(as_of))
+    }
+
+
+def project_register(organization, first_month, periods):
+    """
+    Monthly depreciation of the active assets of an organization for
+    ``periods`` months from ``first_month``: ``(asset ids, charges)`` with
+    charges in cents, one row per asset.
+    """
+    register = AssetRegister.from_queryset(
+        FixedAsset.objects.filter(organization=organization, status=FixedAsset.Status.ACTIVE)
+    )
+    return register.ids, register.project(first_month, periods)
+
+
+# Month-end run
+
+RUN_FIELDS = (
+    *REGISTER_FIELDS, 'accumulated_depreciation', 'depreciation_expense_account',
+    'accumulated_depreciation_account'
+)
+
+
+@transaction.atomic
+def run_depreciation(organization, period_end, user=None):
+    """
+    Post the depreciation of the month of ``period_end`` for every active
+    asset of ``organization`` with depreciation accounts.  Returns the
+    ``DepreciationRun``; a period that already ran returns its run
+    unchanged.  ``user`` is a user or user id.
+    """
+    period_end = month_end(month_index(period_end))
+    check_period_open(organization, period_end)
+    run, created = DepreciationRun.objects.get_or_create(
+        organization=organization,
+        period_end=period_end,
+        defaults={'created_by_id': getattr(user, 'pk', user)}
+    )
+    if not created:
+        return run
+
+    rows = list(
+        FixedAsset.objects.select_for_update().filter(
+            organization=organization,
+            status=FixedAsset.Status.ACTIVE,
+            purchase_date__lte=period_end,
+            depreciation_expense_account__isnull=False,
+            accumulated_depreciation_account__isnull=False
+        ).order_by('pk').values_list(*RUN_FIELDS)
+    )
+    if not rows:
+        return run
+
+    register = AssetRegister(row[:len(REGISTER_FIELDS)] for row in rows)
+    recorded = money.to_cents(row[6] for row in rows)
+    # Depreciation is never taken back here; disposals settle the rest
+    charges = np.maximum(register.accumulated(period_end) - recorded, 0)
+    accumulated = recorded + charges
+
+    expense = money.sum_by([row[7] for row in rows], charges)
+    contra = money.sum_by([row[8] for row in rows], charges)
+    label = _("Depreciation %(period)s") % {'period': period_end.strftime('%Y-%m')}
+    lines = [
+        *((account, money.from_cents(cents), label) for account, cents in sorted(expense.items())),
+        *((account, -money.from_cents(cents), label) for account, cents in sorted(contra.items())),
+    ]
+    if lines:
+        run.transaction = post_journal(
+            organization,
+            period_end,
+            label,
+            lines,
+            reference=f"DEP-{period_end:%Y-%m}",
+            user=user,
+            tags=['depreciation']
+        )
+
+    now = timezone.now()
+    FixedAsset.objects.bulk_update([
+        FixedAsset(
+            pk=asset_id,
+            accumulated_depreciation=money.from_cents(accumulated[position]),
+            current_value=money.from_cents(register.cost[position] - accumulated[position]),
+            depreciated_through=period_end,
+            updated_at=now
+        )
+        for position, asset_id in enumerate(register.ids)
+    ], ['accumulated_depreciation', 'current_value', 'depreciated_through', 'updated_at'], batch_size=2000)
+
+    run.asset_count = int(np.count_nonzero(charges))
+    run.total_amount = money.from_cents(charges.sum())
+    run.save(update_fields=['transaction', 'asset_count', 'total_amount'])
+    return run
@@ -0,0 +1,157 @@
+"""
+Fixed asset disposals.
+
+Disposing of assets first charges their depreciation through the month of
+the disposal date (whatever the month-end runs have not charged yet), then
+removes them from the books with one journal per request:
+
+* debit depreciation expense, credit accumulated depreciation – the
+  depreciation to date;
+* debit accumulated depreciation, credit the asset account – the assets
+  leave the books at cost;
+* debit the proceeds account – what was received;
+* the difference to the gain/loss account: a debit for a loss, a credit
+  for a gain.
+
+Amounts of any number of assets are computed in one vectorized pass and
+summarized per account, so a year-end write-off of thousands of assets
+posts a handful of entries and updates the assets with one
+``bulk_update``.
+"""
+from decimal import Decimal
+
+import numpy as np
+from django.db import transaction
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from . import money
+from .models import Account, FixedAsset
+from .depreciation import REGISTER_FIELDS, AssetRegister, month_end, month_index
+from .posting import post_journal
+
+DISPOSAL_STATUSES = (
+    FixedAsset.Status.DISPOSED,
+    FixedAsset.Status.SOLD,
+    FixedAsset.Status.WRITTEN_OFF,
+)
+
+DISPOSAL_FIELDS = (
+    *REGISTER_FIELDS, 'asset_number', 'accumulated_depreciation', 'asset_account',
+    'accumulated_depreciation_account', 'depreciation_expense_account'
+)
+
+
+def _organization_account(organization, account):
+    if account is None:
+        return None
+    account_id = getattr(account, 'pk', account)
+    if not Account.objects.filter(organization=organization, pk=account_id).exists():
+        raise serializers.ValidationError(_("Account not found"))
+    return account_id
+
+
+@transaction.atomic
+def dispose_assets(organization, disposals, disposal_date, proceeds_account=None,
+                   gain_loss_account=None, status=None, user=None):
+    """
+    Dispose of active assets of ``organization``.  ``disposals`` maps asset
+    ids to their proceeds.  ``status`` defaults to sold for assets with
+    proceeds and disposed otherwise.  Returns the disposal journal and the
+    total gain (negative for a loss).
+    """
+    if status is not None and status not in DISPOSAL_STATUSES:
+        raise serializers.ValidationError(_("Invalid disposal status"))
+    disposals = {int(asset_id): Decimal(str(amount or 0)) for asset_id, amount in disposals.items()}
+    if not disposals:
+        raise serializers.ValidationError(_("No assets to dispose"))
+    if any(amount < 0 for amount in disposals.values()):
+        raise serializers.ValidationError(_("Proceeds cannot be negative"))
+
+    rows = list(
+        FixedAsset.objects.select_for_update().filter(
+            organization=organization,
+            pk__in=disposals,
+            status=FixedAsset.Status.ACTIVE
+        ).order_by('pk').values_list(*DISPOSAL_FIELDS)
+    )
+    if len(rows) != len(disposals):
+        raise serializers.ValidationError(_("Can only dispose active assets"))
+    for row in rows:
+        if row[1] > disposal_date:
+            raise serializers.ValidationError(
+                _("Asset %(number)s was purchased after the disposal date") % {'number': row[6]}
+            )
+        if row[8] is None or row[9] is None:
+            raise serializers.ValidationError(
+                _("Asset %(number)s has no asset or accumulated depreciation account") % {'number': row[6]}
+            )
+
+    register = AssetRegister(row[:len(REGISTER_FIELDS)] for row in rows)
+    recorded = money.to_cents(row[7] for row in rows)
+    charges = np.maximum(register.accumulated(disposal_date) - recorded, 0)
+    accumulated = recorded + charges
+    proceeds = money.to_cents(disposals[asset_id] for asset_id in register.ids)
+    # Positive for a gain
+    gains = proceeds - (register.cost - accumulated)
+
+    expense_accounts = np.array([row[10] or 0 for row in rows], dtype=np.int64)
+    if np.any((charges > 0) & (expense_accounts == 0)):
+        raise serializers.ValidationError(_("Assets with depreciation to charge need a depreciation expense account"))
+    proceeds_account = _organization_account(organization, proceeds_account)
+    gain_loss_account = _organization_account(organization, gain_loss_account)
+    if proceeds.sum() and proceeds_account is None:
+        raise serializers.ValidationError(_("A proceeds account is required"))
+    if gains.sum() and gain_loss_account is None:
+        raise serializers.ValidationError(_("A gain/loss account is required"))
+
+    asset_accounts = np.array([row[8] for row in rows], dtype=np.int64)
+    contra_accounts = np.array([row[9] for row in rows], dtype=np.int64)
+    if len(rows) == 1:
+        label = _("Disposal of asset %(number)s") % {'number': rows[0][6]}
+    else:
+        label = _("Disposal of %(count)s assets") % {'count': len(rows)}
+    lines = []
+    for account, cents in money.sum_by(expense_accounts, charges).items():
+        lines.append((account, money.from_cents(cents), _("Depreciation to disposal")))
+    for account, cents in money.sum_by(contra_accounts, charges).items():
+        lines.append((account, -money.from_cents(cents), _("Depreciation to disposal")))
+    for account, cents in money.sum_by(contra_accounts, accumulated).items():
+        lines.append((account, money.from_cents(cents), label))
+    for account, cents in money.sum_by(asset_accounts, register.cost).items():
+        lines.append((account, -money.from_cents(cents), label))
+    if proceeds.sum():
+        lines.append((proceeds_account, money.from_cents(proceeds.sum()), _("Disposal proceeds")))
+    if gains.sum():
+        lines.append((gain_loss_account, -money.from_cents(gains.sum()), _("Gain/loss on disposal")))
+
+    journal = post_journal(
+        organization,
+        disposal_date,
+        str(label),
+        [(account, amount, str(description)) for account, amount, description in lines],
+        user=user,
+        tags=['disposal']
+    )
+
+    now = timezone.now()
+    through = month_end(month_index(disposal_date))
+    FixedAsset.objects.bulk_update([
+        FixedAsset(
+            pk=asset_id,
+            status=status or (FixedAsset.Status.SOLD if proceeds[position] else FixedAsset.Status.DISPOSED),
+            accumulated_depreciation=money.from_cents(accumulated[position]),
+            current_value=Decimal('0'),
+            depreciated_through=through,
+            disposal_date=disposal_date,
+            disposal_proceeds=money.from_cents(proceeds[position]),
+            disposal_transaction=journal,
+            updated_at=now
+        )
+        for position, asset_id in enumerate(register.ids)
+    ], [
+        'status', 'accumulated_depreciation', 'current_value', 'depreciated_through',
+        'disposal_date', 'disposal_proceeds', 'disposal_transaction', 'updated_at'
+    ], batch_size=2000)
+    return journal, money.from_cents(gains.sum())
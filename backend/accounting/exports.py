@@ -0,0 +1,213 @@
+"""
+Columnar (Parquet / Arrow IPC) exports of the general ledger.
+
+Rows are read from a server-side cursor in chunks and converted into Arrow
+record batches one chunk at a time, so memory use stays flat no matter how
+large the ledger is.
+"""
+from decimal import Decimal
+import os
+
+from .models import TransactionEntry
+
+PARQUET = 'parquet'
+ARROW = 'arrow'
+FORMATS = (PARQUET, ARROW)
+
+DEFAULT_BATCH_SIZE = 50000
+
+# (column name, queryset lookup) in output order.  ``year`` and ``month`` are
+# derived from ``date`` and only used for partitioned exports.
+LEDGER_COLUMNS = (
+    ('entry_id', 'id'),
+    ('transaction_id', 'transaction_id'),
+    ('date', 'transaction__date'),
+    ('description', 'transaction__description'),
+    ('reference', 'transaction__reference'),
+    ('status', 'transaction__status'),
+    ('account_id', 'account_id'),
+    ('account_code', 'account__code'),
+    ('account_name', 'account__name'),
+    ('account_type', 'account__account_type'),
+    ('entry_description', 'description'),
+    ('amount', 'amount'),
+    ('tax_rate', 'tax_rate'),
+    ('currency', 'currency'),
+    ('exchange_rate', 'exchange_rate'),
+)
+
+
+def _pyarrow():
+    try:
+        import pyarrow
+    except ImportError:  # pragma: no cover - depends on the deployment
+        raise ImportError(
+            "pyarrow is required for Parquet/Arrow ledger exports"
+        )
+    return pyarrow
+
+
+def ledger_schema(partitioned=False):
+    """Arrow schema of an exported ledger, with exact decimal columns."""
+    pa = _pyarrow()
+    fields = [
+        pa.field('entry_id', pa.int64(), nullable=False),
+        pa.field('transaction_id', pa.int64(), nullable=False),
+        pa.field('date', pa.date32(), nullable=False),
+        pa.field('description', pa.string()),
+        pa.field('reference', pa.string()),
+        pa.field('status', pa.dictionary(pa.int8(), pa.string())),
+        pa.field('account_id', pa.int64(), nullable=False),
+        pa.field('account_code', pa.string()),
+        pa.field('account_name', pa.string()),
+        pa.field('account_type', pa.dictionary(pa.int8(), pa.string())),
+        pa.field('entry_description', pa.string()),
+        pa.field('amount', pa.decimal128(15, 2), nullable=False),
+        pa.field('tax_rate', pa.decimal128(5, 2)),
+        pa.field('currency', pa.dictionary(pa.int16(), pa.string())),
+        pa.field('exchange_rate', pa.decimal128(10, 6)),
+    ]
+    if partitioned:
+        fields += [
+            pa.field('year', pa.int16(), nullable=False),
+            pa.field('month', pa.int8(), nullable=False),
+        ]
+    return pa.schema(fields)
+
+
+def ledger_queryset(organization, start_date=None, end_date=None):
+    """Entries of an organization's ledger in (date, transaction) order."""
+    entries = TransactionEntry.objects.filter(
+        transaction__organization=organization
+    )
+    if start_date:
+        entries = entries.filter(transaction__date__gte=start_date)
+    if end_date:
+        entries = entries.filter(transaction__date__lte=end_date)
+    return entries.order_by('transaction__date', 'transaction_id', 'id')
+
+
+def iter_record_batches(queryset, batch_size=DEFAULT_BATCH_SIZE, partitioned=False):
+    """
+    Yield Arrow record batches for ``queryset``.
+
+    ``values_list().iterator()`` streams from a server-side cursor on
+    PostgreSQL, so only ``batch_size`` rows are ever held in Python at once.
+    """
+    pa = _pyarrow()
+    schema = ledger_schema(partitioned)
+    lookups = [lookup for _, lookup in LEDGER_COLUMNS]
+    rows = queryset.values_list(*lookups).iterator(chunk_size=batch_size)
+
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= batch_size:
+            yield _to_record_batch(pa, schema, chunk, partitioned)
+            chunk = []
+    if chunk:
+        yield _to_record_batch(pa, schema, chunk, partitioned)
+
+
+def _to_record_batch(pa, schema, rows, partitioned):
+    columns = [list(column) for column in zip(*rows)]
+    if partitioned:
+        dates = columns[2]
+        columns.append([d.year for d in dates])
+        columns.append([d.month for d in dates])
+    arrays = []
+    for values, field in zip(columns, schema):
+        if pa.types.is_dictionary(field.type):
+            arrays.append(
+                pa.array(values, type=field.type.value_type).dictionary_encode()
+                .cast(field.type)
+            )
+        elif pa.types.is_decimal(field.type):
+            arrays.append(pa.array(
+                [Decimal(v) if v is not None else None for v in values],
+                type=field.type
+            ))
+        else:
+            arrays.append(pa.array(values, type=field.type))
+    return pa.RecordBatch.from_arrays(arrays, schema=schema)
+
+
+def write_ledger(sink, queryset, fmt=PARQUET, batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write ``queryset`` to ``sink`` (a path or binary file object) as a single
+    Parquet file or Arrow IPC file.  Returns the number of rows written.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    pa = _pyarrow()
+    schema = ledger_schema()
+    rows = 0
+
+    writer = _open_writer(pa, sink, schema, fmt)
+    try:
+        for batch in iter_record_batches(queryset, batch_size):
+            writer.write_batch(batch)
+            rows += batch.num_rows
+    finally:
+        writer.close()
+    return rows
+
+
+def write_partitioned_ledger(base_dir, queryset, fmt=PARQUET,
+                             batch_size=DEFAULT_BATCH_SIZE):
+    """
+    Write ``queryset`` as a Hive-partitioned dataset under ``base_dir``
+    (``year=2024/month=1/part-0.parquet`` ...).  Returns the number of rows
+    written.
+
+    The ledger is read in date order, so partitions arrive one after another
+    and only a single file writer is open at any time.  Batches are pulled on
+    the calling thread, which keeps the database cursor on this thread's
+    connection.
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"Unsupported export format: {fmt}")
+    pa = _pyarrow()
+    schema = ledger_schema()
+    extension = 'parquet' if fmt == PARQUET else 'arrow'
+    writer, current, rows = None, None, 0
+
+    try:
+        for batch in iter_record_batches(queryset, batch_size, partitioned=True):
+            keys = list(zip(
+                batch.column('year').to_pylist(),
+                batch.column('month').to_pylist()
+            ))
+            # Row offsets where (year, month) changes within the batch
+            bounds = [0] + [
+                i for i in range(1, len(keys)) if keys[i] != keys[i - 1]
+            ] + [len(keys)]
+
+            for start, stop in zip(bounds, bounds[1:]):
+                partition = keys[start]
+                if partition != current:
+                    if writer is not None:
+                        writer.close()
+                    directory = os.path.join(
+                        base_dir, f'year={partition[0]}', f'month={partition[1]}'
+                    )
+                    os.makedirs(directory, exist_ok=True)
+                    path = os.path.join(directory, f'part-0.{extension}')
+                    writer = _open_writer(pa, path, schema, fmt)
+                    current = partition
+                chunk = batch.slice(start, stop - start)
+                writer.write_batch(pa.RecordBatch.from_arrays(
+                    chunk.columns[:len(schema)], schema=schema
+                ))
+                rows += chunk.num_rows
+    finally:
+        if writer is not None:
+            writer.close()
+    return rows
+
+
+def _open_writer(pa, sink, schema, fmt):
+    if fmt == PARQUET:
+        import pyarrow.parquet as pq
+        return pq.ParquetWriter(sink, schema, compression='zstd')
+    return pa.ipc.new_file(sink, schema)
@@ -0,0 +1,241 @@
+"""
+Foreign currencies.
+
+Entry amounts are in the entry's ``currency``.  Their value in the
+organization's currency is the amount times the organization's
+``ExchangeRate`` of that currency on the transaction date (the latest rate on
+or before it), or the entry's own ``exchange_rate`` where no rate was
+recorded.  Reports convert in the database: ``base_amount`` joins every entry
+to the rate table with a correlated subquery served by the (organization,
+currency, date) unique index, so converted balances are summed by the same
+grouped queries as before, with no per-entry Python.  Invoice based reports
+(aging, tax summary) convert invoice amounts the same way at the rate on the
+invoice date (``invoice_base_amount``).
+
+Single rates (``rate_on``) are read through an in-process LRU cache of
+(organization, currency, date) lookups that expires every
+``RATE_CACHE_TTL`` seconds.
+
+Period-end revaluation restates the foreign currency asset and liability
+accounts of an organization at the closing rate.  The difference between
+that and their booked value is posted to the exchange gain/loss account in
+one journal, in the organization's currency.  Running it again for the same
+date finds nothing left to adjust.
+"""
+from decimal import Decimal
+from functools import lru_cache
+import time
+
+from django.db.models import (
+    Case, DecimalField, ExpressionWrapper, F, OuterRef, Q, Subquery, Sum, Value, When
+)
+from django.db.models.functions import Coalesce, Round
+from django.utils.translation import gettext as _
+from rest_framework import serializers
+
+from organizations.models import Organization
+
+from . import money
+from .models import Account, ExchangeRate, TransactionEntry
+from .posting import BALANCE_STATUSES, post_journal
+
+RATE_CACHE_SIZE = 4096
+RATE_CACHE_TTL = 300
+
+# Accounts carried at the closing rate; the others keep their historical value
+MONETARY_TYPES = (Account.AccountType.ASSET, Account.AccountType.LIABILITY)
+
+_AMOUNT = DecimalField(max_digits=15, decimal_places=2)
+_ZERO = Value(Decimal('0'), output_field=_AMOUNT)
+
+
+@lru_cache(maxsize=RATE_CACHE_SIZE)
+def _cached_rate(organization_id, currency, on_date, _period):
+    return ExchangeRate.objects.filter(
+        organization_id=organization_id,
+        currency=currency,
+        date__lte=on_date
+    ).order_by('-date').values_list('rate', flat=True).first()
+
+
+def clear_rate_cache():
+    """Forget the cached rates of this process (e.g. after rates changed)."""
+    _cached_rate.cache_clear()
+
+
+def rate_on(organization, currency, on_date):
+    """
+    Value of one unit of ``currency`` in the organization's currency on
+    ``on_date``, or ``None`` when no rate was recorded by then.
+    """
+    if currency == organization.currency:
+        return Decimal('1')
+    return _cached_rate(organization.pk, currency, on_date, int(time.monotonic() // RATE_CACHE_TTL))
+
+
+def convert(organization, amount, currency, on_date):
+    """``amount`` of ``currency`` in the organization's currency, to the cent."""
+    rate = rate_on(organization, currency, on_date)
+    if rate is None:
+        raise serializers.ValidationError(
+            _("No exchange rate for %(currency)s on %(date)s") % {'currency': currency, 'date': on_date}
+        )
+    return money.quantize(Decimal(amount) * rate)
+
+
+def rate_at(organization, currency, on_date):
+    """
+    The recorded rate of the outer row's ``currency`` field on its
+    ``on_date`` field, for its ``organization`` field, as a subquery.
+    """
+    return Subquery(
+        ExchangeRate.objects.filter(
+            organization=OuterRef(organization),
+            currency=OuterRef(currency),
+            date__lte=OuterRef(on_date)
+        ).order_by('-date').values('rate')[:1]
+    )
+
+
+def entry_rate():
+    """The rate of an entry's currency on its transaction date, as a subquery."""
+    return rate_at('transaction__organization', 'currency', 'transaction__date')
+
+
+def in_base_currency(amount, base_currency, currency, rate, fallback_rate):
+    """
+    Expression of ``amount`` converted to ``base_currency`` at ``rate``, or
+    the row's ``fallback_rate`` field without one, rounded to the cent.
+    ``currency`` is the field holding the currency of ``amount``.
+    """
+    converted = ExpressionWrapper(
+        amount * Coalesce(rate, F(fallback_rate)),
+        output_field=DecimalField(max_digits=30, decimal_places=10)
+    )
+    return Case(
+        When(**{currency: base_currency}, then=amount),
+        default=Round(converted, 2),
+        output_field=_AMOUNT
+    )
+
+
+def base_amount(base_currency):
+    """
+    Expression of the amount of ``TransactionEntry`` rows in ``base_currency``
+    (the organization's currency), rounded to the cent per entry.
+    """
+    return in_base_currency(F('amount'), base_currency, 'currency', entry_rate(), 'exchange_rate')
+
+
+def invoice_base_amount(amount, base_currency, prefix=''):
+    """
+    Expression of ``amount``, in the currency of the invoice reached through
+    ``prefix``, in ``base_currency`` at the rate on the invoice date.
+    """
+    return in_base_currency(
+        amount,
+        base_currency,
+        f'{prefix}currency',
+        rate_at(f'{prefix}organization', f'{prefix}currency', f'{prefix}date'),
+        f'{prefix}exchange_rate'
+    )
+
+
+def revaluation_balances(organization, period_end):
+    """
+    Foreign currency balance and booked value (in the organization's
+    currency) per monetary foreign currency account of ``organization`` at
+    ``period_end``: ``{account id: (currency, foreign, booked)}``.
+    """
+    rows = (
+        TransactionEntry.objects.filter(
+            transaction__organization=organization,
+            transaction__status__in=BALANCE_STATUSES,
+            transaction__date__lte=period_end,
+            account__organization=organization,
+            account__is_active=True,
+            account__account_type__in=MONETARY_TYPES
+        )
+        .exclude(account__currency=organization.currency)
+        .order_by()
+        .values('account', 'account__currency')
+        .annotate(
+            foreign=Coalesce(Sum('amount', filter=Q(currency=F('account__currency'))), _ZERO),
+            booked=Coalesce(Sum(base_amount(organization.currency)), _ZERO),
+        )
+    )
+    return {
+        row['account']: (row['account__currency'], row['foreign'], row['booked'])
+        for row in rows
+    }
+
+
+def gain_loss_account(organization, account=None):
+    """Id of the exchange gain/loss account: ``account`` or the organization's default."""
+    accounts = Account.objects.filter(organization=organization)
+    if account is not None:
+        account_id = getattr(account, 'pk', account)
+        if not accounts.filter(pk=account_id).exists():
+            raise serializers.ValidationError(_("Account not found"))
+        return account_id
+    account_id = accounts.filter(
+        subtype=Account.AccountSubType.FX_GAIN_LOSS,
+        is_active=True
+    ).order_by('code', 'pk').values_list('pk', flat=True).first()
+    if account_id is None:
+        raise serializers.ValidationError(_("An exchange gain/loss account is required"))
+    return account_id
+
+
+def revalue_accounts(organization, period_end, gain_loss=None, user=None):
+    """
+    Post the unrealized exchange differences of ``organization``'s foreign
+    currency accounts at ``period_end``.  Returns the journal, or ``None``
+    when every account is already stated at the closing rate.  ``user`` is a
+    user or user id.
+    """
+    lines = []
+    missing = set()
+    label = _("Unrealized exchange differences %(date)s") % {'date': period_end}
+    for account_id, (currency, foreign, booked) in sorted(revaluation_balances(organization, period_end).items()):
+        rate = rate_on(organization, currency, period_end)
+        if rate is None:
+            missing.add(currency)
+            continue
+        adjustment = money.quantize(foreign * rate) - booked
+        if adjustment:
+            lines.append((account_id, adjustment, label))
+    if missing:
+        raise serializers.ValidationError(
+            _("No exchange rate for %(currency)s on %(date)s") % {
+                'currency': ', '.join(sorted(missing)),
+                'date': period_end,
+            }
+        )
+    if not lines:
+        return None
+
+    total = sum((amount for _account, amount, _description in lines), Decimal('0'))
+    lines.append((gain_loss_account(organization, gain_loss), -total, label))
+    return post_journal(
+        organization,
+        period_end,
+        label,
+        lines,
+        reference=f"FXR-{period_end:%Y-%m-%d}",
+        user=user,
+        tags=['fx_revaluation']
+    )
+
+
+def revaluation_organizations():
+    """Organizations with foreign currency accounts and an exchange gain/loss account."""
+    foreign = Account.objects.filter(
+        is_active=True,
+        account_type__in=MONETARY_TYPES
+    ).exclude(currency=F('organization__currency')).values('organization')
+    defaults = Account.objects.filter(
+        subtype=Account.AccountSubType.FX_GAIN_LOSS,
+        is_active=True
+    ).values('organization')
+    return Organization.objects.filter(pk__in=foreign).filter(pk__in=defaults).order_by('pk')
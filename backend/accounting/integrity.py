@@ -0,0 +1,253 @@
+"""
+Ledger integrity checks.
+
+``Account.current_balance`` is maintained incrementally, so it can drift from
+the entries it summarizes.  The checks here recompute what the books should
+say with grouped queries (one per check, never one per row) and report every
+difference.  Entry contents are additionally hashed per month into a chain of
+``LedgerPeriodChecksum`` rows; only months whose cheap aggregates changed are
+rescanned on the next run.
+"""
+from decimal import Decimal
+import hashlib
+
+from django.db import transaction
+from django.db.models import Count, DecimalField, F, Max, Q, Sum, Value
+from django.db.models.functions import Coalesce, TruncMonth
+from django.utils import timezone
+
+from .models import Account, LedgerPeriodChecksum, Transaction, TransactionEntry
+from .posting import BALANCE_STATUSES
+
+GENESIS_DIGEST = '0' * 64
+
+_ZERO = Value(Decimal('0'), output_field=DecimalField(max_digits=15, decimal_places=2))
+
+
+def ledger_checksum(organization, using='default'):
+    """
+    Digest of an organization's ledger that does not depend on primary keys.
+
+    Entries are summarized per account code and the account balances are
+    added, so two databases holding the same books produce the same digest
+    even when every row has a different id.
+    """
+    digest = hashlib.sha256()
+    entries = (
+        TransactionEntry.objects.using(using)
+        .filter(transaction__organization=organization)
+        .values('account__code')
+        .annotate(entries=Count('id'), total=Sum('amount'))
+        .order_by('account__code')
+    )
+    for row in entries:
+        digest.update(
+            f"E|{row['account__code']}|{row['entries']}|{row['total']:.2f}\n".encode()
+        )
+    balances = (
+        Account.objects.using(using)
+        .filter(organization=organization)
+        .order_by('code')
+        .values_list('code', 'current_balance')
+    )
+    for code, balance in balances:
+        digest.update(f"B|{code}|{balance:.2f}\n".encode())
+    return digest.hexdigest()
+
+
+def ledger_balances(organization, using='default'):
+    """Accounts annotated with ``ledger_balance``, the sum of their posted entries."""
+    return Account.objects.using(using).filter(
+        organization=organization
+    ).annotate(
+        ledger_balance=Coalesce(
+            Sum(
+                'entries__amount',
+                filter=Q(entries__transaction__status__in=BALANCE_STATUSES)
+            ),
+            _ZERO
+        )
+    )
+
+
+def balance_drift(organization, using='default'):
+    """Accounts whose ``current_balance`` disagrees with their posted entries."""
+    return list(
+        ledger_balances(organization, using)
+        .exclude(current_balance=F('ledger_balance'))
+        .values('id', 'code', 'name', 'current_balance', 'ledger_balance')
+        .order_by('code')
+    )
+
+
+def unbalanced_transactions(organization, using='default'):
+    """
+    Posted transactions whose entries do not sum to zero, found with a single
+    ``GROUP BY ... HAVING`` query instead of ``Transaction.is_balanced``.
+    """
+    return list(
+        Transaction.objects.using(using)
+        .filter(organization=organization, status__in=BALANCE_STATUSES)
+        .values('id', 'date', 'reference')
+        .annotate(total=Coalesce(Sum('entries__amount'), _ZERO))
+        .filter(~Q(total=0))
+        .order_by('date', 'id')
+    )
+
+
+@transaction.atomic
+def repair_balances(organization, using='default'):
+    """Reset ``current_balance`` of drifted accounts to their ledger balance."""
+    drift = balance_drift(organization, using)
+    accounts = [
+        Account(id=row['id'], current_balance=row['ledger_balance'])
+        for row in drift
+    ]
+    Account.objects.using(using).bulk_update(accounts, ['current_balance'])
+    return len(accounts)
+
+
+def period_fingerprints(organization, using='default'):
+    """Cheap per-month aggregates used to decide which months to rescan."""
+    rows = (
+        TransactionEntry.objects.using(using)
+        .filter(transaction__organization=organization)
+        .annotate(period=TruncMonth('transaction__date'))
+        .values('period')
+        .annotate(
+            entry_count=Count('id'),
+            total_amount=Coalesce(Sum('amount'), _ZERO),
+            id_total=Sum('id'),
+            last_modified=Max('transaction__updated_at'),
+        )
+        .order_by('period')
+    )
+    return {row['period']: row for row in rows}
+
+
+def period_digest(organization, period, using='default'):
+    """Hash every entry of the month starting at ``period``."""
+    if period.month == 12:
+        next_period = period.replace(year=period.year + 1, month=1)
+    else:
+        next_period = period.replace(month=period.month + 1)
+    entries = (
+        TransactionEntry.objects.using(using)
+        .filter(
+            transaction__organization=organization,
+            transaction__date__gte=period,
+            transaction__date__lt=next_period
+        )
+        .order_by('transaction__date', 'transaction_id', 'id')
+        .values_list(
+            'id', 'transaction_id', 'transaction__date', 'transaction__status',
+            'account_id', 'amount', 'currency', 'exchange_rate'
+        )
+    )
+    digest = hashlib.sha256()
+    for row in entries.iterator(chunk_size=5000):
+        digest.update('|'.join(str(value) for value in row).encode())
+        digest.update(b'\n')
+    return digest.hexdigest()
+
+
+def _chain(previous, digest):
+    return hashlib.sha256(f'{previous}{digest}'.encode()).hexdigest()
+
+
+def _changed(stored, fingerprint):
+    return (
+        stored.entry_count != fingerprint['entry_count']
+        or stored.total_amount != fingerprint['total_amount']
+        or stored.id_total != fingerprint['id_total']
+        or stored.last_modified != fingerprint['last_modified']
+    )
+
+
+@transaction.atomic
+def verify_periods(organization, full=False, using='default'):
+    """
+    Bring the period hash chain of ``organization`` up to date.
+
+    Returns the months that had to be rescanned (because they are new, were
+    edited or ``full`` was requested) and the months whose contents actually
+    changed since the last verification.
+    """
+    fingerprints = period_fingerprints(organization, using)
+    now = timezone.now()
+    stored = {
+        row.period: row
+        for row in LedgerPeriodChecksum.objects.using(using)
+        .select_for_update().filter(organization=organization)
+    }
+
+    removed = [period for period in stored if period not in fingerprints]
+    if removed:
+        LedgerPeriodChecksum.objects.using(using).filter(
+            organization=organization, period__in=removed
+        ).delete()
+
+    rescanned, changed, to_create, to_update = [], [], [], []
+    for period, fingerprint in fingerprints.items():
+        row = stored.get(period)
+        if row is not None and not full and not _changed(row, fingerprint):
+            continue
+        digest = period_digest(organization, period, using)
+        rescanned.append(period)
+        if row is None:
+            row = stored[period] = LedgerPeriodChecksum(
+                organization=organization, period=period
+            )
+            to_create.append(row)
+        else:
+            if row.digest != digest:
+                changed.append(period)
+            to_update.append(row)
+        row.entry_count = fingerprint['entry_count']
+        row.total_amount = fingerprint['total_amount']
+        row.id_total = fingerprint['id_total']
+        row.last_modified = fingerprint['last_modified']
+        row.digest = digest
+        row.verified_at = now
+
+    # Relink the chain from the first period that was added, changed or removed
+    dirty = changed + removed + [row.period for row in to_create]
+    if dirty:
+        first_dirty = min(dirty)
+        previous = GENESIS_DIGEST
+        for period in sorted(fingerprints):
+            row = stored[period]
+            if period >= first_dirty:
+                row.chain_digest = _chain(previous, row.digest)
+                if row.pk is not None and row not in to_update:
+                    to_update.append(row)
+            previous = row.chain_digest
+
+    LedgerPeriodChecksum.objects.using(using).bulk_create(to_create)
+    LedgerPeriodChecksum.objects.using(using).bulk_update(
+        to_update,
+        ['entry_count', 'total_amount', 'id_total', 'last_modified',
+         'digest', 'chain_digest', 'verified_at']
+    )
+    return {
+        'periods': len(fingerprints),
+        'rescanned': rescanned,
+        'changed': changed,
+    }
+
+
+def verify_organization(organization, full=False, repair=False, using='default'):
+    """Run every ledger check for one organization and return a report."""
+    drift = balance_drift(organization, using)
+    if repair and drift:
+        repair_balances(organization, using)
+    periods = verify_periods(organization, full=full, using=using)
+    return {
+        'organization': organization.pk,
+        'balance_drift': drift,
+        'repaired': repair and bool(drift),
+        'unbalanced_transactions': unbalanced_transactions(organization, using),
+        'periods': periods['periods'],
+        'rescanned_periods': periods['rescanned'],
+        'changed_periods': periods['changed'],
+    }
@@ -0,0 +1,32 @@
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+from accounting import parties
+
+
+class Command(BaseCommand):
+    help = "Create parties from the details copied on invoices and link them"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--organization',
+            help='Organization id or slug (default: every organization)'
+        )
+        parser.add_argument('--batch-size', type=int, default=2000)
+
+    def handle(self, *args, **options):
+        organization = None
+        if options['organization']:
+            organization = self.get_organization(options['organization'])
+
+        result = parties.backfill_parties(organization, batch_size=options['batch_size'])
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['parties']} parties created, {result['invoices']} invoices and "
+            f"{result['recurring_invoices']} recurring invoices linked"
+        ))
+
+    def get_organization(self, value):
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        try:
+            return Organization.objects.get(**lookup)
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization '{value}' does not exist")
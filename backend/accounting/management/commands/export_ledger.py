@@ -0,0 +1,56 @@
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+from accounting import exports
+
+
+class Command(BaseCommand):
+    help = "Export an organization's general ledger as Parquet or Arrow IPC"
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', help='Organization id or slug')
+        parser.add_argument('output', help='Output file, or directory when partitioning')
+        parser.add_argument('--format', choices=exports.FORMATS, default=exports.PARQUET)
+        parser.add_argument('--start-date')
+        parser.add_argument('--end-date')
+        parser.add_argument(
+            '--partition',
+            action='store_true',
+            help='Write a year=/month= partitioned dataset instead of one file'
+        )
+        parser.add_argument('--batch-size', type=int, default=exports.DEFAULT_BATCH_SIZE)
+
+    def handle(self, *args, **options):
+        organization = self.get_organization(options['organization'])
+        entries = exports.ledger_queryset(
+            organization,
+            start_date=options['start_date'],
+            end_date=options['end_date']
+        )
+
+        if options['partition']:
+            exports.write_partitioned_ledger(
+                options['output'],
+                entries,
+                fmt=options['format'],
+                batch_size=options['batch_size']
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"Ledger of {organization} written to {options['output']}"
+            ))
+        else:
+            rows = exports.write_ledger(
+                options['output'],
+                entries,
+                fmt=options['format'],
+                batch_size=options['batch_size']
+            )
+            self.stdout.write(self.style.SUCCESS(
+                f"{rows} entries of {organization} written to {options['output']}"
+            ))
+
+    def get_organization(self, value):
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        try:
+            return Organization.objects.get(**lookup)
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization '{value}' does not exist")
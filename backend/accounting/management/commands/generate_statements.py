@@ -0,0 +1,47 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+from accounting import rendering, statements
+
+
+class Command(BaseCommand):
+    help = "Generate and store the customer statements of an organization for a period"
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', help='Organization id or slug')
+        parser.add_argument('--period-start', help='Default: first day of the previous month')
+        parser.add_argument('--period-end', help='Default: last day of the previous month')
+        parser.add_argument('--format', choices=rendering.FORMATS, default=rendering.PDF)
+        parser.add_argument('--workers', type=int, help='Rendering processes (default: one per CPU)')
+
+    def handle(self, *args, **options):
+        organization = self.get_organization(options['organization'])
+        period_start, period_end = statements.previous_month()
+        try:
+            if options['period_start']:
+                period_start = date.fromisoformat(options['period_start'])
+            if options['period_end']:
+                period_end = date.fromisoformat(options['period_end'])
+        except ValueError as e:
+            raise CommandError(str(e))
+        if period_start > period_end:
+            raise CommandError("The period start must not be after its end")
+
+        documents = statements.generate_statements(
+            organization,
+            period_start,
+            period_end,
+            fmt=options['format'],
+            workers=options['workers']
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(documents)} statements of {organization} stored for {period_start} - {period_end}"
+        ))
+
+    def get_organization(self, value):
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        try:
+            return Organization.objects.get(**lookup)
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization '{value}' does not exist")
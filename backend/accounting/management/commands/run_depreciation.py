@@ -0,0 +1,36 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+from accounting import depreciation
+from accounting.statements import previous_month
+
+
+class Command(BaseCommand):
+    help = "Post the depreciation of an organization's fixed assets for a month"
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', help='Organization id or slug')
+        parser.add_argument('--period-end', help='Any day of the month (default: the previous month)')
+
+    def handle(self, *args, **options):
+        organization = self.get_organization(options['organization'])
+        period_end = previous_month()[1]
+        if options['period_end']:
+            try:
+                period_end = date.fromisoformat(options['period_end'])
+            except ValueError as e:
+                raise CommandError(str(e))
+
+        run = depreciation.run_depreciation(organization, period_end)
+        self.stdout.write(self.style.SUCCESS(
+            f"Depreciation of {organization} for {run.period_end}: "
+            f"{run.total_amount} on {run.asset_count} assets"
+        ))
+
+    def get_organization(self, value):
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        try:
+            return Organization.objects.get(**lookup)
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization '{value}' does not exist")
@@ -0,0 +1,95 @@
+from concurrent.futures import ThreadPoolExecutor
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from organizations.models import Organization
+from accounting import integrity
+
+
+class Command(BaseCommand):
+    help = "Verify account balances, transaction balance and period checksums of ledgers"
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--organization',
+            action='append',
+            dest='organizations',
+            help='Organization id or slug (repeatable); defaults to every active organization'
+        )
+        parser.add_argument('--workers', type=int, default=4)
+        parser.add_argument(
+            '--full',
+            action='store_true',
+            help='Rescan every period instead of only the periods that changed'
+        )
+        parser.add_argument(
+            '--fix-balances',
+            action='store_true',
+            help='Reset drifted account balances to the sum of their posted entries'
+        )
+        parser.add_argument('--database', default='default')
+
+    def handle(self, *args, **options):
+        organizations = self.get_organizations(options['organizations'])
+        using = options['database']
+
+        def verify(organization):
+            try:
+                return organization, integrity.verify_organization(
+                    organization,
+                    full=options['full'],
+                    repair=options['fix_balances'],
+                    using=using
+                )
+            finally:
+                # Every worker thread opens its own connection
+                connections.close_all()
+
+        workers = max(1, min(options['workers'], len(organizations)))
+        problems = 0
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            for organization, report in executor.map(verify, organizations):
+                problems += self.write_report(organization, report)
+
+        if problems:
+            raise CommandError(f"{problems} ledger problem(s) found")
+        self.stdout.write(self.style.SUCCESS(
+            f"{len(organizations)} ledger(s) verified"
+        ))
+
+    def write_report(self, organization, report):
+        problems = 0
+        for row in report['balance_drift']:
+            self.stdout.write(self.style.WARNING(
+                f"{organization}: account {row['code']} balance {row['current_balance']} "
+                f"!= ledger {row['ledger_balance']}"
+                + (' (fixed)' if report['repaired'] else '')
+            ))
+        if not report['repaired']:
+            problems += len(report['balance_drift'])
+        for row in report['unbalanced_transactions']:
+            self.stdout.write(self.style.WARNING(
+                f"{organization}: transaction {row['id']} of {row['date']} "
+                f"is off by {row['total']}"
+            ))
+        problems += len(report['unbalanced_transactions'])
+        for period in report['changed_periods']:
+            self.stdout.write(self.style.WARNING(
+                f"{organization}: entries of {period:%Y-%m} changed since last verification"
+            ))
+        self.stdout.write(
+            f"{organization}: {report['periods']} period(s), "
+            f"{len(report['rescanned_periods'])} rescanned"
+        )
+        return problems
+
+    def get_organizations(self, values):
+        if not values:
+            return list(Organization.objects.filter(is_active=True))
+        organizations = []
+        for value in values:
+            lookup = {'pk': value} if value.isdigit() else {'slug': value}
+            try:
+                organizations.append(Organization.objects.get(**lookup))
+            except Organization.DoesNotExist:
+                raise CommandError(f"Organization '{value}' does not exist")
+        return organizations
@@ -0,0 +1,36 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:11
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0009_alter_organization_owner'),
+        ('accounting', '0002_invoice_recurringinvoice_recurringinvoiceitem_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerPeriodChecksum',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period', models.DateField(verbose_name='period')),
+                ('entry_count', models.PositiveIntegerField(default=0, verbose_name='entry count')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='total amount')),
+                ('id_total', models.BigIntegerField(default=0, verbose_name='id total')),
+                ('last_modified', models.DateTimeField(blank=True, null=True, verbose_name='last modified')),
+                ('digest', models.CharField(max_length=64, verbose_name='digest')),
+                ('chain_digest', models.CharField(max_length=64, verbose_name='chain digest')),
+                ('verified_at', models.DateTimeField(auto_now=True, verbose_name='verified at')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_checksums', to='organizations.organization', verbose_name='organization')),
+            ],
+            options={
+                'verbose_name': 'ledger period checksum',
+                'verbose_name_plural': 'ledger period checksums',
+                'ordering': ['organization', 'period'],
+                'unique_together': {('organization', 'period')},
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:16
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0010_organization_books_closed_through'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting', '0003_ledgerperiodchecksum'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PeriodClose',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_start', models.DateField(blank=True, null=True, verbose_name='period start')),
+                ('period_end', models.DateField(verbose_name='period end')),
+                ('notes', models.TextField(blank=True, verbose_name='notes')),
+                ('closed_at', models.DateTimeField(auto_now_add=True, verbose_name='closed at')),
+                ('closed_by', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='closed_periods', to=settings.AUTH_USER_MODEL, verbose_name='closed by')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='period_closes', to='organizations.organization', verbose_name='organization')),
+            ],
+            options={
+                'verbose_name': 'period close',
+                'verbose_name_plural': 'period closes',
+                'ordering': ['-period_end'],
+                'unique_together': {('organization', 'period_end')},
+            },
+        ),
+        migrations.CreateModel(
+            name='ClosingBalance',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('debits', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='debits')),
+                ('credits', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='credits')),
+                ('period_amount', models.DecimalField(decimal_places=2, default=0, help_text='Net movement within the closed period', max_digits=15, verbose_name='period amount')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='closing_balances', to='accounting.account', verbose_name='account')),
+                ('period_close', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='balances', to='accounting.periodclose', verbose_name='period close')),
+            ],
+            options={
+                'verbose_name': 'closing balance',
+                'verbose_name_plural': 'closing balances',
+                'unique_together': {('period_close', 'account')},
+            },
+        ),
+    ]
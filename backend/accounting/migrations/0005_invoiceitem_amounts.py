@@ -0,0 +1,42 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:19
+
+from decimal import Decimal, ROUND_HALF_UP
+
+from django.db import migrations, models
+
+
+def backfill_amounts(apps, schema_editor):
+    InvoiceItem = apps.get_model('accounting', 'InvoiceItem')
+    cent = Decimal('0.01')
+    batch = []
+    for item in InvoiceItem.objects.order_by('pk').iterator(chunk_size=2000):
+        gross = item.quantity * item.unit_price
+        item.amount = (gross - gross * item.discount_rate / 100).quantize(cent, rounding=ROUND_HALF_UP)
+        item.tax_amount = (item.amount * item.tax_rate / 100).quantize(cent, rounding=ROUND_HALF_UP)
+        batch.append(item)
+        if len(batch) == 2000:
+            InvoiceItem.objects.bulk_update(batch, ['amount', 'tax_amount'])
+            batch = []
+    if batch:
+        InvoiceItem.objects.bulk_update(batch, ['amount', 'tax_amount'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0004_periodclose_closingbalance'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15, verbose_name='amount'),
+        ),
+        migrations.AddField(
+            model_name='invoiceitem',
+            name='tax_amount',
+            field=models.DecimalField(decimal_places=2, default=0, editable=False, max_digits=15, verbose_name='tax amount'),
+        ),
+        migrations.RunPython(backfill_amounts, migrations.RunPython.noop),
+    ]
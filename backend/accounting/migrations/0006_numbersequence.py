@@ -0,0 +1,34 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0010_organization_books_closed_through'),
+        ('accounting', '0005_invoiceitem_amounts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='NumberSequence',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('series', models.CharField(default='invoice', max_length=50, verbose_name='series')),
+                ('prefix', models.CharField(blank=True, default='INV-', max_length=20, verbose_name='prefix')),
+                ('pattern', models.CharField(default='{prefix}{number:06d}', help_text='Placeholders: {prefix}, {number}, {year}, {month}', max_length=100, verbose_name='pattern')),
+                ('next_value', models.PositiveBigIntegerField(default=1, verbose_name='next value')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='number_sequences', to='organizations.organization', verbose_name='organization')),
+            ],
+            options={
+                'verbose_name': 'number sequence',
+                'verbose_name_plural': 'number sequences',
+                'ordering': ['organization', 'series'],
+                'unique_together': {('organization', 'series')},
+            },
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:23
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def allocate_existing_payments(apps, schema_editor):
+    Payment = apps.get_model('accounting', 'Payment')
+    PaymentAllocation = apps.get_model('accounting', 'PaymentAllocation')
+    batch = []
+    payments = Payment.objects.filter(invoice__isnull=False).order_by('pk')
+    for payment_id, invoice_id, amount in payments.values_list('pk', 'invoice_id', 'amount').iterator(chunk_size=2000):
+        batch.append(PaymentAllocation(payment_id=payment_id, invoice_id=invoice_id, amount=amount))
+        if len(batch) == 2000:
+            PaymentAllocation.objects.bulk_create(batch)
+            batch = []
+    if batch:
+        PaymentAllocation.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0006_numbersequence'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='payment',
+            name='invoice',
+            field=models.ForeignKey(blank=True, help_text='Invoice the payment was received for; see allocations for split payments', null=True, on_delete=django.db.models.deletion.CASCADE, related_name='payments', to='accounting.invoice', verbose_name='invoice'),
+        ),
+        migrations.CreateModel(
+            name='PaymentAllocation',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))], verbose_name='amount')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('invoice', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='accounting.invoice', verbose_name='invoice')),
+                ('payment', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocations', to='accounting.payment', verbose_name='payment')),
+            ],
+            options={
+                'verbose_name': 'payment allocation',
+                'verbose_name_plural': 'payment allocations',
+                'unique_together': {('payment', 'invoice')},
+            },
+        ),
+        migrations.RunPython(allocate_existing_payments, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:25
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0007_payment_allocations'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transactionentry',
+            name='reconciled',
+            field=models.BooleanField(default=False, verbose_name='reconciled'),
+        ),
+        migrations.AddField(
+            model_name='transactionentry',
+            name='reconciled_date',
+            field=models.DateField(blank=True, null=True, verbose_name='reconciled date'),
+        ),
+        migrations.AddIndex(
+            model_name='transactionentry',
+            index=models.Index(fields=['account', 'reconciled'], name='entry_account_reconciled_idx'),
+        ),
+    ]
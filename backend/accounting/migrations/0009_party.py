@@ -0,0 +1,88 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:33
+
+from django.contrib.postgres.operations import TrigramExtension
+from django.db import migrations, models
+import django.db.models.deletion
+
+TRIGRAM_INDEXES = (
+    ('party_name_trgm_idx', 'name'),
+    ('party_tax_id_trgm_idx', 'tax_id'),
+)
+
+
+def create_trigram_indexes(apps, schema_editor):
+    # GIN trigram indexes only exist on PostgreSQL
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, column in TRIGRAM_INDEXES:
+        schema_editor.execute(
+            f'CREATE INDEX IF NOT EXISTS {name} ON accounting_party USING gin ({column} gin_trgm_ops)'
+        )
+
+
+def drop_trigram_indexes(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    for name, _column in TRIGRAM_INDEXES:
+        schema_editor.execute(f'DROP INDEX IF EXISTS {name}')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0010_organization_books_closed_through'),
+        ('accounting', '0008_entry_reconciliation'),
+    ]
+
+    operations = [
+        TrigramExtension(),
+        migrations.CreateModel(
+            name='Party',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('type', models.CharField(choices=[('customer', 'Customer'), ('vendor', 'Vendor'), ('both', 'Customer and Vendor')], default='customer', max_length=20, verbose_name='type')),
+                ('name', models.CharField(max_length=255, verbose_name='name')),
+                ('tax_id', models.CharField(blank=True, max_length=50, verbose_name='tax ID')),
+                ('address', models.TextField(blank=True, verbose_name='address')),
+                ('email', models.EmailField(blank=True, max_length=254, verbose_name='email')),
+                ('phone', models.CharField(blank=True, max_length=50, verbose_name='phone')),
+                ('match_key', models.CharField(editable=False, max_length=255, verbose_name='match key')),
+                ('is_active', models.BooleanField(default=True, verbose_name='is active')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+            ],
+            options={
+                'verbose_name': 'party',
+                'verbose_name_plural': 'parties',
+                'ordering': ['name'],
+            },
+        ),
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(fields=['organization', 'updated_at'], name='invoice_org_updated_idx'),
+        ),
+        migrations.AddField(
+            model_name='party',
+            name='organization',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='parties', to='organizations.organization', verbose_name='organization'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='party',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='invoices', to='accounting.party', verbose_name='party'),
+        ),
+        migrations.AddField(
+            model_name='recurringinvoice',
+            name='party',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='recurring_invoices', to='accounting.party', verbose_name='party'),
+        ),
+        migrations.AddIndex(
+            model_name='party',
+            index=models.Index(fields=['organization', 'name'], name='party_org_name_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='party',
+            unique_together={('organization', 'match_key')},
+        ),
+        migrations.RunPython(create_trigram_indexes, drop_trigram_indexes),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:40
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0009_party'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_file',
+            field=models.FileField(blank=True, upload_to='invoices/%Y/%m/', verbose_name='PDF file'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='pdf_hash',
+            field=models.CharField(blank=True, editable=False, max_length=64, verbose_name='PDF hash'),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:44
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0010_invoice_pdf'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='invoice',
+            name='email_attempts',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='email attempts'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='email_error',
+            field=models.TextField(blank=True, verbose_name='email error'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='email_sent_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='email sent at'),
+        ),
+        migrations.AddField(
+            model_name='invoice',
+            name='email_status',
+            field=models.CharField(choices=[('not_sent', 'Not sent'), ('queued', 'Queued'), ('sent', 'Sent'), ('failed', 'Failed')], default='not_sent', max_length=20, verbose_name='email status'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:47
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0011_invoice_email'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='invoice',
+            index=models.Index(condition=models.Q(('status__in', ['sent', 'approved', 'partially_paid'])), fields=['organization', 'due_date'], name='invoice_open_due_idx'),
+        ),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:52
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0010_organization_books_closed_through'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting', '0012_invoice_open_due_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fixedasset',
+            name='accumulated_depreciation_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='accumulated_depreciation_assets', to='accounting.account', verbose_name='accumulated depreciation account'),
+        ),
+        migrations.AddField(
+            model_name='fixedasset',
+            name='asset_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='fixed_assets', to='accounting.account', verbose_name='asset account'),
+        ),
+        migrations.AddField(
+            model_name='fixedasset',
+            name='depreciated_through',
+            field=models.DateField(blank=True, null=True, verbose_name='depreciated through'),
+        ),
+        migrations.AddField(
+            model_name='fixedasset',
+            name='depreciation_expense_account',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='depreciation_expense_assets', to='accounting.account', verbose_name='depreciation expense account'),
+        ),
+        migrations.CreateModel(
+            name='DepreciationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField(verbose_name='period end')),
+                ('asset_count', models.PositiveIntegerField(default=0, verbose_name='asset count')),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='total amount')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='depreciation_runs', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='depreciation_runs', to='organizations.organization', verbose_name='organization')),
+                ('transaction', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='depreciation_runs', to='accounting.transaction', verbose_name='transaction')),
+            ],
+            options={
+                'verbose_name': 'depreciation run',
+                'verbose_name_plural': 'depreciation runs',
+                'ordering': ['-period_end'],
+                'unique_together': {('organization', 'period_end')},
+            },
+        ),
+    ]
@@ -0,0 +1,29 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:55
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0013_depreciation_run'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='fixedasset',
+            name='disposal_date',
+            field=models.DateField(blank=True, null=True, verbose_name='disposal date'),
+        ),
+        migrations.AddField(
+            model_name='fixedasset',
+            name='disposal_proceeds',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=15, verbose_name='disposal proceeds'),
+        ),
+        migrations.AddField(
+            model_name='fixedasset',
+            name='disposal_transaction',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='disposed_assets', to='accounting.transaction', verbose_name='disposal transaction'),
+        ),
+    ]
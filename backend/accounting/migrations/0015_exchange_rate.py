@@ -0,0 +1,40 @@
+# Generated by Django 4.2.10 on 2026-10-18 23:00
+
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0010_organization_books_closed_through'),
+        ('accounting', '0014_fixedasset_disposal'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='account',
+            name='subtype',
+            field=models.CharField(blank=True, choices=[('cash', 'Cash'), ('bank', 'Bank Account'), ('receivable', 'Accounts Receivable'), ('inventory', 'Inventory'), ('fixed_asset', 'Fixed Asset'), ('payable', 'Accounts Payable'), ('credit_card', 'Credit Card'), ('loan', 'Loan'), ('sales', 'Sales'), ('service', 'Service Revenue'), ('interest', 'Interest Income'), ('cost_of_goods', 'Cost of Goods Sold'), ('operating', 'Operating Expense'), ('payroll', 'Payroll'), ('tax', 'Tax'), ('fx_gain_loss', 'Exchange Gain/Loss')], max_length=20, verbose_name='account subtype'),
+        ),
+        migrations.CreateModel(
+            name='ExchangeRate',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('currency', models.CharField(max_length=3, verbose_name='currency')),
+                ('date', models.DateField(verbose_name='date')),
+                ('rate', models.DecimalField(decimal_places=8, max_digits=18, validators=[django.core.validators.MinValueValidator(0)], verbose_name='rate')),
+                ('source', models.CharField(blank=True, max_length=50, verbose_name='source')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='exchange_rates', to='organizations.organization', verbose_name='organization')),
+            ],
+            options={
+                'verbose_name': 'exchange rate',
+                'verbose_name_plural': 'exchange rates',
+                'ordering': ['currency', '-date'],
+                'unique_together': {('organization', 'currency', 'date')},
+            },
+        ),
+    ]
@@ -0,0 +1,61 @@
+# Generated by Django 4.2.10 on 2026-10-18 23:07
+
+from datetime import date
+
+from dateutil.relativedelta import relativedelta
+from django.db import migrations, models
+import django.db.models.deletion
+
+STEPS = {
+    'daily': relativedelta(days=1),
+    'weekly': relativedelta(weeks=1),
+    'monthly': relativedelta(months=1),
+    'quarterly': relativedelta(months=3),
+    'yearly': relativedelta(years=1),
+}
+
+
+def backfill_next_dates(apps, schema_editor):
+    # Existing recurring transactions start repeating from today on instead
+    # of catching up on every period since they were entered
+    Transaction = apps.get_model('accounting', 'Transaction')
+    today = date.today()
+    batch = []
+    for trans in Transaction.objects.filter(
+        is_recurring=True,
+        recurrence_type__in=list(STEPS)
+    ).order_by('pk').iterator(chunk_size=2000):
+        step = STEPS[trans.recurrence_type]
+        if trans.recurrence_type not in ('daily', 'weekly'):
+            step = step + relativedelta(day=trans.date.day)
+        current = trans.date + step
+        while current < today:
+            current = current + step
+        trans.next_recurrence_date = current
+        batch.append(trans)
+    Transaction.objects.bulk_update(batch, ['next_recurrence_date'], batch_size=2000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0015_exchange_rate'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='next_recurrence_date',
+            field=models.DateField(blank=True, help_text='Date of the next copy of a recurring transaction', null=True, verbose_name='next recurrence date'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='recurrence_source',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='occurrences', to='accounting.transaction', verbose_name='recurrence source'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('is_recurring', True)), fields=['next_recurrence_date'], name='transaction_recurrence_idx'),
+        ),
+        migrations.RunPython(backfill_next_dates, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,28 @@
+# Generated by Django 4.2.10 on 2026-10-18 23:09
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0016_transaction_recurrence'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='transaction',
+            name='reversal_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reversals', to='accounting.transaction', verbose_name='reversal of'),
+        ),
+        migrations.AddField(
+            model_name='transaction',
+            name='reverse_on',
+            field=models.DateField(blank=True, help_text='Date on which a posted transaction (e.g. an accrual) is reversed', null=True, verbose_name='reverse on'),
+        ),
+        migrations.AddIndex(
+            model_name='transaction',
+            index=models.Index(condition=models.Q(('reverse_on__isnull', False)), fields=['reverse_on'], name='transaction_reverse_on_idx'),
+        ),
+    ]
@@ -0,0 +1,73 @@
+# Generated by Django 4.2.10 on 2026-10-18 23:12
+
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0010_organization_books_closed_through'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('accounting', '0017_transaction_reversal'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AllocationRule',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, verbose_name='name')),
+                ('description', models.TextField(blank=True, verbose_name='description')),
+                ('method', models.CharField(choices=[('percentage', 'Percentage'), ('driver', 'Driver Based')], default='percentage', max_length=20, verbose_name='method')),
+                ('is_active', models.BooleanField(default=True, verbose_name='active')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='updated at')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocation_rules', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocation_rules', to='organizations.organization', verbose_name='organization')),
+                ('source_account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='allocation_rules', to='accounting.account', verbose_name='source account')),
+            ],
+            options={
+                'verbose_name': 'allocation rule',
+                'verbose_name_plural': 'allocation rules',
+                'ordering': ['name'],
+                'unique_together': {('organization', 'name')},
+            },
+        ),
+        migrations.CreateModel(
+            name='AllocationTarget',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('percentage', models.DecimalField(decimal_places=2, default=0, max_digits=5, validators=[django.core.validators.MinValueValidator(0)], verbose_name='percentage')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='allocation_targets', to='accounting.account', verbose_name='account')),
+                ('driver_account', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.PROTECT, related_name='allocation_drivers', to='accounting.account', verbose_name='driver account')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='targets', to='accounting.allocationrule', verbose_name='rule')),
+            ],
+            options={
+                'verbose_name': 'allocation target',
+                'verbose_name_plural': 'allocation targets',
+                'ordering': ['pk'],
+            },
+        ),
+        migrations.CreateModel(
+            name='AllocationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('period_end', models.DateField(verbose_name='period end')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=15, verbose_name='amount')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='created at')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='allocation_runs', to=settings.AUTH_USER_MODEL, verbose_name='created by')),
+                ('organization', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='allocation_runs', to='organizations.organization', verbose_name='organization')),
+                ('rule', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='runs', to='accounting.allocationrule', verbose_name='rule')),
+                ('transaction', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='allocation_runs', to='accounting.transaction', verbose_name='transaction')),
+            ],
+            options={
+                'verbose_name': 'allocation run',
+                'verbose_name_plural': 'allocation runs',
+                'ordering': ['-period_end', 'rule'],
+                'unique_together': {('rule', 'period_end')},
+            },
+        ),
+    ]
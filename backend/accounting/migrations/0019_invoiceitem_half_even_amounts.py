@@ -0,0 +1,61 @@
+# Generated by Django 4.2.10 on 2026-10-19 09:40
+
+from django.db import migrations, models
+
+from accounting import money
+
+
+def recompute_amounts(apps, schema_editor):
+    """
+    0005 stored the line amounts rounded half up; the models round half to
+    even now, so rewrite them (and the totals of their invoices) the way
+    ``InvoiceItem.compute_many`` would.
+    """
+    InvoiceItem = apps.get_model('accounting', 'InvoiceItem')
+    Invoice = apps.get_model('accounting', 'Invoice')
+    invoice_ids = set()
+
+    def flush(batch):
+        amounts, taxes = money.line_amounts(
+            [item.quantity for item in batch],
+            [item.unit_price for item in batch],
+            [item.discount_rate for item in batch],
+            [item.tax_rate for item in batch]
+        )
+        changed = []
+        for item, amount, tax in zip(batch, amounts, taxes):
+            amount, tax = money.from_cents(amount), money.from_cents(tax)
+            if (item.amount, item.tax_amount) != (amount, tax):
+                item.amount, item.tax_amount = amount, tax
+                changed.append(item)
+                invoice_ids.add(item.invoice_id)
+        InvoiceItem.objects.bulk_update(changed, ['amount', 'tax_amount'])
+
+    batch = []
+    for item in InvoiceItem.objects.order_by('pk').iterator(chunk_size=2000):
+        batch.append(item)
+        if len(batch) == 2000:
+            flush(batch)
+            batch = []
+    if batch:
+        flush(batch)
+
+    for invoice in Invoice.objects.filter(pk__in=invoice_ids).annotate(
+        line_subtotal=models.Sum('items__amount'),
+        line_tax=models.Sum('items__tax_amount')
+    ).iterator(chunk_size=2000):
+        invoice.subtotal = invoice.line_subtotal
+        invoice.tax_amount = invoice.line_tax
+        invoice.total = invoice.subtotal + invoice.tax_amount
+        invoice.save(update_fields=['subtotal', 'tax_amount', 'total'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('accounting', '0018_allocation_rules'),
+    ]
+
+    operations = [
+        migrations.RunPython(recompute_amounts, migrations.RunPython.noop),
+    ]
@@ -1,10 +1,14 @@
-from django.db import models
+from django.db import models, transaction
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from django.core.validators import MinValueValidator
+from django.utils.dateparse import parse_date
 from organizations.models import Organization
+from . import money
 from decimal import Decimal
-from datetime import timedelta
+from datetime import date, timedelta
+from string import Formatter
+import re
 
 class Account(models.Model):
     class AccountType(models.TextChoices):
@@ -37,6 +41,7 @@ class Account(models.Model):
         OPERATING = 'operating', _('Operating Expense')
         PAYROLL = 'payroll', _('Payroll')
         TAX = 'tax', _('Tax')
+        FX_GAIN_LOSS = 'fx_gain_loss', _('Exchange Gain/Loss')
 
     organization = models.ForeignKey(
         Organization,
@@ -156,6 +161,36 @@ class Transaction(models.Model):
         default=RecurrenceType.NONE
     )
     recurrence_end_date = models.DateField(_('recurrence end date'), null=True, blank=True)
+    next_recurrence_date = models.DateField(
+        _('next recurrence date'),
+        null=True,
+        blank=True,
+        help_text=_('Date of the next copy of a recurring transaction')
+    )
+    recurrence_source = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='occurrences',
+        verbose_name=_('recurrence source')
+    )
+    
+    # Reversal
+    reverse_on = models.DateField(
+        _('reverse on'),
+        null=True,
+        blank=True,
+        help_text=_('Date on which a posted transaction (e.g. an accrual) is reversed')
+    )
+    reversal_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='reversals',
+        verbose_name=_('reversal of')
+    )
     
     # Metadata
     created_at = models.DateTimeField(_('created at'), auto_now_add=True)
@@ -183,10 +218,67 @@ class Transaction(models.Model):
         verbose_name = _('transaction')
         verbose_name_plural = _('transactions')
         ordering = ['-date', '-created_at']
+        indexes = [
+            # The nightly recurring run only reads recurring transactions that fell due
+            models.Index(
+                fields=['next_recurrence_date'],
+                name='transaction_recurrence_idx',
+                condition=models.Q(is_recurring=True)
+            ),
+            models.Index(
+                fields=['reverse_on'],
+                name='transaction_reverse_on_idx',
+                condition=models.Q(reverse_on__isnull=False)
+            ),
+        ]
 
     def __str__(self):
         return f"{self.date} - {self.description[:50]}"
 
+    @property
+    def repeats(self):
+        return self.is_recurring and self.recurrence_type != self.RecurrenceType.NONE
+
+    # Fields the recurrence schedule is derived from
+    SCHEDULE_FIELDS = ('date', 'recurrence_type')
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_schedule = {
+            name: value for name, value in zip(field_names, values)
+            if name in cls.SCHEDULE_FIELDS
+        }
+        return instance
+
+    def _schedule(self):
+        start = parse_date(self.date) if isinstance(self.date, str) else self.date
+        return {'date': start, 'recurrence_type': self.recurrence_type}
+
+    def _schedule_changed(self):
+        loaded = getattr(self, '_loaded_schedule', {})
+        current = self._schedule()
+        return any(loaded[name] != current[name] for name in loaded)
+
+    def save(self, *args, **kwargs):
+        # A recurring transaction is first copied one period after its own
+        # date; moving the date or changing the frequency restarts the schedule
+        previous = self.next_recurrence_date
+        if not self.repeats:
+            self.next_recurrence_date = None
+        elif self.date and (self.next_recurrence_date is None or self._schedule_changed()):
+            from .recurring import next_occurrence
+
+            start = self._schedule()['date']
+            self.next_recurrence_date = next_occurrence(start, self.recurrence_type, start.day)
+        # Only write the date when this save moved it, so saving a stale
+        # instance does not undo the nightly run
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None and self.next_recurrence_date != previous:
+            kwargs['update_fields'] = {*update_fields, 'next_recurrence_date'}
+        super().save(*args, **kwargs)
+        self._loaded_schedule = self._schedule()
+
     @property
     def total_amount(self):
         return sum(entry.amount for entry in self.entries.all())
@@ -227,18 +319,21 @@ class TransactionEntry(models.Model):
         default=1,
         validators=[MinValueValidator(0)]
     )
+    
+    # Bank reconciliation
+    reconciled = models.BooleanField(_('reconciled'), default=False)
+    reconciled_date = models.DateField(_('reconciled date'), null=True, blank=True)
 
     class Meta:
         verbose_name = _('transaction entry')
         verbose_name_plural = _('transaction entries')
+        indexes = [
+            models.Index(fields=['account', 'reconciled'], name='entry_account_reconciled_idx'),
+        ]
 
     def __str__(self):
         return f"{self.account} - {self.amount}"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        self.account.update_balance(self.amount)
-
 class Budget(models.Model):
     class Period(models.TextChoices):
         MONTHLY = 'monthly', _('Monthly')
@@ -337,6 +432,64 @@ class BudgetItem(models.Model):
             return self.amount - actual
         return None
 
+class Party(models.Model):
+    class Type(models.TextChoices):
+        CUSTOMER = 'customer', _('Customer')
+        VENDOR = 'vendor', _('Vendor')
+        BOTH = 'both', _('Customer and Vendor')
+
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='parties',
+        verbose_name=_('organization')
+    )
+    type = models.CharField(
+        _('type'),
+        max_length=20,
+        choices=Type.choices,
+        default=Type.CUSTOMER
+    )
+    name = models.CharField(_('name'), max_length=255)
+    tax_id = models.CharField(_('tax ID'), max_length=50, blank=True)
+    address = models.TextField(_('address'), blank=True)
+    email = models.EmailField(_('email'), blank=True)
+    phone = models.CharField(_('phone'), max_length=50, blank=True)
+    # Normalized tax id (or name) identifying the same party across spellings
+    match_key = models.CharField(_('match key'), max_length=255, editable=False)
+    is_active = models.BooleanField(_('is active'), default=True)
+    
+    # Metadata
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('party')
+        verbose_name_plural = _('parties')
+        unique_together = ('organization', 'match_key')
+        ordering = ['name']
+        indexes = [
+            models.Index(fields=['organization', 'name'], name='party_org_name_idx'),
+        ]
+
+    def __str__(self):
+        return self.name
+
+    @staticmethod
+    def make_match_key(name, tax_id=''):
+        """Key under which invoices of the same party are merged."""
+        tax_id = ''.join(ch for ch in (tax_id or '').upper() if ch.isalnum())
+        if tax_id:
+            return f'tax:{tax_id}'
+        return 'name:' + ' '.join((name or '').casefold().split())[:250]
+
+    def save(self, *args, **kwargs):
+        self.match_key = self.make_match_key(self.name, self.tax_id)
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'match_key'}
+        super().save(*args, **kwargs)
+
 class Invoice(models.Model):
     class Type(models.TextChoices):
         SALE = 'sale', _('Sales Invoice')
@@ -354,6 +507,12 @@ class Invoice(models.Model):
         VOID = 'void', _('Void')
         CANCELLED = 'cancelled', _('Cancelled')
 
+    class EmailStatus(models.TextChoices):
+        NOT_SENT = 'not_sent', _('Not sent')
+        QUEUED = 'queued', _('Queued')
+        SENT = 'sent', _('Sent')
+        FAILED = 'failed', _('Failed')
+
     organization = models.ForeignKey(
         Organization,
         on_delete=models.CASCADE,
@@ -374,6 +533,14 @@ class Invoice(models.Model):
     due_date = models.DateField(_('due date'))
     
     # Party information
+    party = models.ForeignKey(
+        Party,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='invoices',
+        verbose_name=_('party')
+    )
     party_name = models.CharField(_('party name'), max_length=255)
     party_tax_id = models.CharField(_('party tax ID'), max_length=50, blank=True)
     party_address = models.TextField(_('party address'), blank=True)
@@ -425,6 +592,21 @@ class Invoice(models.Model):
         default=Status.DRAFT
     )
     
+    # Rendered PDF and the content hash it was rendered from
+    pdf_file = models.FileField(_('PDF file'), upload_to='invoices/%Y/%m/', blank=True)
+    pdf_hash = models.CharField(_('PDF hash'), max_length=64, blank=True, editable=False)
+    
+    # Email delivery
+    email_status = models.CharField(
+        _('email status'),
+        max_length=20,
+        choices=EmailStatus.choices,
+        default=EmailStatus.NOT_SENT
+    )
+    email_sent_at = models.DateTimeField(_('email sent at'), null=True, blank=True)
+    email_attempts = models.PositiveSmallIntegerField(_('email attempts'), default=0)
+    email_error = models.TextField(_('email error'), blank=True)
+    
     # Metadata
     created_at = models.DateTimeField(_('created at'), auto_now_add=True)
     updated_at = models.DateTimeField(_('updated at'), auto_now=True)
@@ -441,14 +623,27 @@ class Invoice(models.Model):
         verbose_name_plural = _('invoices')
         unique_together = ('organization', 'number')
         ordering = ['-date', '-number']
+        indexes = [
+            models.Index(fields=['organization', 'updated_at'], name='invoice_org_updated_idx'),
+            # Only invoices that can still fall due: the overdue sweep never reads paid ones
+            models.Index(
+                fields=['organization', 'due_date'],
+                name='invoice_open_due_idx',
+                condition=models.Q(status__in=['sent', 'approved', 'partially_paid'])
+            ),
+        ]
 
     def __str__(self):
         return f"{self.number} - {self.party_name}"
 
     def calculate_totals(self):
-        """Calculate invoice totals from items"""
-        self.subtotal = sum(item.amount for item in self.items.all())
-        self.tax_amount = sum(item.tax_amount for item in self.items.all())
+        """Calculate invoice totals from the stored item amounts in one query"""
+        totals = self.items.aggregate(
+            subtotal=models.Sum('amount'),
+            tax_amount=models.Sum('tax_amount')
+        )
+        self.subtotal = totals['subtotal'] or Decimal('0')
+        self.tax_amount = totals['tax_amount'] or Decimal('0')
         self.total = self.subtotal + self.tax_amount
         self.save(update_fields=['subtotal', 'tax_amount', 'total'])
 
@@ -460,7 +655,24 @@ class Invoice(models.Model):
     def is_paid(self):
         return self.amount_paid >= self.total
 
+class InvoiceItemQuerySet(models.QuerySet):
+    """Keeps the stored line amounts in step on bulk writes too."""
+
+    def bulk_create(self, objs, *args, **kwargs):
+        objs = list(objs)
+        InvoiceItem.compute_many(objs)
+        return super().bulk_create(objs, *args, **kwargs)
+
+    def bulk_update(self, objs, fields, *args, **kwargs):
+        objs = list(objs)
+        if set(fields) & set(InvoiceItem.AMOUNT_SOURCE_FIELDS):
+            InvoiceItem.compute_many(objs)
+            fields = list(dict.fromkeys([*fields, 'amount', 'tax_amount']))
+        return super().bulk_update(objs, fields, *args, **kwargs)
+
 class InvoiceItem(models.Model):
+    AMOUNT_SOURCE_FIELDS = ('quantity', 'unit_price', 'discount_rate', 'tax_rate')
+
     invoice = models.ForeignKey(
         Invoice,
         on_delete=models.CASCADE,
@@ -510,6 +722,24 @@ class InvoiceItem(models.Model):
         related_name='invoice_tax_items',
         verbose_name=_('tax account')
     )
+    
+    # Stored line totals, derived from the fields above on every save
+    amount = models.DecimalField(
+        _('amount'),
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        editable=False
+    )
+    tax_amount = models.DecimalField(
+        _('tax amount'),
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        editable=False
+    )
+
+    objects = InvoiceItemQuerySet.as_manager()
 
     class Meta:
         verbose_name = _('invoice item')
@@ -518,17 +748,36 @@ class InvoiceItem(models.Model):
     def __str__(self):
         return f"{self.invoice.number} - {self.description}"
 
-    @property
-    def amount(self):
-        """Calculate net amount after discount"""
-        gross = self.quantity * self.unit_price
-        discount = gross * (self.discount_rate / Decimal('100'))
-        return gross - discount
+    def compute_amounts(self):
+        """Calculate net amount after discount and its tax, rounded to cents"""
+        gross = Decimal(self.quantity) * Decimal(self.unit_price)
+        discount = gross * (Decimal(self.discount_rate) / Decimal('100'))
+        self.amount = money.quantize(gross - discount)
+        self.tax_amount = money.quantize(
+            self.amount * (Decimal(self.tax_rate) / Decimal('100'))
+        )
 
-    @property
-    def tax_amount(self):
-        """Calculate tax amount"""
-        return self.amount * (self.tax_rate / Decimal('100'))
+    @classmethod
+    def compute_many(cls, items):
+        """``compute_amounts`` of many items at once, in integer cents"""
+        if not items:
+            return
+        amounts, taxes = money.line_amounts(
+            [item.quantity for item in items],
+            [item.unit_price for item in items],
+            [item.discount_rate for item in items],
+            [item.tax_rate for item in items]
+        )
+        for item, amount, tax in zip(items, amounts, taxes):
+            item.amount = money.from_cents(amount)
+            item.tax_amount = money.from_cents(tax)
+
+    def save(self, *args, **kwargs):
+        self.compute_amounts()
+        update_fields = kwargs.get('update_fields')
+        if update_fields is not None:
+            kwargs['update_fields'] = {*update_fields, 'amount', 'tax_amount'}
+        super().save(*args, **kwargs)
 
 class FixedAsset(models.Model):
     class Status(models.TextChoices):
@@ -573,6 +822,32 @@ class FixedAsset(models.Model):
         default='straight_line'
     )
     
+    # Ledger accounts
+    asset_account = models.ForeignKey(
+        Account,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='fixed_assets',
+        verbose_name=_('asset account')
+    )
+    accumulated_depreciation_account = models.ForeignKey(
+        Account,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='accumulated_depreciation_assets',
+        verbose_name=_('accumulated depreciation account')
+    )
+    depreciation_expense_account = models.ForeignKey(
+        Account,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='depreciation_expense_assets',
+        verbose_name=_('depreciation expense account')
+    )
+    
     # Current status
     status = models.CharField(
         _('status'),
@@ -591,6 +866,24 @@ class FixedAsset(models.Model):
         decimal_places=2,
         default=0
     )
+    depreciated_through = models.DateField(_('depreciated through'), null=True, blank=True)
+    
+    # Disposal
+    disposal_date = models.DateField(_('disposal date'), null=True, blank=True)
+    disposal_proceeds = models.DecimalField(
+        _('disposal proceeds'),
+        max_digits=15,
+        decimal_places=2,
+        default=0
+    )
+    disposal_transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='disposed_assets',
+        verbose_name=_('disposal transaction')
+    )
     
     # Location and tracking
     location = models.CharField(_('location'), max_length=255, blank=True)
@@ -627,25 +920,54 @@ class FixedAsset(models.Model):
         return f"{self.asset_number} - {self.name}"
 
     def calculate_depreciation(self, date):
-        """Calculate depreciation amount up to the given date"""
+        """Accumulated depreciation at the end of the month of the given date"""
         if self.status != self.Status.ACTIVE:
-            return 0
-            
-        years_held = (date - self.purchase_date).days / 365.25
-        if years_held > self.useful_life_years:
-            years_held = self.useful_life_years
-            
-        depreciable_amount = self.purchase_cost - self.salvage_value
-        
-        if self.depreciation_method == 'straight_line':
-            return (depreciable_amount / self.useful_life_years) * years_held
-        elif self.depreciation_method == 'declining_balance':
-            rate = 2 / self.useful_life_years  # Double declining balance
-            return depreciable_amount * (1 - (1 - rate) ** years_held)
-        else:  # Sum of years digits
-            sum_of_years = (self.useful_life_years * (self.useful_life_years + 1)) / 2
-            remaining_life = self.useful_life_years - years_held
-            return depreciable_amount * (remaining_life / sum_of_years)
+            return Decimal('0')
+        from .depreciation import accumulated_depreciation
+        return accumulated_depreciation([self], date)[self.pk]
+
+class DepreciationRun(models.Model):
+    """Depreciation posted for one month of an organization; at most one per period."""
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='depreciation_runs',
+        verbose_name=_('organization')
+    )
+    period_end = models.DateField(_('period end'))
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='depreciation_runs',
+        verbose_name=_('transaction')
+    )
+    asset_count = models.PositiveIntegerField(_('asset count'), default=0)
+    total_amount = models.DecimalField(
+        _('total amount'),
+        max_digits=15,
+        decimal_places=2,
+        default=0
+    )
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='depreciation_runs',
+        verbose_name=_('created by')
+    )
+
+    class Meta:
+        verbose_name = _('depreciation run')
+        verbose_name_plural = _('depreciation runs')
+        unique_together = ('organization', 'period_end')
+        ordering = ['-period_end']
+
+    def __str__(self):
+        return f"{self.organization} - {self.period_end}"
 
 class TaxRate(models.Model):
     organization = models.ForeignKey(
@@ -695,6 +1017,171 @@ class TaxRate(models.Model):
     def __str__(self):
         return f"{self.name} ({self.rate}%)"
 
+class ExchangeRate(models.Model):
+    """
+    Value of one unit of ``currency`` in the organization's currency from
+    ``date`` on, until the next rate of the same currency.
+    """
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='exchange_rates',
+        verbose_name=_('organization')
+    )
+    currency = models.CharField(_('currency'), max_length=3)
+    date = models.DateField(_('date'))
+    rate = models.DecimalField(
+        _('rate'),
+        max_digits=18,
+        decimal_places=8,
+        validators=[MinValueValidator(0)]
+    )
+    source = models.CharField(_('source'), max_length=50, blank=True)
+    
+    # Metadata
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('exchange rate')
+        verbose_name_plural = _('exchange rates')
+        unique_together = ('organization', 'currency', 'date')
+        ordering = ['currency', '-date']
+
+    def __str__(self):
+        return f"{self.currency} {self.date}: {self.rate}"
+
+class AllocationRule(models.Model):
+    """
+    Distributes the period movement of ``source_account`` over the accounts of
+    its targets, by fixed percentages or in proportion to the movement of
+    each target's driver account.
+    """
+    class Method(models.TextChoices):
+        PERCENTAGE = 'percentage', _('Percentage')
+        DRIVER = 'driver', _('Driver Based')
+
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='allocation_rules',
+        verbose_name=_('organization')
+    )
+    name = models.CharField(_('name'), max_length=100)
+    description = models.TextField(_('description'), blank=True)
+    source_account = models.ForeignKey(
+        Account,
+        on_delete=models.PROTECT,
+        related_name='allocation_rules',
+        verbose_name=_('source account')
+    )
+    method = models.CharField(
+        _('method'),
+        max_length=20,
+        choices=Method.choices,
+        default=Method.PERCENTAGE
+    )
+    is_active = models.BooleanField(_('active'), default=True)
+
+    # Metadata
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='allocation_rules',
+        verbose_name=_('created by')
+    )
+
+    class Meta:
+        verbose_name = _('allocation rule')
+        verbose_name_plural = _('allocation rules')
+        unique_together = ('organization', 'name')
+        ordering = ['name']
+
+    def __str__(self):
+        return self.name
+
+class AllocationTarget(models.Model):
+    rule = models.ForeignKey(
+        AllocationRule,
+        on_delete=models.CASCADE,
+        related_name='targets',
+        verbose_name=_('rule')
+    )
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.PROTECT,
+        related_name='allocation_targets',
+        verbose_name=_('account')
+    )
+    percentage = models.DecimalField(
+        _('percentage'),
+        max_digits=5,
+        decimal_places=2,
+        default=0,
+        validators=[MinValueValidator(0)]
+    )
+    driver_account = models.ForeignKey(
+        Account,
+        on_delete=models.PROTECT,
+        null=True,
+        blank=True,
+        related_name='allocation_drivers',
+        verbose_name=_('driver account')
+    )
+
+    class Meta:
+        verbose_name = _('allocation target')
+        verbose_name_plural = _('allocation targets')
+        ordering = ['pk']
+
+    def __str__(self):
+        return f"{self.rule} - {self.account}"
+
+class AllocationRun(models.Model):
+    """One allocation rule posted for one month; at most one per rule and period."""
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='allocation_runs',
+        verbose_name=_('organization')
+    )
+    rule = models.ForeignKey(
+        AllocationRule,
+        on_delete=models.CASCADE,
+        related_name='runs',
+        verbose_name=_('rule')
+    )
+    period_end = models.DateField(_('period end'))
+    transaction = models.ForeignKey(
+        Transaction,
+        on_delete=models.PROTECT,
+        related_name='allocation_runs',
+        verbose_name=_('transaction')
+    )
+    amount = models.DecimalField(_('amount'), max_digits=15, decimal_places=2)
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    created_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='allocation_runs',
+        verbose_name=_('created by')
+    )
+
+    class Meta:
+        verbose_name = _('allocation run')
+        verbose_name_plural = _('allocation runs')
+        unique_together = ('rule', 'period_end')
+        ordering = ['-period_end', 'rule']
+
+    def __str__(self):
+        return f"{self.rule} - {self.period_end}"
+
 class Payment(models.Model):
     class Method(models.TextChoices):
         CASH = 'cash', _('Cash')
@@ -722,8 +1209,11 @@ class Payment(models.Model):
     invoice = models.ForeignKey(
         Invoice,
         on_delete=models.CASCADE,
+        null=True,
+        blank=True,
         related_name='payments',
-        verbose_name=_('invoice')
+        verbose_name=_('invoice'),
+        help_text=_('Invoice the payment was received for; see allocations for split payments')
     )
     
     date = models.DateField(_('date'))
@@ -789,19 +1279,39 @@ class Payment(models.Model):
         ordering = ['-date', '-created_at']
 
     def __str__(self):
-        return f"Payment {self.id} - {self.invoice.number}"
+        if self.invoice_id:
+            return f"Payment {self.id} - {self.invoice.number}"
+        return f"Payment {self.id}"
 
-    def save(self, *args, **kwargs):
-        super().save(*args, **kwargs)
-        if self.status == self.Status.COMPLETED:
-            # Update invoice paid amount
-            self.invoice.amount_paid = sum(
-                payment.amount 
-                for payment in self.invoice.payments.filter(
-                    status=self.Status.COMPLETED
-                )
-            )
-            self.invoice.save(update_fields=['amount_paid'])
+class PaymentAllocation(models.Model):
+    """Part of a payment applied to one invoice."""
+    payment = models.ForeignKey(
+        Payment,
+        on_delete=models.CASCADE,
+        related_name='allocations',
+        verbose_name=_('payment')
+    )
+    invoice = models.ForeignKey(
+        Invoice,
+        on_delete=models.CASCADE,
+        related_name='allocations',
+        verbose_name=_('invoice')
+    )
+    amount = models.DecimalField(
+        _('amount'),
+        max_digits=15,
+        decimal_places=2,
+        validators=[MinValueValidator(Decimal('0.01'))]
+    )
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+
+    class Meta:
+        verbose_name = _('payment allocation')
+        verbose_name_plural = _('payment allocations')
+        unique_together = ('payment', 'invoice')
+
+    def __str__(self):
+        return f"{self.payment} -> {self.invoice.number}: {self.amount}"
 
 class RecurringInvoice(models.Model):
     class Frequency(models.TextChoices):
@@ -837,6 +1347,14 @@ class RecurringInvoice(models.Model):
         choices=Invoice.Type.choices,
         default=Invoice.Type.SALE
     )
+    party = models.ForeignKey(
+        Party,
+        on_delete=models.SET_NULL,
+        null=True,
+        blank=True,
+        related_name='recurring_invoices',
+        verbose_name=_('party')
+    )
     party_name = models.CharField(_('party name'), max_length=255)
     party_tax_id = models.CharField(_('party tax ID'), max_length=50, blank=True)
     party_address = models.TextField(_('party address'), blank=True)
@@ -870,13 +1388,18 @@ class RecurringInvoice(models.Model):
     def __str__(self):
         return self.name
 
+    @transaction.atomic
     def generate_invoice(self):
         """Generate a new invoice from this template"""
+        from .numbering import next_invoice_number
+        
         invoice = Invoice.objects.create(
             organization=self.organization,
+            number=next_invoice_number(self.organization_id, on=self.next_date),
             type=self.invoice_type,
             date=self.next_date,
             due_date=self.next_date + timedelta(days=self.days_due),
+            party_id=self.party_id,
             party_name=self.party_name,
             party_tax_id=self.party_tax_id,
             party_address=self.party_address,
@@ -905,28 +1428,12 @@ class RecurringInvoice(models.Model):
 
     def update_next_date(self):
         """Update the next generation date based on frequency"""
+        from .recurring import next_occurrence
+        
         if not self.is_active or (self.end_date and self.next_date >= self.end_date):
             return
             
-        if self.frequency == self.Frequency.DAILY:
-            self.next_date += timedelta(days=1)
-        elif self.frequency == self.Frequency.WEEKLY:
-            self.next_date += timedelta(weeks=1)
-        elif self.frequency == self.Frequency.MONTHLY:
-            # Add one month, handling month end dates
-            year = self.next_date.year + (self.next_date.month // 12)
-            month = (self.next_date.month % 12) + 1
-            day = min(self.next_date.day, [31,29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28,31,30,31,30,31,31,30,31,30,31][month-1])
-            self.next_date = self.next_date.replace(year=year, month=month, day=day)
-        elif self.frequency == self.Frequency.QUARTERLY:
-            # Add three months
-            year = self.next_date.year + ((self.next_date.month + 2) // 12)
-            month = ((self.next_date.month + 2) % 12) + 1
-            day = min(self.next_date.day, [31,29 if year % 4 == 0 and (year % 100 != 0 or year % 400 == 0) else 28,31,30,31,30,31,31,30,31,30,31][month-1])
-            self.next_date = self.next_date.replace(year=year, month=month, day=day)
-        else:  # YEARLY
-            self.next_date = self.next_date.replace(year=self.next_date.year + 1)
-        
+        self.next_date = next_occurrence(self.next_date, self.frequency, self.start_date.day)
         self.save(update_fields=['next_date'])
 
 class RecurringInvoiceItem(models.Model):
@@ -986,3 +1493,183 @@ class RecurringInvoiceItem(models.Model):
 
     def __str__(self):
         return f"{self.recurring_invoice.name} - {self.description}"
+
+class LedgerPeriodChecksum(models.Model):
+    """
+    Verification state of one month of an organization's ledger.
+
+    The cheap aggregates (entry count, amount total, id total and latest
+    transaction change) tell whether a period must be rescanned; ``digest``
+    hashes every entry of the period and ``chain_digest`` links it to all
+    earlier periods, so the last link summarizes the whole ledger.
+    """
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='ledger_checksums',
+        verbose_name=_('organization')
+    )
+    period = models.DateField(_('period'))
+    
+    entry_count = models.PositiveIntegerField(_('entry count'), default=0)
+    total_amount = models.DecimalField(
+        _('total amount'),
+        max_digits=15,
+        decimal_places=2,
+        default=0
+    )
+    id_total = models.BigIntegerField(_('id total'), default=0)
+    last_modified = models.DateTimeField(_('last modified'), null=True, blank=True)
+    
+    digest = models.CharField(_('digest'), max_length=64)
+    chain_digest = models.CharField(_('chain digest'), max_length=64)
+    verified_at = models.DateTimeField(_('verified at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('ledger period checksum')
+        verbose_name_plural = _('ledger period checksums')
+        unique_together = ('organization', 'period')
+        ordering = ['organization', 'period']
+
+    def __str__(self):
+        return f"{self.organization} - {self.period:%Y-%m}"
+
+class PeriodClose(models.Model):
+    """
+    A closed accounting period.  Closes follow each other without gaps; the
+    ``period_end`` of the latest one is the organization's lock date.
+    """
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='period_closes',
+        verbose_name=_('organization')
+    )
+    period_start = models.DateField(_('period start'), null=True, blank=True)
+    period_end = models.DateField(_('period end'))
+    notes = models.TextField(_('notes'), blank=True)
+    
+    closed_at = models.DateTimeField(_('closed at'), auto_now_add=True)
+    closed_by = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.SET_NULL,
+        null=True,
+        related_name='closed_periods',
+        verbose_name=_('closed by')
+    )
+
+    class Meta:
+        verbose_name = _('period close')
+        verbose_name_plural = _('period closes')
+        unique_together = ('organization', 'period_end')
+        ordering = ['-period_end']
+
+    def __str__(self):
+        return f"{self.organization} - {self.period_end}"
+
+class ClosingBalance(models.Model):
+    """
+    Frozen cumulative debits and credits of an account at the end of a
+    closed period, from the first entry up to ``period_close.period_end``.
+    """
+    period_close = models.ForeignKey(
+        PeriodClose,
+        on_delete=models.CASCADE,
+        related_name='balances',
+        verbose_name=_('period close')
+    )
+    account = models.ForeignKey(
+        Account,
+        on_delete=models.CASCADE,
+        related_name='closing_balances',
+        verbose_name=_('account')
+    )
+    debits = models.DecimalField(_('debits'), max_digits=15, decimal_places=2, default=0)
+    credits = models.DecimalField(_('credits'), max_digits=15, decimal_places=2, default=0)
+    period_amount = models.DecimalField(
+        _('period amount'),
+        max_digits=15,
+        decimal_places=2,
+        default=0,
+        help_text=_('Net movement within the closed period')
+    )
+
+    class Meta:
+        verbose_name = _('closing balance')
+        verbose_name_plural = _('closing balances')
+        unique_together = ('period_close', 'account')
+
+    def __str__(self):
+        return f"{self.account} - {self.balance}"
+
+    @property
+    def balance(self):
+        return self.debits - self.credits
+
+class NumberSequence(models.Model):
+    """
+    Counter handing out document numbers for one series of an organization.
+
+    ``pattern`` is a format string with the placeholders ``{prefix}``,
+    ``{number}``, ``{year}`` and ``{month}``, each optionally padded to a
+    width of at most ``MAX_WIDTH`` (``{number:06d}``, ``{month:02}``).
+    """
+    PLACEHOLDERS = ('prefix', 'number', 'year', 'month')
+    MAX_WIDTH = 20
+    # Optional fill and alignment, zero padding, width, integer type
+    FORMAT_SPEC = re.compile(r'(?:[^{}]?[<>^])?0?(?P<width>[0-9]{1,2})?d?')
+
+    organization = models.ForeignKey(
+        Organization,
+        on_delete=models.CASCADE,
+        related_name='number_sequences',
+        verbose_name=_('organization')
+    )
+    series = models.CharField(_('series'), max_length=50, default='invoice')
+    prefix = models.CharField(_('prefix'), max_length=20, blank=True, default='INV-')
+    pattern = models.CharField(
+        _('pattern'),
+        max_length=100,
+        default='{prefix}{number:06d}',
+        help_text=_('Placeholders: {prefix}, {number}, {year}, {month}')
+    )
+    next_value = models.PositiveBigIntegerField(_('next value'), default=1)
+    
+    # Metadata
+    created_at = models.DateTimeField(_('created at'), auto_now_add=True)
+    updated_at = models.DateTimeField(_('updated at'), auto_now=True)
+
+    class Meta:
+        verbose_name = _('number sequence')
+        verbose_name_plural = _('number sequences')
+        unique_together = ('organization', 'series')
+        ordering = ['organization', 'series']
+
+    def __str__(self):
+        return f"{self.organization} - {self.series}"
+
+    @classmethod
+    def check_pattern(cls, pattern):
+        """
+        Raise ``ValueError`` unless ``pattern`` only uses the placeholders by
+        name (no attribute or index access, no conversion) with a bounded width.
+        """
+        for _literal, field, spec, conversion in Formatter().parse(pattern):
+            if field is None:
+                continue
+            if field not in cls.PLACEHOLDERS or conversion:
+                raise ValueError(f"Invalid placeholder: {field}")
+            match = cls.FORMAT_SPEC.fullmatch(spec or '')
+            if match is None or int(match['width'] or 0) > cls.MAX_WIDTH:
+                raise ValueError(f"Invalid format: {spec}")
+
+    def format(self, value, on=None):
+        on = on or date.today()
+        self.check_pattern(self.pattern)
+        return self.pattern.format(
+            prefix=self.prefix,
+            number=value,
+            year=on.year,
+            month=on.month
+        )
+
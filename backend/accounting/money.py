@@ -0,0 +1,137 @@
+"""
+Money arithmetic.
+
+Bulk calculations run on NumPy ``int64`` arrays of cents: amounts are
+converted exactly from ``Decimal`` once, computed with integer arithmetic
+(or, for schedules that need powers and fractions, in floating point and
+rounded once at the end) and turned back into ``Decimal`` at the edges.
+Every rounding to the cent is half to even, in arrays and in the
+``Decimal`` helpers alike, so a bulk calculation and the same calculation
+done one value at a time agree to the cent.
+
+``allocate`` splits an amount by weights so the parts always add up to it:
+each part is rounded down and the cents left over go to the parts with the
+largest remainders.
+"""
+from decimal import ROUND_HALF_EVEN, Decimal
+
+import numpy as np
+
+CENT = Decimal('0.01')
+
+# Percentages are stored with two decimals: 21.00% is 2100 basis points
+PERCENT_SCALE = 100 * 100
+
+# Products above this may overflow int64 and are computed with Python ints
+_INT64_SAFE = 2 ** 62
+
+
+def quantize(value):
+    """``value`` rounded to the cent, half to even."""
+    return Decimal(value).quantize(CENT, rounding=ROUND_HALF_EVEN)
+
+
+def cents(value):
+    """A single amount in integer cents, half to even."""
+    return int((Decimal(value) * 100).to_integral_value(rounding=ROUND_HALF_EVEN))
+
+
+def from_cents(value):
+    """A single amount in cents as a ``Decimal``."""
+    return Decimal(int(value)).scaleb(-2)
+
+
+def to_cents(values):
+    """Amounts (``Decimal``, str or int; ``None`` is zero) as an int64 array of cents."""
+    return np.fromiter((cents(value or 0) for value in values), dtype=np.int64)
+
+
+def to_decimals(values):
+    """An array of cents as a list of ``Decimal`` amounts."""
+    return [from_cents(value) for value in values]
+
+
+def basis_points(rates):
+    """Percentages with two decimals (``Decimal``) as an int64 array of basis points."""
+    return to_cents(rates)
+
+
+def rint(values):
+    """Floating point cents rounded half to even, as int64."""
+    return np.rint(values).astype(np.int64)
+
+
+def divide(numerator, denominator):
+    """
+    ``numerator / denominator`` rounded half to even, elementwise on integer
+    arrays (or Python ints).  ``denominator`` must be positive.
+    """
+    quotient = numerator // denominator
+    twice = (numerator - quotient * denominator) * 2
+    return quotient + ((twice > denominator) | ((twice == denominator) & (quotient % 2 == 1)))
+
+
+def _exact(*arrays):
+    """The arrays as int64, or as Python ints when their product could overflow."""
+    bound = 1.0
+    for array in arrays:
+        bound *= float(np.max(np.abs(array), initial=0)) or 1.0
+    if bound < _INT64_SAFE:
+        return [np.asarray(array, dtype=np.int64) for array in arrays]
+    return [np.asarray(array, dtype=np.int64).astype(object) for array in arrays]
+
+
+def percent(amounts, rates):
+    """``rates`` percent (basis points) of ``amounts`` (cents), half to even."""
+    amounts, rates = _exact(amounts, rates)
+    return divide(amounts * rates, PERCENT_SCALE).astype(np.int64)
+
+
+def line_amounts(quantities, unit_prices, discount_rates, tax_rates):
+    """
+    Net amounts and taxes in cents of document lines: ``quantity *
+    unit_price`` less the discount, then the tax on that net amount.  All
+    inputs are ``Decimal`` sequences with two decimals.
+    """
+    quantities = to_cents(quantities)
+    prices = to_cents(unit_prices)
+    kept = PERCENT_SCALE - basis_points(discount_rates)
+    quantities, prices, kept = _exact(quantities, prices, kept)
+    # Hundredths of a unit times cents is 1/100 of a cent
+    amounts = divide(quantities * prices * kept, 100 * PERCENT_SCALE).astype(np.int64)
+    return amounts, percent(amounts, basis_points(tax_rates))
+
+
+def allocate(total, weights):
+    """
+    Split ``total`` cents in proportion to integer ``weights`` (basis
+    points, cents of a driver balance...); the parts (int64) add up to
+    ``total`` exactly.  Leftover cents go to the largest remainders, the
+    earlier part first on ties.  All-zero weights split evenly.
+    """
+    weights = np.asarray(weights, dtype=np.int64)
+    if np.any(weights < 0):
+        raise ValueError("Allocation weights cannot be negative")
+    if not len(weights):
+        return weights
+    if not weights.any():
+        weights = np.ones(len(weights), dtype=np.int64)
+    sign, total = (-1 if total < 0 else 1), abs(int(total))
+    weights, = _exact(weights, total)[:1]
+    scaled, whole = weights * total, int(weights.sum())
+    parts = scaled // whole
+    remainders = scaled - parts * whole
+    parts = parts.astype(np.int64)
+    leftover = total - int(parts.sum())
+    if leftover:
+        order = np.argsort(-remainders.astype(np.float64), kind='stable')
+        parts[order[:leftover]] += 1
+    return sign * parts
+
+
+def sum_by(keys, amounts):
+    """Sum ``amounts`` (cents) per key, leaving out zero totals: ``{key: cents}``."""
+    keys, positions = np.unique(np.asarray(keys), return_inverse=True)
+    totals = np.zeros(len(keys), dtype=np.int64)
+    np.add.at(totals, positions, amounts)
+    return {key.item(): int(total) for key, total in zip(keys, totals) if total}
@@ -0,0 +1,87 @@
+"""
+Id-aware writer for nested child rows (invoice items, transaction entries...).
+
+Instead of deleting every child and creating the submitted list again, the
+submitted items are matched to the existing rows by ``id``: changed rows are
+written with one ``bulk_update``, new rows with one ``bulk_create`` and rows
+left out of the submission are removed with one ``DELETE ... WHERE id IN``.
+Unchanged rows are not touched at all.
+"""
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+
+def _submitted_id(raw):
+    value = raw.get('id') if isinstance(raw, dict) else None
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        raise serializers.ValidationError(_("Invalid item id: %(id)s") % {'id': value})
+
+
+def _changed_fields(model, obj, data):
+    changed = []
+    for name, value in data.items():
+        field = model._meta.get_field(name)
+        if field.is_relation:
+            # Compare raw keys so unchanged rows do not load related objects
+            current = getattr(obj, field.attname)
+            value = value.pk if value is not None else None
+        else:
+            current = getattr(obj, name)
+        if current != value:
+            changed.append(name)
+    return changed
+
+
+def write_children(parent, related_name, items_data, raw_items=None):
+    """
+    Make the ``related_name`` children of ``parent`` match ``items_data``.
+
+    ``items_data`` is the validated list of a nested serializer and
+    ``raw_items`` the matching submitted list, which carries the ``id`` of
+    rows that already exist (nested serializers treat ``id`` as read-only).
+    Without ``raw_items`` every item is created.  Returns the created,
+    updated and deleted row counts.
+    """
+    manager = getattr(parent, related_name)
+    model = manager.model
+    parent_field = manager.field.name
+    existing = {obj.pk: obj for obj in manager.all()} if raw_items is not None else {}
+    raw_items = raw_items or [None] * len(items_data)
+
+    to_create, to_update, update_fields, seen = [], [], set(), set()
+    for data, raw in zip(items_data, raw_items):
+        data = {name: value for name, value in data.items() if name != parent_field}
+        pk = _submitted_id(raw)
+        if pk is None:
+            to_create.append(model(**data, **{parent_field: parent}))
+            continue
+        obj = existing.get(pk)
+        if obj is None or pk in seen:
+            raise serializers.ValidationError(
+                _("Item %(id)s does not belong to this record") % {'id': pk}
+            )
+        seen.add(pk)
+        changed = _changed_fields(model, obj, data)
+        if changed:
+            for name in changed:
+                setattr(obj, name, data[name])
+            to_update.append(obj)
+            update_fields.update(changed)
+
+    removed = [pk for pk in existing if pk not in seen]
+    if removed:
+        model.objects.filter(pk__in=removed).delete()
+    if to_update:
+        model.objects.bulk_update(to_update, sorted(update_fields), batch_size=500)
+    if to_create:
+        model.objects.bulk_create(to_create, batch_size=500)
+
+    return {
+        'created': len(to_create),
+        'updated': len(to_update),
+        'deleted': len(removed),
+    }
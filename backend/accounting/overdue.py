@@ -0,0 +1,158 @@
+"""
+Overdue invoice sweep.
+
+Open invoices past their due date move to ``overdue`` in set-based batches:
+each batch of an organization is locked, updated with one ``UPDATE`` and
+reported to the organization's finance members with one ``bulk_create`` of
+notifications.  Candidates are read through the partial index on open
+invoices by due date (``invoice_open_due_idx``), so the cost of a sweep
+follows the number of open invoices, not the size of the invoice history.
+Invoices already overdue are not selected again, so a member is notified
+once per invoice.
+"""
+from decimal import Decimal
+
+from django.contrib.contenttypes.models import ContentType
+from django.db import transaction
+from django.db.models.functions import Now
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from notifications.models import Notification, NotificationCategory
+from organizations.models import Organization, OrganizationMembership
+
+from .models import Invoice
+
+# Open statuses an invoice leaves when it falls due (the partial index condition)
+DUE_STATUSES = (
+    Invoice.Status.SENT,
+    Invoice.Status.APPROVED,
+    Invoice.Status.PARTIALLY_PAID,
+)
+
+# Members told about invoices falling overdue, besides the owner
+REMINDER_ROLES = (
+    OrganizationMembership.RoleChoices.OWNER,
+    OrganizationMembership.RoleChoices.ADMIN,
+    OrganizationMembership.RoleChoices.MANAGER,
+    OrganizationMembership.RoleChoices.ACCOUNTANT,
+    OrganizationMembership.RoleChoices.BOOKKEEPER,
+)
+
+BATCH_SIZE = 1000
+
+CATEGORY_NAME = 'Overdue invoices'
+
+
+def due_invoices(today, organization=None):
+    """Open invoices whose due date passed before ``today``."""
+    invoices = Invoice.objects.filter(status__in=DUE_STATUSES, due_date__lt=today)
+    if organization is not None:
+        invoices = invoices.filter(organization=organization)
+    return invoices
+
+
+def reminder_recipients(organization):
+    """Ids of the users notified about an organization's overdue invoices."""
+    members = OrganizationMembership.objects.filter(
+        organization=organization,
+        is_active=True,
+        role__in=REMINDER_ROLES
+    ).values_list('user', flat=True)
+    return sorted({organization.owner_id, *members})
+
+
+def _category():
+    category, _created = NotificationCategory.objects.get_or_create(
+        name=CATEGORY_NAME,
+        type=NotificationCategory.CategoryType.TRANSACTION
+    )
+    return category
+
+
+def overdue_notifications(organization, invoices, recipients, category):
+    """
+    Reminder notifications of a batch of invoices that fell overdue: one per
+    recipient, pointing to the invoice when the batch has a single one.
+    """
+    total = sum((invoice['total'] - invoice['amount_paid'] for invoice in invoices), Decimal('0'))
+    if len(invoices) == 1:
+        invoice = invoices[0]
+        title = _("Invoice %(number)s is overdue") % {'number': invoice['number']}
+        message = _("%(party)s owes %(amount)s since %(due_date)s.") % {
+            'party': invoice['party_name'],
+            'amount': total,
+            'due_date': invoice['due_date'],
+        }
+        content_type, object_id = ContentType.objects.get_for_model(Invoice), invoice['id']
+    else:
+        title = _("%(count)s invoices are overdue") % {'count': len(invoices)}
+        message = _("%(count)s invoices fell overdue with %(amount)s outstanding.") % {
+            'count': len(invoices),
+            'amount': total,
+        }
+        content_type, object_id = None, None
+    data = {
+        'kind': 'overdue_invoices',
+        'invoices': [invoice['id'] for invoice in invoices],
+        'outstanding': str(total),
+    }
+    return [
+        Notification(
+            organization=organization,
+            recipient_id=recipient,
+            category=category,
+            title=title,
+            message=message,
+            data=data,
+            content_type=content_type,
+            object_id=object_id,
+            priority=Notification.Priority.HIGH
+        )
+        for recipient in recipients
+    ]
+
+
+def _sweep_batch(organization, today, batch_size, recipients, category):
+    with transaction.atomic():
+        invoices = list(
+            due_invoices(today, organization)
+            .select_for_update(skip_locked=True)
+            .order_by('pk')
+            .values('id', 'number', 'party_name', 'due_date', 'total', 'amount_paid')[:batch_size]
+        )
+        if not invoices:
+            return 0, 0
+        Invoice.objects.filter(pk__in=[invoice['id'] for invoice in invoices]).update(
+            status=Invoice.Status.OVERDUE,
+            updated_at=Now()
+        )
+        notifications = Notification.objects.bulk_create(
+            overdue_notifications(organization, invoices, recipients, category)
+        )
+    return len(invoices), len(notifications)
+
+
+def sweep_overdue_invoices(today=None, organization=None, batch_size=BATCH_SIZE):
+    """
+    Mark every open invoice past its due date overdue and notify each
+    organization's finance members.  Returns the number of invoices marked
+    and of notifications created.
+    """
+    today = today or timezone.localdate()
+    organization_ids = (
+        due_invoices(today, organization).order_by().values_list('organization', flat=True).distinct()
+    )
+    organizations = Organization.objects.filter(pk__in=list(organization_ids)).order_by('pk')
+    category = _category() if organizations else None
+
+    marked = notified = 0
+    for org in organizations:
+        recipients = reminder_recipients(org)
+        while True:
+            invoices, notifications = _sweep_batch(org, today, batch_size, recipients, category)
+            if not invoices:
+                break
+            marked += invoices
+            notified += notifications
+    return {'invoices': marked, 'notifications': notified}
@@ -0,0 +1,244 @@
+"""
+Customers and vendors.
+
+Invoices keep a free-text copy of the party details (what was printed on the
+document) and point to a ``Party`` row, so per-party balances, aging and
+statements group on an indexed foreign key instead of on strings.  Parties
+are matched on their normalized tax id, or on their normalized name when
+there is none (``Party.make_match_key``).
+
+On PostgreSQL the party name and tax id carry trigram GIN indexes, which
+serve both similarity search and ``icontains`` lookups.
+"""
+from datetime import date
+
+from django.core.cache import cache
+from django.db import connection, transaction
+from django.db.models import Count, DecimalField, F, Max, Min, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from .models import Invoice, Party, RecurringInvoice
+
+# Invoice statuses that still carry an open balance
+OPEN_INVOICE_STATUSES = (
+    Invoice.Status.SENT,
+    Invoice.Status.APPROVED,
+    Invoice.Status.PARTIALLY_PAID,
+    Invoice.Status.OVERDUE,
+)
+RECEIVABLE_TYPES = (Invoice.Type.SALE, Invoice.Type.DEBIT_NOTE)
+
+BALANCE_CACHE_TIMEOUT = 60 * 60
+
+PARTY_FIELDS = ('name', 'tax_id', 'address', 'email', 'phone')
+
+_MONEY = DecimalField(max_digits=15, decimal_places=2)
+
+
+def _party_type(invoice_type):
+    return Party.Type.VENDOR if invoice_type == Invoice.Type.PURCHASE else Party.Type.CUSTOMER
+
+
+def party_from_invoice(organization, data):
+    """
+    The party of invoice ``data`` (a dict with ``party_*`` keys), created
+    from those details when the organization does not know it yet.
+    """
+    organization_id = getattr(organization, 'pk', organization)
+    key = Party.make_match_key(data.get('party_name'), data.get('party_tax_id'))
+    party_type = _party_type(data.get('type') or data.get('invoice_type'))
+    party, created = Party.objects.get_or_create(
+        organization_id=organization_id,
+        match_key=key,
+        defaults={
+            'type': party_type,
+            **{field: data.get(f'party_{field}') or '' for field in PARTY_FIELDS},
+        }
+    )
+    if not created and party.type not in (party_type, Party.Type.BOTH):
+        party.type = Party.Type.BOTH
+        party.save(update_fields=['type', 'updated_at'])
+    return party
+
+
+def resolve_party(organization, data):
+    """
+    The party of validated invoice ``data``: the submitted ``party`` when it
+    belongs to ``organization``, otherwise the one matching its details.
+    """
+    party = data.get('party')
+    if party is None:
+        return party_from_invoice(organization, data)
+    if party.organization_id != getattr(organization, 'pk', organization):
+        raise serializers.ValidationError(_("Party not found"))
+    return party
+
+
+def resolve_updated_party(instance, data):
+    """
+    The party of an invoice or recurring invoice after an update with
+    validated ``data``: the submitted ``party`` (checked like on create), or
+    the one matching its details when they changed.
+    """
+    if 'party' not in data and not {'party_name', 'party_tax_id'} & data.keys():
+        return instance.party
+    details = {
+        key: getattr(instance, key, None)
+        for key in (*(f'party_{field}' for field in PARTY_FIELDS), 'type', 'invoice_type')
+    }
+    details.update(data)
+    # Changed details are matched again rather than kept on the old party
+    details.setdefault('party', None)
+    return resolve_party(instance.organization_id, details)
+
+
+def search_parties(organization, query, limit=20):
+    """Parties whose name or tax id resembles ``query``, best matches first."""
+    parties = Party.objects.filter(organization=organization, is_active=True)
+    query = (query or '').strip()
+    if not query:
+        return parties[:limit]
+    matches = Q(name__icontains=query) | Q(tax_id__icontains=query)
+    if connection.vendor == 'postgresql':
+        from django.contrib.postgres.search import TrigramSimilarity
+
+        return parties.annotate(
+            similarity=TrigramSimilarity('name', query)
+        ).filter(matches | Q(name__trigram_similar=query)).order_by('-similarity', 'name')[:limit]
+    return parties.filter(matches)[:limit]
+
+
+@transaction.atomic
+def backfill_parties(organization=None, batch_size=2000):
+    """
+    Create the parties of existing invoices and recurring invoices and link
+    them.  Details are deduplicated in memory, missing parties are inserted
+    with one ``bulk_create`` and the links are written with ``bulk_update``.
+    Returns the number of parties created and of rows linked per model.
+    """
+    sources = (
+        (Invoice, 'type', 'invoices'),
+        (RecurringInvoice, 'invoice_type', 'recurring_invoices'),
+    )
+    # One pass over the unlinked rows; the newest details of a party win
+    found, assignments = {}, []
+    for model, type_field, label in sources:
+        rows = model.objects.filter(party__isnull=True)
+        if organization is not None:
+            rows = rows.filter(organization=organization)
+        rows = rows.order_by('-pk').values_list(
+            'pk', 'organization_id', type_field, *(f'party_{field}' for field in PARTY_FIELDS)
+        )
+        for pk, organization_id, invoice_type, *details in rows.iterator(chunk_size=batch_size):
+            values = dict(zip(PARTY_FIELDS, details))
+            key = (organization_id, Party.make_match_key(values['name'], values['tax_id']))
+            party_type = _party_type(invoice_type)
+            if key not in found:
+                found[key] = Party(organization_id=organization_id, match_key=key[1], type=party_type, **values)
+            elif found[key].type != party_type:
+                found[key].type = Party.Type.BOTH
+            assignments.append((model, label, pk, key))
+
+    organization_ids = {organization_id for organization_id, _key in found}
+    known = set(
+        Party.objects.filter(organization_id__in=organization_ids)
+        .values_list('organization_id', 'match_key')
+    )
+    # bulk_create skips save(), so match_key was set above
+    created = Party.objects.bulk_create(
+        [party for key, party in found.items() if key not in known],
+        batch_size=batch_size,
+        ignore_conflicts=True
+    )
+    party_ids = {
+        (organization_id, key): pk
+        for pk, organization_id, key in Party.objects.filter(
+            organization_id__in=organization_ids
+        ).values_list('pk', 'organization_id', 'match_key')
+    }
+
+    # updated_at moves too, so cached balance summaries see the new links
+    now = timezone.now()
+    linked = {}
+    for model, _type_field, label in sources:
+        rows = [
+            model(pk=pk, party_id=party_ids[key], updated_at=now)
+            for row_model, _label, pk, key in assignments
+            if row_model is model
+        ]
+        model.objects.bulk_update(rows, ['party', 'updated_at'], batch_size=batch_size)
+        linked[label] = len(rows)
+    return {'parties': len(created), **linked}
+
+
+def party_balances(organization, party_ids=None, as_of=None):
+    """
+    Open balances per party in one grouped query on the party key.
+    Receivable is what customers owe (credit notes reduce it), payable what
+    is owed to vendors and overdue the part of both past its due date.
+    """
+    as_of = as_of or date.today()
+    outstanding = F('total') - F('amount_paid')
+    zero = Value(0, output_field=_MONEY)
+    invoices = Invoice.objects.filter(
+        organization=organization,
+        party__isnull=False,
+        status__in=OPEN_INVOICE_STATUSES
+    )
+    if party_ids is not None:
+        invoices = invoices.filter(party__in=party_ids)
+    rows = invoices.values('party', 'party__name').annotate(
+        open_invoices=Count('pk'),
+        receivable=Coalesce(Sum(outstanding, filter=Q(type__in=RECEIVABLE_TYPES)), zero),
+        credits=Coalesce(Sum(outstanding, filter=Q(type=Invoice.Type.CREDIT_NOTE)), zero),
+        payable=Coalesce(Sum(outstanding, filter=Q(type=Invoice.Type.PURCHASE)), zero),
+        overdue=Coalesce(
+            Sum(outstanding, filter=Q(due_date__lt=as_of) & ~Q(type=Invoice.Type.CREDIT_NOTE)),
+            zero
+        ),
+        oldest_due_date=Min('due_date'),
+    ).order_by()
+    return {
+        row['party']: {
+            'party': row['party'],
+            'name': row['party__name'],
+            'open_invoices': row['open_invoices'],
+            'receivable': row['receivable'] - row['credits'],
+            'payable': row['payable'],
+            'overdue': row['overdue'],
+            'oldest_due_date': row['oldest_due_date'],
+        }
+        for row in rows
+    }
+
+
+def _balance_stamp(organization_id):
+    """Changes whenever an invoice of the organization is saved, updated or deleted."""
+    stamp = Invoice.objects.filter(organization_id=organization_id).aggregate(
+        changed=Max('updated_at'),
+        count=Count('pk')
+    )
+    changed = stamp['changed'].timestamp() if stamp['changed'] else 0
+    return f"{changed}:{stamp['count']}"
+
+
+def open_balance_summary(organization):
+    """
+    ``party_balances`` of an organization sorted by receivable, cached.
+    The cache key carries a stamp of the latest invoice change, so a stale
+    summary is never served and nothing has to invalidate it.
+    """
+    organization_id = getattr(organization, 'pk', organization)
+    as_of = date.today()
+    key = f'accounting:party-balances:{organization_id}:{as_of}:{_balance_stamp(organization_id)}'
+    summary = cache.get(key)
+    if summary is None:
+        summary = sorted(
+            party_balances(organization_id, as_of=as_of).values(),
+            key=lambda row: (-row['receivable'], -row['payable'], row['name'])
+        )
+        cache.set(key, summary, BALANCE_CACHE_TIMEOUT)
+    return summary
@@ -0,0 +1,206 @@
+"""
+Payment application.
+
+A payment is applied to one or more invoices through ``PaymentAllocation``
+rows.  ``Invoice.amount_paid`` and ``Invoice.status`` are never summed in
+Python: after the affected invoices are locked, one ``UPDATE`` recomputes
+both from the allocations of completed payments.  Remittance batches of
+thousands of payments resolve their invoices and accounts in one query
+each, are inserted with ``bulk_create`` and refresh every touched invoice
+with that same single statement.
+"""
+from collections import defaultdict
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, OuterRef, Subquery, Sum, Value, When
+from django.db.models.functions import Coalesce, Now
+from django.db.models.lookups import GreaterThan, GreaterThanOrEqual
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from .models import Account, Invoice, Payment, PaymentAllocation
+
+# Invoice statuses that payments do not change
+CLOSED_INVOICE_STATUSES = (Invoice.Status.VOID, Invoice.Status.CANCELLED)
+PAID_INVOICE_STATUSES = (Invoice.Status.PAID, Invoice.Status.PARTIALLY_PAID)
+
+_MONEY = DecimalField(max_digits=15, decimal_places=2)
+
+
+def lock_invoices(invoice_ids):
+    """Lock invoices in primary key order (avoiding deadlocks) and return them by id."""
+    return {
+        invoice.pk: invoice
+        for invoice in Invoice.objects.select_for_update().filter(
+            pk__in=set(invoice_ids)
+        ).order_by('pk')
+    }
+
+
+def refresh_invoices(invoice_ids):
+    """
+    Recompute ``amount_paid`` and ``status`` of invoices from the allocations
+    of completed payments, in one UPDATE.  Call with the invoices locked.
+    """
+    paid = Coalesce(
+        Subquery(
+            PaymentAllocation.objects.filter(
+                invoice=OuterRef('pk'),
+                payment__status=Payment.Status.COMPLETED
+            ).order_by().values('invoice').annotate(
+                total=Sum('amount')
+            ).values('total'),
+            output_field=_MONEY
+        ),
+        Value(Decimal('0'), output_field=_MONEY)
+    )
+    zero = Value(Decimal('0'), output_field=_MONEY)
+    return Invoice.objects.filter(pk__in=set(invoice_ids)).update(
+        amount_paid=paid,
+        updated_at=Now(),
+        status=Case(
+            When(status__in=CLOSED_INVOICE_STATUSES, then=F('status')),
+            When(
+                GreaterThanOrEqual(paid, F('total')) & GreaterThan(F('total'), zero),
+                then=Value(Invoice.Status.PAID)
+            ),
+            # Overdue invoices stay overdue until paid in full
+            When(status=Invoice.Status.OVERDUE, then=F('status')),
+            When(GreaterThan(paid, zero), then=Value(Invoice.Status.PARTIALLY_PAID)),
+            When(status__in=PAID_INVOICE_STATUSES, then=Value(Invoice.Status.SENT)),
+            default=F('status')
+        )
+    )
+
+
+def _check_allocations(payment, allocations, invoices, pending=None):
+    """Validate ``(invoice_id, amount)`` pairs against the locked invoices."""
+    pending = pending if pending is not None else defaultdict(Decimal)
+    total = Decimal('0')
+    for invoice_id, amount in allocations:
+        invoice = invoices.get(invoice_id)
+        if invoice is None or invoice.organization_id != payment.organization_id:
+            raise serializers.ValidationError(_("Invoice not found"))
+        if invoice.status in CLOSED_INVOICE_STATUSES:
+            raise serializers.ValidationError(
+                _("Invoice %(number)s is closed") % {'number': invoice.number}
+            )
+        if amount <= 0:
+            raise serializers.ValidationError(_("Allocated amounts must be positive"))
+        if amount > invoice.total - invoice.amount_paid - pending[invoice_id]:
+            raise serializers.ValidationError(
+                _("Payment exceeds the balance of invoice %(number)s") % {'number': invoice.number}
+            )
+        pending[invoice_id] += amount
+        total += amount
+    if total > payment.amount:
+        raise serializers.ValidationError(
+            _("Allocations exceed the payment amount")
+        )
+
+
+@transaction.atomic
+def apply_payment(payment, allocations=None):
+    """
+    Apply a saved payment to invoices.  ``allocations`` is a list of
+    ``(invoice or invoice id, amount)`` pairs; by default the whole payment
+    goes to ``payment.invoice``.
+    """
+    if allocations is None:
+        allocations = [(payment.invoice_id, payment.amount)]
+    allocations = [
+        (getattr(invoice, 'pk', invoice), Decimal(amount))
+        for invoice, amount in allocations
+    ]
+    invoices = lock_invoices(invoice_id for invoice_id, _amount in allocations)
+    _check_allocations(payment, allocations, invoices)
+
+    PaymentAllocation.objects.bulk_create([
+        PaymentAllocation(payment=payment, invoice_id=invoice_id, amount=amount)
+        for invoice_id, amount in allocations
+    ])
+    refresh_invoices(invoices)
+    return payment
+
+
+@transaction.atomic
+def set_payment_status(payment, status):
+    """Change the status of a payment and refresh the invoices it is applied to."""
+    invoice_ids = list(payment.allocations.values_list('invoice_id', flat=True))
+    lock_invoices(invoice_ids)
+    payment.status = status
+    payment.save(update_fields=['status', 'updated_at'])
+    refresh_invoices(invoice_ids)
+    return payment
+
+
+REMITTANCE_FIELDS = ('date', 'invoice_number', 'amount', 'method', 'reference', 'bank_account')
+
+
+@transaction.atomic
+def apply_remittance(organization, rows, user=None, status=Payment.Status.COMPLETED):
+    """
+    Apply a remittance (rows with ``REMITTANCE_FIELDS``; ``bank_account`` is
+    an account code) as one batch.  Rows that cannot be applied are returned
+    as errors; the others are created.  Returns ``(payments, errors)``.
+    """
+    numbers = {str(row.get('invoice_number', '')).strip() for row in rows}
+    codes = {str(row.get('bank_account', '')).strip() for row in rows}
+    invoice_ids = dict(
+        Invoice.objects.filter(organization=organization, number__in=numbers)
+        .values_list('number', 'pk')
+    )
+    accounts = dict(
+        Account.objects.filter(organization=organization, code__in=codes)
+        .values_list('code', 'pk')
+    )
+    invoices = lock_invoices(invoice_ids.values())
+    pending = defaultdict(Decimal)
+
+    payments, allocations, errors = [], [], []
+    for index, row in enumerate(rows, start=1):
+        try:
+            invoice_id = invoice_ids.get(str(row.get('invoice_number', '')).strip())
+            account_id = accounts.get(str(row.get('bank_account', '')).strip())
+            if invoice_id is None:
+                raise serializers.ValidationError(_("Invoice not found"))
+            if account_id is None:
+                raise serializers.ValidationError(_("Bank account not found"))
+            try:
+                amount = Decimal(str(row.get('amount'))).quantize(Decimal('0.01'))
+            except (InvalidOperation, ValueError):
+                raise serializers.ValidationError(_("Invalid amount"))
+            try:
+                payment_date = parse_date(str(row.get('date', '')))
+            except ValueError:
+                payment_date = None
+            if payment_date is None:
+                raise serializers.ValidationError(_("Invalid date"))
+            method = str(row.get('method') or Payment.Method.BANK_TRANSFER).strip()
+            if method not in Payment.Method.values:
+                raise serializers.ValidationError(_("Invalid payment method"))
+
+            payment = Payment(
+                organization=organization,
+                invoice_id=invoice_id,
+                date=payment_date,
+                amount=amount,
+                method=method,
+                status=status,
+                reference=row.get('reference', ''),
+                bank_account_id=account_id,
+                created_by=user
+            )
+            _check_allocations(payment, [(invoice_id, amount)], invoices, pending)
+        except serializers.ValidationError as e:
+            errors.append({'row': index, 'error': e.detail})
+            continue
+        payments.append(payment)
+        allocations.append(PaymentAllocation(payment=payment, invoice_id=invoice_id, amount=amount))
+
+    Payment.objects.bulk_create(payments, batch_size=1000)
+    PaymentAllocation.objects.bulk_create(allocations, batch_size=1000)
+    refresh_invoices(pending)
+    return payments, errors
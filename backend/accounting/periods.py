@@ -0,0 +1,176 @@
+"""
+Accounting period close.
+
+Closing a period locks every transaction dated on or before its end and
+freezes the cumulative debits and credits of each account in
+``ClosingBalance`` rows.  Balances as of any date are then read from the
+latest snapshot on or before that date plus the (small) tail of entries after
+it, so reports over locked history never rescan it.  Amounts are summed in
+the organization's currency (see ``fx.base_amount``).
+"""
+from datetime import timedelta
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import DecimalField, Q, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from organizations.models import Organization
+from .fx import base_amount
+from .models import ClosingBalance, PeriodClose, Transaction, TransactionEntry
+from .posting import BALANCE_STATUSES
+
+_ZERO = Value(Decimal('0'), output_field=DecimalField(max_digits=15, decimal_places=2))
+
+OPEN_STATUSES = (
+    Transaction.Status.DRAFT,
+    Transaction.Status.PENDING,
+    Transaction.Status.APPROVED,
+)
+
+
+def _as_date(value):
+    return parse_date(value) if isinstance(value, str) else value
+
+
+def _movements(organization, start=None, end=None):
+    """
+    Debits, credits and net amount per account of posted entries in a date
+    range, in the organization's currency.
+    """
+    entries = TransactionEntry.objects.filter(
+        transaction__organization=organization,
+        transaction__status__in=BALANCE_STATUSES
+    )
+    if start is not None:
+        entries = entries.filter(transaction__date__gte=start)
+    if end is not None:
+        entries = entries.filter(transaction__date__lte=end)
+    amount = base_amount(organization.currency)
+    return (
+        entries.order_by()
+        .values('account')
+        .annotate(
+            debits=Coalesce(Sum(amount, filter=Q(amount__gt=0)), _ZERO),
+            credits=Coalesce(Sum(amount, filter=Q(amount__lt=0)), _ZERO),
+            net=Coalesce(Sum(amount), _ZERO),
+        )
+    )
+
+
+@transaction.atomic
+def close_period(organization, period_end, user=None, notes=''):
+    """Close the books of ``organization`` through ``period_end``."""
+    period_end = _as_date(period_end)
+    locked = Organization.objects.select_for_update().get(pk=organization.pk)
+    previous = locked.period_closes.order_by('-period_end').first()
+
+    if previous and period_end <= previous.period_end:
+        raise serializers.ValidationError(
+            _("The books are already closed through %(date)s") % {'date': previous.period_end}
+        )
+    if Transaction.objects.filter(
+        organization=locked,
+        date__lte=period_end,
+        status__in=OPEN_STATUSES
+    ).exists():
+        raise serializers.ValidationError(
+            _("Post or void every transaction in the period before closing it")
+        )
+
+    period_start = previous.period_end + timedelta(days=1) if previous else None
+    period_close = PeriodClose.objects.create(
+        organization=locked,
+        period_start=period_start,
+        period_end=period_end,
+        notes=notes,
+        closed_by=user
+    )
+
+    balances = {}
+    if previous:
+        for balance in previous.balances.all():
+            balances[balance.account_id] = ClosingBalance(
+                period_close=period_close,
+                account_id=balance.account_id,
+                debits=balance.debits,
+                credits=balance.credits
+            )
+    for row in _movements(locked, period_start, period_end):
+        balance = balances.setdefault(row['account'], ClosingBalance(
+            period_close=period_close,
+            account_id=row['account']
+        ))
+        balance.debits += row['debits']
+        balance.credits += -row['credits']
+        balance.period_amount = row['net']
+    ClosingBalance.objects.bulk_create(balances.values(), batch_size=2000)
+
+    locked.books_closed_through = period_end
+    locked.save(update_fields=['books_closed_through', 'updated_at'])
+    organization.books_closed_through = period_end
+    return period_close
+
+
+@transaction.atomic
+def reopen_period(period_close):
+    """Reopen the most recently closed period of an organization."""
+    organization = Organization.objects.select_for_update().get(
+        pk=period_close.organization_id
+    )
+    latest = organization.period_closes.order_by('-period_end').first()
+    if latest is None or latest.pk != period_close.pk:
+        raise serializers.ValidationError(
+            _("Only the most recently closed period can be reopened")
+        )
+    period_close.delete()
+    previous = organization.period_closes.order_by('-period_end').first()
+    organization.books_closed_through = previous.period_end if previous else None
+    organization.save(update_fields=['books_closed_through', 'updated_at'])
+    return organization.books_closed_through
+
+
+def cumulative_totals(organization, as_of):
+    """
+    Cumulative ``(debits, credits)`` per account id of posted entries dated on
+    or before ``as_of``.  Credits are positive amounts.
+    """
+    as_of = _as_date(as_of)
+    snapshot = organization.period_closes.filter(
+        period_end__lte=as_of
+    ).order_by('-period_end').first()
+
+    totals = {}
+    if snapshot:
+        for account_id, debits, credits in snapshot.balances.values_list(
+            'account_id', 'debits', 'credits'
+        ):
+            totals[account_id] = [debits, credits]
+        if as_of == snapshot.period_end:
+            return totals
+
+    start = snapshot.period_end + timedelta(days=1) if snapshot else None
+    for row in _movements(organization, start, as_of):
+        total = totals.setdefault(row['account'], [Decimal('0'), Decimal('0')])
+        total[0] += row['debits']
+        total[1] += -row['credits']
+    return totals
+
+
+def period_totals(organization, start_date, end_date):
+    """
+    ``(debits, credits)`` per account id of posted entries dated between
+    ``start_date`` and ``end_date`` (inclusive), read through the snapshots.
+    """
+    totals = cumulative_totals(organization, end_date)
+    if not start_date:
+        return totals
+    before = cumulative_totals(organization, _as_date(start_date) - timedelta(days=1))
+    for account_id, (debits, credits) in before.items():
+        total = totals.setdefault(account_id, [Decimal('0'), Decimal('0')])
+        total[0] -= debits
+        total[1] -= credits
+    return totals
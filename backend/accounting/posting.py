@@ -0,0 +1,252 @@
+"""
+Posting pipeline.
+
+Account balances only move when a transaction is posted (or a posted
+transaction is changed): the entries involved are summed per account in the
+database and applied with a single ``UPDATE ... CASE`` statement, instead of
+one read-modify-write per entry.  Nothing dated inside a closed period can be
+posted or changed.
+
+Approving, posting and voiding also work on batches of transactions: the
+balance of all of them is checked with one grouped query, their status
+changes with one ``UPDATE`` and the balance deltas of everything posted are
+aggregated into one statement.
+"""
+from collections import defaultdict
+from datetime import date
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, DecimalField, F, Sum, Value, When
+from django.utils import timezone
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from .models import Account, Transaction, TransactionEntry
+from .nested import write_children
+
+# Transactions whose entries make up an account's balance
+BALANCE_STATUSES = (Transaction.Status.POSTED, Transaction.Status.RECONCILED)
+
+APPROVE = 'approve'
+POST = 'post'
+VOID = 'void'
+
+# Batch action: (statuses it applies to, status it leads to)
+TRANSITIONS = {
+    APPROVE: ((Transaction.Status.DRAFT,), Transaction.Status.APPROVED),
+    POST: ((Transaction.Status.APPROVED,), Transaction.Status.POSTED),
+    VOID: ((Transaction.Status.DRAFT, Transaction.Status.APPROVED), Transaction.Status.VOID),
+}
+
+
+def check_period_open(organization, *dates):
+    """Raise a validation error if any of ``dates`` falls in a closed period."""
+    locked = organization.books_closed_through
+    if locked is None:
+        return
+    for value in dates:
+        if isinstance(value, str):
+            value = parse_date(value)
+        if isinstance(value, date) and value <= locked:
+            raise serializers.ValidationError(
+                _("The books are closed through %(date)s") % {'date': locked}
+            )
+
+
+def balance_deltas(entries):
+    """Net amount per account id of an entry queryset, in one grouped query."""
+    return dict(
+        entries.order_by()
+        .values('account')
+        .annotate(total=Sum('amount'))
+        .values_list('account', 'total')
+    )
+
+
+def apply_balance_deltas(deltas, sign=1):
+    """Add ``sign * amount`` to ``current_balance`` of every account in ``deltas``."""
+    deltas = {account: amount for account, amount in deltas.items() if amount}
+    if not deltas:
+        return 0
+    output_field = DecimalField(max_digits=15, decimal_places=2)
+    delta = Case(
+        *[
+            When(pk=account, then=Value(sign * amount, output_field=output_field))
+            for account, amount in deltas.items()
+        ],
+        output_field=output_field
+    )
+    return Account.objects.filter(pk__in=deltas).update(
+        current_balance=F('current_balance') + delta,
+        updated_at=timezone.now()
+    )
+
+
+@transaction.atomic
+def post_transaction(transaction_obj):
+    """Post an approved transaction and move the balances of its accounts."""
+    if transaction_obj.status != Transaction.Status.APPROVED:
+        raise serializers.ValidationError(
+            _("Only approved transactions can be posted")
+        )
+    check_period_open(transaction_obj.organization, transaction_obj.date)
+
+    transaction_obj.status = Transaction.Status.POSTED
+    transaction_obj.save(update_fields=['status', 'updated_at'])
+    apply_balance_deltas(balance_deltas(transaction_obj.entries.all()))
+    return transaction_obj
+
+
+@transaction.atomic
+def write_entries(transaction_obj, entries_data, raw_entries=None):
+    """
+    Write the entries of a transaction through the nested writer.  When the
+    transaction is posted, the difference between the old and the new
+    entries is applied to the account balances in one statement.
+    """
+    posted = transaction_obj.status in BALANCE_STATUSES
+    entries = TransactionEntry.objects.filter(transaction=transaction_obj)
+    before = balance_deltas(entries) if posted else {}
+    changes = write_children(transaction_obj, 'entries', entries_data, raw_entries)
+    if posted:
+        deltas = balance_deltas(entries)
+        for account, amount in before.items():
+            deltas[account] = deltas.get(account, 0) - amount
+        apply_balance_deltas(deltas)
+    return changes
+
+
+@transaction.atomic
+def post_journal(organization, journal_date, description, lines, reference='', user=None, tags=None):
+    """
+    Create a posted journal from ``(account id, amount, description)`` lines,
+    debits positive and credits negative.  Entries are inserted with one
+    ``bulk_create`` and the balances moved with one statement.  Lines of
+    the same account are not merged; zero lines are dropped.  Amounts are
+    in the organization's currency.  ``user`` is a user or user id.
+    """
+    check_period_open(organization, journal_date)
+    lines = [(account, amount, line_description) for account, amount, line_description in lines if amount]
+    if sum((amount for _account, amount, _description in lines), Decimal('0')) != 0:
+        raise serializers.ValidationError(_("The journal is not balanced"))
+
+    journal = Transaction.objects.create(
+        organization=organization,
+        date=journal_date,
+        description=description,
+        reference=reference,
+        status=Transaction.Status.POSTED,
+        created_by_id=getattr(user, 'pk', user),
+        tags=tags or []
+    )
+    TransactionEntry.objects.bulk_create([
+        TransactionEntry(
+            transaction=journal,
+            account_id=account,
+            amount=amount,
+            description=line_description,
+            currency=organization.currency
+        )
+        for account, amount, line_description in lines
+    ], batch_size=1000)
+
+    deltas = defaultdict(Decimal)
+    for account, amount, _description in lines:
+        deltas[account] += amount
+    apply_balance_deltas(deltas)
+    return journal
+
+
+@transaction.atomic
+def bulk_post(journals):
+    """
+    Insert and post many journals built in memory: ``(Transaction,
+    [TransactionEntry, ...])`` pairs, neither saved yet.  Transactions and
+    entries are written with one ``bulk_create`` each and the balance deltas
+    of all of them, summed from the entries in memory, are applied in one
+    statement.  Callers check closed periods.  Returns the transactions.
+    """
+    transactions = []
+    entries = []
+    deltas = defaultdict(Decimal)
+    for journal, journal_entries in journals:
+        journal.status = Transaction.Status.POSTED
+        transactions.append(journal)
+        for entry in journal_entries:
+            entry.transaction = journal
+            entries.append(entry)
+            deltas[entry.account_id] += entry.amount
+    Transaction.objects.bulk_create(transactions, batch_size=500)
+    TransactionEntry.objects.bulk_create(entries, batch_size=1000)
+    apply_balance_deltas(deltas)
+    return transactions
+
+
+def unbalanced_transactions(transaction_ids):
+    """Ids among ``transaction_ids`` whose entries do not add up to zero, in one ``HAVING`` query."""
+    return sorted(
+        TransactionEntry.objects.filter(transaction__in=transaction_ids)
+        .order_by()
+        .values('transaction')
+        .annotate(total=Sum('amount'))
+        .exclude(total=0)
+        .values_list('transaction', flat=True)
+    )
+
+
+def _id_list(ids):
+    return ', '.join(str(pk) for pk in sorted(ids))
+
+
+@transaction.atomic
+def transition_transactions(organization, transaction_ids, action, user=None):
+    """
+    Approve, post or void transactions of ``organization`` as one batch:
+    either all of them change or, if any is missing, in the wrong status,
+    in a closed period or (to approve or post) unbalanced, none does.
+    Returns the number of transactions changed.  ``user`` is a user or user
+    id, recorded as the approver.
+    """
+    if action not in TRANSITIONS:
+        raise serializers.ValidationError(_("Unknown action"))
+    sources, target = TRANSITIONS[action]
+    ids = {int(pk) for pk in transaction_ids}
+    if not ids:
+        raise serializers.ValidationError(_("No transactions given"))
+
+    rows = list(
+        Transaction.objects.select_for_update()
+        .filter(organization=organization, pk__in=ids)
+        .order_by('pk')
+        .values_list('pk', 'status', 'date')
+    )
+    missing = ids - {pk for pk, _status, _date in rows}
+    if missing:
+        raise serializers.ValidationError(
+            _("Transactions not found: %(ids)s") % {'ids': _id_list(missing)}
+        )
+    wrong = [pk for pk, status, _date in rows if status not in sources]
+    if wrong:
+        raise serializers.ValidationError(
+            _("Transactions in the wrong status to %(action)s: %(ids)s") % {
+                'action': action,
+                'ids': _id_list(wrong),
+            }
+        )
+    check_period_open(organization, *{value for _pk, _status, value in rows})
+    if action in (APPROVE, POST):
+        unbalanced = unbalanced_transactions(ids)
+        if unbalanced:
+            raise serializers.ValidationError(
+                _("Unbalanced transactions: %(ids)s") % {'ids': _id_list(unbalanced)}
+            )
+
+    changes = {'status': target, 'updated_at': timezone.now()}
+    if action == APPROVE:
+        changes['approved_by_id'] = getattr(user, 'pk', user)
+    updated = Transaction.objects.filter(pk__in=ids).update(**changes)
+    if action == POST:
+        apply_balance_deltas(balance_deltas(TransactionEntry.objects.filter(transaction__in=ids)))
+    return updated
@@ -0,0 +1,271 @@
+"""
+Bank reconciliation matching.
+
+Imported statement lines are matched to the unreconciled entries of a bank
+account in a few passes, strongest first:
+
+* ``reference`` – same reference and amount, nearest date;
+* ``amount`` – same amount with a date inside the matching window;
+* ``sum`` – one statement line equal to the sum of several entries (a
+  deposit of several receipts) or several lines equal to one entry, grouped
+  by reference or by date.
+
+Every pass works on hash indexes keyed by amount in cents and on date
+sorted lists searched with ``bisect``, so no pass compares every line with
+every entry and tens of thousands of lines on each side match in seconds.
+Confirmed matches are marked reconciled with one ``UPDATE``.
+"""
+import csv
+import io
+import re
+from bisect import bisect_left
+from collections import defaultdict, namedtuple
+from datetime import date, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.db import transaction
+from django.utils.dateparse import parse_date
+from django.utils.translation import gettext_lazy as _
+from rest_framework import serializers
+
+from .models import TransactionEntry
+from .posting import BALANCE_STATUSES
+
+DEFAULT_DATE_WINDOW = 3
+
+STATEMENT_FIELDS = ('date', 'amount', 'reference', 'description')
+
+StatementLine = namedtuple('StatementLine', 'index date amount reference description')
+Candidate = namedtuple('Candidate', 'id date amount reference')
+Match = namedtuple('Match', 'lines entries rule')
+
+_NOT_ALNUM = re.compile(r'[^0-9A-Z]')
+
+
+def _cents(value):
+    value = Decimal(value)
+    if not value.is_finite():
+        raise InvalidOperation(value)
+    return int((value * 100).to_integral_value())
+
+
+def _normalize_reference(value):
+    # Banks reformat references: compare letters and digits only
+    return _NOT_ALNUM.sub('', str(value or '').upper())
+
+
+def parse_statement(rows):
+    """
+    Normalize statement rows (dicts with ``STATEMENT_FIELDS``).  Returns
+    ``(lines, errors)``; a line keeps the position of its row.
+    """
+    lines, errors = [], []
+    for index, row in enumerate(rows):
+        try:
+            line_date = parse_date(str(row.get('date', '')).strip())
+        except ValueError:
+            line_date = None
+        if line_date is None:
+            errors.append({'line': index, 'error': _("Invalid date")})
+            continue
+        try:
+            amount = _cents(str(row.get('amount', '')).strip())
+        except (ArithmeticError, ValueError):
+            errors.append({'line': index, 'error': _("Invalid amount")})
+            continue
+        lines.append(StatementLine(
+            index,
+            line_date.toordinal(),
+            amount,
+            _normalize_reference(row.get('reference')),
+            row.get('description', '')
+        ))
+    return lines, errors
+
+
+def read_statement_csv(uploaded_file):
+    """Rows of a CSV statement file with a ``date,amount,reference,description`` header."""
+    decoded = uploaded_file.read().decode('utf-8-sig')
+    return list(csv.DictReader(io.StringIO(decoded)))
+
+
+def candidate_entries(account, start, end):
+    """Unreconciled posted entries of ``account`` dated between ``start`` and ``end``."""
+    rows = TransactionEntry.objects.filter(
+        account=account,
+        reconciled=False,
+        transaction__status__in=BALANCE_STATUSES,
+        transaction__date__range=(start, end)
+    ).values_list('pk', 'transaction__date', 'amount', 'transaction__reference')
+    return [
+        Candidate(pk, entry_date.toordinal(), _cents(amount), _normalize_reference(reference))
+        for pk, entry_date, amount, reference in rows.iterator(chunk_size=5000)
+    ]
+
+
+class _DateIndex:
+    """Entries bucketed by amount, each bucket sorted by date."""
+
+    def __init__(self, entries):
+        buckets = defaultdict(list)
+        for entry in entries:
+            buckets[entry.amount].append((entry.date, entry.id))
+        self.buckets = {amount: sorted(bucket) for amount, bucket in buckets.items()}
+        self.dates = {amount: [d for d, _key in bucket] for amount, bucket in self.buckets.items()}
+
+    def take(self, amount, on, window):
+        """
+        Remove and return the id of the entry of ``amount`` dated closest to
+        ``on``, within ``window`` days.
+        """
+        bucket = self.buckets.get(amount)
+        if not bucket:
+            return None
+        dates = self.dates[amount]
+        position = bisect_left(dates, on)
+        # Only the neighbours around the insertion point can be the closest
+        best = None
+        for candidate in (position - 1, position):
+            if 0 <= candidate < len(dates) and abs(dates[candidate] - on) <= window:
+                if best is None or abs(dates[candidate] - on) < abs(dates[best] - on):
+                    best = candidate
+        if best is None:
+            return None
+        del dates[best]
+        return bucket.pop(best)[1]
+
+
+def _match_references(lines, entries, used_lines, used_entries, matches):
+    by_reference = defaultdict(list)
+    for entry in entries:
+        if entry.reference:
+            by_reference[(entry.reference, entry.amount)].append(entry)
+    for line in lines:
+        if not line.reference:
+            continue
+        best = None
+        for entry in by_reference.get((line.reference, line.amount), ()):
+            if entry.id in used_entries:
+                continue
+            if best is None or abs(entry.date - line.date) < abs(best.date - line.date):
+                best = entry
+        if best is not None:
+            used_lines.add(line.index)
+            used_entries.add(best.id)
+            matches.append(Match((line.index,), (best.id,), 'reference'))
+
+
+def _match_amounts(lines, entries, window, used_lines, used_entries, matches):
+    index = _DateIndex(e for e in entries if e.id not in used_entries)
+    for line in lines:
+        if line.index in used_lines:
+            continue
+        entry_id = index.take(line.amount, line.date, window)
+        if entry_id is not None:
+            used_lines.add(line.index)
+            used_entries.add(entry_id)
+            matches.append(Match((line.index,), (entry_id,), 'amount'))
+
+
+def _groups(items):
+    """Groups of two or more items by reference and by date: ``{amount: [group, ...]}``."""
+    grouped = defaultdict(list)
+    for item in items:
+        if item.reference:
+            grouped[('reference', item.reference)].append(item)
+        grouped[('date', item.date)].append(item)
+    by_amount = defaultdict(list)
+    for group in grouped.values():
+        if len(group) > 1:
+            by_amount[sum(item.amount for item in group)].append(group)
+    return by_amount
+
+
+def _match_sums(lines, entries, window, used_lines, used_entries, matches):
+    open_lines = [line for line in lines if line.index not in used_lines]
+    open_entries = [entry for entry in entries if entry.id not in used_entries]
+
+    # One statement line paying several entries
+    entry_groups = _groups(open_entries)
+    for line in open_lines:
+        for group in entry_groups.get(line.amount, ()):
+            if any(entry.id in used_entries for entry in group):
+                continue
+            if any(abs(entry.date - line.date) > window for entry in group):
+                continue
+            used_lines.add(line.index)
+            used_entries.update(entry.id for entry in group)
+            matches.append(Match((line.index,), tuple(entry.id for entry in group), 'sum'))
+            break
+
+    # Several statement lines settling one entry
+    line_groups = _groups([line for line in open_lines if line.index not in used_lines])
+    for entry in open_entries:
+        if entry.id in used_entries:
+            continue
+        for group in line_groups.get(entry.amount, ()):
+            if any(line.index in used_lines for line in group):
+                continue
+            if any(abs(line.date - entry.date) > window for line in group):
+                continue
+            used_entries.add(entry.id)
+            used_lines.update(line.index for line in group)
+            matches.append(Match(tuple(line.index for line in group), (entry.id,), 'sum'))
+            break
+
+
+def match_statement(lines, entries, date_window=DEFAULT_DATE_WINDOW):
+    """
+    Match parsed statement lines to candidate entries.  Each line and entry
+    is used at most once.  Returns ``(matches, unmatched_line_indexes)``.
+    """
+    used_lines, used_entries, matches = set(), set(), []
+    _match_references(lines, entries, used_lines, used_entries, matches)
+    _match_amounts(lines, entries, date_window, used_lines, used_entries, matches)
+    _match_sums(lines, entries, date_window, used_lines, used_entries, matches)
+    unmatched = [line.index for line in lines if line.index not in used_lines]
+    return matches, unmatched
+
+
+def confirm_matches(account, entry_ids, statement_date):
+    """
+    Mark posted entries of ``account`` reconciled, in one UPDATE; entries of
+    unposted transactions are skipped.  Returns the count.
+    """
+    entry_ids = set(entry_ids)
+    if not entry_ids:
+        return 0
+    return TransactionEntry.objects.filter(
+        account=account,
+        pk__in=entry_ids,
+        transaction__status__in=BALANCE_STATUSES,
+        reconciled=False
+    ).update(reconciled=True, reconciled_date=statement_date)
+
+
+@transaction.atomic
+def reconcile_statement(account, rows, statement_date=None, date_window=DEFAULT_DATE_WINDOW,
+                        confirm=True, entry_ids=()):
+    """
+    Parse statement ``rows``, match them to the unreconciled entries of
+    ``account`` and, with ``confirm``, mark the matched entries reconciled
+    together with the hand-picked ``entry_ids``.
+    """
+    if date_window < 0:
+        raise serializers.ValidationError(_("The date window cannot be negative"))
+    lines, errors = parse_statement(rows)
+    statement_date = statement_date or date.today()
+    matches, unmatched = [], []
+    if lines:
+        start = date.fromordinal(min(line.date for line in lines)) - timedelta(days=date_window)
+        end = date.fromordinal(max(line.date for line in lines)) + timedelta(days=date_window)
+        entries = candidate_entries(account, start, end)
+        matches, unmatched = match_statement(lines, entries, date_window)
+    matched_ids = [entry_id for match in matches for entry_id in match.entries] if confirm else []
+    reconciled = confirm_matches(account, [*matched_ids, *entry_ids], statement_date)
+    return {
+        'matches': [match._asdict() for match in matches],
+        'unmatched_lines': unmatched,
+        'errors': errors,
+        'reconciled': reconciled,
+    }
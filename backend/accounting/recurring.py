@@ -0,0 +1,170 @@
+"""
+Set-based recurring invoice generation.
+
+Due templates are loaded in chunks together with their items, every missed
+occurrence up to the run date is generated (catch-up), and invoices and
+items are written with ``bulk_create``.  Each chunk runs in one transaction
+with its templates locked, so overlapping runs never generate an occurrence
+twice.
+"""
+from collections import defaultdict
+from datetime import timedelta
+from decimal import Decimal
+
+from dateutil.relativedelta import relativedelta
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Invoice, InvoiceItem, RecurringInvoice
+from . import delivery
+from .numbering import reserve_invoice_numbers
+
+CHUNK_SIZE = 200
+# Upper bound of occurrences generated for one template in a single run
+MAX_OCCURRENCES = 400
+
+_STEPS = {
+    RecurringInvoice.Frequency.DAILY: relativedelta(days=1),
+    RecurringInvoice.Frequency.WEEKLY: relativedelta(weeks=1),
+    RecurringInvoice.Frequency.MONTHLY: relativedelta(months=1),
+    RecurringInvoice.Frequency.QUARTERLY: relativedelta(months=3),
+    RecurringInvoice.Frequency.YEARLY: relativedelta(years=1),
+}
+
+
+def next_occurrence(value, frequency, anchor_day=None):
+    """
+    Date of the occurrence after ``value``.  Monthly, quarterly and yearly
+    schedules keep ``anchor_day`` (the day of the start date), clamped to the
+    length of the month, so the 31st does not drift to the 28th.
+    """
+    step = _STEPS[frequency]
+    if anchor_day and frequency not in (
+        RecurringInvoice.Frequency.DAILY, RecurringInvoice.Frequency.WEEKLY
+    ):
+        step = step + relativedelta(day=anchor_day)
+    return value + step
+
+
+def occurrences(template, until):
+    """Every occurrence of ``template`` from ``next_date`` through ``until``, and the following one."""
+    last = min(until, template.end_date) if template.end_date else until
+    dates = []
+    current = template.next_date
+    while current <= last and len(dates) < MAX_OCCURRENCES:
+        dates.append(current)
+        current = next_occurrence(current, template.frequency, template.start_date.day)
+    return dates, current
+
+
+def due_templates(today, organization=None):
+    queryset = RecurringInvoice.objects.filter(
+        is_active=True,
+        next_date__lte=today
+    ).filter(
+        Q(end_date__isnull=True) | Q(next_date__lte=F('end_date'))
+    )
+    if organization is not None:
+        queryset = queryset.filter(organization=organization)
+    return queryset
+
+
+def _build_invoice(template, occurrence):
+    invoice = Invoice(
+        organization_id=template.organization_id,
+        type=template.invoice_type,
+        date=occurrence,
+        due_date=occurrence + timedelta(days=template.days_due),
+        party_id=template.party_id,
+        party_name=template.party_name,
+        party_tax_id=template.party_tax_id,
+        party_address=template.party_address,
+        party_email=template.party_email,
+        party_phone=template.party_phone,
+        terms=template.terms,
+        notes=template.notes,
+        status=Invoice.Status.SENT if template.auto_send else Invoice.Status.DRAFT,
+        created_by_id=template.created_by_id
+    )
+    items = []
+    for template_item in template.items.all():
+        item = InvoiceItem(
+            description=template_item.description,
+            quantity=template_item.quantity,
+            unit_price=template_item.unit_price,
+            discount_rate=template_item.discount_rate,
+            tax_rate=template_item.tax_rate,
+            income_account_id=template_item.income_account_id,
+            tax_account_id=template_item.tax_account_id
+        )
+        items.append(item)
+    InvoiceItem.compute_many(items)
+    invoice.subtotal = sum((item.amount for item in items), Decimal('0'))
+    invoice.tax_amount = sum((item.tax_amount for item in items), Decimal('0'))
+    invoice.total = invoice.subtotal + invoice.tax_amount
+    return invoice, items
+
+
+@transaction.atomic
+def _generate_chunk(template_ids, today):
+    templates = list(
+        due_templates(today)
+        .filter(pk__in=template_ids)
+        .select_for_update(skip_locked=True)
+        .prefetch_related('items')
+        .order_by('pk')
+    )
+    invoices, items_per_invoice = [], []
+    for template in templates:
+        dates, following = occurrences(template, today)
+        for occurrence in dates:
+            invoice, items = _build_invoice(template, occurrence)
+            invoices.append(invoice)
+            items_per_invoice.append(items)
+        template.next_date = following
+        template.updated_at = timezone.now()
+
+    # One number reservation per organization
+    per_organization = defaultdict(list)
+    for invoice in invoices:
+        per_organization[invoice.organization_id].append(invoice)
+    for organization_id, org_invoices in per_organization.items():
+        numbers = reserve_invoice_numbers(
+            organization_id,
+            len(org_invoices),
+            dates=[invoice.date for invoice in org_invoices]
+        )
+        for invoice, number in zip(org_invoices, numbers):
+            invoice.number = number
+
+    Invoice.objects.bulk_create(invoices, batch_size=CHUNK_SIZE)
+    items = []
+    for invoice, invoice_items in zip(invoices, items_per_invoice):
+        for item in invoice_items:
+            item.invoice = invoice
+            items.append(item)
+    InvoiceItem.objects.bulk_create(items, batch_size=1000)
+    RecurringInvoice.objects.bulk_update(templates, ['next_date', 'updated_at'])
+    # Invoices of auto_send templates are emailed once the chunk commits
+    delivery.queue_invoice_emails([
+        invoice.pk for invoice in invoices if invoice.status == Invoice.Status.SENT
+    ])
+    return [invoice.pk for invoice in invoices]
+
+
+def generate_due_invoices(today=None, organization=None, chunk_size=CHUNK_SIZE):
+    """
+    Generate every due occurrence of every active template, optionally
+    limited to one organization.  Returns the ids of the created invoices.
+    """
+    today = today or timezone.localdate()
+    template_ids = list(
+        due_templates(today, organization).order_by('pk').values_list('pk', flat=True)
+    )
+    invoice_ids = []
+    for start in range(0, len(template_ids), chunk_size):
+        invoice_ids.extend(
+            _generate_chunk(template_ids[start:start + chunk_size], today)
+        )
+    return invoice_ids
@@ -0,0 +1,116 @@
+"""
+Set-based recurring journal generation.
+
+A posted transaction flagged as recurring is copied every period after its
+own date until its recurrence end date.  ``next_recurrence_date`` holds the
+date of the next copy and is indexed for recurring transactions only, so a
+run reads nothing but the sources that fell due.
+
+Like recurring invoices, due sources are loaded in chunks together with
+their entries, every missed occurrence up to the run date is generated
+(catch-up) and the copies and their entries are written with
+``bulk_create``.  The copies are posted through ``posting.bulk_post``: the
+balance deltas of a chunk are summed from the entries already in memory and
+applied in one statement.  Occurrences inside a closed period are skipped.
+Each chunk runs in one transaction with its sources locked, so overlapping
+runs never copy an occurrence twice.
+"""
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+
+from .models import Transaction, TransactionEntry
+from .posting import BALANCE_STATUSES, bulk_post
+from .recurring import MAX_OCCURRENCES, next_occurrence
+
+CHUNK_SIZE = 200
+
+ENTRY_FIELDS = ('account_id', 'description', 'amount', 'tax_rate', 'currency', 'exchange_rate')
+
+
+def due_journals(today, organization=None):
+    """Posted recurring transactions with a copy due on or before ``today``."""
+    queryset = Transaction.objects.filter(
+        is_recurring=True,
+        next_recurrence_date__lte=today,
+        status__in=BALANCE_STATUSES
+    ).exclude(
+        recurrence_type=Transaction.RecurrenceType.NONE
+    ).filter(
+        Q(recurrence_end_date__isnull=True) | Q(next_recurrence_date__lte=F('recurrence_end_date'))
+    )
+    if organization is not None:
+        queryset = queryset.filter(organization=organization)
+    return queryset
+
+
+def occurrences(source, until):
+    """Copy dates of ``source`` from ``next_recurrence_date`` through ``until``, and the following one."""
+    last = min(until, source.recurrence_end_date) if source.recurrence_end_date else until
+    dates = []
+    current = source.next_recurrence_date
+    while current <= last and len(dates) < MAX_OCCURRENCES:
+        dates.append(current)
+        current = next_occurrence(current, source.recurrence_type, source.date.day)
+    return dates, current
+
+
+@transaction.atomic
+def _generate_chunk(source_ids, today):
+    sources = list(
+        due_journals(today)
+        .filter(pk__in=source_ids)
+        .select_for_update(skip_locked=True, of=('self',))
+        .select_related('organization')
+        .prefetch_related('entries')
+        .order_by('pk')
+    )
+    now = timezone.now()
+    journals = []
+    for source in sources:
+        dates, following = occurrences(source, today)
+        closed = source.organization.books_closed_through
+        entries = [
+            {field: getattr(entry, field) for field in ENTRY_FIELDS}
+            for entry in source.entries.all()
+        ]
+        for occurrence in dates:
+            if closed is not None and occurrence <= closed:
+                continue
+            copy = Transaction(
+                organization_id=source.organization_id,
+                date=occurrence,
+                description=source.description,
+                reference=source.reference,
+                tags=source.tags,
+                created_by_id=source.created_by_id,
+                approved_by_id=source.approved_by_id,
+                recurrence_source=source,
+                # Recurring accruals reverse as long after each copy as after the source
+                reverse_on=occurrence + (source.reverse_on - source.date) if source.reverse_on else None
+            )
+            journals.append((copy, [TransactionEntry(**entry) for entry in entries]))
+        source.next_recurrence_date = following
+        source.updated_at = now
+
+    copies = bulk_post(journals)
+    Transaction.objects.bulk_update(sources, ['next_recurrence_date', 'updated_at'])
+    return [copy.pk for copy in copies]
+
+
+def generate_due_journals(today=None, organization=None, chunk_size=CHUNK_SIZE):
+    """
+    Copy every due occurrence of every recurring transaction, optionally
+    limited to one organization.  Returns the ids of the created
+    transactions.
+    """
+    today = today or timezone.localdate()
+    source_ids = list(
+        due_journals(today, organization).order_by('pk').values_list('pk', flat=True)
+    )
+    transaction_ids = []
+    for start in range(0, len(source_ids), chunk_size):
+        transaction_ids.extend(
+            _generate_chunk(source_ids[start:start + chunk_size], today)
+        )
+    return transaction_ids
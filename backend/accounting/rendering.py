@@ -0,0 +1,296 @@
+"""
+Document rendering (invoices, statements, financial reports).
+
+Templates are compiled once per process and kept in memory.  Converting HTML
+to PDF (weasyprint, imported lazily) is CPU bound, so it never runs on web
+workers: views queue Celery tasks, and batches are spread over a process
+pool.  Prefork Celery children are daemonic and cannot start one, so the
+rendering tasks are routed to the ``rendering`` queue, consumed by a worker
+running ``--pool=solo`` (see ``CELERY_TASK_ROUTES``); pool processes are
+spawned rather than forked, which is also safe from a threaded worker.
+
+Every render is identified by a hash of its template, format and context; a
+document whose hash has not changed since it was last rendered keeps its
+stored file instead of being rendered again.  Output goes through Django's
+storage API.
+"""
+from concurrent.futures import ProcessPoolExecutor
+from functools import lru_cache
+import hashlib
+import json
+import logging
+import multiprocessing
+import os
+
+import django
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.db.models import Prefetch
+from django.template import loader
+from django.utils.text import slugify
+
+from documents.models import Document
+
+from .models import Invoice, InvoiceItem
+
+logger = logging.getLogger(__name__)
+
+PDF = 'pdf'
+HTML = 'html'
+FORMATS = (PDF, HTML)
+CONTENT_TYPES = {PDF: 'application/pdf', HTML: 'text/html'}
+
+# Bump to render every stored document again (e.g. after a template change)
+RENDERER_VERSION = 1
+
+# Below this many documents a process pool costs more than it saves
+POOL_THRESHOLD = 20
+
+# Celery queue of the rendering tasks, consumed by a non-daemonic worker
+RENDERING_QUEUE = 'rendering'
+
+INVOICE_TEMPLATE = 'accounting/invoices/invoice.html'
+REPORT_TEMPLATE = 'accounting/reports/financial_statements.html'
+REPORT_KIND = 'financial_statements'
+
+
+def _weasyprint():
+    try:
+        import weasyprint
+    except ImportError:  # pragma: no cover - depends on the deployment
+        raise ImportError(
+            "weasyprint is required to render PDF documents"
+        )
+    return weasyprint
+
+
+@lru_cache(maxsize=64)
+def get_template(template_name):
+    """Compiled template, loaded once per process."""
+    return loader.get_template(template_name)
+
+
+def render(template_name, context, fmt=PDF):
+    """Render a template to bytes in ``fmt``."""
+    html = get_template(template_name).render(context)
+    if fmt == HTML:
+        return html.encode('utf-8')
+    return _weasyprint().HTML(string=html).write_pdf()
+
+
+def content_hash(template_name, context, fmt=PDF):
+    """Hash identifying the output of a render."""
+    payload = json.dumps(
+        [RENDERER_VERSION, template_name, fmt, context],
+        cls=DjangoJSONEncoder,
+        sort_keys=True
+    )
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+def _render_job(job):
+    return render(*job)
+
+
+def render_many(jobs, workers=None):
+    """
+    Render ``(template_name, context, fmt)`` jobs, in order.  Large batches
+    are rendered in a process pool.
+    """
+    jobs = list(jobs)
+    workers = workers or os.cpu_count() or 1
+    if workers == 1 or len(jobs) < POOL_THRESHOLD:
+        return [_render_job(job) for job in jobs]
+    if multiprocessing.current_process().daemon:
+        logger.warning(
+            "Rendering %d documents serially: daemonic processes cannot start a pool; "
+            "route rendering tasks to the %r queue", len(jobs), RENDERING_QUEUE
+        )
+        return [_render_job(job) for job in jobs]
+    # Spawned processes share no sockets or locks with the caller and
+    # only need Django set up to load templates
+    chunksize = max(1, len(jobs) // (workers * 4))
+    with ProcessPoolExecutor(
+        max_workers=workers,
+        mp_context=multiprocessing.get_context('spawn'),
+        initializer=django.setup
+    ) as executor:
+        return list(executor.map(_render_job, jobs, chunksize=chunksize))
+
+
+# Invoices
+
+def invoice_context(invoice):
+    """Template context of an invoice, from its (prefetched) items."""
+    organization = invoice.organization
+    return {
+        'organization': {
+            'name': organization.name,
+            'tax_id': organization.tax_id,
+            'address': organization.address,
+            'email': organization.email,
+            'phone': organization.phone,
+        },
+        'invoice': {
+            'number': invoice.number,
+            'type': str(invoice.get_type_display()),
+            'reference': invoice.reference,
+            'date': invoice.date,
+            'due_date': invoice.due_date,
+            'currency': invoice.currency,
+            'subtotal': invoice.subtotal,
+            'tax_amount': invoice.tax_amount,
+            'total': invoice.total,
+            'amount_paid': invoice.amount_paid,
+            'balance_due': invoice.balance_due,
+            'notes': invoice.notes,
+            'terms': invoice.terms,
+        },
+        'party': {
+            'name': invoice.party_name,
+            'tax_id': invoice.party_tax_id,
+            'address': invoice.party_address,
+            'email': invoice.party_email,
+            'phone': invoice.party_phone,
+        },
+        'items': [
+            {
+                'description': item.description,
+                'quantity': item.quantity,
+                'unit_price': item.unit_price,
+                'discount_rate': item.discount_rate,
+                'tax_rate': item.tax_rate,
+                'amount': item.amount,
+            }
+            for item in invoice.items.all()
+        ],
+    }
+
+
+def invoices_for_rendering(invoice_ids):
+    return Invoice.objects.filter(pk__in=invoice_ids).select_related('organization').prefetch_related(
+        Prefetch('items', queryset=InvoiceItem.objects.order_by('pk'))
+    )
+
+
+def invoice_pdf_hash(invoice):
+    return content_hash(INVOICE_TEMPLATE, invoice_context(invoice), PDF)
+
+
+def render_invoice_pdfs(invoice_ids, workers=None, force=False):
+    """
+    Render the PDFs of invoices whose content changed since their last render
+    (all of them with ``force``) and store them.  Returns the number of
+    invoices rendered and left unchanged.
+    """
+    invoices = list(invoices_for_rendering(invoice_ids))
+    pending, jobs = [], []
+    for invoice in invoices:
+        context = invoice_context(invoice)
+        digest = content_hash(INVOICE_TEMPLATE, context, PDF)
+        if not force and invoice.pdf_file and invoice.pdf_hash == digest:
+            continue
+        pending.append((invoice, digest))
+        jobs.append((INVOICE_TEMPLATE, context, PDF))
+
+    rendered = render_many(jobs, workers)
+
+    replaced = []
+    for (invoice, digest), content in zip(pending, rendered):
+        if invoice.pdf_file:
+            replaced.append(invoice.pdf_file.name)
+        name = f"{slugify(invoice.number) or invoice.pk}-{digest[:12]}.pdf"
+        invoice.pdf_file.save(name, ContentFile(content), save=False)
+        invoice.pdf_hash = digest
+    Invoice.objects.bulk_update([invoice for invoice, _digest in pending], ['pdf_file', 'pdf_hash'], batch_size=500)
+    for name in replaced:
+        default_storage.delete(name)
+    return {'rendered': len(pending), 'unchanged': len(invoices) - len(pending)}
+
+
+# Financial statements
+
+REPORT_TITLES = {
+    'balance_sheet': 'Balance Sheet',
+    'income_statement': 'Income Statement',
+    'cash_flow': 'Cash Flow Statement',
+}
+
+
+def report_context(organization, reports, as_of):
+    """
+    Context of the financial statements document.  ``reports`` are the
+    payloads of the report endpoints: sections holding ``accounts`` and a
+    ``total``, next to top-level totals.
+    """
+    context_reports = []
+    for key, report in reports.items():
+        sections, totals = [], []
+        for name, value in report.items():
+            label = name.replace('_', ' ').capitalize()
+            if isinstance(value, dict) and 'total' in value:
+                sections.append({
+                    'title': label,
+                    'rows': [
+                        {
+                            'code': row.get('code', ''),
+                            'name': row.get('name') or row.get('description', ''),
+                            'amount': row.get('balance', row.get('amount', '')),
+                        }
+                        for rows in value.values() if isinstance(rows, list)
+                        for row in rows if isinstance(row, dict)
+                    ],
+                    'total': value['total'],
+                })
+            elif not isinstance(value, (dict, list)):
+                totals.append({'label': label, 'value': value})
+        context_reports.append({
+            'title': REPORT_TITLES.get(key, key.replace('_', ' ').capitalize()),
+            'sections': sections,
+            'totals': totals,
+        })
+    return {
+        'organization': {'name': organization.name, 'tax_id': organization.tax_id},
+        'as_of': as_of,
+        'reports': context_reports,
+    }
+
+
+@transaction.atomic
+def store_report(organization, reports, as_of, fmt=PDF, user=None):
+    """
+    Render financial statements and store them as a document.  When an
+    identical document was rendered before it is returned instead.  ``user``
+    is a user or user id.
+    """
+    context = report_context(organization, reports, as_of)
+    digest = content_hash(REPORT_TEMPLATE, context, fmt)
+    existing = Document.objects.filter(
+        organization=organization,
+        metadata__kind=REPORT_KIND,
+        metadata__content_hash=digest
+    ).first()
+    if existing is not None:
+        return existing
+
+    content = render(REPORT_TEMPLATE, context, fmt)
+    filename = f"financial-statements-{as_of}-{digest[:12]}.{fmt}"
+    return Document.objects.create(
+        organization=organization,
+        title=f"Financial statements {as_of}",
+        document_type=Document.DocumentType.REPORT,
+        file=ContentFile(content, name=filename),
+        file_size=len(content),
+        file_type=CONTENT_TYPES[fmt],
+        original_filename=filename,
+        document_date=as_of,
+        tags=['financial_statements'],
+        metadata={
+            'kind': REPORT_KIND,
+            'reports': list(reports),
+            'content_hash': digest,
+        },
+        created_by_id=getattr(user, 'pk', user)
+    )
@@ -0,0 +1,96 @@
+"""
+Reversing entries.
+
+A posted transaction with a ``reverse_on`` date (typically a month-end
+accrual reversed on the first day of the next month) is reversed by a
+nightly batch across organizations: a posted transaction on that date with
+every entry negated, linked back through ``reversal_of``.
+
+Due sources are read through the partial index on ``reverse_on`` in chunks,
+with their entries prefetched in one query; the reversals are built from
+those entries in memory and written by ``posting.bulk_post``, which applies
+the balance deltas of the whole chunk in one statement.  A source counts as
+reversed once a reversal points to it, so reruns never reverse twice.
+Sources whose reversal date falls in a closed period are left alone.
+"""
+from django.db import transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.translation import gettext as _
+
+from .models import Transaction, TransactionEntry
+from .posting import BALANCE_STATUSES, bulk_post
+
+CHUNK_SIZE = 500
+
+
+def due_reversals(today, organization=None):
+    """Posted transactions to reverse on or before ``today`` that have no reversal yet."""
+    queryset = Transaction.objects.filter(
+        reverse_on__isnull=False,
+        reverse_on__lte=today,
+        status__in=BALANCE_STATUSES,
+        reversals__isnull=True
+    ).filter(
+        Q(organization__books_closed_through__isnull=True)
+        | Q(reverse_on__gt=F('organization__books_closed_through'))
+    )
+    if organization is not None:
+        queryset = queryset.filter(organization=organization)
+    return queryset
+
+
+def build_reversal(source):
+    """The reversal of ``source`` and its entries, unsaved, from its (prefetched) entries."""
+    reversal = Transaction(
+        organization_id=source.organization_id,
+        date=source.reverse_on,
+        description=_("Reversal of %(description)s") % {'description': source.description},
+        reference=source.reference,
+        tags=[*(source.tags if isinstance(source.tags, list) else []), 'reversal'],
+        created_by_id=source.created_by_id,
+        approved_by_id=source.approved_by_id,
+        reversal_of=source
+    )
+    entries = [
+        TransactionEntry(
+            account_id=entry.account_id,
+            description=entry.description,
+            amount=-entry.amount,
+            tax_rate=entry.tax_rate,
+            currency=entry.currency,
+            exchange_rate=entry.exchange_rate
+        )
+        for entry in source.entries.all()
+    ]
+    return reversal, entries
+
+
+@transaction.atomic
+def _reverse_chunk(source_ids, today):
+    sources = list(
+        due_reversals(today)
+        .filter(pk__in=source_ids)
+        .select_for_update(skip_locked=True, of=('self',))
+        .prefetch_related('entries')
+        .order_by('pk')
+    )
+    reversals = bulk_post([build_reversal(source) for source in sources])
+    return [reversal.pk for reversal in reversals]
+
+
+def reverse_due_transactions(today=None, organization=None, chunk_size=CHUNK_SIZE):
+    """
+    Reverse every due transaction, optionally limited to one organization.
+    Returns the ids of the created reversals.
+    """
+    today = today or timezone.localdate()
+    source_ids = list(
+        due_reversals(today, organization).order_by('pk').values_list('pk', flat=True)
+    )
+    reversal_ids = []
+    for start in range(0, len(source_ids), chunk_size):
+        reversal_ids.extend(
+            _reverse_chunk(source_ids[start:start + chunk_size], today)
+        )
+    return reversal_ids
@@ -2,11 +2,19 @@ from rest_framework import serializers
 from django.utils.translation import gettext_lazy as _
 from django.db.models import Sum
 from decimal import Decimal
+from datetime import date
 from .models import (
     Account, Transaction, TransactionEntry, Budget, BudgetItem,
     Invoice, InvoiceItem, FixedAsset, TaxRate, Payment,
-    RecurringInvoice, RecurringInvoiceItem
+    RecurringInvoice, RecurringInvoiceItem, PeriodClose, ClosingBalance,
+    NumberSequence, PaymentAllocation, Party, ExchangeRate, AllocationRule,
+    AllocationTarget, AllocationRun
 )
+from .nested import write_children
+from .numbering import next_invoice_number
+from .parties import resolve_party, resolve_updated_party
+from . import depreciation, disposals, payments
+from .posting import check_period_open, write_entries
 
 class AccountSerializer(serializers.ModelSerializer):
     balance = serializers.DecimalField(
@@ -59,8 +67,9 @@ class TransactionEntrySerializer(serializers.ModelSerializer):
         fields = (
             'id', 'transaction', 'account', 'account_name',
             'description', 'amount', 'tax_rate', 'currency',
-            'exchange_rate'
+            'exchange_rate', 'reconciled', 'reconciled_date'
         )
+        read_only_fields = ('reconciled', 'reconciled_date')
 
     def validate(self, data):
         if data['amount'] == 0:
@@ -84,11 +93,17 @@ class TransactionSerializer(serializers.ModelSerializer):
             'id', 'organization', 'date', 'description',
             'reference', 'status', 'is_recurring',
             'recurrence_type', 'recurrence_end_date',
+            'next_recurrence_date', 'recurrence_source',
+            'reverse_on', 'reversal_of',
             'entries', 'total_amount', 'is_balanced',
             'tags', 'created_at', 'updated_at',
             'created_by', 'approved_by'
         )
-        read_only_fields = ('created_at', 'updated_at', 'created_by', 'approved_by')
+        # Status changes go through approve/post/void, which move the balances
+        read_only_fields = (
+            'status', 'created_at', 'updated_at', 'created_by', 'approved_by',
+            'next_recurrence_date', 'recurrence_source', 'reversal_of'
+        )
 
     def validate(self, data):
         entries = self.initial_data.get('entries', [])
@@ -103,19 +118,27 @@ class TransactionSerializer(serializers.ModelSerializer):
                 _("Transaction must be balanced (debits = credits)")
             )
         
+        reverse_on = data.get('reverse_on')
+        transaction_date = data.get('date', getattr(self.instance, 'date', None))
+        if reverse_on and transaction_date and reverse_on <= transaction_date:
+            raise serializers.ValidationError(
+                _("A transaction can only be reversed after its date")
+            )
+        
         return data
 
     def create(self, validated_data):
         entries_data = validated_data.pop('entries')
+        check_period_open(validated_data['organization'], validated_data.get('date'))
         transaction = Transaction.objects.create(**validated_data)
-        
-        for entry_data in entries_data:
-            TransactionEntry.objects.create(transaction=transaction, **entry_data)
-        
+        write_entries(transaction, entries_data)
         return transaction
 
     def update(self, instance, validated_data):
-        entries_data = validated_data.pop('entries')
+        entries_data = validated_data.pop('entries', None)
+        
+        # Neither the current nor the new date may be in a closed period
+        check_period_open(instance.organization, instance.date, validated_data.get('date'))
         
         # Update transaction fields
         for attr, value in validated_data.items():
@@ -123,9 +146,8 @@ class TransactionSerializer(serializers.ModelSerializer):
         instance.save()
         
         # Handle entries
-        instance.entries.all().delete()
-        for entry_data in entries_data:
-            TransactionEntry.objects.create(transaction=instance, **entry_data)
+        if entries_data is not None:
+            write_entries(instance, entries_data, self.initial_data.get('entries', []))
         
         return instance
 
@@ -207,14 +229,11 @@ class BudgetSerializer(serializers.ModelSerializer):
     def create(self, validated_data):
         items_data = validated_data.pop('items')
         budget = Budget.objects.create(**validated_data)
-        
-        for item_data in items_data:
-            BudgetItem.objects.create(budget=budget, **item_data)
-        
+        write_children(budget, 'items', items_data)
         return budget
 
     def update(self, instance, validated_data):
-        items_data = validated_data.pop('items')
+        items_data = validated_data.pop('items', None)
         
         # Update budget fields
         for attr, value in validated_data.items():
@@ -222,9 +241,8 @@ class BudgetSerializer(serializers.ModelSerializer):
         instance.save()
         
         # Handle items
-        instance.items.all().delete()
-        for item_data in items_data:
-            BudgetItem.objects.create(budget=instance, **item_data)
+        if items_data is not None:
+            write_children(instance, 'items', items_data, self.initial_data.get('items', []))
         
         return instance
 
@@ -270,6 +288,7 @@ class InvoiceItemSerializer(serializers.ModelSerializer):
 
 class InvoiceSerializer(serializers.ModelSerializer):
     items = InvoiceItemSerializer(many=True)
+    number = serializers.CharField(max_length=50, allow_blank=True, default='')
     balance_due = serializers.DecimalField(
         max_digits=15,
         decimal_places=2,
@@ -281,17 +300,19 @@ class InvoiceSerializer(serializers.ModelSerializer):
         model = Invoice
         fields = (
             'id', 'organization', 'type', 'number',
-            'reference', 'date', 'due_date', 'party_name',
+            'reference', 'date', 'due_date', 'party', 'party_name',
             'party_tax_id', 'party_address', 'party_email',
             'party_phone', 'subtotal', 'tax_amount',
             'total', 'amount_paid', 'balance_due',
             'is_paid', 'currency', 'exchange_rate',
-            'notes', 'terms', 'status', 'items',
+            'notes', 'terms', 'status', 'items', 'pdf_file',
+            'email_status', 'email_sent_at', 'email_attempts', 'email_error',
             'created_at', 'updated_at', 'created_by'
         )
         read_only_fields = (
             'created_at', 'updated_at', 'created_by',
-            'subtotal', 'tax_amount', 'total', 'amount_paid'
+            'subtotal', 'tax_amount', 'total', 'amount_paid', 'pdf_file',
+            'email_status', 'email_sent_at', 'email_attempts', 'email_error'
         )
 
     def validate(self, data):
@@ -310,16 +331,20 @@ class InvoiceSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
+        if not validated_data.get('number'):
+            validated_data['number'] = next_invoice_number(
+                validated_data['organization'],
+                on=validated_data.get('date')
+            )
+        validated_data['party'] = resolve_party(validated_data['organization'], validated_data)
         invoice = Invoice.objects.create(**validated_data)
-        
-        for item_data in items_data:
-            InvoiceItem.objects.create(invoice=invoice, **item_data)
-        
+        write_children(invoice, 'items', items_data)
         invoice.calculate_totals()
         return invoice
 
     def update(self, instance, validated_data):
-        items_data = validated_data.pop('items')
+        items_data = validated_data.pop('items', None)
+        validated_data['party'] = resolve_updated_party(instance, validated_data)
         
         # Update invoice fields
         for attr, value in validated_data.items():
@@ -327,11 +352,12 @@ class InvoiceSerializer(serializers.ModelSerializer):
         instance.save()
         
         # Handle items
-        instance.items.all().delete()
-        for item_data in items_data:
-            InvoiceItem.objects.create(invoice=instance, **item_data)
-        
-        instance.calculate_totals()
+        if items_data is not None:
+            changes = write_children(
+                instance, 'items', items_data, self.initial_data.get('items', [])
+            )
+            if any(changes.values()):
+                instance.calculate_totals()
         return instance
 
 class FixedAssetSerializer(serializers.ModelSerializer):
@@ -343,16 +369,26 @@ class FixedAssetSerializer(serializers.ModelSerializer):
             'id', 'organization', 'name', 'description',
             'asset_number', 'purchase_date', 'purchase_cost',
             'useful_life_years', 'salvage_value',
-            'depreciation_method', 'status', 'current_value',
-            'accumulated_depreciation', 'location',
+            'depreciation_method', 'asset_account',
+            'accumulated_depreciation_account', 'depreciation_expense_account',
+            'status', 'current_value',
+            'accumulated_depreciation', 'depreciated_through', 'location',
             'custodian', 'insurance_policy',
             'insurance_expiry', 'depreciation_schedule',
+            'disposal_date', 'disposal_proceeds', 'disposal_transaction',
             'created_at', 'updated_at', 'created_by'
         )
-        read_only_fields = ('created_at', 'updated_at', 'created_by')
+        read_only_fields = (
+            'organization', 'depreciated_through', 'disposal_date', 'disposal_proceeds',
+            'disposal_transaction', 'created_at', 'updated_at', 'created_by'
+        )
 
     def get_depreciation_schedule(self, obj):
-        return obj.calculate_depreciation(obj.purchase_date)
+        # Lists pass the schedules of the whole page, computed in one pass
+        schedules = self.context.get('depreciation_schedules')
+        if schedules is None:
+            schedules = depreciation.schedules([obj])
+        return schedules.get(obj.pk, [])
 
     def validate(self, data):
         if data['salvage_value'] >= data['purchase_cost']:
@@ -363,8 +399,67 @@ class FixedAssetSerializer(serializers.ModelSerializer):
             raise serializers.ValidationError(
                 _("Useful life must be greater than zero")
             )
+
+        # Depreciation and disposals post to these accounts
+        if self.instance is not None:
+            organization_id = self.instance.organization_id
+        else:
+            organization_id = self.context['request'].user.organization.pk
+        accounts = (
+            data.get('asset_account'),
+            data.get('accumulated_depreciation_account'),
+            data.get('depreciation_expense_account'),
+        )
+        if any(account is not None and account.organization_id != organization_id for account in accounts):
+            raise serializers.ValidationError(_("Account not found"))
+        return data
+
+class AssetDisposalSerializer(serializers.Serializer):
+    """Request body of a disposal of one asset"""
+    date = serializers.DateField(required=False)
+    value = serializers.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        min_value=0,
+        default=Decimal('0')
+    )
+    proceeds_account = serializers.PrimaryKeyRelatedField(
+        queryset=Account.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    gain_loss_account = serializers.PrimaryKeyRelatedField(
+        queryset=Account.objects.all(),
+        required=False,
+        allow_null=True
+    )
+    status = serializers.ChoiceField(
+        choices=disposals.DISPOSAL_STATUSES,
+        required=False,
+        allow_null=True
+    )
+
+    def validate(self, data):
+        organization_id = self.context['request'].user.organization.pk
+        accounts = (data.get('proceeds_account'), data.get('gain_loss_account'))
+        if any(account is not None and account.organization_id != organization_id for account in accounts):
+            raise serializers.ValidationError(_("Account not found"))
         return data
 
+class AssetDisposalItemSerializer(serializers.Serializer):
+    id = serializers.IntegerField()
+    value = serializers.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        min_value=0,
+        default=Decimal('0')
+    )
+
+class AssetBatchDisposalSerializer(AssetDisposalSerializer):
+    """Request body of a disposal of several assets"""
+    value = None
+    assets = AssetDisposalItemSerializer(many=True, allow_empty=False)
+
 class TaxRateSerializer(serializers.ModelSerializer):
     class Meta:
         model = TaxRate
@@ -383,9 +478,157 @@ class TaxRateSerializer(serializers.ModelSerializer):
             )
         return data
 
+class ExchangeRateSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = ExchangeRate
+        fields = (
+            'id', 'organization', 'currency', 'date', 'rate', 'source',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = ('organization', 'created_at', 'updated_at')
+
+    def validate_currency(self, value):
+        return value.upper()
+
+    def validate_rate(self, value):
+        if value <= 0:
+            raise serializers.ValidationError(
+                _("Exchange rate must be positive")
+            )
+        return value
+
+    def validate(self, data):
+        if self.instance is not None:
+            organization_id = self.instance.organization_id
+        else:
+            organization_id = self.context['request'].user.organization.pk
+
+        # organization is read-only, so DRF adds no unique-together validator
+        duplicates = ExchangeRate.objects.filter(
+            organization_id=organization_id,
+            currency=data.get('currency', getattr(self.instance, 'currency', '')),
+            date=data.get('date', getattr(self.instance, 'date', None))
+        )
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError(
+                _("A rate for this currency and date already exists")
+            )
+        return data
+
+class AllocationTargetSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = AllocationTarget
+        fields = ('id', 'account', 'percentage', 'driver_account')
+
+class AllocationRuleSerializer(serializers.ModelSerializer):
+    targets = AllocationTargetSerializer(many=True)
+    last_period_end = serializers.SerializerMethodField()
+
+    class Meta:
+        model = AllocationRule
+        fields = (
+            'id', 'organization', 'name', 'description',
+            'source_account', 'method', 'is_active', 'targets',
+            'last_period_end', 'created_at', 'updated_at', 'created_by'
+        )
+        read_only_fields = ('organization', 'created_at', 'updated_at', 'created_by')
+
+    def get_last_period_end(self, obj):
+        # Annotated by the view; rules just created have not run
+        return getattr(obj, 'last_period_end', None)
+
+    def validate(self, data):
+        if self.instance is not None:
+            organization_id = self.instance.organization_id
+        else:
+            organization_id = self.context['request'].user.organization.pk
+        # organization is read-only, so DRF adds no unique-together validator
+        duplicates = AllocationRule.objects.filter(
+            organization_id=organization_id,
+            name=data.get('name', getattr(self.instance, 'name', ''))
+        )
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError(
+                _("An allocation rule with this name already exists")
+            )
+
+        method = data.get('method', getattr(self.instance, 'method', AllocationRule.Method.PERCENTAGE))
+        source = data.get('source_account', getattr(self.instance, 'source_account', None))
+        targets = data.get('targets')
+        if targets is None:
+            targets = [] if self.instance is None else [
+                {'account': target.account, 'percentage': target.percentage,
+                 'driver_account': target.driver_account}
+                for target in self.instance.targets.all()
+            ]
+        if not targets:
+            raise serializers.ValidationError(
+                _("At least one target is required")
+            )
+
+        accounts = [source, *(target['account'] for target in targets)]
+        accounts += [target['driver_account'] for target in targets if target.get('driver_account')]
+        if any(account.organization_id != organization_id for account in accounts):
+            raise serializers.ValidationError(_("Account not found"))
+        if any(target['account'] == source for target in targets):
+            raise serializers.ValidationError(
+                _("The source account cannot be a target")
+            )
+
+        if method == AllocationRule.Method.DRIVER:
+            if not all(target.get('driver_account') for target in targets):
+                raise serializers.ValidationError(
+                    _("Every target of a driver based rule needs a driver account")
+                )
+        else:
+            total = sum((target.get('percentage') or Decimal('0') for target in targets), Decimal('0'))
+            if total <= 0 or total > 100:
+                raise serializers.ValidationError(
+                    _("Target percentages must add up to more than 0% and at most 100%")
+                )
+        return data
+
+    def create(self, validated_data):
+        targets_data = validated_data.pop('targets')
+        rule = AllocationRule.objects.create(**validated_data)
+        write_children(rule, 'targets', targets_data)
+        return rule
+
+    def update(self, instance, validated_data):
+        targets_data = validated_data.pop('targets', None)
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        instance.save()
+        if targets_data is not None:
+            write_children(instance, 'targets', targets_data, self.initial_data.get('targets', []))
+        return instance
+
+class AllocationRunSerializer(serializers.ModelSerializer):
+    rule_name = serializers.CharField(source='rule.name', read_only=True)
+
+    class Meta:
+        model = AllocationRun
+        fields = (
+            'id', 'organization', 'rule', 'rule_name', 'period_end',
+            'transaction', 'amount', 'created_at', 'created_by'
+        )
+        read_only_fields = fields
+
+class PaymentAllocationSerializer(serializers.ModelSerializer):
+    invoice_number = serializers.CharField(source='invoice.number', read_only=True)
+    
+    class Meta:
+        model = PaymentAllocation
+        fields = ('id', 'invoice', 'invoice_number', 'amount')
+
 class PaymentSerializer(serializers.ModelSerializer):
     invoice_number = serializers.CharField(source='invoice.number', read_only=True)
     party_name = serializers.CharField(source='invoice.party_name', read_only=True)
+    allocations = PaymentAllocationSerializer(many=True, required=False)
     
     class Meta:
         model = Payment
@@ -396,7 +639,7 @@ class PaymentSerializer(serializers.ModelSerializer):
             'bank_account', 'check_number', 'check_date',
             'card_last4', 'card_type', 'authorization_code',
             'transaction_id', 'payment_gateway', 'notes',
-            'created_at', 'updated_at', 'created_by'
+            'allocations', 'created_at', 'updated_at', 'created_by'
         )
         read_only_fields = ('created_at', 'updated_at', 'created_by')
 
@@ -406,11 +649,28 @@ class PaymentSerializer(serializers.ModelSerializer):
                 _("Payment amount must be greater than zero")
             )
         
-        invoice = data['invoice']
-        if data['amount'] > invoice.balance_due:
-            raise serializers.ValidationError(
-                _("Payment amount cannot exceed invoice balance")
-            )
+        allocations = data.get('allocations')
+        if self.instance is not None and self.instance.allocations.exists():
+            # Allocations are fixed once applied, and so is what they split
+            if data['amount'] != self.instance.amount:
+                raise serializers.ValidationError(
+                    _("The amount of an applied payment cannot be changed; void and re-enter the payment")
+                )
+        elif allocations:
+            if sum(allocation['amount'] for allocation in allocations) > data['amount']:
+                raise serializers.ValidationError(
+                    _("Allocations exceed the payment amount")
+                )
+        else:
+            invoice = data.get('invoice')
+            if invoice is None:
+                raise serializers.ValidationError(
+                    _("An invoice or allocations are required")
+                )
+            if data['amount'] > invoice.balance_due:
+                raise serializers.ValidationError(
+                    _("Payment amount cannot exceed invoice balance")
+                )
         
         if data['method'] == 'check' and not data.get('check_number'):
             raise serializers.ValidationError(
@@ -419,6 +679,27 @@ class PaymentSerializer(serializers.ModelSerializer):
         
         return data
 
+    def create(self, validated_data):
+        allocations = validated_data.pop('allocations', None)
+        if allocations and not validated_data.get('invoice'):
+            validated_data['invoice'] = allocations[0]['invoice']
+        payment = Payment.objects.create(**validated_data)
+        payments.apply_payment(
+            payment,
+            [(allocation['invoice'], allocation['amount']) for allocation in allocations]
+            if allocations else None
+        )
+        return payment
+
+    def update(self, instance, validated_data):
+        # Allocations are fixed once applied; void and re-enter the payment instead
+        validated_data.pop('allocations', None)
+        instance = super().update(instance, validated_data)
+        invoice_ids = list(instance.allocations.values_list('invoice_id', flat=True))
+        payments.lock_invoices(invoice_ids)
+        payments.refresh_invoices(invoice_ids)
+        return instance
+
 class RecurringInvoiceItemSerializer(serializers.ModelSerializer):
     class Meta:
         model = RecurringInvoiceItem
@@ -448,7 +729,7 @@ class RecurringInvoiceSerializer(serializers.ModelSerializer):
         fields = (
             'id', 'organization', 'name', 'description',
             'start_date', 'end_date', 'frequency',
-            'next_invoice_date', 'invoice_type',
+            'next_invoice_date', 'invoice_type', 'party',
             'party_name', 'party_tax_id', 'party_address',
             'party_email', 'party_phone', 'terms',
             'notes', 'is_active', 'auto_send',
@@ -473,18 +754,14 @@ class RecurringInvoiceSerializer(serializers.ModelSerializer):
 
     def create(self, validated_data):
         items_data = validated_data.pop('items')
+        validated_data['party'] = resolve_party(validated_data['organization'], validated_data)
         recurring_invoice = RecurringInvoice.objects.create(**validated_data)
-        
-        for item_data in items_data:
-            RecurringInvoiceItem.objects.create(
-                recurring_invoice=recurring_invoice,
-                **item_data
-            )
-        
+        write_children(recurring_invoice, 'items', items_data)
         return recurring_invoice
 
     def update(self, instance, validated_data):
-        items_data = validated_data.pop('items')
+        items_data = validated_data.pop('items', None)
+        validated_data['party'] = resolve_updated_party(instance, validated_data)
         
         # Update recurring invoice fields
         for attr, value in validated_data.items():
@@ -492,11 +769,103 @@ class RecurringInvoiceSerializer(serializers.ModelSerializer):
         instance.save()
         
         # Handle items
-        instance.items.all().delete()
-        for item_data in items_data:
-            RecurringInvoiceItem.objects.create(
-                recurring_invoice=instance,
-                **item_data
-            )
+        if items_data is not None:
+            write_children(instance, 'items', items_data, self.initial_data.get('items', []))
         
-        return instance 
\ No newline at end of file
+        return instance 
+
+class ClosingBalanceSerializer(serializers.ModelSerializer):
+    account_code = serializers.CharField(source='account.code', read_only=True)
+    account_name = serializers.CharField(source='account.name', read_only=True)
+    balance = serializers.DecimalField(
+        max_digits=15,
+        decimal_places=2,
+        read_only=True
+    )
+    
+    class Meta:
+        model = ClosingBalance
+        fields = (
+            'id', 'account', 'account_code', 'account_name',
+            'debits', 'credits', 'balance', 'period_amount'
+        )
+
+class PeriodCloseSerializer(serializers.ModelSerializer):
+    class Meta:
+        model = PeriodClose
+        fields = (
+            'id', 'organization', 'period_start', 'period_end',
+            'notes', 'closed_at', 'closed_by'
+        )
+        read_only_fields = ('organization', 'period_start', 'closed_at', 'closed_by')
+
+class NumberSequenceSerializer(serializers.ModelSerializer):
+    preview = serializers.SerializerMethodField()
+    
+    class Meta:
+        model = NumberSequence
+        fields = (
+            'id', 'organization', 'series', 'prefix', 'pattern',
+            'next_value', 'preview', 'created_at', 'updated_at'
+        )
+        read_only_fields = ('organization', 'created_at', 'updated_at')
+
+    def get_preview(self, obj):
+        return obj.format(obj.next_value)
+
+    def validate_next_value(self, value):
+        # Moving the counter back would hand out numbers already in use
+        if self.instance is not None and value < self.instance.next_value:
+            raise serializers.ValidationError(
+                _("The next value cannot be lower than %(value)s") % {'value': self.instance.next_value}
+            )
+        return value
+
+    def validate(self, data):
+        sample = NumberSequence(
+            prefix=data.get('prefix', getattr(self.instance, 'prefix', '')),
+            pattern=data.get('pattern', getattr(self.instance, 'pattern', '{number}'))
+        )
+        next_value = data.get('next_value', getattr(self.instance, 'next_value', 1))
+        try:
+            # The longest year and month the pattern can be filled with
+            number = sample.format(next_value, date(9999, 12, 31))
+        except (KeyError, IndexError, ValueError):
+            raise serializers.ValidationError(
+                _("Invalid pattern; use {prefix}, {number}, {year} and {month}")
+            )
+        max_length = Invoice._meta.get_field('number').max_length
+        if len(number) > max_length:
+            raise serializers.ValidationError(
+                _("Numbers of this pattern are longer than %(length)s characters") % {'length': max_length}
+            )
+        return data
+
+class PartySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = Party
+        fields = (
+            'id', 'organization', 'type', 'name', 'tax_id',
+            'address', 'email', 'phone', 'is_active',
+            'created_at', 'updated_at'
+        )
+        read_only_fields = ('organization', 'created_at', 'updated_at')
+
+    def validate(self, data):
+        if self.instance is not None:
+            organization_id = self.instance.organization_id
+        else:
+            organization_id = self.context['request'].user.organization.pk
+        key = Party.make_match_key(
+            data.get('name', getattr(self.instance, 'name', '')),
+            data.get('tax_id', getattr(self.instance, 'tax_id', ''))
+        )
+        duplicates = Party.objects.filter(organization_id=organization_id, match_key=key)
+        if self.instance is not None:
+            duplicates = duplicates.exclude(pk=self.instance.pk)
+        if duplicates.exists():
+            raise serializers.ValidationError(
+                _("A party with this name or tax ID already exists")
+            )
+        return data
+
@@ -0,0 +1,248 @@
+"""
+Customer statements in batch.
+
+Every party's statement for a period (opening balance, invoices, payments,
+closing balance) is built from a fixed handful of grouped queries over all
+parties at once: opening totals and period lines of invoices, the same for
+payments (allocations grouped per payment and party) and the party details.
+No query is issued per customer.
+
+Statements are rendered through ``rendering`` (a process pool for large
+batches; the month-end task runs on the ``rendering`` queue, whose worker
+can start one) and stored as ``documents.Document`` rows with
+``bulk_create``.
+Statements whose content did not change since they were last generated
+keep their document.
+"""
+from collections import defaultdict
+from datetime import date, timedelta
+from decimal import Decimal
+
+from django.core.files.base import ContentFile
+from django.db import transaction
+from django.db.models import Case, F, Sum, When
+from django.utils.text import slugify
+
+from documents.models import Document
+
+from .models import Invoice, Party, Payment, PaymentAllocation
+from . import rendering
+from .parties import RECEIVABLE_TYPES
+from .rendering import CONTENT_TYPES, PDF
+
+TEMPLATE = 'accounting/statements/customer_statement.html'
+DOCUMENT_KIND = 'customer_statement'
+
+# Invoices shown on customer statements
+STATEMENT_TYPES = (*RECEIVABLE_TYPES, Invoice.Type.CREDIT_NOTE)
+EXCLUDED_STATUSES = (Invoice.Status.DRAFT, Invoice.Status.VOID, Invoice.Status.CANCELLED)
+
+
+def previous_month(today=None):
+    """First and last day of the month before ``today``."""
+    today = today or date.today()
+    period_end = today.replace(day=1) - timedelta(days=1)
+    return period_end.replace(day=1), period_end
+
+
+def _statement_invoices(organization, period_end):
+    return Invoice.objects.filter(
+        organization=organization,
+        party__isnull=False,
+        type__in=STATEMENT_TYPES,
+        date__lte=period_end
+    ).exclude(status__in=EXCLUDED_STATUSES)
+
+
+def _statement_allocations(organization, period_end):
+    return PaymentAllocation.objects.filter(
+        payment__organization=organization,
+        payment__status=Payment.Status.COMPLETED,
+        payment__date__lte=period_end,
+        invoice__party__isnull=False,
+        invoice__type__in=STATEMENT_TYPES
+    ).exclude(invoice__status__in=EXCLUDED_STATUSES)
+
+
+def compute_statements(organization, period_start, period_end, party_ids=None):
+    """
+    Statements of every party with an opening balance or activity in the
+    period, sorted by party name.  Amounts are what the customer owes:
+    invoices and debit notes are charges, credit notes and payments credits.
+    """
+    invoices = _statement_invoices(organization, period_end)
+    allocations = _statement_allocations(organization, period_end)
+    if party_ids is not None:
+        invoices = invoices.filter(party__in=party_ids)
+        allocations = allocations.filter(invoice__party__in=party_ids)
+    signed_total = Case(
+        When(type=Invoice.Type.CREDIT_NOTE, then=-F('total')),
+        default=F('total')
+    )
+
+    opening = defaultdict(Decimal)
+    for party_id, total in invoices.filter(date__lt=period_start).values('party').annotate(
+        total=Sum(signed_total)
+    ).values_list('party', 'total').order_by():
+        opening[party_id] += total
+    for party_id, total in allocations.filter(payment__date__lt=period_start).values(
+        'invoice__party'
+    ).annotate(total=Sum('amount')).values_list('invoice__party', 'total').order_by():
+        opening[party_id] -= total
+
+    lines = defaultdict(list)
+    for row in invoices.filter(date__gte=period_start).values(
+        'party', 'date', 'number', 'type', 'due_date', 'total'
+    ).order_by():
+        credit_note = row['type'] == Invoice.Type.CREDIT_NOTE
+        lines[row['party']].append({
+            'date': row['date'],
+            'order': 0,
+            'reference': row['number'],
+            'description': str(Invoice.Type(row['type']).label),
+            'due_date': row['due_date'],
+            'debit': Decimal('0') if credit_note else row['total'],
+            'credit': row['total'] if credit_note else Decimal('0'),
+        })
+    # One line per payment, summing its allocations to the party's invoices
+    for row in allocations.filter(payment__date__gte=period_start).values(
+        'invoice__party', 'payment', 'payment__date', 'payment__reference', 'payment__method'
+    ).annotate(total=Sum('amount')).order_by():
+        lines[row['invoice__party']].append({
+            'date': row['payment__date'],
+            'order': 1,
+            'reference': row['payment__reference'],
+            'description': str(Payment.Method(row['payment__method']).label),
+            'due_date': None,
+            'debit': Decimal('0'),
+            'credit': row['total'],
+        })
+
+    active = {party_id for party_id, amount in opening.items() if amount} | set(lines)
+    parties = Party.objects.filter(pk__in=active).values(
+        'id', 'name', 'tax_id', 'address', 'email'
+    )
+    organization_data = {'id': organization.pk, 'name': organization.name}
+
+    statements = []
+    for party in sorted(parties, key=lambda party: (party['name'], party['id'])):
+        balance = opening[party['id']]
+        party_lines = sorted(
+            lines[party['id']],
+            key=lambda line: (line['date'], line['order'], line['reference'])
+        )
+        charges = credits = Decimal('0')
+        for line in party_lines:
+            balance += line['debit'] - line['credit']
+            line['balance'] = balance
+            charges += line['debit']
+            credits += line['credit']
+        statements.append({
+            'organization': organization_data,
+            'party': party,
+            'period_start': period_start,
+            'period_end': period_end,
+            'opening_balance': opening[party['id']],
+            'lines': party_lines,
+            'charges': charges,
+            'credits': credits,
+            'closing_balance': balance,
+        })
+    return statements
+
+
+def render_statement(statement, fmt=PDF):
+    """Render one statement to bytes."""
+    return rendering.render(TEMPLATE, statement, fmt)
+
+
+def render_statements(statements, fmt=PDF, workers=None):
+    """Render statements in order, in a process pool for large batches."""
+    return rendering.render_many(((TEMPLATE, statement, fmt) for statement in statements), workers)
+
+
+def _filename(statement, fmt):
+    name = slugify(statement['party']['name'])[:60] or 'party'
+    return f"statement-{name}-{statement['party']['id']}-{statement['period_end']}.{fmt}"
+
+
+def previous_statements(organization, period_start, period_end, party_ids):
+    """Stored statements of a period, by party."""
+    documents = Document.objects.filter(
+        organization=organization,
+        metadata__kind=DOCUMENT_KIND,
+        metadata__period_start=str(period_start),
+        metadata__period_end=str(period_end),
+        metadata__party__in=list(party_ids)
+    )
+    return {document.metadata['party']: document for document in documents}
+
+
+@transaction.atomic
+def store_statements(organization, statements, rendered, hashes, fmt=PDF, user=None, replaced=()):
+    """
+    Store rendered statements as documents, deleting the ``replaced``
+    documents (earlier renders of the same statements) and their files.
+    """
+    for document in replaced:
+        document.file.delete(save=False)
+    Document.objects.filter(pk__in=[document.pk for document in replaced]).delete()
+
+    documents = []
+    for statement, content, digest in zip(statements, rendered, hashes):
+        filename = _filename(statement, fmt)
+        documents.append(Document(
+            organization=organization,
+            title=f"Statement {statement['party']['name']} {statement['period_end']}",
+            document_type=Document.DocumentType.REPORT,
+            file=ContentFile(content, name=filename),
+            file_size=len(content),
+            file_type=CONTENT_TYPES[fmt],
+            original_filename=filename,
+            document_date=statement['period_end'],
+            tags=['statement'],
+            metadata={
+                'kind': DOCUMENT_KIND,
+                'party': statement['party']['id'],
+                'period_start': str(statement['period_start']),
+                'period_end': str(statement['period_end']),
+                'closing_balance': str(statement['closing_balance']),
+                'content_hash': digest,
+            },
+            created_by=user
+        ))
+    return Document.objects.bulk_create(documents, batch_size=500)
+
+
+def generate_statements(organization, period_start, period_end, fmt=PDF, workers=None,
+                        user=None, party_ids=None):
+    """
+    Compute the statements of a period and store the ones that changed since
+    they were last generated.  Returns the documents of every statement.
+    """
+    statements = compute_statements(organization, period_start, period_end, party_ids)
+    hashes = [rendering.content_hash(TEMPLATE, statement, fmt) for statement in statements]
+    previous = previous_statements(
+        organization, period_start, period_end,
+        (statement['party']['id'] for statement in statements)
+    )
+
+    unchanged, changed = [], []
+    for statement, digest in zip(statements, hashes):
+        document = previous.get(statement['party']['id'])
+        if document is not None and document.metadata.get('content_hash') == digest:
+            unchanged.append(document)
+        else:
+            changed.append((statement, digest, document))
+
+    rendered = render_statements([statement for statement, _digest, _document in changed], fmt, workers)
+    created = store_statements(
+        organization,
+        [statement for statement, _digest, _document in changed],
+        rendered,
+        [digest for _statement, digest, _document in changed],
+        fmt,
+        user,
+        replaced=[document for _statement, _digest, document in changed if document is not None]
+    )
+    return unchanged + created
@@ -0,0 +1,208 @@
+from celery import shared_task
+
+
+@shared_task
+def generate_recurring_invoices():
+    """Nightly run generating every due recurring invoice of every organization."""
+    from .recurring import generate_due_invoices
+
+    return len(generate_due_invoices())
+
+
+@shared_task
+def generate_recurring_journals():
+    """Nightly run copying every due recurring transaction of every organization."""
+    from .recurring_journals import generate_due_journals
+
+    return len(generate_due_journals())
+
+
+@shared_task
+def reverse_due_transactions():
+    """Nightly run posting the reversal of every transaction due to reverse."""
+    from .reversals import reverse_due_transactions
+
+    return len(reverse_due_transactions())
+
+
+@shared_task
+def generate_customer_statements(organization_id=None, period_start=None, period_end=None, fmt='pdf'):
+    """
+    Month-end run storing the customer statements of every organization
+    (or one) for a period, by default the previous month.
+    """
+    from datetime import date
+
+    from organizations.models import Organization
+
+    from .statements import generate_statements, previous_month
+
+    if period_end is None:
+        period_start, period_end = previous_month()
+    else:
+        period_start, period_end = date.fromisoformat(period_start), date.fromisoformat(period_end)
+
+    organizations = Organization.objects.filter(parties__isnull=False).distinct()
+    if organization_id is not None:
+        organizations = organizations.filter(pk=organization_id)
+
+    documents = 0
+    for organization in organizations:
+        documents += len(generate_statements(organization, period_start, period_end, fmt))
+    return documents
+
+
+@shared_task
+def render_invoice_pdfs(invoice_ids, force=False):
+    """Render the PDFs of invoices that changed since their last render."""
+    from .rendering import render_invoice_pdfs
+
+    return render_invoice_pdfs(invoice_ids, force=force)
+
+
+@shared_task
+def render_financial_statements(organization_id, reports, as_of, fmt='pdf', user_id=None):
+    """Render financial statement payloads into a stored document."""
+    from organizations.models import Organization
+
+    from .rendering import store_report
+
+    organization = Organization.objects.get(pk=organization_id)
+    document = store_report(organization, reports, as_of, fmt, user_id)
+    return document.pk
+
+
+@shared_task
+def send_invoice_emails(invoice_ids):
+    """
+    Render the PDFs of queued invoices and schedule their delivery in
+    batches, within each organization's sending limit.
+    """
+    from .delivery import render_queued, schedule_batches
+
+    render_queued(invoice_ids)
+    batches = schedule_batches(invoice_ids)
+    for batch, countdown in batches:
+        deliver_invoice_emails.apply_async((batch,), countdown=countdown)
+    return len(batches)
+
+
+@shared_task(bind=True, max_retries=None)
+def deliver_invoice_emails(self, invoice_ids):
+    """
+    Send a batch of invoices over one connection.  The part of the batch
+    a connection failure left undelivered is retried with backoff.
+    """
+    from .delivery import MAX_RETRIES, deliver_batch, fail_deliveries, retry_countdown
+
+    pending, error = deliver_batch(invoice_ids)
+    if not pending:
+        return len(invoice_ids)
+    if self.request.retries >= MAX_RETRIES:
+        fail_deliveries(pending, error)
+        return len(invoice_ids) - len(pending)
+    raise self.retry(args=(pending,), exc=error, countdown=retry_countdown(self.request.retries))
+
+
+@shared_task
+def mark_overdue_invoices():
+    """Nightly sweep moving open invoices past their due date to overdue."""
+    from .overdue import sweep_overdue_invoices
+
+    return sweep_overdue_invoices()
+
+
+@shared_task
+def run_monthly_depreciation(period_end=None):
+    """
+    Month-end fan-out: one depreciation task per organization with active
+    assets, by default for the previous month.
+    """
+    from .models import FixedAsset
+    from .statements import previous_month
+
+    if period_end is None:
+        period_end = previous_month()[1].isoformat()
+    organization_ids = FixedAsset.objects.filter(
+        status=FixedAsset.Status.ACTIVE
+    ).order_by().values_list('organization', flat=True).distinct()
+    for organization_id in organization_ids:
+        run_organization_depreciation.delay(organization_id, period_end)
+    return len(organization_ids)
+
+
+@shared_task
+def run_organization_depreciation(organization_id, period_end, user_id=None):
+    """Post one organization's depreciation for the month of ``period_end``."""
+    from datetime import date
+
+    from organizations.models import Organization
+
+    from .depreciation import run_depreciation
+
+    organization = Organization.objects.get(pk=organization_id)
+    run = run_depreciation(organization, date.fromisoformat(period_end), user_id)
+    return run.pk
+
+
+@shared_task
+def revalue_foreign_currency_accounts(period_end=None):
+    """
+    Month-end fan-out: one revaluation task per organization with foreign
+    currency accounts and an exchange gain/loss account, by default at the
+    end of the previous month.
+    """
+    from .fx import revaluation_organizations
+    from .statements import previous_month
+
+    if period_end is None:
+        period_end = previous_month()[1].isoformat()
+    organization_ids = list(revaluation_organizations().values_list('pk', flat=True))
+    for organization_id in organization_ids:
+        revalue_organization_accounts.delay(organization_id, period_end)
+    return len(organization_ids)
+
+
+@shared_task
+def revalue_organization_accounts(organization_id, period_end, gain_loss_account=None, user_id=None):
+    """Post one organization's unrealized exchange differences at ``period_end``."""
+    from datetime import date
+
+    from organizations.models import Organization
+
+    from .fx import revalue_accounts
+
+    organization = Organization.objects.get(pk=organization_id)
+    journal = revalue_accounts(organization, date.fromisoformat(period_end), gain_loss_account, user_id)
+    return journal.pk if journal else None
+
+
+@shared_task
+def run_monthly_allocations(period_end=None):
+    """
+    Month-end fan-out: one allocation task per organization with active
+    allocation rules, by default for the previous month.
+    """
+    from .allocations import allocation_organizations
+    from .statements import previous_month
+
+    if period_end is None:
+        period_end = previous_month()[1].isoformat()
+    organization_ids = list(allocation_organizations().values_list('pk', flat=True))
+    for organization_id in organization_ids:
+        run_organization_allocations.delay(organization_id, period_end)
+    return len(organization_ids)
+
+
+@shared_task
+def run_organization_allocations(organization_id, period_end, user_id=None):
+    """Post one organization's allocation rules for the month of ``period_end``."""
+    from datetime import date
+
+    from organizations.models import Organization
+
+    from .allocations import run_allocations
+
+    organization = Organization.objects.get(pk=organization_id)
+    runs = run_allocations(organization, date.fromisoformat(period_end), user_id)
+    return [run.pk for run in runs]
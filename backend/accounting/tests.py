@@ -1,15 +1,74 @@
-from django.test import TestCase
+from django.apps import apps as django_apps
+from django.conf import settings
+from django.test import TestCase, override_settings
+from django.core.management import call_command
+from django.urls import reverse
+from django.core import mail
+from django.core.mail.backends.locmem import EmailBackend as LocmemEmailBackend
 from django.contrib.auth import get_user_model
-from rest_framework.test import APITestCase, APIClient
+from rest_framework.test import APITestCase, APIClient, APIRequestFactory, force_authenticate
 from rest_framework import status
-from organizations.models import Organization
+from organizations.models import Organization, OrganizationMembership
+from notifications.models import Notification
+from decimal import Decimal
 from .models import (
-    Account, Transaction, Budget, Invoice,
-    FixedAsset, TaxRate, Payment, RecurringInvoice
+    Account, Transaction, TransactionEntry, Budget, Invoice,
+    FixedAsset, TaxRate, Payment, RecurringInvoice, LedgerPeriodChecksum,
+    PeriodClose, InvoiceItem, RecurringInvoiceItem, NumberSequence,
+    PaymentAllocation, Party, DepreciationRun, ExchangeRate, AllocationRule,
+    AllocationTarget, AllocationRun
 )
+from documents.models import Document
+from . import (
+    allocations, delivery, depreciation, disposals, exports, fx, integrity, money, numbering, overdue, parties, payments,
+    periods, posting, reconciliation, recurring, recurring_journals, rendering, reversals, statements
+)
+from .nested import write_children
+from .serializers import (
+    AllocationRuleSerializer, ExchangeRateSerializer, FixedAssetSerializer, NumberSequenceSerializer,
+    InvoiceSerializer, PaymentSerializer, RecurringInvoiceSerializer, TransactionSerializer
+)
+from .views import (
+    AccountReconciliationView, AgedReceivablesView, FixedAssetViewSet, InvoiceViewSet, TaxSummaryView,
+    TransactionViewSet
+)
+from rest_framework import serializers
+import io
+import smtplib
+from types import SimpleNamespace
+from datetime import date
+import tempfile
+from unittest import skipUnless
+from unittest.mock import patch
+import importlib
+import importlib.util
+import numpy as np
 
 User = get_user_model()
 
+class OrganizationTestCase(TestCase):
+    """An owner and their organization; ``account`` adds to its chart of accounts."""
+
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner',
+            password='testpass123'
+        )
+        self.organization = Organization.objects.create(
+            name='Test Org',
+            slug='test-org',
+            owner=self.owner
+        )
+
+    def account(self, name, code, account_type, **kwargs):
+        return Account.objects.create(
+            organization=self.organization,
+            name=name,
+            code=code,
+            account_type=account_type,
+            **kwargs
+        )
+
 class AccountingAPITestCase(APITestCase):
     def setUp(self):
         self.client = APIClient()
@@ -226,3 +285,2125 @@ class AccountingAPITestCase(APITestCase):
         response = self.client.post('/api/accounting/recurring-invoices/', data)
         self.assertEqual(response.status_code, status.HTTP_201_CREATED)
         self.assertEqual(RecurringInvoice.objects.count(), 1)
+
+class LedgerExportTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        cash = self.account('Cash', '1000', 'asset')
+        revenue = self.account('Revenue', '4000', 'income')
+        for day, amount in (('2024-01-15', '100.10'), ('2024-02-01', '250.00')):
+            trans = Transaction.objects.create(
+                organization=self.organization,
+                date=day,
+                description='Sale'
+            )
+            TransactionEntry.objects.create(transaction=trans, account=cash, amount=Decimal(amount))
+            TransactionEntry.objects.create(transaction=trans, account=revenue, amount=-Decimal(amount))
+
+    def test_write_parquet(self):
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        output = io.BytesIO()
+        rows = exports.write_ledger(
+            output,
+            exports.ledger_queryset(self.organization),
+            batch_size=3
+        )
+        self.assertEqual(rows, 4)
+
+        output.seek(0)
+        table = pq.read_table(output)
+        self.assertEqual(table.schema.field('amount').type, pa.decimal128(15, 2))
+        self.assertEqual(table.schema.field('date').type, pa.date32())
+        self.assertEqual(sum(table.column('amount').to_pylist()), Decimal('0'))
+        self.assertEqual(table.column('account_code').to_pylist()[:2], ['1000', '4000'])
+
+    def test_write_partitioned(self):
+        import pyarrow.dataset as ds
+
+        with tempfile.TemporaryDirectory() as base_dir:
+            exports.write_partitioned_ledger(
+                base_dir,
+                exports.ledger_queryset(self.organization)
+            )
+            dataset = ds.dataset(base_dir, partitioning='hive')
+            self.assertEqual(dataset.count_rows(), 4)
+            self.assertEqual(
+                dataset.count_rows(filter=ds.field('month') == 2), 2
+            )
+
+@skipUnless(importlib.util.find_spec('pyarrow'), 'pyarrow is not installed')
+class LedgerExportAPITestCase(APITestCase):
+    def setUp(self):
+        owner = User.objects.create_user(username='owner', password='testpass123')
+        self.organization = Organization.objects.create(name='Test Org', slug='test-org', owner=owner)
+        cash = Account.objects.create(
+            organization=self.organization, name='Cash', code='1000', account_type='asset'
+        )
+        revenue = Account.objects.create(
+            organization=self.organization, name='Revenue', code='4000', account_type='income'
+        )
+        trans = Transaction.objects.create(organization=self.organization, date='2024-01-15', description='Sale')
+        TransactionEntry.objects.create(transaction=trans, account=cash, amount=Decimal('100.10'))
+        TransactionEntry.objects.create(transaction=trans, account=revenue, amount=Decimal('-100.10'))
+        owner.organization = self.organization
+        self.client.force_authenticate(user=owner)
+
+    def download(self, export_format):
+        response = self.client.get(
+            reverse('accounting:transaction-export'),
+            {'export_format': export_format, 'end_date': '2024-01-31'}
+        )
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return io.BytesIO(b''.join(response.streaming_content))
+
+    def test_download_parquet(self):
+        import pyarrow.parquet as pq
+
+        table = pq.read_table(self.download('parquet'))
+        self.assertEqual(table.column('account_code').to_pylist(), ['1000', '4000'])
+        self.assertEqual(sum(table.column('amount').to_pylist()), Decimal('0'))
+
+    def test_download_arrow(self):
+        import pyarrow as pa
+
+        table = pa.ipc.open_file(self.download('arrow')).read_all()
+        self.assertEqual(table.num_rows, 2)
+        self.assertEqual(table.column('amount').to_pylist(), [Decimal('100.10'), Decimal('-100.10')])
+
+class LedgerIntegrityTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cash = self.account('Cash', '1000', 'asset')
+        self.revenue = self.account('Revenue', '4000', 'income')
+        for day, amount in (('2024-01-15', '100.10'), ('2024-02-01', '250.00')):
+            trans = Transaction.objects.create(
+                organization=self.organization,
+                date=day,
+                description='Sale',
+                status=Transaction.Status.APPROVED
+            )
+            TransactionEntry.objects.create(transaction=trans, account=self.cash, amount=Decimal(amount))
+            TransactionEntry.objects.create(transaction=trans, account=self.revenue, amount=-Decimal(amount))
+            posting.post_transaction(trans)
+
+    def test_clean_ledger(self):
+        report = integrity.verify_organization(self.organization)
+        self.assertEqual(report['balance_drift'], [])
+        self.assertEqual(report['unbalanced_transactions'], [])
+        self.assertEqual(report['periods'], 2)
+        self.assertEqual(LedgerPeriodChecksum.objects.filter(organization=self.organization).count(), 2)
+
+        # Nothing changed, so nothing is rescanned
+        report = integrity.verify_organization(self.organization)
+        self.assertEqual(report['rescanned_periods'], [])
+
+    def test_balance_drift_and_repair(self):
+        Account.objects.filter(pk=self.cash.pk).update(current_balance=Decimal('1.00'))
+
+        drift = integrity.balance_drift(self.organization)
+        self.assertEqual(len(drift), 1)
+        self.assertEqual(drift[0]['ledger_balance'], Decimal('350.10'))
+
+        integrity.verify_organization(self.organization, repair=True)
+        self.cash.refresh_from_db()
+        self.assertEqual(self.cash.current_balance, Decimal('350.10'))
+        self.assertEqual(integrity.balance_drift(self.organization), [])
+
+    def test_unbalanced_transaction(self):
+        entry = TransactionEntry.objects.filter(account=self.revenue).first()
+        TransactionEntry.objects.filter(pk=entry.pk).update(amount=Decimal('-90.00'))
+
+        unbalanced = integrity.unbalanced_transactions(self.organization)
+        self.assertEqual([row['id'] for row in unbalanced], [entry.transaction_id])
+
+    def test_only_changed_periods_are_rescanned(self):
+        integrity.verify_organization(self.organization)
+        january = LedgerPeriodChecksum.objects.get(organization=self.organization, period='2024-01-01')
+        february = LedgerPeriodChecksum.objects.get(organization=self.organization, period='2024-02-01')
+
+        entry = TransactionEntry.objects.get(account=self.cash, transaction__date='2024-02-01')
+        TransactionEntry.objects.filter(pk=entry.pk).update(amount=Decimal('260.00'))
+
+        report = integrity.verify_organization(self.organization)
+        self.assertEqual([str(period) for period in report['rescanned_periods']], ['2024-02-01'])
+        self.assertEqual([str(period) for period in report['changed_periods']], ['2024-02-01'])
+
+        january_after = LedgerPeriodChecksum.objects.get(pk=january.pk)
+        february_after = LedgerPeriodChecksum.objects.get(pk=february.pk)
+        self.assertEqual(january_after.chain_digest, january.chain_digest)
+        self.assertNotEqual(february_after.chain_digest, february.chain_digest)
+
+class PeriodCloseTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cash = self.account('Cash', '1000', 'asset')
+        self.revenue = self.account('Revenue', '4000', 'income')
+        self.january = self.post('2024-01-15', '100.00')
+        self.february = self.post('2024-02-10', '40.00')
+
+    def post(self, day, amount):
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date=day,
+            description='Sale',
+            status=Transaction.Status.APPROVED
+        )
+        TransactionEntry.objects.create(transaction=trans, account=self.cash, amount=Decimal(amount))
+        TransactionEntry.objects.create(transaction=trans, account=self.revenue, amount=-Decimal(amount))
+        return posting.post_transaction(trans)
+
+    def test_posting_moves_balances_once(self):
+        self.cash.refresh_from_db()
+        self.revenue.refresh_from_db()
+        self.assertEqual(self.cash.current_balance, Decimal('140.00'))
+        self.assertEqual(self.revenue.current_balance, Decimal('-140.00'))
+
+    def test_status_only_changes_through_posting(self):
+        self.assertTrue(TransactionSerializer().fields['status'].read_only)
+
+        self.owner.organization = self.organization
+        view = TransactionViewSet.as_view({'delete': 'destroy'})
+
+        def delete(trans):
+            request = APIRequestFactory().delete('/')
+            force_authenticate(request, user=self.owner)
+            return view(request, pk=trans.pk)
+
+        self.assertEqual(delete(self.january).status_code, status.HTTP_400_BAD_REQUEST)
+        self.assertTrue(Transaction.objects.filter(pk=self.january.pk).exists())
+        self.cash.refresh_from_db()
+        self.assertEqual(self.cash.current_balance, Decimal('140.00'))
+
+        draft = Transaction.objects.create(organization=self.organization, date='2024-02-20', description='Draft')
+        self.assertEqual(delete(draft).status_code, status.HTTP_204_NO_CONTENT)
+
+    def test_close_writes_closing_balances(self):
+        january = periods.close_period(self.organization, '2024-01-31', user=self.owner)
+        self.assertEqual(str(self.organization.books_closed_through), '2024-01-31')
+        self.assertEqual(january.balances.get(account=self.cash).balance, Decimal('100.00'))
+
+        february = periods.close_period(self.organization, '2024-02-29')
+        cash = february.balances.get(account=self.cash)
+        self.assertEqual(cash.balance, Decimal('140.00'))
+        self.assertEqual(cash.period_amount, Decimal('40.00'))
+        self.assertEqual(str(february.period_start), '2024-02-01')
+
+    def test_locked_period_rejects_changes(self):
+        periods.close_period(self.organization, '2024-01-31')
+
+        with self.assertRaises(serializers.ValidationError):
+            posting.check_period_open(self.organization, self.january.date)
+        posting.check_period_open(self.organization, self.february.date)
+
+        draft = Transaction.objects.create(
+            organization=self.organization,
+            date='2024-01-20',
+            description='Late entry',
+            status=Transaction.Status.APPROVED
+        )
+        with self.assertRaises(serializers.ValidationError):
+            posting.post_transaction(draft)
+
+    def test_close_requires_posted_period(self):
+        Transaction.objects.create(
+            organization=self.organization,
+            date='2024-01-20',
+            description='Pending',
+            status=Transaction.Status.DRAFT
+        )
+        with self.assertRaises(serializers.ValidationError):
+            periods.close_period(self.organization, '2024-01-31')
+
+    def test_reports_read_snapshot(self):
+        periods.close_period(self.organization, '2024-01-31')
+        # Changing history behind the lock does not alter the frozen figures
+        TransactionEntry.objects.filter(transaction=self.january).update(amount=Decimal('0'))
+
+        totals = periods.cumulative_totals(self.organization, '2024-01-31')
+        self.assertEqual(totals[self.cash.id], [Decimal('100.00'), Decimal('0')])
+        totals = periods.cumulative_totals(self.organization, '2024-02-28')
+        self.assertEqual(totals[self.cash.id], [Decimal('140.00'), Decimal('0')])
+        totals = periods.period_totals(self.organization, '2024-02-01', '2024-02-28')
+        self.assertEqual(totals[self.revenue.id], [Decimal('0'), Decimal('40.00')])
+
+    def test_reopen_latest_only(self):
+        january = periods.close_period(self.organization, '2024-01-31')
+        february = periods.close_period(self.organization, '2024-02-29')
+
+        with self.assertRaises(serializers.ValidationError):
+            periods.reopen_period(january)
+        self.assertEqual(str(periods.reopen_period(february)), '2024-01-31')
+        self.assertEqual(PeriodClose.objects.filter(organization=self.organization).count(), 1)
+
+class TransactionBatchTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cash = self.account('Cash', '1000', 'asset')
+        self.revenue = self.account('Revenue', '4000', 'income')
+        self.drafts = [self.draft('2024-01-15', amount) for amount in ('10.00', '20.00', '30.00')]
+
+    def draft(self, day, amount, credit=None):
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date=day,
+            description='Sale'
+        )
+        TransactionEntry.objects.create(transaction=trans, account=self.cash, amount=Decimal(amount))
+        TransactionEntry.objects.create(
+            transaction=trans, account=self.revenue, amount=-Decimal(credit or amount)
+        )
+        return trans
+
+    def ids(self):
+        return [trans.pk for trans in self.drafts]
+
+    def test_approve_and_post_in_batch(self):
+        with self.assertNumQueries(5):
+            self.assertEqual(
+                posting.transition_transactions(self.organization, self.ids(), posting.APPROVE, self.owner), 3
+            )
+        self.assertEqual(
+            set(Transaction.objects.values_list('status', 'approved_by')),
+            {(Transaction.Status.APPROVED, self.owner.pk)}
+        )
+
+        posting.transition_transactions(self.organization, self.ids(), posting.POST)
+        self.cash.refresh_from_db()
+        self.revenue.refresh_from_db()
+        self.assertEqual(self.cash.current_balance, Decimal('60.00'))
+        self.assertEqual(self.revenue.current_balance, Decimal('-60.00'))
+
+    def test_batch_is_all_or_nothing(self):
+        unbalanced = self.draft('2024-01-16', '5.00', credit='4.00')
+        with self.assertRaises(serializers.ValidationError) as raised:
+            posting.transition_transactions(self.organization, [*self.ids(), unbalanced.pk], posting.APPROVE)
+        self.assertIn(str(unbalanced.pk), str(raised.exception))
+        self.assertFalse(Transaction.objects.filter(status=Transaction.Status.APPROVED).exists())
+
+        # Drafts cannot be posted, posted transactions cannot be voided
+        with self.assertRaises(serializers.ValidationError):
+            posting.transition_transactions(self.organization, self.ids(), posting.POST)
+        posting.transition_transactions(self.organization, self.ids()[:1], posting.APPROVE)
+        posting.transition_transactions(self.organization, self.ids()[:1], posting.POST)
+        with self.assertRaises(serializers.ValidationError):
+            posting.transition_transactions(self.organization, self.ids(), posting.VOID)
+
+        other = Organization.objects.create(name='Other', slug='other', owner=self.owner)
+        with self.assertRaises(serializers.ValidationError):
+            posting.transition_transactions(other, self.ids(), posting.VOID)
+
+    def test_void_respects_closed_periods(self):
+        self.organization.books_closed_through = date(2024, 1, 31)
+        with self.assertRaises(serializers.ValidationError):
+            posting.transition_transactions(self.organization, self.ids(), posting.VOID)
+        self.organization.books_closed_through = None
+
+        self.assertEqual(posting.transition_transactions(self.organization, self.ids(), posting.VOID), 3)
+        self.assertEqual(
+            set(Transaction.objects.values_list('status', flat=True)), {Transaction.Status.VOID}
+        )
+
+class NestedWriterTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.cash = self.account('Cash', '1000', 'asset')
+        self.revenue = self.account('Revenue', '4000', 'income')
+        self.invoice = Invoice.objects.create(
+            organization=self.organization,
+            number='INV-1',
+            date='2024-01-15',
+            due_date='2024-02-15',
+            party_name='Customer'
+        )
+        write_children(self.invoice, 'items', [
+            {'description': f'Line {n}', 'quantity': Decimal('1'),
+             'unit_price': Decimal('10.00'), 'income_account': self.revenue}
+            for n in range(3)
+        ])
+
+    def test_diff_items(self):
+        first, second, third = self.invoice.items.order_by('id')
+        items = [
+            {'description': 'Line 0', 'quantity': Decimal('1.00'),
+             'unit_price': Decimal('10.00'), 'income_account': self.revenue},
+            {'description': 'Line 1', 'quantity': Decimal('2'),
+             'unit_price': Decimal('10.00'), 'income_account': self.revenue},
+            {'description': 'New line', 'quantity': Decimal('1'),
+             'unit_price': Decimal('5.00'), 'income_account': self.revenue},
+        ]
+        raw = [{'id': first.id}, {'id': str(second.id)}, {}]
+
+        changes = write_children(self.invoice, 'items', items, raw)
+
+        self.assertEqual(changes, {'created': 1, 'updated': 1, 'deleted': 1})
+        self.assertFalse(InvoiceItem.objects.filter(pk=third.pk).exists())
+        second.refresh_from_db()
+        self.assertEqual(second.quantity, Decimal('2'))
+        self.assertEqual(self.invoice.items.count(), 3)
+
+    def test_foreign_item_rejected(self):
+        other = Invoice.objects.create(
+            organization=self.organization,
+            number='INV-2',
+            date='2024-01-15',
+            due_date='2024-02-15',
+            party_name='Customer'
+        )
+        write_children(other, 'items', [
+            {'description': 'Other', 'quantity': Decimal('1'),
+             'unit_price': Decimal('1.00'), 'income_account': self.revenue}
+        ])
+        item = other.items.get()
+        with self.assertRaises(serializers.ValidationError):
+            write_children(self.invoice, 'items', [
+                {'description': 'Stolen', 'quantity': Decimal('1'),
+                 'unit_price': Decimal('1.00'), 'income_account': self.revenue}
+            ], [{'id': item.id}])
+
+    def test_posted_entries_adjust_balances(self):
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date='2024-01-15',
+            description='Sale',
+            status=Transaction.Status.APPROVED
+        )
+        posting.write_entries(trans, [
+            {'account': self.cash, 'amount': Decimal('100.00')},
+            {'account': self.revenue, 'amount': Decimal('-100.00')},
+        ])
+        posting.post_transaction(trans)
+        cash, revenue = trans.entries.order_by('id')
+
+        posting.write_entries(trans, [
+            {'account': self.cash, 'amount': Decimal('120.00')},
+            {'account': self.revenue, 'amount': Decimal('-100.00')},
+            {'account': self.revenue, 'amount': Decimal('-20.00')},
+        ], [{'id': cash.id}, {'id': revenue.id}, {}])
+
+        self.cash.refresh_from_db()
+        self.revenue.refresh_from_db()
+        self.assertEqual(self.cash.current_balance, Decimal('120.00'))
+        self.assertEqual(self.revenue.current_balance, Decimal('-120.00'))
+        self.assertEqual(integrity.balance_drift(self.organization), [])
+
+class MoneyTestCase(TestCase):
+    def test_rounding_is_half_to_even(self):
+        self.assertEqual(list(money.divide(np.array([5, 15, 25, -5, -15, 26]), 10)), [0, 2, 2, 0, -2, 3])
+        self.assertEqual(money.quantize(Decimal('0.125')), Decimal('0.12'))
+        self.assertEqual(money.cents(Decimal('0.135')), 14)
+        self.assertEqual(list(money.percent(money.to_cents(['0.25', '0.35']), money.basis_points(['10', '10']))), [2, 4])
+
+    def test_allocation_adds_up(self):
+        self.assertEqual(list(money.allocate(100, [1, 1, 1])), [34, 33, 33])
+        self.assertEqual(list(money.allocate(-100, [1, 1, 1])), [-34, -33, -33])
+        self.assertEqual(list(money.allocate(1000, [5000, 3000, 2000])), [500, 300, 200])
+        self.assertEqual(list(money.allocate(5, [0, 0])), [3, 2])
+        parts = money.allocate(10 ** 17 + 1, [3333, 3333, 3334])
+        self.assertEqual(int(parts.sum()), 10 ** 17 + 1)
+        with self.assertRaises(ValueError):
+            money.allocate(100, [1, -1])
+
+    def test_line_amounts_match_single_items(self):
+        lines = [
+            ('3', '33.33', '10', '21'),
+            ('1', '0.25', '0', '10'),
+            ('2.5', '19.99', '12.5', '7'),
+            ('9999999.99', '99999999.99', '0', '21'),
+        ]
+        amounts, taxes = money.line_amounts(*zip(*[[Decimal(value) for value in line] for line in lines]))
+        for line, amount, tax in zip(lines, amounts, taxes):
+            item = InvoiceItem(
+                quantity=Decimal(line[0]),
+                unit_price=Decimal(line[1]),
+                discount_rate=Decimal(line[2]),
+                tax_rate=Decimal(line[3])
+            )
+            item.compute_amounts()
+            self.assertEqual((item.amount, item.tax_amount), (money.from_cents(amount), money.from_cents(tax)))
+
+    def test_sum_by(self):
+        self.assertEqual(money.sum_by([3, 1, 3, 2], [100, 200, 50, 0]), {1: 200, 3: 150})
+
+class InvoiceAmountTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.revenue = self.account('Revenue', '4000', 'income')
+        self.invoice = Invoice.objects.create(
+            organization=self.organization,
+            number='INV-1',
+            date='2024-01-15',
+            due_date='2024-02-15',
+            party_name='Customer'
+        )
+
+    def test_amounts_are_stored(self):
+        item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description='Consulting',
+            quantity=Decimal('3'),
+            unit_price=Decimal('33.33'),
+            discount_rate=Decimal('10'),
+            tax_rate=Decimal('21'),
+            income_account=self.revenue
+        )
+        self.assertEqual(item.amount, Decimal('89.99'))
+        self.assertEqual(item.tax_amount, Decimal('18.90'))
+
+        item.quantity = Decimal('1')
+        item.save(update_fields=['quantity'])
+        item.refresh_from_db()
+        self.assertEqual(item.amount, Decimal('30.00'))
+
+    def test_bulk_writes_and_totals(self):
+        InvoiceItem.objects.bulk_create([
+            InvoiceItem(
+                invoice=self.invoice,
+                description=f'Line {n}',
+                quantity=Decimal('1'),
+                unit_price=Decimal('10.00'),
+                tax_rate=Decimal('10'),
+                income_account=self.revenue
+            )
+            for n in range(2)
+        ])
+        items = list(self.invoice.items.all())
+        items[0].quantity = Decimal('2')
+        InvoiceItem.objects.bulk_update(items, ['quantity'])
+
+        self.invoice.calculate_totals()
+        self.assertEqual(self.invoice.subtotal, Decimal('30.00'))
+        self.assertEqual(self.invoice.tax_amount, Decimal('3.00'))
+        self.assertEqual(self.invoice.total, Decimal('33.00'))
+        self.assertEqual(
+            InvoiceItem.objects.filter(amount__gt=15).count(), 1
+        )
+
+    def test_half_up_backfill_is_recomputed(self):
+        item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description='Sample',
+            quantity=Decimal('0.50'),
+            unit_price=Decimal('0.05'),
+            income_account=self.revenue
+        )
+        self.assertEqual(item.amount, Decimal('0.02'))
+        # What 0005 stored for the same line
+        InvoiceItem.objects.filter(pk=item.pk).update(amount=Decimal('0.03'))
+        Invoice.objects.filter(pk=self.invoice.pk).update(subtotal=Decimal('0.03'), total=Decimal('0.03'))
+
+        migration = importlib.import_module('accounting.migrations.0019_invoiceitem_half_even_amounts')
+        migration.recompute_amounts(django_apps, None)
+        item.refresh_from_db()
+        self.invoice.refresh_from_db()
+        self.assertEqual(item.amount, Decimal('0.02'))
+        self.assertEqual(self.invoice.total, Decimal('0.02'))
+
+    def test_amount_filters_need_numbers(self):
+        self.invoice.total = Decimal('50.00')
+        self.invoice.save()
+        self.owner.organization = self.organization
+        view = InvoiceViewSet.as_view({'get': 'list'})
+
+        def get(params):
+            request = APIRequestFactory().get('/', params)
+            force_authenticate(request, user=self.owner)
+            return view(request)
+
+        for value in ('abc', 'NaN', 'Infinity'):
+            response = get({'min_outstanding': value})
+            self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST, value)
+            self.assertIn('min_outstanding', response.data)
+        self.assertEqual(len(get({'min_total': '40', 'max_total': '50.00'}).data), 1)
+        self.assertEqual(len(get({'min_total': '50.01'}).data), 0)
+
+class RecurringEngineTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.revenue = self.account('Revenue', '4000', 'income')
+        self.template = RecurringInvoice.objects.create(
+            organization=self.organization,
+            name='Hosting',
+            start_date=date(2024, 1, 31),
+            next_date=date(2024, 1, 31),
+            frequency=RecurringInvoice.Frequency.MONTHLY,
+            party_name='Customer'
+        )
+        RecurringInvoiceItem.objects.create(
+            recurring_invoice=self.template,
+            description='Hosting',
+            quantity=Decimal('1'),
+            unit_price=Decimal('50.00'),
+            tax_rate=Decimal('10'),
+            income_account=self.revenue
+        )
+
+    def test_next_occurrence_keeps_month_end(self):
+        monthly = RecurringInvoice.Frequency.MONTHLY
+        self.assertEqual(recurring.next_occurrence(date(2024, 1, 31), monthly, 31), date(2024, 2, 29))
+        self.assertEqual(recurring.next_occurrence(date(2024, 2, 29), monthly, 31), date(2024, 3, 31))
+        yearly = RecurringInvoice.Frequency.YEARLY
+        self.assertEqual(recurring.next_occurrence(date(2024, 2, 29), yearly, 29), date(2025, 2, 28))
+
+    def test_catch_up_generation(self):
+        invoice_ids = recurring.generate_due_invoices(today=date(2024, 4, 15))
+
+        self.assertEqual(len(invoice_ids), 3)
+        invoices = Invoice.objects.filter(pk__in=invoice_ids).order_by('date')
+        self.assertEqual(
+            [invoice.date for invoice in invoices],
+            [date(2024, 1, 31), date(2024, 2, 29), date(2024, 3, 31)]
+        )
+        self.assertEqual(
+            [invoice.number for invoice in invoices],
+            ['INV-000001', 'INV-000002', 'INV-000003']
+        )
+        self.assertEqual(invoices[0].total, Decimal('55.00'))
+        self.assertEqual(invoices[0].items.get().amount, Decimal('50.00'))
+
+        self.template.refresh_from_db()
+        self.assertEqual(self.template.next_date, date(2024, 4, 30))
+        # Running again the same day generates nothing
+        self.assertEqual(recurring.generate_due_invoices(today=date(2024, 4, 15)), [])
+
+    def test_end_date_limits_occurrences(self):
+        self.template.end_date = date(2024, 2, 29)
+        self.template.save()
+
+        self.assertEqual(len(recurring.generate_due_invoices(today=date(2024, 6, 1))), 2)
+
+class RecurringJournalTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.rent = self.account('Rent', '6000', 'expense')
+        self.bank = self.account('Bank', '1000', 'asset')
+        self.source = self.journal(date(2024, 1, 31), Transaction.Status.APPROVED)
+        posting.post_transaction(self.source)
+
+    def journal(self, day, status, **kwargs):
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date=day,
+            description='Office rent',
+            status=status,
+            is_recurring=True,
+            recurrence_type=Transaction.RecurrenceType.MONTHLY,
+            **kwargs
+        )
+        TransactionEntry.objects.create(transaction=trans, account=self.rent, amount=Decimal('100.00'))
+        TransactionEntry.objects.create(transaction=trans, account=self.bank, amount=Decimal('-100.00'))
+        return trans
+
+    def test_catches_up_missed_periods_once(self):
+        self.assertEqual(self.source.next_recurrence_date, date(2024, 2, 29))
+
+        created = recurring_journals.generate_due_journals(today=date(2024, 4, 30))
+
+        copies = Transaction.objects.filter(pk__in=created).order_by('date')
+        self.assertEqual([copy.date for copy in copies], [date(2024, 2, 29), date(2024, 3, 31), date(2024, 4, 30)])
+        self.assertTrue(all(copy.status == Transaction.Status.POSTED for copy in copies))
+        self.assertEqual(set(copies.values_list('recurrence_source', flat=True)), {self.source.pk})
+        self.assertEqual(TransactionEntry.objects.filter(transaction__in=copies).count(), 6)
+        self.rent.refresh_from_db()
+        self.assertEqual(self.rent.current_balance, Decimal('400.00'))
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.next_recurrence_date, date(2024, 5, 31))
+
+        self.assertEqual(recurring_journals.generate_due_journals(today=date(2024, 4, 30)), [])
+
+    def test_end_date_drafts_and_closed_periods(self):
+        self.source.recurrence_end_date = date(2024, 3, 15)
+        self.source.save(update_fields=['recurrence_end_date'])
+        self.journal(date(2024, 1, 31), Transaction.Status.DRAFT)
+        self.organization.books_closed_through = date(2024, 2, 29)
+        self.organization.save()
+
+        created = recurring_journals.generate_due_journals(today=date(2024, 6, 30))
+
+        # February is closed and March 31 is past the end date
+        self.assertEqual(list(Transaction.objects.filter(pk__in=created).values_list('date', flat=True)), [])
+        self.assertEqual(recurring_journals.due_journals(date(2024, 6, 30)).count(), 0)
+
+        self.source.recurrence_end_date = None
+        self.source.save(update_fields=['recurrence_end_date'])
+        created = recurring_journals.generate_due_journals(today=date(2024, 4, 30))
+        self.assertEqual(
+            list(Transaction.objects.filter(pk__in=created).order_by('date').values_list('date', flat=True)),
+            [date(2024, 3, 31), date(2024, 4, 30)]
+        )
+
+    def test_schedule_follows_edits_but_not_stale_saves(self):
+        stale = Transaction.objects.get(pk=self.source.pk)
+        recurring_journals.generate_due_journals(today=date(2024, 2, 29))
+
+        stale.description = 'Office rent, HQ'
+        stale.save(update_fields=['description'])
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.next_recurrence_date, date(2024, 3, 31))
+
+        self.source.date = date(2024, 1, 15)
+        self.source.save(update_fields=['date'])
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.next_recurrence_date, date(2024, 2, 15))
+
+        self.source.recurrence_type = Transaction.RecurrenceType.QUARTERLY
+        self.source.save()
+        self.source.refresh_from_db()
+        self.assertEqual(self.source.next_recurrence_date, date(2024, 4, 15))
+
+class ReversalTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.expense = self.account('Utilities', '6200', 'expense')
+        self.accrued = self.account('Accrued liabilities', '2100', 'liability')
+        self.accruals = [self.accrual(amount) for amount in ('100.00', '200.00', '300.00')]
+
+    def accrual(self, amount, **kwargs):
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date=date(2024, 1, 31),
+            description='Accrued utilities',
+            status=Transaction.Status.APPROVED,
+            reverse_on=date(2024, 2, 1),
+            **kwargs
+        )
+        TransactionEntry.objects.create(transaction=trans, account=self.expense, amount=Decimal(amount))
+        TransactionEntry.objects.create(transaction=trans, account=self.accrued, amount=-Decimal(amount))
+        return posting.post_transaction(trans)
+
+    def test_reverses_due_transactions_in_one_batch(self):
+        self.assertEqual(reversals.reverse_due_transactions(today=date(2024, 1, 31)), [])
+
+        # Ids, sources, their entries, two inserts and one balance update (plus savepoints)
+        with self.assertNumQueries(10):
+            created = reversals.reverse_due_transactions(today=date(2024, 2, 1))
+
+        self.assertEqual(len(created), 3)
+        reversal = Transaction.objects.get(reversal_of=self.accruals[0])
+        self.assertEqual(reversal.date, date(2024, 2, 1))
+        self.assertEqual(reversal.status, Transaction.Status.POSTED)
+        self.assertIn('reversal', reversal.tags)
+        self.assertEqual(
+            sorted(reversal.entries.values_list('account', 'amount')),
+            sorted([(self.expense.pk, Decimal('-100.00')), (self.accrued.pk, Decimal('100.00'))])
+        )
+        self.expense.refresh_from_db()
+        self.accrued.refresh_from_db()
+        self.assertEqual(self.expense.current_balance, Decimal('0'))
+        self.assertEqual(self.accrued.current_balance, Decimal('0'))
+
+        self.assertEqual(reversals.reverse_due_transactions(today=date(2024, 3, 1)), [])
+
+    def test_closed_periods_and_recurring_accruals(self):
+        self.organization.books_closed_through = date(2024, 2, 29)
+        self.organization.save()
+        self.assertEqual(reversals.reverse_due_transactions(today=date(2024, 3, 1)), [])
+        self.organization.books_closed_through = None
+        self.organization.save()
+
+        monthly = self.accrual(
+            '50.00', is_recurring=True, recurrence_type=Transaction.RecurrenceType.MONTHLY
+        )
+        copies = recurring_journals.generate_due_journals(today=date(2024, 2, 29))
+        self.assertEqual(Transaction.objects.get(pk__in=copies).reverse_on, date(2024, 3, 1))
+
+        created = reversals.reverse_due_transactions(today=date(2024, 3, 1))
+        self.assertEqual(len(created), 5)
+        self.assertTrue(Transaction.objects.filter(reversal_of=monthly).exists())
+
+class NumberingTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def test_block_reservation(self):
+        first = numbering.reserve_invoice_numbers(self.organization, 3)
+        second = numbering.reserve_invoice_numbers(self.organization, 2)
+        self.assertEqual(first, ['INV-000001', 'INV-000002', 'INV-000003'])
+        self.assertEqual(second, ['INV-000004', 'INV-000005'])
+        self.assertEqual(
+            NumberSequence.objects.get(organization=self.organization).next_value, 6
+        )
+
+    def test_continues_existing_numbers(self):
+        Invoice.objects.create(
+            organization=self.organization,
+            number='INV-000041',
+            date='2024-01-15',
+            due_date='2024-02-15',
+            party_name='Customer'
+        )
+        self.assertEqual(numbering.next_invoice_number(self.organization), 'INV-000042')
+
+    def test_pattern_and_series(self):
+        NumberSequence.objects.create(
+            organization=self.organization,
+            series='credit_note',
+            prefix='CN',
+            pattern='{prefix}/{year}/{number:04d}'
+        )
+        number = numbering.next_invoice_number(
+            self.organization, series='credit_note', on=date(2024, 3, 1)
+        )
+        self.assertEqual(number, 'CN/2024/0001')
+
+    def test_patterns_only_use_bare_placeholders(self):
+        for pattern in ('{prefix}{number:06d}', '{year}-{month:02}-{number}', '{number:>8}', 'No. {number}'):
+            NumberSequence.check_pattern(pattern)
+        for pattern in (
+            '{number.real.x}', '{number[0]}', '{number!r}', '{other}', '{}', '{0}',
+            '{number:>999999999}', '{number:{year}}', '{number:,}', '{number:021d}',
+        ):
+            with self.assertRaises(ValueError, msg=pattern):
+                NumberSequence.check_pattern(pattern)
+
+    def test_serializer_rejects_unsafe_patterns_and_moving_back(self):
+        sequence = numbering.get_sequence(self.organization)
+        numbering.reserve_invoice_numbers(self.organization, 5)
+        sequence.refresh_from_db()
+
+        for data in (
+            {'pattern': '{number.real.x}'},
+            {'pattern': '{number:>999999999}'},
+            {'prefix': 'X' * 20, 'pattern': '{prefix}{prefix}{number:020d}'},
+            {'next_value': 3},
+        ):
+            serializer = NumberSequenceSerializer(sequence, data=data, partial=True)
+            self.assertFalse(serializer.is_valid(), data)
+
+        serializer = NumberSequenceSerializer(
+            sequence, data={'pattern': '{prefix}{year}-{number:04d}', 'next_value': 6}, partial=True
+        )
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+
+class PaymentApplicationTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = self.account('Bank', '1010', 'asset')
+        self.invoices = [
+            Invoice.objects.create(
+                organization=self.organization,
+                number=f'INV-{n}',
+                date='2024-01-15',
+                due_date='2024-02-15',
+                party_name='Customer',
+                status=Invoice.Status.SENT,
+                total=Decimal('100.00')
+            )
+            for n in range(2)
+        ]
+
+    def payment(self, amount, status=Payment.Status.COMPLETED):
+        return Payment.objects.create(
+            organization=self.organization,
+            invoice=self.invoices[0],
+            date='2024-01-20',
+            amount=Decimal(amount),
+            method=Payment.Method.BANK_TRANSFER,
+            status=status,
+            bank_account=self.bank
+        )
+
+    def test_split_payment(self):
+        payment = self.payment('150.00')
+        payments.apply_payment(payment, [
+            (self.invoices[0], Decimal('100.00')),
+            (self.invoices[1].pk, Decimal('50.00')),
+        ])
+
+        first, second = (Invoice.objects.get(pk=invoice.pk) for invoice in self.invoices)
+        self.assertEqual(first.amount_paid, Decimal('100.00'))
+        self.assertEqual(first.status, Invoice.Status.PAID)
+        self.assertEqual(second.amount_paid, Decimal('50.00'))
+        self.assertEqual(second.status, Invoice.Status.PARTIALLY_PAID)
+
+        payments.set_payment_status(payment, Payment.Status.VOIDED)
+        first.refresh_from_db()
+        self.assertEqual(first.amount_paid, Decimal('0.00'))
+        self.assertEqual(first.status, Invoice.Status.SENT)
+
+    def test_overpayment_rejected(self):
+        payments.apply_payment(self.payment('80.00'))
+        with self.assertRaises(serializers.ValidationError):
+            payments.apply_payment(self.payment('30.00'))
+
+    def test_applied_amount_cannot_change(self):
+        payment = self.payment('100.00')
+        payments.apply_payment(payment)
+        data = {'amount': '60.00', 'method': Payment.Method.BANK_TRANSFER, 'reference': 'Wire 1'}
+
+        self.assertFalse(PaymentSerializer(payment, data=data, partial=True).is_valid())
+        serializer = PaymentSerializer(payment, data={**data, 'amount': '100.00'}, partial=True)
+        self.assertTrue(serializer.is_valid(), serializer.errors)
+        serializer.save()
+        self.assertEqual(Invoice.objects.get(pk=self.invoices[0].pk).amount_paid, Decimal('100.00'))
+
+    def test_remittance_batch(self):
+        rows = [
+            {'date': '2024-01-20', 'invoice_number': 'INV-0', 'amount': '60.00', 'bank_account': '1010'},
+            {'date': '2024-01-21', 'invoice_number': 'INV-0', 'amount': '40.00', 'bank_account': '1010'},
+            {'date': '2024-01-21', 'invoice_number': 'INV-0', 'amount': '1.00', 'bank_account': '1010'},
+            {'date': '2024-01-21', 'invoice_number': 'INV-9', 'amount': '1.00', 'bank_account': '1010'},
+            {'date': '2024-01-21', 'invoice_number': 'INV-1', 'amount': '25.00', 'bank_account': '1010', 'method': 'cash'},
+            {'date': '2024-01-22', 'invoice_number': 'INV-1', 'amount': '5.00', 'bank_account': '1010', 'method': 'barter'},
+        ]
+        created, errors = payments.apply_remittance(self.organization, rows)
+
+        self.assertEqual(len(created), 3)
+        self.assertEqual([error['row'] for error in errors], [3, 4, 6])
+        self.assertEqual(created[2].method, Payment.Method.CASH)
+        self.assertEqual(PaymentAllocation.objects.count(), 3)
+        first, second = (Invoice.objects.get(pk=invoice.pk) for invoice in self.invoices)
+        self.assertEqual(first.status, Invoice.Status.PAID)
+        self.assertEqual(second.amount_paid, Decimal('25.00'))
+
+
+class ReconciliationTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = self.account('Bank', '1010', 'asset')
+        self.revenue = self.account('Revenue', '4000', 'income')
+        self.entries = [
+            self.deposit(day, amount, reference)
+            for day, amount, reference in (
+                ('2024-03-01', '100.00', 'CHK-1'),
+                ('2024-03-02', '100.00', ''),
+                ('2024-03-05', '40.00', ''),
+                ('2024-03-05', '60.00', ''),
+                ('2024-03-10', '75.00', ''),
+            )
+        ]
+
+    def deposit(self, day, amount, reference=''):
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date=day,
+            description='Deposit',
+            reference=reference,
+            status=Transaction.Status.APPROVED
+        )
+        entry = TransactionEntry.objects.create(transaction=trans, account=self.bank, amount=Decimal(amount))
+        TransactionEntry.objects.create(transaction=trans, account=self.revenue, amount=-Decimal(amount))
+        posting.post_transaction(trans)
+        return entry
+
+    def test_match_passes(self):
+        lines = [
+            {'date': '2024-03-03', 'amount': '100.00', 'reference': 'chk 1'},
+            {'date': '2024-03-03', 'amount': '100.00'},
+            {'date': '2024-03-06', 'amount': '100.00'},
+            {'date': '2024-03-10', 'amount': '30.00'},
+            {'date': '2024-03-10', 'amount': '45.00'},
+            {'date': '2024-04-30', 'amount': '12.00'},
+            {'date': 'not a date', 'amount': '1.00'},
+        ]
+        result = reconciliation.reconcile_statement(self.bank, lines, date(2024, 3, 31))
+
+        rules = {match['rule']: match for match in result['matches']}
+        self.assertEqual(rules['reference']['entries'], (self.entries[0].pk,))
+        self.assertEqual(rules['amount']['entries'], (self.entries[1].pk,))
+        by_lines = {match['lines']: match for match in result['matches']}
+        self.assertEqual(set(by_lines[(2,)]['entries']), {self.entries[2].pk, self.entries[3].pk})
+        self.assertEqual(by_lines[(3, 4)]['entries'], (self.entries[4].pk,))
+        self.assertEqual(result['unmatched_lines'], [5])
+        self.assertEqual(len(result['errors']), 1)
+        self.assertEqual(result['reconciled'], 5)
+        self.assertFalse(TransactionEntry.objects.filter(account=self.bank, reconciled=False).exists())
+        self.assertEqual(
+            set(TransactionEntry.objects.filter(account=self.bank).values_list('reconciled_date', flat=True)),
+            {date(2024, 3, 31)}
+        )
+
+        # Reconciled entries are not matched again
+        again = reconciliation.reconcile_statement(self.bank, lines[:1], date(2024, 3, 31))
+        self.assertEqual(again['matches'], [])
+
+    def test_date_window(self):
+        lines = [{'date': '2024-03-20', 'amount': '75.00'}]
+        result = reconciliation.reconcile_statement(self.bank, lines, confirm=False)
+        self.assertEqual(result['matches'], [])
+        result = reconciliation.reconcile_statement(self.bank, lines, date_window=10, confirm=False)
+        self.assertEqual(result['matches'][0]['entries'], (self.entries[4].pk,))
+        self.assertEqual(result['reconciled'], 0)
+
+    def test_malformed_input_is_rejected(self):
+        lines, errors = reconciliation.parse_statement([
+            {'date': '2024-03-03', 'amount': amount}
+            for amount in ('NaN', 'Infinity', '-inf', 'sNaN', '1e999999999', 'abc', '10.00')
+        ])
+        self.assertEqual([line.amount for line in lines], [1000])
+        self.assertEqual([error['line'] for error in errors], [0, 1, 2, 3, 4, 5])
+
+        self.owner.organization = self.organization
+        view = AccountReconciliationView.as_view()
+
+        def post(data):
+            request = APIRequestFactory().post('/', data, format='json')
+            force_authenticate(request, user=self.owner)
+            return view(request, pk=self.bank.pk)
+
+        for data in (
+            {'statement_balance': 'NaN'},
+            {'statement_lines': ['2024-03-03;100.00']},
+            {'reconciled_items': ['abc']},
+            {'reconciled_items': [{'entry_id': '1.5'}]},
+            {'reconciled_items': [{'id': self.entries[0].pk}]},
+        ):
+            self.assertEqual(post(data).status_code, status.HTTP_400_BAD_REQUEST, data)
+        response = post({'statement_date': '2024-03-31', 'reconciled_items': [str(self.entries[0].pk)]})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['reconciled'], 1)
+
+    def test_hand_picked_entries_must_be_posted(self):
+        draft = Transaction.objects.create(
+            organization=self.organization,
+            date='2024-03-04',
+            description='Deposit',
+            status=Transaction.Status.DRAFT
+        )
+        entry = TransactionEntry.objects.create(transaction=draft, account=self.bank, amount=Decimal('10.00'))
+        TransactionEntry.objects.create(transaction=draft, account=self.revenue, amount=Decimal('-10.00'))
+
+        result = reconciliation.reconcile_statement(
+            self.bank, [], date(2024, 3, 31), entry_ids=[entry.pk, self.entries[0].pk]
+        )
+        self.assertEqual(result['reconciled'], 1)
+        entry.refresh_from_db()
+        self.assertFalse(entry.reconciled)
+
+    def test_large_statement(self):
+        entries = [
+            reconciliation.Candidate(n, 738000 + n % 300, 1000 + n % 5000, '')
+            for n in range(50000)
+        ]
+        lines, _errors = reconciliation.parse_statement([
+            {'date': date.fromordinal(738000 + n % 300 + 1).isoformat(), 'amount': f'{(1000 + n % 5000) / 100:.2f}'}
+            for n in range(50000)
+        ])
+        matches, unmatched = reconciliation.match_statement(lines, entries)
+        self.assertEqual(len(matches), 50000)
+        self.assertEqual(unmatched, [])
+
+
+@override_settings(CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}})
+class PartyTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+
+    def invoice(self, number, party_name, tax_id='', total='100.00', type=Invoice.Type.SALE,
+                status=Invoice.Status.SENT, due_date='2024-02-15', **kwargs):
+        return Invoice.objects.create(
+            organization=self.organization,
+            number=number,
+            type=type,
+            date='2024-01-15',
+            due_date=due_date,
+            party_name=party_name,
+            party_tax_id=tax_id,
+            status=status,
+            total=Decimal(total),
+            **kwargs
+        )
+
+    def test_backfill_dedups(self):
+        self.invoice('INV-1', 'Acme Corp', 'B-123.45')
+        self.invoice('INV-2', 'ACME Corporation', 'b12345')
+        self.invoice('INV-3', '  acme   corp ')
+        self.invoice('INV-4', 'Acme corp')
+        self.invoice('BILL-1', 'Acme corp', type=Invoice.Type.PURCHASE)
+        other = Organization.objects.create(name='Other', slug='other', owner=self.owner)
+        Invoice.objects.create(
+            organization=other, number='INV-1', date='2024-01-15',
+            due_date='2024-02-15', party_name='Acme Corp'
+        )
+
+        call_command('backfill_parties', '--organization', 'test-org', stdout=io.StringIO())
+
+        self.assertEqual(Party.objects.filter(organization=self.organization).count(), 2)
+        self.assertFalse(Party.objects.filter(organization=other).exists())
+        by_number = dict(Invoice.objects.filter(organization=self.organization).values_list('number', 'party__match_key'))
+        self.assertEqual(by_number['INV-1'], 'tax:B12345')
+        self.assertEqual(by_number['INV-2'], 'tax:B12345')
+        self.assertEqual(by_number['INV-3'], 'name:acme corp')
+        self.assertEqual(by_number['BILL-1'], 'name:acme corp')
+        self.assertEqual(Party.objects.get(match_key='name:acme corp').type, Party.Type.BOTH)
+
+        # Running again changes nothing
+        result = parties.backfill_parties(self.organization)
+        self.assertEqual(result, {'parties': 0, 'invoices': 0, 'recurring_invoices': 0})
+
+    def test_balances(self):
+        acme = Party.objects.create(organization=self.organization, name='Acme')
+        supplier = Party.objects.create(
+            organization=self.organization, name='Supplier', type=Party.Type.VENDOR
+        )
+        self.invoice('INV-1', 'Acme', party=acme, total='100.00', due_date='2024-01-20', amount_paid=Decimal('30.00'))
+        self.invoice('INV-2', 'Acme', party=acme, total='50.00', due_date='2999-01-01')
+        self.invoice('CN-1', 'Acme', party=acme, total='20.00', type=Invoice.Type.CREDIT_NOTE)
+        self.invoice('INV-3', 'Acme', party=acme, total='500.00', status=Invoice.Status.PAID)
+        self.invoice('BILL-1', 'Supplier', party=supplier, total='80.00', type=Invoice.Type.PURCHASE)
+
+        balances = parties.party_balances(self.organization, as_of=date(2024, 6, 1))
+        self.assertEqual(balances[acme.pk]['receivable'], Decimal('100.00'))
+        self.assertEqual(balances[acme.pk]['overdue'], Decimal('70.00'))
+        self.assertEqual(balances[acme.pk]['open_invoices'], 3)
+        self.assertEqual(balances[supplier.pk]['payable'], Decimal('80.00'))
+        self.assertEqual(balances[supplier.pk]['receivable'], Decimal('0'))
+
+        summary = parties.open_balance_summary(self.organization)
+        self.assertEqual([row['name'] for row in summary], ['Acme', 'Supplier'])
+        with self.assertNumQueries(1):
+            self.assertEqual(parties.open_balance_summary(self.organization), summary)
+
+        # A change to any invoice is picked up by the next read
+        self.invoice('INV-4', 'Acme', party=acme, total='10.00')
+        summary = parties.open_balance_summary(self.organization)
+        self.assertEqual(summary[0]['receivable'], Decimal('110.00'))
+
+    def test_resolve_party(self):
+        party = parties.resolve_party(self.organization, {'party_name': 'New Co', 'party_tax_id': ''})
+        self.assertEqual(party.name, 'New Co')
+        self.assertEqual(parties.resolve_party(self.organization, {'party_name': 'new  co'}), party)
+        other = Organization.objects.create(name='Other', slug='other', owner=self.owner)
+        foreign = Party.objects.create(organization=other, name='Foreign')
+        with self.assertRaises(serializers.ValidationError):
+            parties.resolve_party(self.organization, {'party': foreign, 'party_name': 'Foreign'})
+        self.assertEqual(list(parties.search_parties(self.organization, 'new')), [party])
+
+    def test_updates_cannot_link_other_organizations_parties(self):
+        acme = Party.objects.create(organization=self.organization, name='Acme')
+        invoice = self.invoice('INV-1', 'Acme', party=acme)
+        template = RecurringInvoice.objects.create(
+            organization=self.organization,
+            name='Hosting',
+            start_date=date(2024, 1, 31),
+            next_date=date(2024, 1, 31),
+            frequency=RecurringInvoice.Frequency.MONTHLY,
+            party_name='Acme',
+            party=acme
+        )
+        other = Organization.objects.create(name='Other', slug='other', owner=self.owner)
+        foreign = Party.objects.create(organization=other, name='Foreign')
+
+        for serializer_class, instance in ((InvoiceSerializer, invoice), (RecurringInvoiceSerializer, template)):
+            with self.assertRaises(serializers.ValidationError):
+                serializer_class(instance).update(instance, {'party': foreign})
+            instance.refresh_from_db()
+            self.assertEqual(instance.party, acme)
+
+        # New details are matched to a party of the invoice's organization
+        InvoiceSerializer(invoice).update(invoice, {'party_name': 'Globex'})
+        invoice.refresh_from_db()
+        self.assertEqual((invoice.party.name, invoice.party.organization), ('Globex', self.organization))
+
+
+class CustomerStatementTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = self.account('Bank', '1010', 'asset')
+        self.acme = Party.objects.create(organization=self.organization, name='Acme')
+        self.globex = Party.objects.create(organization=self.organization, name='Globex')
+        Party.objects.create(organization=self.organization, name='Idle')
+
+        old = self.invoice('INV-1', self.acme, '2024-01-10', '100.00')
+        self.invoice('INV-2', self.acme, '2024-02-05', '250.00')
+        self.invoice('CN-1', self.acme, '2024-02-07', '50.00', type=Invoice.Type.CREDIT_NOTE)
+        self.invoice('INV-3', self.acme, '2024-02-08', '999.00', status=Invoice.Status.VOID)
+        globex_invoice = self.invoice('INV-4', self.globex, '2024-02-20', '80.00')
+        self.pay(old, '2024-01-20', '60.00')
+        self.pay(old, '2024-02-10', '40.00')
+        self.pay(globex_invoice, '2024-03-02', '80.00')
+
+    def invoice(self, number, party, day, total, type=Invoice.Type.SALE, status=Invoice.Status.SENT):
+        return Invoice.objects.create(
+            organization=self.organization,
+            number=number,
+            type=type,
+            date=day,
+            due_date=day,
+            party=party,
+            party_name=party.name,
+            status=status,
+            total=Decimal(total)
+        )
+
+    def pay(self, invoice, day, amount):
+        payment = Payment.objects.create(
+            organization=self.organization,
+            invoice=invoice,
+            date=day,
+            amount=Decimal(amount),
+            method=Payment.Method.BANK_TRANSFER,
+            status=Payment.Status.COMPLETED,
+            reference=f'PAY-{day}',
+            bank_account=self.bank
+        )
+        payments.apply_payment(payment)
+
+    def test_compute_statements(self):
+        with self.assertNumQueries(5):
+            result = statements.compute_statements(self.organization, date(2024, 2, 1), date(2024, 2, 29))
+
+        self.assertEqual([s['party']['name'] for s in result], ['Acme', 'Globex'])
+        acme, globex = result
+        self.assertEqual(acme['opening_balance'], Decimal('40.00'))
+        self.assertEqual(
+            [(line['reference'], line['debit'], line['credit'], line['balance']) for line in acme['lines']],
+            [
+                ('INV-2', Decimal('250.00'), Decimal('0'), Decimal('290.00')),
+                ('CN-1', Decimal('0'), Decimal('50.00'), Decimal('240.00')),
+                ('PAY-2024-02-10', Decimal('0'), Decimal('40.00'), Decimal('200.00')),
+            ]
+        )
+        self.assertEqual(acme['closing_balance'], Decimal('200.00'))
+        self.assertEqual(acme['charges'], Decimal('250.00'))
+        self.assertEqual(acme['credits'], Decimal('90.00'))
+        # Payments after the period are left out
+        self.assertEqual(globex['closing_balance'], Decimal('80.00'))
+
+    def test_generate_documents(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            documents = statements.generate_statements(
+                self.organization, date(2024, 2, 1), date(2024, 2, 29), fmt=rendering.HTML, workers=1
+            )
+            self.assertEqual(len(documents), 2)
+            document = Document.objects.get(metadata__party=self.acme.pk)
+            self.assertEqual(document.file_type, 'text/html')
+            self.assertEqual(document.metadata['closing_balance'], '200.00')
+            with document.file.open('rb') as handle:
+                content = handle.read().decode('utf-8')
+            self.assertIn('INV-2', content)
+            self.assertEqual(document.file_size, len(content.encode('utf-8')))
+
+            # Unchanged statements keep their document, changed ones are replaced
+            self.invoice('INV-5', self.globex, '2024-02-25', '10.00')
+            again = statements.generate_statements(
+                self.organization, date(2024, 2, 1), date(2024, 2, 29), fmt=rendering.HTML, workers=1
+            )
+            self.assertEqual(Document.objects.filter(organization=self.organization).count(), 2)
+            self.assertIn(document, again)
+            self.assertNotIn(
+                Document.objects.get(metadata__party=self.globex.pk).pk,
+                [d.pk for d in documents]
+            )
+
+    def test_statement_batches_render_in_a_process_pool(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root), \
+                patch.object(rendering, 'POOL_THRESHOLD', 2), \
+                patch.object(rendering, 'ProcessPoolExecutor', wraps=rendering.ProcessPoolExecutor) as pool:
+            documents = statements.generate_statements(
+                self.organization, date(2024, 2, 1), date(2024, 2, 29), fmt=rendering.HTML, workers=2
+            )
+            pool.assert_called_once()
+            document = Document.objects.get(pk__in=[d.pk for d in documents], metadata__party=self.acme.pk)
+            with document.file.open('rb') as handle:
+                self.assertIn('INV-2', handle.read().decode('utf-8'))
+        self.assertEqual(
+            settings.CELERY_TASK_ROUTES['accounting.tasks.generate_customer_statements']['queue'],
+            rendering.RENDERING_QUEUE
+        )
+
+
+class RenderingTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoice = Invoice.objects.create(
+            organization=self.organization,
+            number='INV-000001',
+            date='2024-01-15',
+            due_date='2024-02-15',
+            party_name='Customer',
+            status=Invoice.Status.SENT
+        )
+        revenue = self.account('Revenue', '4000', 'income')
+        self.item = InvoiceItem.objects.create(
+            invoice=self.invoice,
+            description='Consulting',
+            quantity=Decimal('2'),
+            unit_price=Decimal('50.00'),
+            tax_rate=Decimal('10'),
+            income_account=revenue
+        )
+        self.invoice.calculate_totals()
+
+    def invoice_hash(self):
+        return rendering.invoice_pdf_hash(rendering.invoices_for_rendering([self.invoice.pk]).get())
+
+    def test_invoice_hash_follows_content(self):
+        digest = self.invoice_hash()
+        self.assertEqual(self.invoice_hash(), digest)
+
+        self.item.description = 'Consulting services'
+        self.item.save()
+        self.assertNotEqual(self.invoice_hash(), digest)
+
+    def test_render_many_html(self):
+        context = rendering.invoice_context(rendering.invoices_for_rendering([self.invoice.pk]).get())
+        rendered = rendering.render_many([(rendering.INVOICE_TEMPLATE, context, rendering.HTML)] * 3, workers=1)
+        self.assertEqual(len(rendered), 3)
+        self.assertIn(b'Consulting', rendered[0])
+        self.assertIn(b'110.00', rendered[0])
+
+    def test_render_many_in_a_process_pool(self):
+        invoice = rendering.invoices_for_rendering([self.invoice.pk]).get()
+        jobs = []
+        for index in range(rendering.POOL_THRESHOLD):
+            context = rendering.invoice_context(invoice)
+            context['invoice']['number'] = f'INV-{index:06d}'
+            jobs.append((rendering.INVOICE_TEMPLATE, context, rendering.HTML))
+
+        with patch.object(rendering, 'ProcessPoolExecutor', wraps=rendering.ProcessPoolExecutor) as pool:
+            rendered = rendering.render_many(jobs, workers=2)
+
+        pool.assert_called_once()
+        self.assertEqual(rendered, rendering.render_many(jobs, workers=1))
+        self.assertIn(b'INV-000007', rendered[7])
+        self.assertEqual(
+            settings.CELERY_TASK_ROUTES['accounting.tasks.render_invoice_pdfs']['queue'],
+            rendering.RENDERING_QUEUE
+        )
+
+    def test_store_report_dedup(self):
+        reports = {
+            'balance_sheet': {
+                'date': '2024-01-31',
+                'assets': {'accounts': [{'code': '1000', 'name': 'Cash', 'balance': '10.00'}], 'total': '10.00'},
+                'total_liabilities_and_equity': '0.00',
+            }
+        }
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            document = rendering.store_report(self.organization, reports, '2024-01-31', rendering.HTML, self.owner)
+            with document.file.open('rb') as handle:
+                self.assertIn(b'Cash', handle.read())
+            self.assertEqual(
+                rendering.store_report(self.organization, reports, '2024-01-31', rendering.HTML).pk,
+                document.pk
+            )
+
+    @skipUnless(importlib.util.find_spec('weasyprint'), 'weasyprint is not installed')
+    def test_render_invoice_pdfs(self):
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root):
+            self.assertEqual(rendering.render_invoice_pdfs([self.invoice.pk]), {'rendered': 1, 'unchanged': 0})
+            self.assertEqual(rendering.render_invoice_pdfs([self.invoice.pk]), {'rendered': 0, 'unchanged': 1})
+            self.invoice.refresh_from_db()
+            self.assertTrue(self.invoice.pdf_file.name.endswith('.pdf'))
+
+
+
+class CountingEmailBackend(LocmemEmailBackend):
+    """Locmem backend counting opened connections, optionally failing."""
+    opened = 0
+    fail_after = None
+    refuse = ()
+    too_large = ()
+
+    def open(self):
+        CountingEmailBackend.opened += 1
+        return True
+
+    def send_messages(self, messages):
+        for message in messages:
+            if self.fail_after is not None and len(mail.outbox) >= self.fail_after:
+                raise smtplib.SMTPServerDisconnected('Connection lost')
+            if set(message.to) & set(self.refuse):
+                raise smtplib.SMTPRecipientsRefused({message.to[0]: (550, b'No such user')})
+            if set(message.to) & set(self.too_large):
+                raise smtplib.SMTPDataError(552, b'Message size exceeds fixed limit')
+        return super().send_messages(messages)
+
+
+@override_settings(
+    EMAIL_BACKEND='accounting.tests.CountingEmailBackend',
+    CACHES={'default': {'BACKEND': 'django.core.cache.backends.locmem.LocMemCache'}}
+)
+class InvoiceDeliveryTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.invoices = [
+            Invoice.objects.create(
+                organization=self.organization,
+                number=f'INV-00000{index}',
+                date='2024-01-15',
+                due_date='2024-02-15',
+                party_name=f'Customer {index}',
+                party_email=f'customer{index}@example.com',
+                total=Decimal('100.00'),
+                status=Invoice.Status.SENT
+            )
+            for index in range(1, 4)
+        ]
+        self.ids = [invoice.pk for invoice in self.invoices]
+        CountingEmailBackend.opened = 0
+        CountingEmailBackend.fail_after = None
+        CountingEmailBackend.refuse = ()
+        CountingEmailBackend.too_large = ()
+
+    def statuses(self):
+        return list(Invoice.objects.filter(pk__in=self.ids).order_by('pk').values_list(
+            'email_status', 'email_attempts'
+        ))
+
+    def test_queue_requires_recipient(self):
+        Invoice.objects.filter(pk=self.ids[0]).update(party_email='')
+
+        with self.captureOnCommitCallbacks() as callbacks:
+            self.assertEqual(delivery.queue_invoice_emails(self.ids), 2)
+
+        self.assertEqual(len(callbacks), 1)
+        self.assertEqual(
+            [status for status, _attempts in self.statuses()],
+            [Invoice.EmailStatus.FAILED, Invoice.EmailStatus.QUEUED, Invoice.EmailStatus.QUEUED]
+        )
+
+    def test_batch_uses_one_connection(self):
+        delivery.queue_invoice_emails(self.ids)
+
+        self.assertEqual(delivery.deliver_batch(self.ids), ([], None))
+
+        self.assertEqual(CountingEmailBackend.opened, 1)
+        self.assertEqual(len(mail.outbox), 3)
+        self.assertEqual(mail.outbox[0].to, ['customer1@example.com'])
+        self.assertIn('INV-000001', mail.outbox[0].subject)
+        self.assertIn('100.00', mail.outbox[0].body)
+        self.assertEqual(self.statuses(), [(Invoice.EmailStatus.SENT, 1)] * 3)
+        # Delivered invoices are not sent again
+        self.assertEqual(delivery.deliver_batch(self.ids), ([], None))
+        self.assertEqual(len(mail.outbox), 3)
+
+    def test_connection_failure_keeps_rest_queued(self):
+        delivery.queue_invoice_emails(self.ids)
+        CountingEmailBackend.fail_after = 1
+
+        pending, error = delivery.deliver_batch(self.ids)
+
+        self.assertEqual(pending, self.ids[1:])
+        self.assertIsInstance(error, smtplib.SMTPServerDisconnected)
+        self.assertEqual(self.statuses(), [
+            (Invoice.EmailStatus.SENT, 1),
+            (Invoice.EmailStatus.QUEUED, 1),
+            (Invoice.EmailStatus.QUEUED, 1),
+        ])
+        self.assertEqual(delivery.retry_countdown(0), delivery.RETRY_BACKOFF)
+        self.assertEqual(delivery.retry_countdown(2), delivery.RETRY_BACKOFF * 4)
+
+        self.assertEqual(delivery.fail_deliveries(pending, error), 2)
+        self.assertEqual(
+            Invoice.objects.get(pk=self.ids[2]).email_error,
+            'Connection lost'
+        )
+
+    def test_refused_recipient_fails_only_its_invoice(self):
+        delivery.queue_invoice_emails(self.ids)
+        CountingEmailBackend.refuse = ('customer2@example.com',)
+
+        self.assertEqual(delivery.deliver_batch(self.ids), ([], None))
+
+        self.assertEqual(len(mail.outbox), 2)
+        self.assertEqual(self.statuses(), [
+            (Invoice.EmailStatus.SENT, 1),
+            (Invoice.EmailStatus.FAILED, 1),
+            (Invoice.EmailStatus.SENT, 1),
+        ])
+
+    def test_bad_invoice_in_the_middle_fails_alone(self):
+        delivery.queue_invoice_emails(self.ids)
+        # The stored PDF of the second invoice is gone
+        Invoice.objects.filter(pk=self.ids[1]).update(pdf_file='invoices/missing/INV-000002.pdf')
+        CountingEmailBackend.too_large = ('customer3@example.com',)
+
+        self.assertEqual(delivery.deliver_batch(self.ids), ([], None))
+
+        self.assertEqual(len(mail.outbox), 1)
+        self.assertEqual(self.statuses(), [
+            (Invoice.EmailStatus.SENT, 1),
+            (Invoice.EmailStatus.FAILED, 1),
+            (Invoice.EmailStatus.FAILED, 1),
+        ])
+        self.assertIn('552', Invoice.objects.get(pk=self.ids[2]).email_error)
+
+    def test_render_failure_fails_only_its_invoice(self):
+        delivery.queue_invoice_emails(self.ids)
+        render = rendering.render_invoice_pdfs
+
+        def broken(invoice_ids, **kwargs):
+            if self.ids[1] in invoice_ids:
+                raise ValueError('Template error')
+            return render(invoice_ids, **kwargs)
+
+        with tempfile.TemporaryDirectory() as media_root, self.settings(MEDIA_ROOT=media_root), \
+                patch.object(rendering, 'render_invoice_pdfs', side_effect=broken), \
+                patch.object(rendering, 'render', return_value=b'%PDF'):
+            self.assertEqual(delivery.render_queued(self.ids), [self.ids[1]])
+
+        self.assertEqual(
+            [status for status, _attempts in self.statuses()],
+            [Invoice.EmailStatus.QUEUED, Invoice.EmailStatus.FAILED, Invoice.EmailStatus.QUEUED]
+        )
+        self.assertEqual(Invoice.objects.get(pk=self.ids[1]).email_error, 'Template error')
+
+    def test_batches_throttled_per_organization(self):
+        delivery.queue_invoice_emails(self.ids)
+
+        batches = delivery.schedule_batches(self.ids, size=2, limit=3, now=125.0)
+
+        self.assertEqual(batches, [(self.ids[:2], 0), (self.ids[2:], 0)])
+        # The minute's budget is spent: the next batch waits for the next minute
+        self.assertEqual(delivery.reserve_send_slot(self.organization.pk, 2, limit=3, now=130.0), 50.0)
+
+    def test_recurring_auto_send_queues_invoices(self):
+        revenue = self.account('Revenue', '4000', 'income')
+        template = RecurringInvoice.objects.create(
+            organization=self.organization,
+            name='Hosting',
+            start_date=date(2024, 1, 31),
+            next_date=date(2024, 1, 31),
+            frequency=RecurringInvoice.Frequency.MONTHLY,
+            party_name='Customer',
+            party_email='customer@example.com',
+            auto_send=True
+        )
+        RecurringInvoiceItem.objects.create(
+            recurring_invoice=template,
+            description='Hosting',
+            quantity=Decimal('1'),
+            unit_price=Decimal('50.00'),
+            income_account=revenue
+        )
+
+        invoice_ids = recurring.generate_due_invoices(today=date(2024, 2, 15))
+
+        self.assertEqual(
+            Invoice.objects.get(pk__in=invoice_ids).email_status,
+            Invoice.EmailStatus.QUEUED
+        )
+
+
+class OverdueSweepTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.accountant = User.objects.create_user(
+            username='accountant',
+            email='accountant@example.com',
+            password='testpass123'
+        )
+        self.viewer = User.objects.create_user(
+            username='viewer',
+            email='viewer@example.com',
+            password='testpass123'
+        )
+        OrganizationMembership.objects.create(
+            organization=self.organization,
+            user=self.accountant,
+            role=OrganizationMembership.RoleChoices.ACCOUNTANT
+        )
+        OrganizationMembership.objects.create(
+            organization=self.organization,
+            user=self.viewer,
+            role=OrganizationMembership.RoleChoices.VIEWER
+        )
+
+    def invoice(self, number, due_date, status=Invoice.Status.SENT, amount_paid=Decimal('0')):
+        return Invoice.objects.create(
+            organization=self.organization,
+            number=number,
+            date='2024-01-01',
+            due_date=due_date,
+            party_name='Customer',
+            total=Decimal('100.00'),
+            amount_paid=amount_paid,
+            status=status
+        )
+
+    def test_sweep_marks_open_invoices_past_due(self):
+        late = self.invoice('INV-000001', '2024-01-31')
+        partial = self.invoice(
+            'INV-000002', '2024-01-31', Invoice.Status.PARTIALLY_PAID, Decimal('40.00')
+        )
+        due_today = self.invoice('INV-000003', '2024-02-15')
+        paid = self.invoice('INV-000004', '2024-01-31', Invoice.Status.PAID, Decimal('100.00'))
+        draft = self.invoice('INV-000005', '2024-01-31', Invoice.Status.DRAFT)
+
+        result = overdue.sweep_overdue_invoices(today=date(2024, 2, 15), batch_size=1)
+
+        self.assertEqual(result, {'invoices': 2, 'notifications': 4})
+        statuses = dict(Invoice.objects.values_list('pk', 'status'))
+        self.assertEqual(statuses[late.pk], Invoice.Status.OVERDUE)
+        self.assertEqual(statuses[partial.pk], Invoice.Status.OVERDUE)
+        self.assertEqual(statuses[due_today.pk], Invoice.Status.SENT)
+        self.assertEqual(statuses[paid.pk], Invoice.Status.PAID)
+        self.assertEqual(statuses[draft.pk], Invoice.Status.DRAFT)
+
+        # Owner and accountant, once per batch; viewers are not reminded
+        notifications = Notification.objects.filter(organization=self.organization)
+        self.assertEqual(
+            sorted(notifications.values_list('recipient', flat=True)),
+            [self.owner.pk, self.owner.pk, self.accountant.pk, self.accountant.pk]
+        )
+        reminder = notifications.get(recipient=self.owner, object_id=partial.pk)
+        self.assertEqual(reminder.data['outstanding'], '60.00')
+
+        # Invoices already overdue are not notified again
+        self.assertEqual(
+            overdue.sweep_overdue_invoices(today=date(2024, 2, 15)),
+            {'invoices': 0, 'notifications': 0}
+        )
+
+    def test_partial_payment_keeps_overdue(self):
+        invoice = self.invoice('INV-000001', '2024-01-31', Invoice.Status.OVERDUE)
+        bank = self.account('Bank', '1100', 'asset')
+        payment = Payment.objects.create(
+            organization=self.organization,
+            invoice=invoice,
+            date='2024-02-20',
+            amount=Decimal('30.00'),
+            method=Payment.Method.BANK_TRANSFER,
+            status=Payment.Status.COMPLETED,
+            bank_account=bank
+        )
+        PaymentAllocation.objects.create(payment=payment, invoice=invoice, amount=Decimal('30.00'))
+
+        payments.refresh_invoices([invoice.pk])
+
+        invoice.refresh_from_db()
+        self.assertEqual(invoice.amount_paid, Decimal('30.00'))
+        self.assertEqual(invoice.status, Invoice.Status.OVERDUE)
+
+
+class DepreciationScheduleTestCase(TestCase):
+    def register(self, method, cost, salvage, years):
+        return depreciation.AssetRegister([
+            (1, date(2024, 1, 10), Decimal(cost), Decimal(salvage), years, method)
+        ])
+
+    def test_straight_line(self):
+        schedule = self.register('straight_line', '1000.00', '0', 1).schedules()[1]
+
+        self.assertEqual(len(schedule), 12)
+        self.assertEqual(schedule[0]['period'], date(2024, 1, 31))
+        self.assertEqual(schedule[0]['depreciation'], Decimal('83.33'))
+        self.assertEqual(schedule[-1]['period'], date(2024, 12, 31))
+        self.assertEqual(schedule[-1]['book_value'], Decimal('0.00'))
+        # Rounding never leaks: the charges add up to the depreciable amount
+        self.assertEqual(sum(row['depreciation'] for row in schedule), Decimal('1000.00'))
+
+    def test_sum_of_years(self):
+        schedule = self.register('sum_of_years', '15000.00', '0', 5).schedules()[1]
+
+        yearly = [sum(row['depreciation'] for row in schedule[year * 12:(year + 1) * 12]) for year in range(5)]
+        self.assertEqual(yearly, [Decimal(amount) for amount in ('5000', '4000', '3000', '2000', '1000')])
+
+    def test_declining_balance_switches_to_straight_line(self):
+        register = self.register('declining_balance', '10000.00', '1000.00', 5)
+        schedule = register.schedules()[1]
+
+        self.assertEqual(schedule[0]['depreciation'], Decimal('333.33'))
+        self.assertEqual(schedule[-1]['book_value'], Decimal('1000.00'))
+        charges = [row['depreciation'] for row in schedule]
+        switch = int(register.switch[0])
+        # Declining charges until the switch, then a flat straight line
+        self.assertEqual(charges[:switch], sorted(charges[:switch], reverse=True))
+        self.assertLessEqual(max(charges[switch:]) - min(charges[switch:]), Decimal('0.01'))
+
+    def test_project_register(self):
+        register = depreciation.AssetRegister([
+            (1, date(2024, 1, 10), Decimal('1200.00'), Decimal('0'), 1, 'straight_line'),
+            (2, date(2024, 3, 1), Decimal('1200.00'), Decimal('0'), 1, 'straight_line'),
+        ])
+
+        charges = register.project(date(2024, 12, 1), 3)
+
+        # Depreciation starts in the purchase month and stops after the useful life
+        self.assertEqual(charges.tolist(), [[10000, 0, 0], [10000, 10000, 10000]])
+        self.assertEqual(register.accumulated(date(2024, 3, 15)).tolist(), [30000, 10000])
+
+
+class DepreciationRunTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.expense = self.account('Depreciation expense', '6100', 'expense')
+        self.contra = self.account('Accumulated depreciation', '1590', 'asset')
+        self.assets = [
+            FixedAsset.objects.create(
+                organization=self.organization,
+                name=f'Laptop {index}',
+                asset_number=f'FA-{index}',
+                purchase_date=date(2024, 1, 10),
+                purchase_cost=Decimal('1200.00'),
+                current_value=Decimal('1200.00'),
+                useful_life_years=1,
+                depreciation_expense_account=self.expense,
+                accumulated_depreciation_account=self.contra
+            )
+            for index in range(3)
+        ]
+        # Without accounts an asset cannot be posted and is left alone
+        self.unmapped = FixedAsset.objects.create(
+            organization=self.organization,
+            name='Desk',
+            asset_number='FA-9',
+            purchase_date=date(2024, 1, 10),
+            purchase_cost=Decimal('1200.00'),
+            current_value=Decimal('1200.00'),
+            useful_life_years=1
+        )
+
+    def test_run_posts_one_summarized_journal(self):
+        run = depreciation.run_depreciation(self.organization, date(2024, 1, 15))
+
+        self.assertEqual(run.period_end, date(2024, 1, 31))
+        self.assertEqual(run.asset_count, 3)
+        self.assertEqual(run.total_amount, Decimal('300.00'))
+        journal = run.transaction
+        self.assertEqual(journal.status, Transaction.Status.POSTED)
+        self.assertEqual(
+            sorted(journal.entries.values_list('account', 'amount')),
+            sorted([(self.expense.pk, Decimal('300.00')), (self.contra.pk, Decimal('-300.00'))])
+        )
+        self.expense.refresh_from_db()
+        self.assertEqual(self.expense.current_balance, Decimal('300.00'))
+
+        asset = FixedAsset.objects.get(pk=self.assets[0].pk)
+        self.assertEqual(asset.accumulated_depreciation, Decimal('100.00'))
+        self.assertEqual(asset.current_value, Decimal('1100.00'))
+        self.assertEqual(asset.depreciated_through, date(2024, 1, 31))
+        self.unmapped.refresh_from_db()
+        self.assertEqual(self.unmapped.accumulated_depreciation, Decimal('0'))
+
+    def test_run_is_idempotent_and_catches_up(self):
+        first = depreciation.run_depreciation(self.organization, date(2024, 1, 31))
+        self.assertEqual(depreciation.run_depreciation(self.organization, date(2024, 1, 31)).pk, first.pk)
+        self.assertEqual(Transaction.objects.filter(organization=self.organization).count(), 1)
+
+        # February was skipped: March charges both months
+        march = depreciation.run_depreciation(self.organization, date(2024, 3, 31))
+
+        self.assertEqual(march.total_amount, Decimal('600.00'))
+        self.assertEqual(DepreciationRun.objects.filter(organization=self.organization).count(), 2)
+        asset = FixedAsset.objects.get(pk=self.assets[0].pk)
+        self.assertEqual(asset.accumulated_depreciation, Decimal('300.00'))
+
+    def test_assets_only_post_to_accounts_of_their_organization(self):
+        other = Organization.objects.create(name='Other Org', slug='other-org', owner=self.owner)
+        foreign = Account.objects.create(
+            organization=other, name='Other expense', code='6100', account_type='expense'
+        )
+        context = {'request': SimpleNamespace(user=SimpleNamespace(organization=self.organization))}
+        data = {
+            'name': 'Server',
+            'asset_number': 'FA-10',
+            'purchase_date': '2024-01-10',
+            'purchase_cost': '1200.00',
+            'current_value': '1200.00',
+            'useful_life_years': 1,
+            'salvage_value': '0.00',
+            'accumulated_depreciation_account': self.contra.pk,
+            'depreciation_expense_account': foreign.pk,
+        }
+
+        serializer = FixedAssetSerializer(data=data, context=context)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('non_field_errors', serializer.errors)
+
+        data['depreciation_expense_account'] = self.expense.pk
+        self.assertTrue(FixedAssetSerializer(data=data, context=context).is_valid())
+
+        serializer = FixedAssetSerializer(
+            self.assets[0], data={**data, 'asset_number': 'FA-0', 'asset_account': foreign.pk}, context=context
+        )
+        self.assertFalse(serializer.is_valid())
+
+
+class AssetDisposalTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        accounts = {
+            code: self.account(name, code, account_type)
+            for code, name, account_type in (
+                ('1500', 'Equipment', 'asset'),
+                ('1590', 'Accumulated depreciation', 'asset'),
+                ('6100', 'Depreciation expense', 'expense'),
+                ('1100', 'Bank', 'asset'),
+                ('7900', 'Gain/loss on disposal', 'income'),
+            )
+        }
+        self.equipment, self.contra, self.expense, self.bank, self.gain_loss = accounts.values()
+        self.assets = [
+            FixedAsset.objects.create(
+                organization=self.organization,
+                name=f'Laptop {index}',
+                asset_number=f'FA-{index}',
+                purchase_date=date(2024, 1, 10),
+                purchase_cost=Decimal('1200.00'),
+                current_value=Decimal('1200.00'),
+                useful_life_years=1,
+                asset_account=self.equipment,
+                accumulated_depreciation_account=self.contra,
+                depreciation_expense_account=self.expense
+            )
+            for index in range(3)
+        ]
+
+    def balances(self):
+        return dict(Account.objects.filter(organization=self.organization).values_list('code', 'current_balance'))
+
+    def test_sale_with_gain(self):
+        # January was charged by the month-end run, February and March are not yet
+        depreciation.run_depreciation(self.organization, date(2024, 1, 31))
+
+        journal, gain = disposals.dispose_assets(
+            self.organization,
+            {self.assets[0].pk: Decimal('1000.00')},
+            date(2024, 3, 20),
+            proceeds_account=self.bank,
+            gain_loss_account=self.gain_loss
+        )
+
+        # Book value 1200 - 300 = 900, sold for 1000
+        self.assertEqual(gain, Decimal('100.00'))
+        self.assertEqual(sum(journal.entries.values_list('amount', flat=True)), Decimal('0'))
+        balances = self.balances()
+        self.assertEqual(balances['6100'], Decimal('500.00'))
+        # The two remaining laptops keep their January depreciation
+        self.assertEqual(balances['1590'], Decimal('-200.00'))
+        self.assertEqual(balances['1500'], Decimal('-1200.00'))
+        self.assertEqual(balances['1100'], Decimal('1000.00'))
+        self.assertEqual(balances['7900'], Decimal('-100.00'))
+
+        asset = FixedAsset.objects.get(pk=self.assets[0].pk)
+        self.assertEqual(asset.status, FixedAsset.Status.SOLD)
+        self.assertEqual(asset.accumulated_depreciation, Decimal('300.00'))
+        self.assertEqual(asset.current_value, Decimal('0'))
+        self.assertEqual(asset.disposal_transaction, journal)
+
+    def test_batch_write_off_posts_summarized_journal(self):
+        journal, gain = disposals.dispose_assets(
+            self.organization,
+            {asset.pk: 0 for asset in self.assets},
+            date(2024, 6, 30),
+            gain_loss_account=self.gain_loss,
+            status=FixedAsset.Status.WRITTEN_OFF
+        )
+
+        # Six months of 100 charged, 600 of book value lost per asset
+        self.assertEqual(gain, Decimal('-1800.00'))
+        self.assertEqual(journal.entries.count(), 5)
+        self.assertEqual(self.balances()['7900'], Decimal('1800.00'))
+        self.assertEqual(
+            set(FixedAsset.objects.values_list('status', flat=True)),
+            {FixedAsset.Status.WRITTEN_OFF}
+        )
+
+        with self.assertRaises(serializers.ValidationError):
+            disposals.dispose_assets(self.organization, {self.assets[0].pk: 0}, date(2024, 7, 1))
+
+    def test_gain_loss_account_required(self):
+        with self.assertRaises(serializers.ValidationError):
+            disposals.dispose_assets(self.organization, {self.assets[0].pk: 0}, date(2024, 6, 30))
+        self.assertEqual(Transaction.objects.count(), 0)
+
+    def test_malformed_requests_are_rejected(self):
+        other = Organization.objects.create(name='Other Org', slug='other-org', owner=self.owner)
+        foreign_bank = Account.objects.create(
+            organization=other, name='Bank', code='1100', account_type='asset'
+        )
+        self.owner.organization = self.organization
+        view = FixedAssetViewSet.as_view({'post': 'dispose_batch'})
+
+        def post(data):
+            request = APIRequestFactory().post('/', data, format='json')
+            force_authenticate(request, user=self.owner)
+            return view(request)
+
+        for data in (
+            {'assets': [{'id': 'abc'}]},
+            {'assets': [{'id': self.assets[0].pk, 'value': 'NaN'}]},
+            {'assets': [{'id': self.assets[0].pk, 'value': '-1'}]},
+            {'assets': []},
+            {'assets': [{'id': self.assets[0].pk, 'value': '10'}], 'proceeds_account': 'x'},
+            {'assets': [{'id': self.assets[0].pk, 'value': '10'}], 'proceeds_account': foreign_bank.pk},
+        ):
+            self.assertEqual(post(data).status_code, status.HTTP_400_BAD_REQUEST, data)
+        self.assertEqual(Transaction.objects.count(), 0)
+
+        response = post({
+            'date': '2024-06-30',
+            'assets': [{'id': self.assets[0].pk, 'value': '700.00'}],
+            'proceeds_account': self.bank.pk,
+            'gain_loss_account': self.gain_loss.pk,
+        })
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['gain_loss'], Decimal('100.00'))
+
+
+class ForeignCurrencyTestCase(OrganizationTestCase):
+    def setUp(self):
+        fx.clear_rate_cache()
+        super().setUp()
+        self.bank = self.account('Bank EUR', '1010', 'asset', subtype='bank', currency='EUR')
+        self.revenue = self.account('Sales', '4000', 'income')
+        self.gain_loss = self.account(
+            'Exchange differences', '7950', 'expense', subtype=Account.AccountSubType.FX_GAIN_LOSS
+        )
+        ExchangeRate.objects.create(
+            organization=self.organization, currency='EUR', date=date(2024, 1, 1), rate=Decimal('1.10')
+        )
+        ExchangeRate.objects.create(
+            organization=self.organization, currency='EUR', date=date(2024, 1, 31), rate=Decimal('1.20')
+        )
+        sale = Transaction.objects.create(
+            organization=self.organization,
+            date=date(2024, 1, 15),
+            description='Sale in EUR',
+            status=Transaction.Status.POSTED
+        )
+        TransactionEntry.objects.create(
+            transaction=sale, account=self.bank, amount=Decimal('100.00'), currency='EUR'
+        )
+        TransactionEntry.objects.create(
+            transaction=sale, account=self.revenue, amount=Decimal('-110.00')
+        )
+
+    def balance(self, account, as_of):
+        debits, credits = periods.cumulative_totals(self.organization, as_of).get(
+            account.pk, (Decimal('0'), Decimal('0'))
+        )
+        return debits - credits
+
+    def test_reports_convert_at_the_transaction_date_rate(self):
+        self.assertEqual(self.balance(self.bank, date(2024, 1, 20)), Decimal('110.00'))
+        self.assertEqual(self.balance(self.revenue, date(2024, 1, 20)), Decimal('-110.00'))
+
+        # Without a recorded rate the entry's own exchange rate applies
+        other = Transaction.objects.create(
+            organization=self.organization,
+            date=date(2024, 1, 16),
+            description='Sale in GBP',
+            status=Transaction.Status.POSTED
+        )
+        TransactionEntry.objects.create(
+            transaction=other, account=self.bank, amount=Decimal('10.00'),
+            currency='GBP', exchange_rate=Decimal('1.255')
+        )
+        self.assertEqual(self.balance(self.bank, date(2024, 1, 20)), Decimal('122.55'))
+
+    def test_rates_are_cached(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(fx.rate_on(self.organization, 'EUR', date(2024, 1, 20)), Decimal('1.10'))
+            self.assertEqual(fx.rate_on(self.organization, 'EUR', date(2024, 1, 20)), Decimal('1.10'))
+        with self.assertNumQueries(0):
+            self.assertEqual(fx.rate_on(self.organization, 'USD', date(2024, 1, 20)), Decimal('1'))
+        self.assertIsNone(fx.rate_on(self.organization, 'EUR', date(2023, 12, 31)))
+        self.assertEqual(fx.convert(self.organization, Decimal('10.05'), 'EUR', date(2024, 2, 1)), Decimal('12.06'))
+
+    def test_revaluation_posts_unrealized_difference_once(self):
+        self.assertEqual(list(fx.revaluation_organizations()), [self.organization])
+
+        journal = fx.revalue_accounts(self.organization, date(2024, 1, 31))
+
+        self.assertEqual(journal.status, Transaction.Status.POSTED)
+        self.assertEqual(
+            sorted(journal.entries.values_list('account', 'amount', 'currency')),
+            sorted([(self.bank.pk, Decimal('10.00'), 'USD'), (self.gain_loss.pk, Decimal('-10.00'), 'USD')])
+        )
+        self.assertEqual(self.balance(self.bank, date(2024, 1, 31)), Decimal('120.00'))
+        self.assertIsNone(fx.revalue_accounts(self.organization, date(2024, 1, 31)))
+
+    def test_revaluation_needs_a_closing_rate(self):
+        self.bank.currency = 'GBP'
+        self.bank.save()
+        with self.assertRaises(serializers.ValidationError):
+            fx.revalue_accounts(self.organization, date(2024, 1, 31))
+        self.assertEqual(Transaction.objects.count(), 1)
+
+    def test_serializer_rejects_a_second_rate_for_the_same_day(self):
+        context = {'request': SimpleNamespace(user=SimpleNamespace(organization=self.organization))}
+        data = {'currency': 'eur', 'date': '2024-01-31', 'rate': '1.25'}
+
+        serializer = ExchangeRateSerializer(data=data, context=context)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('non_field_errors', serializer.errors)
+        self.assertTrue(ExchangeRateSerializer(data={**data, 'date': '2024-02-01'}, context=context).is_valid())
+        rate = ExchangeRate.objects.get(currency='EUR', date=date(2024, 1, 31))
+        self.assertTrue(ExchangeRateSerializer(rate, data=data, context=context).is_valid())
+
+    def test_invoice_reports_convert_at_the_invoice_date_rate(self):
+        tax_rate = TaxRate.objects.create(
+            organization=self.organization,
+            name='VAT',
+            rate=Decimal('10.00'),
+            sales_tax_account=self.gain_loss,
+            purchase_tax_account=self.gain_loss
+        )
+        for number, currency, total, exchange_rate in (
+            ('INV-1', 'EUR', Decimal('110.00'), Decimal('1')),
+            ('INV-2', 'USD', Decimal('55.00'), Decimal('1')),
+            ('INV-3', 'GBP', Decimal('11.00'), Decimal('1.25')),
+        ):
+            invoice = Invoice.objects.create(
+                organization=self.organization,
+                number=number,
+                type='sale',
+                status='sent',
+                date=date(2024, 1, 15),
+                due_date=date(2024, 2, 15),
+                party_name='Customer',
+                currency=currency,
+                exchange_rate=exchange_rate,
+                total=total
+            )
+            InvoiceItem.objects.create(
+                invoice=invoice, description='Goods', quantity=1, unit_price=total / 11 * 10,
+                tax_rate=Decimal('10.00'), income_account=self.revenue
+            )
+        self.owner.organization = self.organization
+
+        def get(view, params):
+            request = APIRequestFactory().get('/', params)
+            force_authenticate(request, user=self.owner)
+            return view.as_view()(request).data
+
+        aging = get(AgedReceivablesView, {'date': '2024-01-20'})
+        # 110 EUR at 1.10, 55 USD and 11 GBP at the invoice's own 1.25
+        self.assertEqual(aging['total_receivables'], Decimal('189.75'))
+        self.assertEqual(aging['aging']['current']['total'], Decimal('189.75'))
+
+        summary = get(TaxSummaryView, {'end_date': '2024-01-31'})
+        self.assertEqual(summary['totals']['tax_collected'], Decimal('17.25'))
+        self.assertEqual(summary['tax_rates'][0]['tax_rate']['id'], tax_rate.pk)
+
+
+class AllocationTestCase(OrganizationTestCase):
+    def setUp(self):
+        super().setUp()
+        self.bank = self.account('Bank', '1000', 'asset')
+        self.rent = self.account('Rent', '6100', 'expense')
+        self.departments = [
+            self.account(f'Rent department {number}', f'61{number}', 'expense')
+            for number in (10, 20, 30)
+        ]
+        self.post(date(2024, 1, 5), self.rent, Decimal('1000.00'))
+
+    def post(self, on, account, amount):
+        journal = Transaction.objects.create(
+            organization=self.organization,
+            date=on,
+            description='Posted',
+            status=Transaction.Status.POSTED
+        )
+        TransactionEntry.objects.create(transaction=journal, account=account, amount=amount)
+        TransactionEntry.objects.create(transaction=journal, account=self.bank, amount=-amount)
+
+    def rule(self, name, method, targets):
+        rule = AllocationRule.objects.create(
+            organization=self.organization, name=name, source_account=self.rent, method=method
+        )
+        AllocationTarget.objects.bulk_create([AllocationTarget(rule=rule, **target) for target in targets])
+        return rule
+
+    def amounts(self, run):
+        return dict(run.transaction.entries.values_list('account', 'amount'))
+
+    def test_percentages_split_without_losing_cents(self):
+        self.rule('Rent', AllocationRule.Method.PERCENTAGE, [
+            {'account': account, 'percentage': Decimal('33.33')} for account in self.departments
+        ])
+
+        run, = allocations.run_allocations(self.organization, date(2024, 1, 15), self.owner)
+
+        self.assertEqual(run.period_end, date(2024, 1, 31))
+        self.assertEqual(run.amount, Decimal('999.90'))
+        self.assertEqual(run.transaction.status, Transaction.Status.POSTED)
+        self.assertEqual(run.transaction.date, date(2024, 1, 31))
+        self.assertEqual(self.amounts(run), {
+            self.rent.pk: Decimal('-999.90'),
+            self.departments[0].pk: Decimal('333.30'),
+            self.departments[1].pk: Decimal('333.30'),
+            self.departments[2].pk: Decimal('333.30'),
+        })
+        self.rent.refresh_from_db()
+        self.assertEqual(self.rent.current_balance, Decimal('-999.90'))
+
+    def test_leftover_cents_go_to_the_largest_remainders(self):
+        self.post(date(2024, 1, 20), self.rent, Decimal('0.01'))
+        self.rule('Rent', AllocationRule.Method.PERCENTAGE, [
+            {'account': self.departments[0], 'percentage': Decimal('33.33')},
+            {'account': self.departments[1], 'percentage': Decimal('33.33')},
+            {'account': self.departments[2], 'percentage': Decimal('33.34')},
+        ])
+
+        run, = allocations.run_allocations(self.organization, date(2024, 1, 31))
+
+        self.assertEqual(self.amounts(run), {
+            self.rent.pk: Decimal('-1000.01'),
+            self.departments[0].pk: Decimal('333.30'),
+            self.departments[1].pk: Decimal('333.30'),
+            self.departments[2].pk: Decimal('333.41'),
+        })
+
+    def test_drivers_weight_by_their_period_movement(self):
+        head_count = [self.account(f'Head count {number}', f'9{number}', 'expense') for number in range(3)]
+        self.post(date(2024, 1, 31), head_count[0], Decimal('1.00'))
+        self.post(date(2024, 1, 31), head_count[1], Decimal('-2.00'))
+        # Outside the period
+        self.post(date(2023, 12, 31), head_count[2], Decimal('5.00'))
+        self.rule('Rent by head count', AllocationRule.Method.DRIVER, [
+            {'account': account, 'driver_account': driver}
+            for account, driver in zip(self.departments, head_count)
+        ])
+
+        run, = allocations.run_allocations(self.organization, date(2024, 1, 31))
+
+        self.assertEqual(self.amounts(run), {
+            self.rent.pk: Decimal('-1000.00'),
+            self.departments[0].pk: Decimal('333.33'),
+            self.departments[1].pk: Decimal('666.67'),
+        })
+
+    def test_rules_run_once_per_period_in_one_batch(self):
+        driver = self.account('Floor space', '9000', 'expense')
+        self.rule('Rent', AllocationRule.Method.PERCENTAGE, [
+            {'account': self.departments[0], 'percentage': Decimal('100')}
+        ])
+        self.rule('Empty drivers', AllocationRule.Method.DRIVER, [
+            {'account': self.departments[1], 'driver_account': driver}
+        ])
+        self.rule('Second', AllocationRule.Method.PERCENTAGE, [
+            {'account': self.departments[2], 'percentage': Decimal('10')}
+        ])
+        self.assertEqual(list(allocations.allocation_organizations()), [self.organization])
+
+        runs = allocations.run_allocations(self.organization, date(2024, 1, 31))
+
+        self.assertEqual([run.rule.name for run in runs], ['Rent', 'Second'])
+        # Both rules read the balances from before the run
+        self.assertEqual([run.amount for run in runs], [Decimal('1000.00'), Decimal('100.00')])
+        self.assertEqual(Transaction.objects.filter(reference='ALC-2024-01').count(), 2)
+        self.assertEqual(allocations.run_allocations(self.organization, date(2024, 1, 31)), [])
+        self.assertEqual(AllocationRun.objects.count(), 2)
+
+    def test_rule_names_are_unique_per_organization(self):
+        rule = self.rule('Rent', AllocationRule.Method.PERCENTAGE, [
+            {'account': self.departments[0], 'percentage': Decimal('100')}
+        ])
+        context = {'request': SimpleNamespace(user=SimpleNamespace(organization=self.organization))}
+        data = {
+            'name': 'Rent',
+            'source_account': self.rent.pk,
+            'targets': [{'account': self.departments[1].pk, 'percentage': '100'}],
+        }
+
+        serializer = AllocationRuleSerializer(data=data, context=context)
+        self.assertFalse(serializer.is_valid())
+        self.assertIn('non_field_errors', serializer.errors)
+        self.assertTrue(AllocationRuleSerializer(data={**data, 'name': 'Rent 2'}, context=context).is_valid())
+        # Saving a rule under its own name is fine
+        self.assertTrue(AllocationRuleSerializer(rule, data=data, context=context).is_valid())
+
+    def test_closed_periods_are_refused(self):
+        self.rule('Rent', AllocationRule.Method.PERCENTAGE, [
+            {'account': self.departments[0], 'percentage': Decimal('100')}
+        ])
+        periods.close_period(self.organization, date(2024, 1, 31))
+        with self.assertRaises(serializers.ValidationError):
+            allocations.run_allocations(self.organization, date(2024, 1, 31))
+        self.assertFalse(AllocationRun.objects.exists())
@@ -11,8 +11,13 @@ router.register(r'budgets', views.BudgetViewSet, basename='budget')
 router.register(r'invoices', views.InvoiceViewSet, basename='invoice')
 router.register(r'fixed-assets', views.FixedAssetViewSet, basename='fixed-asset')
 router.register(r'tax-rates', views.TaxRateViewSet, basename='tax-rate')
+router.register(r'exchange-rates', views.ExchangeRateViewSet, basename='exchange-rate')
+router.register(r'allocation-rules', views.AllocationRuleViewSet, basename='allocation-rule')
 router.register(r'payments', views.PaymentViewSet, basename='payment')
 router.register(r'recurring-invoices', views.RecurringInvoiceViewSet, basename='recurring-invoice')
+router.register(r'period-closes', views.PeriodCloseViewSet, basename='period-close')
+router.register(r'number-sequences', views.NumberSequenceViewSet, basename='number-sequence')
+router.register(r'parties', views.PartyViewSet, basename='party')
 
 # Additional views for reports and specific functionality
 report_patterns = [
@@ -64,6 +69,12 @@ report_patterns = [
         views.TaxSummaryView.as_view(),
         name='tax-summary'
     ),
+    # Customer statements
+    path(
+        'reports/customer-statements/',
+        views.CustomerStatementsView.as_view(),
+        name='customer-statements'
+    ),
 ]
 
 # Additional functionality patterns
@@ -100,8 +111,10 @@ functionality_patterns = [
     ),
 ]
 
+# The fixed paths come first: transactions/export/ and transactions/import/
+# would otherwise be taken by the router's transactions/<pk>/ route
 urlpatterns = [
+    path('', include(functionality_patterns)),
     path('', include(router.urls)),
     path('', include(report_patterns)),
-    path('', include(functionality_patterns)),
 ] 
\ No newline at end of file
@@ -1,5 +1,5 @@
-from django.shortcuts import render
-from rest_framework import viewsets, status, filters
+from django.shortcuts import get_object_or_404, render
+from rest_framework import viewsets, status, filters, serializers
 from rest_framework.decorators import action
 from rest_framework.response import Response
 from rest_framework.permissions import IsAuthenticated
@@ -7,25 +7,39 @@ from django.db import transaction
 from django.db.models import Q, Sum
 from django.utils.translation import gettext_lazy as _
 from django.utils import timezone
+from django.utils.dateparse import parse_date
 from datetime import datetime, date, timedelta
 from decimal import Decimal
 from .models import (
     Account, Transaction, TransactionEntry, Budget, BudgetItem,
     Invoice, InvoiceItem, FixedAsset, TaxRate, Payment,
-    RecurringInvoice, RecurringInvoiceItem
+    RecurringInvoice, RecurringInvoiceItem, PeriodClose, NumberSequence, Party,
+    ExchangeRate, AllocationRule
 )
 from .serializers import (
     AccountSerializer, TransactionSerializer, TransactionEntrySerializer,
     BudgetSerializer, BudgetItemSerializer, InvoiceSerializer,
     InvoiceItemSerializer, FixedAssetSerializer, TaxRateSerializer,
-    PaymentSerializer, RecurringInvoiceSerializer, RecurringInvoiceItemSerializer
+    PaymentSerializer, RecurringInvoiceSerializer, RecurringInvoiceItemSerializer,
+    PeriodCloseSerializer, ClosingBalanceSerializer, NumberSequenceSerializer,
+    PartySerializer, ExchangeRateSerializer, AllocationRuleSerializer,
+    AllocationRunSerializer, AssetDisposalSerializer, AssetBatchDisposalSerializer
 )
 from rest_framework.views import APIView
-from rest_framework.parsers import MultiPartParser, FormParser
-from django.db.models import Sum, F, Q, Case, When, Value, DecimalField
+from rest_framework.parsers import JSONParser, MultiPartParser, FormParser
+from django.db.models import Sum, F, Q, Case, Max, When, Value, DecimalField
 from django.db.models.functions import Coalesce, ExtractYear, ExtractMonth
+from django.http import FileResponse
+from django.core.serializers.json import DjangoJSONEncoder
+from . import (
+    delivery, depreciation, disposals, exports, fx, money, parties, payments, periods,
+    posting, reconciliation, recurring, recurring_journals, rendering, reversals, statements
+)
 import csv
 import io
+import json
+import tempfile
+import numpy as np
 
 # Create your views here.
 
@@ -144,9 +158,18 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 _("Transaction must be balanced (debits = credits)")
             )
 
+    def perform_destroy(self, instance):
+        posting.check_period_open(instance.organization, instance.date)
+        if instance.status in posting.BALANCE_STATUSES:
+            raise serializers.ValidationError(
+                _("Posted transactions cannot be deleted; reverse them instead")
+            )
+        instance.delete()
+
     @action(detail=True, methods=['post'])
     def approve(self, request, pk=None):
         transaction_obj = self.get_object()
+        posting.check_period_open(transaction_obj.organization, transaction_obj.date)
         
         if not transaction_obj.is_balanced():
             return Response(
@@ -176,18 +199,14 @@ class TransactionViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        transaction_obj.status = 'posted'
-        transaction_obj.save()
-        
-        # Update account balances
-        for entry in transaction_obj.entries.all():
-            entry.account.update_balance(entry.amount)
+        posting.post_transaction(transaction_obj)
         
         return Response({'status': 'transaction posted'})
 
     @action(detail=True, methods=['post'])
     def void(self, request, pk=None):
         transaction_obj = self.get_object()
+        posting.check_period_open(transaction_obj.organization, transaction_obj.date)
         
         if transaction_obj.status not in ['draft', 'approved']:
             return Response(
@@ -200,6 +219,46 @@ class TransactionViewSet(viewsets.ModelViewSet):
         
         return Response({'status': 'transaction voided'})
 
+    def _transition_batch(self, request, transition, done):
+        ids = request.data.get('ids', [])
+        if not isinstance(ids, list) or not all(str(pk).isdigit() for pk in ids):
+            return Response(
+                {'error': _("ids must be a list of transaction ids")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        count = posting.transition_transactions(
+            request.user.organization, ids, transition, user=request.user
+        )
+        return Response({'status': done, 'transactions': count})
+
+    @action(detail=False, methods=['post'])
+    def approve_batch(self, request):
+        return self._transition_batch(request, posting.APPROVE, 'transactions approved')
+
+    @action(detail=False, methods=['post'])
+    def post_batch(self, request):
+        return self._transition_batch(request, posting.POST, 'transactions posted')
+
+    @action(detail=False, methods=['post'])
+    def void_batch(self, request):
+        return self._transition_batch(request, posting.VOID, 'transactions voided')
+
+    @action(detail=False, methods=['post'])
+    def generate_recurring(self, request):
+        # Every due recurring transaction of the organization, including missed periods
+        generated = recurring_journals.generate_due_journals(
+            organization=request.user.organization
+        )
+        return Response({'generated_transactions': generated})
+
+    @action(detail=False, methods=['post'])
+    def generate_reversals(self, request):
+        # Every due reversal of the organization, including missed days
+        reversed_ids = reversals.reverse_due_transactions(
+            organization=request.user.organization
+        )
+        return Response({'reversals': reversed_ids})
+
 class BudgetViewSet(viewsets.ModelViewSet):
     queryset = Budget.objects.all()
     serializer_class = BudgetSerializer
@@ -270,15 +329,29 @@ class InvoiceViewSet(viewsets.ModelViewSet):
     permission_classes = [IsAuthenticated]
     filter_backends = [filters.SearchFilter, filters.OrderingFilter]
     search_fields = ['number', 'reference', 'party_name', 'party_tax_id']
-    ordering_fields = ['date', 'due_date', 'total', 'status']
+    ordering_fields = [
+        'date', 'due_date', 'subtotal', 'tax_amount', 'total',
+        'amount_paid', 'outstanding', 'status'
+    ]
     ordering = ['-date']
+    
+    # Query parameter -> lookup for filtering on stored amounts
+    amount_filters = {
+        'min_total': 'total__gte',
+        'max_total': 'total__lte',
+        'min_outstanding': 'outstanding__gte',
+        'max_outstanding': 'outstanding__lte',
+    }
 
     def get_queryset(self):
         queryset = Invoice.objects.filter(
             organization=self.request.user.organization
+        ).annotate(
+            outstanding=F('total') - F('amount_paid')
         )
         status = self.request.query_params.get('status', None)
         type = self.request.query_params.get('type', None)
+        party = self.request.query_params.get('party', None)
         start_date = self.request.query_params.get('start_date', None)
         end_date = self.request.query_params.get('end_date', None)
         
@@ -286,10 +359,22 @@ class InvoiceViewSet(viewsets.ModelViewSet):
             queryset = queryset.filter(status=status)
         if type:
             queryset = queryset.filter(type=type)
+        if party:
+            queryset = queryset.filter(party=party)
         if start_date:
             queryset = queryset.filter(date__gte=start_date)
         if end_date:
             queryset = queryset.filter(date__lte=end_date)
+        for param, lookup in self.amount_filters.items():
+            value = self.request.query_params.get(param)
+            if value:
+                try:
+                    value = Decimal(value)
+                except ArithmeticError:
+                    value = None
+                if value is None or not value.is_finite():
+                    raise serializers.ValidationError({param: _("A valid number is required")})
+                queryset = queryset.filter(**{lookup: value})
             
         return queryset
 
@@ -329,9 +414,15 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         invoice.status = 'sent'
         invoice.save()
         
-        # TODO: Implement email sending logic
+        # Rendered and emailed by a Celery task once committed
+        delivery.queue_invoice_emails([invoice.pk])
+        invoice.refresh_from_db(fields=['email_status', 'email_error'])
         
-        return Response({'status': 'invoice sent'})
+        return Response({
+            'status': 'invoice sent',
+            'email_status': invoice.email_status,
+            'email_error': invoice.email_error
+        })
 
     @action(detail=True, methods=['post'])
     def cancel(self, request, pk=None):
@@ -348,13 +439,45 @@ class InvoiceViewSet(viewsets.ModelViewSet):
         
         return Response({'status': 'invoice cancelled'})
 
+    @action(detail=True, methods=['get'])
+    def pdf(self, request, pk=None):
+        invoice = self.get_object()
+        
+        # Serve the stored PDF while it matches the invoice, else render it
+        if invoice.pdf_file and invoice.pdf_hash == rendering.invoice_pdf_hash(invoice):
+            return FileResponse(
+                invoice.pdf_file.open('rb'),
+                content_type='application/pdf',
+                filename=f"{invoice.number}.pdf"
+            )
+        from .tasks import render_invoice_pdfs
+        render_invoice_pdfs.delay([invoice.pk])
+        return Response({'status': 'rendering'}, status=status.HTTP_202_ACCEPTED)
+
+    @action(detail=False, methods=['post'])
+    def render_pdfs(self, request):
+        invoices = self.get_queryset()
+        ids = request.data.get('ids')
+        if ids:
+            invoices = invoices.filter(pk__in=ids)
+        invoice_ids = list(invoices.values_list('pk', flat=True))
+        
+        from .tasks import render_invoice_pdfs
+        task = render_invoice_pdfs.delay(invoice_ids, force=bool(request.data.get('force')))
+        return Response(
+            {'task_id': task.id, 'invoices': len(invoice_ids)},
+            status=status.HTTP_202_ACCEPTED
+        )
+
     @action(detail=True, methods=['get'])
     def payments(self, request, pk=None):
         invoice = self.get_object()
-        payments = invoice.payments.all().order_by('-date')
+        invoice_payments = Payment.objects.filter(
+            allocations__invoice=invoice
+        ).distinct().order_by('-date')
         
         return Response({
-            'payments': PaymentSerializer(payments, many=True).data,
+            'payments': PaymentSerializer(invoice_payments, many=True).data,
             'total_paid': invoice.amount_paid,
             'balance_due': invoice.balance_due
         })
@@ -382,43 +505,93 @@ class FixedAssetViewSet(viewsets.ModelViewSet):
             
         return queryset
 
+    def get_serializer(self, *args, **kwargs):
+        if kwargs.get('many') and args:
+            assets = list(args[0])
+            kwargs.setdefault('context', self.get_serializer_context())
+            kwargs['context']['depreciation_schedules'] = depreciation.schedules(assets)
+            args = (assets, *args[1:])
+        return super().get_serializer(*args, **kwargs)
+
     def perform_create(self, serializer):
         serializer.save(
             organization=self.request.user.organization,
             created_by=self.request.user
         )
 
+    def _disposal_data(self, request, serializer_class):
+        serializer = serializer_class(data=request.data, context=self.get_serializer_context())
+        serializer.is_valid(raise_exception=True)
+        return serializer.validated_data
+
+    def _dispose(self, request, data, proceeds):
+        journal, gain = disposals.dispose_assets(
+            request.user.organization,
+            proceeds,
+            data.get('date') or date.today(),
+            proceeds_account=data.get('proceeds_account'),
+            gain_loss_account=data.get('gain_loss_account'),
+            status=data.get('status'),
+            user=request.user
+        )
+        return Response({
+            'status': 'assets disposed',
+            'assets': len(proceeds),
+            'transaction': journal.pk,
+            'gain_loss': gain
+        })
+
     @action(detail=True, methods=['post'])
     def dispose(self, request, pk=None):
         asset = self.get_object()
-        disposal_date = request.data.get('date', date.today())
-        disposal_value = request.data.get('value', 0)
-        
-        if asset.status != 'active':
-            return Response(
-                {'error': _("Can only dispose active assets")},
-                status=status.HTTP_400_BAD_REQUEST
-            )
-            
-        asset.status = 'disposed'
-        asset.current_value = disposal_value
-        asset.save()
-        
-        # TODO: Create disposal transaction
+        data = self._disposal_data(request, AssetDisposalSerializer)
+        return self._dispose(request, data, {asset.pk: data['value']})
+
+    @action(detail=False, methods=['post'])
+    def dispose_batch(self, request):
+        data = self._disposal_data(request, AssetBatchDisposalSerializer)
+        return self._dispose(request, data, {item['id']: item['value'] for item in data['assets']})
+
+    @action(detail=False, methods=['post'])
+    def run_depreciation(self, request):
+        period_end = request.data.get('period_end')
+        if period_end:
+            period_end = parse_date(str(period_end))
+            if period_end is None:
+                return Response(
+                    {'error': _("Invalid date")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            period_end = statements.previous_month()[1]
+        period_end = depreciation.month_end(depreciation.month_index(period_end))
+        organization = request.user.organization
+        posting.check_period_open(organization, period_end)
         
-        return Response({
-            'status': 'asset disposed',
-            'disposal_value': disposal_value
-        })
+        from .tasks import run_organization_depreciation
+        task = run_organization_depreciation.delay(
+            organization.pk, period_end.isoformat(), request.user.pk
+        )
+        return Response(
+            {'task_id': task.id, 'period_end': period_end},
+            status=status.HTTP_202_ACCEPTED
+        )
 
     @action(detail=True, methods=['get'])
     def depreciation_schedule(self, request, pk=None):
         asset = self.get_object()
         end_date = request.query_params.get('end_date', None)
+        if end_date:
+            end_date = parse_date(end_date)
+            if end_date is None:
+                return Response(
+                    {'error': _("Invalid date")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
         
-        schedule = asset.calculate_depreciation(
-            end_date or (asset.purchase_date + timedelta(days=365*asset.useful_life_years))
-        )
+        schedule = depreciation.schedules([asset])[asset.pk]
+        if end_date:
+            schedule = [row for row in schedule if row['period'] <= end_date]
         
         return Response(schedule)
 
@@ -448,6 +621,138 @@ class TaxRateViewSet(viewsets.ModelViewSet):
     def perform_create(self, serializer):
         serializer.save(organization=self.request.user.organization)
 
+class ExchangeRateViewSet(viewsets.ModelViewSet):
+    queryset = ExchangeRate.objects.all()
+    serializer_class = ExchangeRateSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['currency', 'source']
+    ordering_fields = ['currency', 'date', 'rate']
+    ordering = ['currency', '-date']
+
+    def get_queryset(self):
+        queryset = ExchangeRate.objects.filter(
+            organization=self.request.user.organization
+        )
+        currency = self.request.query_params.get('currency', None)
+        start_date = self.request.query_params.get('start_date', None)
+        end_date = self.request.query_params.get('end_date', None)
+        
+        if currency:
+            queryset = queryset.filter(currency=currency.upper())
+        if start_date:
+            queryset = queryset.filter(date__gte=start_date)
+        if end_date:
+            queryset = queryset.filter(date__lte=end_date)
+            
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(organization=self.request.user.organization)
+        fx.clear_rate_cache()
+
+    def perform_update(self, serializer):
+        serializer.save()
+        fx.clear_rate_cache()
+
+    def perform_destroy(self, instance):
+        instance.delete()
+        fx.clear_rate_cache()
+
+    @action(detail=False, methods=['post'])
+    def revalue(self, request):
+        period_end = request.data.get('period_end')
+        if period_end:
+            period_end = parse_date(str(period_end))
+            if period_end is None:
+                return Response(
+                    {'error': _("Invalid date")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            period_end = statements.previous_month()[1]
+        organization = request.user.organization
+        posting.check_period_open(organization, period_end)
+        gain_loss_account = fx.gain_loss_account(
+            organization, request.data.get('gain_loss_account')
+        )
+        
+        from .tasks import revalue_organization_accounts
+        task = revalue_organization_accounts.delay(
+            organization.pk, period_end.isoformat(), gain_loss_account, request.user.pk
+        )
+        return Response(
+            {'task_id': task.id, 'period_end': period_end},
+            status=status.HTTP_202_ACCEPTED
+        )
+
+class AllocationRuleViewSet(viewsets.ModelViewSet):
+    queryset = AllocationRule.objects.all()
+    serializer_class = AllocationRuleSerializer
+    permission_classes = [IsAuthenticated]
+    filter_backends = [filters.SearchFilter, filters.OrderingFilter]
+    search_fields = ['name', 'description']
+    ordering_fields = ['name', 'method']
+    ordering = ['name']
+
+    def get_queryset(self):
+        queryset = AllocationRule.objects.filter(
+            organization=self.request.user.organization
+        ).annotate(
+            last_period_end=Max('runs__period_end')
+        ).prefetch_related('targets')
+        is_active = self.request.query_params.get('is_active', None)
+        method = self.request.query_params.get('method', None)
+        
+        if is_active is not None:
+            queryset = queryset.filter(is_active=is_active == 'true')
+        if method:
+            queryset = queryset.filter(method=method)
+            
+        return queryset
+
+    @transaction.atomic
+    def perform_create(self, serializer):
+        serializer.save(
+            organization=self.request.user.organization,
+            created_by=self.request.user
+        )
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        serializer.save()
+
+    @action(detail=True, methods=['get'])
+    def runs(self, request, pk=None):
+        rule = self.get_object()
+        serializer = AllocationRunSerializer(rule.runs.select_related('rule'), many=True)
+        return Response(serializer.data)
+
+    @action(detail=False, methods=['post'])
+    def run(self, request):
+        period_end = request.data.get('period_end')
+        if period_end:
+            period_end = parse_date(str(period_end))
+            if period_end is None:
+                return Response(
+                    {'error': _("Invalid date")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            period_end = statements.previous_month()[1]
+        period_end = depreciation.month_end(depreciation.month_index(period_end))
+        organization = request.user.organization
+        posting.check_period_open(organization, period_end)
+        
+        from .tasks import run_organization_allocations
+        task = run_organization_allocations.delay(
+            organization.pk, period_end.isoformat(), request.user.pk
+        )
+        return Response(
+            {'task_id': task.id, 'period_end': period_end},
+            status=status.HTTP_202_ACCEPTED
+        )
+
 class PaymentViewSet(viewsets.ModelViewSet):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
@@ -479,23 +784,14 @@ class PaymentViewSet(viewsets.ModelViewSet):
 
     @transaction.atomic
     def perform_create(self, serializer):
-        payment = serializer.save(
+        serializer.save(
             organization=self.request.user.organization,
             created_by=self.request.user
         )
-        
-        # Update invoice paid amount
-        invoice = payment.invoice
-        invoice.amount_paid = invoice.payments.aggregate(
-            total=Sum('amount')
-        )['total'] or 0
-        
-        if invoice.amount_paid >= invoice.total:
-            invoice.status = 'paid'
-        elif invoice.amount_paid > 0:
-            invoice.status = 'partially_paid'
-            
-        invoice.save()
+
+    @transaction.atomic
+    def perform_update(self, serializer):
+        serializer.save()
 
     @action(detail=True, methods=['post'])
     def void(self, request, pk=None):
@@ -507,26 +803,36 @@ class PaymentViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_400_BAD_REQUEST
             )
             
-        payment.status = 'voided'
-        payment.save()
-        
-        # Update invoice status
-        invoice = payment.invoice
-        invoice.amount_paid = invoice.payments.exclude(
-            status='voided'
-        ).aggregate(total=Sum('amount'))['total'] or 0
-        
-        if invoice.amount_paid >= invoice.total:
-            invoice.status = 'paid'
-        elif invoice.amount_paid > 0:
-            invoice.status = 'partially_paid'
-        else:
-            invoice.status = 'sent'
-            
-        invoice.save()
+        payments.set_payment_status(payment, Payment.Status.VOIDED)
         
         return Response({'status': 'payment voided'})
 
+    @action(detail=False, methods=['post'], parser_classes=[JSONParser, MultiPartParser, FormParser])
+    def remittance(self, request):
+        """Apply a remittance file (CSV) or a list of payments in one batch."""
+        if 'file' in request.FILES:
+            decoded_file = request.FILES['file'].read().decode('utf-8')
+            rows = list(csv.DictReader(io.StringIO(decoded_file)))
+        else:
+            rows = request.data.get('payments', [])
+        
+        if not rows:
+            return Response(
+                {'error': _("No payments provided")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        created, errors = payments.apply_remittance(
+            request.user.organization,
+            rows,
+            user=request.user
+        )
+        
+        return Response({
+            'created_payments': [payment.id for payment in created],
+            'errors': errors
+        })
+
 class RecurringInvoiceViewSet(viewsets.ModelViewSet):
     queryset = RecurringInvoice.objects.all()
     serializer_class = RecurringInvoiceSerializer
@@ -606,11 +912,96 @@ class RecurringInvoiceViewSet(viewsets.ModelViewSet):
             ).data
         })
 
+class PeriodCloseViewSet(viewsets.ModelViewSet):
+    queryset = PeriodClose.objects.all()
+    serializer_class = PeriodCloseSerializer
+    permission_classes = [IsAuthenticated]
+    http_method_names = ['get', 'post', 'delete', 'head', 'options']
+
+    def get_queryset(self):
+        return PeriodClose.objects.filter(
+            organization=self.request.user.organization
+        )
+
+    def perform_create(self, serializer):
+        serializer.instance = periods.close_period(
+            self.request.user.organization,
+            serializer.validated_data['period_end'],
+            user=self.request.user,
+            notes=serializer.validated_data.get('notes', '')
+        )
+
+    def perform_destroy(self, instance):
+        periods.reopen_period(instance)
+
+    @action(detail=True, methods=['get'])
+    def balances(self, request, pk=None):
+        period_close = self.get_object()
+        balances = period_close.balances.select_related('account').order_by('account__code')
+        serializer = ClosingBalanceSerializer(balances, many=True)
+        return Response(serializer.data)
+
+class NumberSequenceViewSet(viewsets.ModelViewSet):
+    queryset = NumberSequence.objects.all()
+    serializer_class = NumberSequenceSerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        return NumberSequence.objects.filter(
+            organization=self.request.user.organization
+        )
+
+    def perform_create(self, serializer):
+        serializer.save(organization=self.request.user.organization)
+
+class PartyViewSet(viewsets.ModelViewSet):
+    queryset = Party.objects.all()
+    serializer_class = PartySerializer
+    permission_classes = [IsAuthenticated]
+
+    def get_queryset(self):
+        organization = self.request.user.organization
+        query = self.request.query_params.get('search', None)
+        if query and self.action == 'list':
+            return parties.search_parties(organization, query, limit=50)
+        queryset = Party.objects.filter(organization=organization)
+        type = self.request.query_params.get('type', None)
+        if type:
+            queryset = queryset.filter(type__in=[type, Party.Type.BOTH])
+        return queryset
+
+    def perform_create(self, serializer):
+        serializer.save(organization=self.request.user.organization)
+
+    @action(detail=False, methods=['get'])
+    def balances(self, request):
+        return Response(parties.open_balance_summary(request.user.organization))
+
+    @action(detail=True, methods=['get'])
+    def balance(self, request, pk=None):
+        party = self.get_object()
+        balances = parties.party_balances(request.user.organization, [party.pk])
+        return Response(balances.get(party.pk, {
+            'party': party.pk,
+            'name': party.name,
+            'open_invoices': 0,
+            'receivable': Decimal('0'),
+            'payable': Decimal('0'),
+            'overdue': Decimal('0'),
+            'oldest_due_date': None,
+        }))
+
+    @action(detail=True, methods=['get'])
+    def invoices(self, request, pk=None):
+        party = self.get_object()
+        invoices = party.invoices.prefetch_related('items').order_by('-date')
+        return Response(InvoiceSerializer(invoices, many=True).data)
+
 class BalanceSheetView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        date = request.query_params.get('date', date.today())
+        as_of = request.query_params.get('date', date.today())
         organization = request.user.organization
         
         # Get all accounts
@@ -619,16 +1010,17 @@ class BalanceSheetView(APIView):
             is_active=True
         ).exclude(account_type='income').exclude(account_type='expense')
         
+        # Closed periods are read from their closing balances
+        totals = periods.cumulative_totals(organization, as_of)
+        
         # Calculate balances
         assets = []
         liabilities = []
         equity = []
         
         for account in accounts:
-            balance = account.entries.filter(
-                transaction__date__lte=date,
-                transaction__status='posted'
-            ).aggregate(balance=Coalesce(Sum('amount'), 0))['balance']
+            debits, credits = totals.get(account.id, (Decimal('0'), Decimal('0')))
+            balance = debits - credits
             
             account_data = {
                 'id': account.id,
@@ -650,7 +1042,7 @@ class BalanceSheetView(APIView):
         total_equity = sum(account['balance'] for account in equity)
         
         return Response({
-            'date': date,
+            'date': as_of,
             'assets': {
                 'accounts': assets,
                 'total': total_assets
@@ -681,21 +1073,16 @@ class IncomeStatementView(APIView):
             account_type__in=['income', 'expense']
         )
         
+        # Closed periods are read from their closing balances
+        totals = periods.period_totals(organization, start_date, end_date)
+        
         # Calculate balances
         income = []
         expenses = []
         
         for account in accounts:
-            query = Q(
-                transaction__status='posted',
-                transaction__date__lte=end_date
-            )
-            if start_date:
-                query &= Q(transaction__date__gte=start_date)
-            
-            balance = account.entries.filter(query).aggregate(
-                balance=Coalesce(Sum('amount'), 0)
-            )['balance']
+            debits, credits = totals.get(account.id, (Decimal('0'), Decimal('0')))
+            balance = debits - credits
             
             account_data = {
                 'id': account.id,
@@ -757,13 +1144,15 @@ class CashFlowStatementView(APIView):
             if start_date:
                 query &= Q(transaction__date__gte=start_date)
             
-            entries = account.entries.filter(query).select_related('transaction')
+            entries = account.entries.filter(query).select_related('transaction').annotate(
+                base_amount=fx.base_amount(organization.currency)
+            )
             
             for entry in entries:
                 flow_data = {
                     'date': entry.transaction.date,
                     'description': entry.transaction.description,
-                    'amount': entry.amount
+                    'amount': entry.base_amount
                 }
                 
                 # Classify the cash flow
@@ -809,7 +1198,7 @@ class TrialBalanceView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        date = request.query_params.get('date', date.today())
+        as_of = request.query_params.get('date', date.today())
         organization = request.user.organization
         
         accounts = Account.objects.filter(
@@ -817,23 +1206,15 @@ class TrialBalanceView(APIView):
             is_active=True
         )
         
+        # Closed periods are read from their closing balances
+        totals = periods.cumulative_totals(organization, as_of)
+        
         trial_balance = []
         total_debits = Decimal('0')
         total_credits = Decimal('0')
         
         for account in accounts:
-            entries = account.entries.filter(
-                transaction__date__lte=date,
-                transaction__status='posted'
-            )
-            
-            debits = entries.filter(amount__gt=0).aggregate(
-                total=Coalesce(Sum('amount'), 0)
-            )['total']
-            
-            credits = abs(entries.filter(amount__lt=0).aggregate(
-                total=Coalesce(Sum('amount'), 0)
-            )['total'])
+            debits, credits = totals.get(account.id, (Decimal('0'), Decimal('0')))
             
             if debits > 0 or credits > 0:
                 trial_balance.append({
@@ -848,7 +1229,7 @@ class TrialBalanceView(APIView):
                 total_credits += credits
         
         return Response({
-            'date': date,
+            'date': as_of,
             'accounts': trial_balance,
             'totals': {
                 'debits': total_debits,
@@ -861,18 +1242,25 @@ class AgedReceivablesView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        as_of_date = request.query_params.get('date', date.today())
+        as_of_date = request.query_params.get('date')
+        as_of_date = parse_date(as_of_date) if as_of_date else date.today()
+        if as_of_date is None:
+            return Response(
+                {'error': _("Invalid date")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         organization = request.user.organization
         
         # Get all unpaid sales invoices
         invoices = Invoice.objects.filter(
             organization=organization,
             type='sale',
-            status__in=['sent', 'partially_paid'],
+            status__in=['sent', 'partially_paid', 'overdue'],
             date__lte=as_of_date
         ).annotate(
-            days_overdue=ExtractDay(Value(as_of_date) - F('due_date')),
-            balance_due=F('total') - F('amount_paid')
+            base_balance_due=fx.invoice_base_amount(
+                F('total') - F('amount_paid'), organization.currency
+            )
         )
         
         # Age brackets
@@ -883,13 +1271,16 @@ class AgedReceivablesView(APIView):
         days_over_90 = []
         
         for invoice in invoices:
+            invoice.days_overdue = (as_of_date - invoice.due_date).days
             data = {
                 'invoice_number': invoice.number,
                 'party_name': invoice.party_name,
                 'date': invoice.date,
                 'due_date': invoice.due_date,
+                'currency': invoice.currency,
                 'total': invoice.total,
                 'balance_due': invoice.balance_due,
+                'base_balance_due': invoice.base_balance_due,
                 'days_overdue': max(0, invoice.days_overdue)
             }
             
@@ -909,27 +1300,27 @@ class AgedReceivablesView(APIView):
             'aging': {
                 'current': {
                     'invoices': current,
-                    'total': sum(inv['balance_due'] for inv in current)
+                    'total': sum(inv['base_balance_due'] for inv in current)
                 },
                 '1-30_days': {
                     'invoices': days_1_30,
-                    'total': sum(inv['balance_due'] for inv in days_1_30)
+                    'total': sum(inv['base_balance_due'] for inv in days_1_30)
                 },
                 '31-60_days': {
                     'invoices': days_31_60,
-                    'total': sum(inv['balance_due'] for inv in days_31_60)
+                    'total': sum(inv['base_balance_due'] for inv in days_31_60)
                 },
                 '61-90_days': {
                     'invoices': days_61_90,
-                    'total': sum(inv['balance_due'] for inv in days_61_90)
+                    'total': sum(inv['base_balance_due'] for inv in days_61_90)
                 },
                 'over_90_days': {
                     'invoices': days_over_90,
-                    'total': sum(inv['balance_due'] for inv in days_over_90)
+                    'total': sum(inv['base_balance_due'] for inv in days_over_90)
                 }
             },
             'total_receivables': sum(
-                inv.balance_due for inv in invoices
+                inv.base_balance_due for inv in invoices
             )
         })
 
@@ -937,18 +1328,25 @@ class AgedPayablesView(APIView):
     permission_classes = [IsAuthenticated]
     
     def get(self, request):
-        as_of_date = request.query_params.get('date', date.today())
+        as_of_date = request.query_params.get('date')
+        as_of_date = parse_date(as_of_date) if as_of_date else date.today()
+        if as_of_date is None:
+            return Response(
+                {'error': _("Invalid date")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         organization = request.user.organization
         
         # Get all unpaid purchase invoices
         invoices = Invoice.objects.filter(
             organization=organization,
             type='purchase',
-            status__in=['sent', 'partially_paid'],
+            status__in=['sent', 'partially_paid', 'overdue'],
             date__lte=as_of_date
         ).annotate(
-            days_overdue=ExtractDay(Value(as_of_date) - F('due_date')),
-            balance_due=F('total') - F('amount_paid')
+            base_balance_due=fx.invoice_base_amount(
+                F('total') - F('amount_paid'), organization.currency
+            )
         )
         
         # Age brackets (same as receivables)
@@ -959,13 +1357,16 @@ class AgedPayablesView(APIView):
         days_over_90 = []
         
         for invoice in invoices:
+            invoice.days_overdue = (as_of_date - invoice.due_date).days
             data = {
                 'invoice_number': invoice.number,
                 'party_name': invoice.party_name,
                 'date': invoice.date,
                 'due_date': invoice.due_date,
+                'currency': invoice.currency,
                 'total': invoice.total,
                 'balance_due': invoice.balance_due,
+                'base_balance_due': invoice.base_balance_due,
                 'days_overdue': max(0, invoice.days_overdue)
             }
             
@@ -985,27 +1386,27 @@ class AgedPayablesView(APIView):
             'aging': {
                 'current': {
                     'invoices': current,
-                    'total': sum(inv['balance_due'] for inv in current)
+                    'total': sum(inv['base_balance_due'] for inv in current)
                 },
                 '1-30_days': {
                     'invoices': days_1_30,
-                    'total': sum(inv['balance_due'] for inv in days_1_30)
+                    'total': sum(inv['base_balance_due'] for inv in days_1_30)
                 },
                 '31-60_days': {
                     'invoices': days_31_60,
-                    'total': sum(inv['balance_due'] for inv in days_31_60)
+                    'total': sum(inv['base_balance_due'] for inv in days_31_60)
                 },
                 '61-90_days': {
                     'invoices': days_61_90,
-                    'total': sum(inv['balance_due'] for inv in days_61_90)
+                    'total': sum(inv['base_balance_due'] for inv in days_61_90)
                 },
                 'over_90_days': {
                     'invoices': days_over_90,
-                    'total': sum(inv['balance_due'] for inv in days_over_90)
+                    'total': sum(inv['base_balance_due'] for inv in days_over_90)
                 }
             },
             'total_payables': sum(
-                inv.balance_due for inv in invoices
+                inv.base_balance_due for inv in invoices
             )
         })
 
@@ -1053,7 +1454,11 @@ class BudgetVsActualView(APIView):
                 transaction__date__gte=budget.start_date,
                 transaction__date__lte=budget.end_date
             ).aggregate(
-                total=Coalesce(Sum('amount'), 0)
+                total=Coalesce(
+                    Sum(fx.base_amount(organization.currency)),
+                    Value(Decimal('0')),
+                    output_field=DecimalField()
+                )
             )['total']
             
             variance = item.amount - actual_amount
@@ -1097,6 +1502,59 @@ class BudgetVsActualView(APIView):
             }
         })
 
+class CustomerStatementsView(APIView):
+    permission_classes = [IsAuthenticated]
+    
+    def get_period(self, data):
+        period_start, period_end = statements.previous_month()
+        try:
+            if data.get('start_date'):
+                period_start = date.fromisoformat(str(data['start_date']))
+            if data.get('end_date'):
+                period_end = date.fromisoformat(str(data['end_date']))
+        except ValueError:
+            return None
+        if period_start > period_end:
+            return None
+        return period_start, period_end
+    
+    def get(self, request):
+        period = self.get_period(request.query_params)
+        if period is None:
+            return Response(
+                {'error': _("Invalid statement period")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        party = request.query_params.get('party')
+        result = statements.compute_statements(
+            request.user.organization,
+            *period,
+            party_ids=[party] if party else None
+        )
+        return Response(result)
+    
+    def post(self, request):
+        period = self.get_period(request.data)
+        fmt = request.data.get('format', rendering.PDF)
+        if period is None or fmt not in rendering.FORMATS:
+            return Response(
+                {'error': _("Invalid statement period or format")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        
+        # Rendering runs on a Celery worker, not on the web process
+        from .tasks import generate_customer_statements
+        task = generate_customer_statements.delay(
+            request.user.organization.pk,
+            period[0].isoformat(),
+            period[1].isoformat(),
+            fmt
+        )
+        return Response(
+            {'task_id': task.id, 'period_start': period[0], 'period_end': period[1]},
+            status=status.HTTP_202_ACCEPTED
+        )
+
 class TaxSummaryView(APIView):
     permission_classes = [IsAuthenticated]
     
@@ -1106,64 +1564,49 @@ class TaxSummaryView(APIView):
         organization = request.user.organization
         
         # Get all tax rates
-        tax_rates = TaxRate.objects.filter(
+        tax_rates = list(TaxRate.objects.filter(
             organization=organization,
             is_active=True
+        ))
+        
+        # Tax per invoice type and rate, in one grouped query
+        items = InvoiceItem.objects.filter(
+            invoice__organization=organization,
+            invoice__type__in=['sale', 'purchase'],
+            invoice__status__in=['sent', 'paid', 'partially_paid', 'overdue'],
+            invoice__date__lte=end_date,
+            tax_rate__in={tax_rate.rate for tax_rate in tax_rates}
         )
-        
-        summary = []
-        total_tax_collected = Decimal('0')
-        total_tax_paid = Decimal('0')
-        
-        for tax_rate in tax_rates:
-            # Sales tax collected
-            sales_tax = InvoiceItem.objects.filter(
-                invoice__organization=organization,
-                invoice__type='sale',
-                invoice__status__in=['sent', 'paid', 'partially_paid'],
-                invoice__date__lte=end_date,
-                tax_rate=tax_rate.rate
-            )
-            
-            if start_date:
-                sales_tax = sales_tax.filter(invoice__date__gte=start_date)
-            
-            tax_collected = sales_tax.aggregate(
-                tax=Sum(F('quantity') * F('unit_price') * F('tax_rate') / 100)
-            )['tax'] or 0
-            
-            # Purchase tax paid
-            purchase_tax = InvoiceItem.objects.filter(
-                invoice__organization=organization,
-                invoice__type='purchase',
-                invoice__status__in=['sent', 'paid', 'partially_paid'],
-                invoice__date__lte=end_date,
-                tax_rate=tax_rate.rate
+        if start_date:
+            items = items.filter(invoice__date__gte=start_date)
+        taxes = {
+            (row['invoice__type'], row['tax_rate']): row['tax']
+            for row in items.order_by().values('invoice__type', 'tax_rate').annotate(
+                tax=Sum(fx.invoice_base_amount(F('tax_amount'), organization.currency, 'invoice__'))
             )
-            
-            if start_date:
-                purchase_tax = purchase_tax.filter(invoice__date__gte=start_date)
-            
-            tax_paid = purchase_tax.aggregate(
-                tax=Sum(F('quantity') * F('unit_price') * F('tax_rate') / 100)
-            )['tax'] or 0
-            
-            summary.append({
+        }
+        
+        collected = money.to_cents(taxes.get(('sale', tax_rate.rate)) for tax_rate in tax_rates)
+        paid = money.to_cents(taxes.get(('purchase', tax_rate.rate)) for tax_rate in tax_rates)
+        recoverable = np.array([tax_rate.is_recoverable for tax_rate in tax_rates], dtype=bool)
+        net = collected - np.where(recoverable, paid, 0)
+        
+        summary = [
+            {
                 'tax_rate': {
                     'id': tax_rate.id,
                     'name': tax_rate.name,
                     'rate': tax_rate.rate,
                     'is_recoverable': tax_rate.is_recoverable
                 },
-                'tax_collected': tax_collected,
-                'tax_paid': tax_paid,
-                'net_tax': tax_collected - (
-                    tax_paid if tax_rate.is_recoverable else 0
-                )
-            })
-            
-            total_tax_collected += tax_collected
-            total_tax_paid += tax_paid if tax_rate.is_recoverable else 0
+                'tax_collected': money.from_cents(collected[index]),
+                'tax_paid': money.from_cents(paid[index]),
+                'net_tax': money.from_cents(net[index])
+            }
+            for index, tax_rate in enumerate(tax_rates)
+        ]
+        total_tax_collected = money.from_cents(collected.sum())
+        total_tax_paid = money.from_cents(paid[recoverable].sum())
         
         return Response({
             'period': {
@@ -1180,42 +1623,85 @@ class TaxSummaryView(APIView):
 
 class AccountReconciliationView(APIView):
     permission_classes = [IsAuthenticated]
+    parser_classes = [JSONParser, MultiPartParser, FormParser]
     
     def post(self, request, pk):
         account = get_object_or_404(Account, pk=pk, organization=request.user.organization)
         
         # Get reconciliation data
-        statement_balance = Decimal(request.data.get('statement_balance', 0))
-        statement_date = request.data.get('statement_date', date.today())
-        reconciled_items = request.data.get('reconciled_items', [])
-        
-        # Mark entries as reconciled
-        for item in reconciled_items:
-            entry = get_object_or_404(
-                TransactionEntry,
-                id=item['entry_id'],
-                account=account
+        try:
+            statement_balance = Decimal(str(request.data.get('statement_balance', 0)))
+            date_window = int(request.data.get('date_window', reconciliation.DEFAULT_DATE_WINDOW))
+            if not statement_balance.is_finite():
+                raise ValueError(statement_balance)
+        except (ArithmeticError, TypeError, ValueError):
+            return Response(
+                {'error': _("Invalid statement balance or date window")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
+        statement_date = request.data.get('statement_date')
+        if statement_date:
+            try:
+                statement_date = parse_date(str(statement_date))
+            except ValueError:
+                statement_date = None
+            if statement_date is None:
+                return Response(
+                    {'error': _("Invalid statement date")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        else:
+            statement_date = date.today()
+        confirm = str(request.data.get('confirm', 'true')).lower() not in ('false', '0')
+        
+        # Statement lines to auto-match, from a CSV file or a list
+        if 'file' in request.FILES:
+            lines = reconciliation.read_statement_csv(request.FILES['file'])
+        else:
+            lines = request.data.get('statement_lines') or []
+            if not isinstance(lines, list) or not all(isinstance(line, dict) for line in lines):
+                return Response(
+                    {'error': _("statement_lines must be a list of objects")},
+                    status=status.HTTP_400_BAD_REQUEST
+                )
+        
+        # Entries picked by hand are confirmed together with the matches
+        items = request.data.get('reconciled_items') or []
+        try:
+            if not isinstance(items, list):
+                raise TypeError(items)
+            entry_ids = [
+                int(str(item['entry_id'] if isinstance(item, dict) else item))
+                for item in items
+            ]
+        except (KeyError, TypeError, ValueError):
+            return Response(
+                {'error': _("reconciled_items must be a list of entry ids")},
+                status=status.HTTP_400_BAD_REQUEST
             )
-            entry.reconciled = True
-            entry.reconciled_date = statement_date
-            entry.save()
+        
+        result = reconciliation.reconcile_statement(
+            account, lines, statement_date, date_window, confirm, entry_ids
+        )
         
         # Calculate reconciled balance
         reconciled_balance = account.entries.filter(
             transaction__date__lte=statement_date,
             reconciled=True
         ).aggregate(
-            balance=Coalesce(Sum('amount'), 0)
+            balance=Coalesce(Sum('amount'), Value(Decimal('0')), output_field=DecimalField())
         )['balance']
         
         # Calculate unreconciled items
         unreconciled_items = account.entries.filter(
             transaction__date__lte=statement_date,
+            transaction__status__in=posting.BALANCE_STATUSES,
             reconciled=False
         ).values(
             'id',
             'transaction__date',
             'transaction__description',
+            'transaction__reference',
             'amount'
         )
         
@@ -1229,6 +1715,10 @@ class AccountReconciliationView(APIView):
             'statement_balance': statement_balance,
             'reconciled_balance': reconciled_balance,
             'difference': statement_balance - reconciled_balance,
+            'matches': result['matches'],
+            'unmatched_lines': result['unmatched_lines'],
+            'errors': result['errors'],
+            'reconciled': result['reconciled'],
             'unreconciled_items': unreconciled_items
         })
 
@@ -1260,10 +1750,13 @@ class TransactionImportView(APIView):
         for row in csv_data:
             try:
                 with transaction.atomic():
+                    trans_date = datetime.strptime(row['date'], '%Y-%m-%d').date()
+                    posting.check_period_open(request.user.organization, trans_date)
+                    
                     # Create transaction
                     trans = Transaction.objects.create(
                         organization=request.user.organization,
-                        date=datetime.strptime(row['date'], '%Y-%m-%d').date(),
+                        date=trans_date,
                         description=row['description'],
                         reference=row.get('reference', ''),
                         created_by=request.user
@@ -1312,6 +1805,11 @@ class TransactionExportView(APIView):
     def get(self, request):
         start_date = request.query_params.get('start_date')
         end_date = request.query_params.get('end_date', date.today())
+        # Not 'format': DRF reads that one as a renderer override
+        export_format = request.query_params.get('export_format', 'csv')
+        
+        if export_format in exports.FORMATS:
+            return self.get_columnar(request, export_format, start_date, end_date)
         
         # Get transactions
         transactions = Transaction.objects.filter(
@@ -1357,44 +1855,42 @@ class TransactionExportView(APIView):
             'filename': f'transactions_{start_date}_{end_date}.csv'
         })
 
+    def get_columnar(self, request, export_format, start_date, end_date):
+        entries = exports.ledger_queryset(
+            request.user.organization,
+            start_date=start_date,
+            end_date=end_date
+        )
+        
+        # Spool to disk rather than memory; large ledgers run to gigabytes
+        output = tempfile.TemporaryFile()
+        exports.write_ledger(output, entries, fmt=export_format)
+        output.seek(0)
+        
+        extension = 'parquet' if export_format == exports.PARQUET else 'arrow'
+        return FileResponse(
+            output,
+            as_attachment=True,
+            filename=f'ledger_{start_date}_{end_date}.{extension}',
+            content_type=(
+                'application/vnd.apache.parquet'
+                if export_format == exports.PARQUET
+                else 'application/vnd.apache.arrow.file'
+            )
+        )
+
 class GenerateRecurringInvoicesView(APIView):
     permission_classes = [IsAuthenticated]
     
     def post(self, request):
         organization = request.user.organization
         
-        # Get all active recurring invoices due for generation
-        recurring_invoices = RecurringInvoice.objects.filter(
-            organization=organization,
-            is_active=True,
-            next_date__lte=date.today()
-        ).exclude(
-            end_date__lt=date.today()
-        )
-        
-        generated_invoices = []
-        errors = []
-        
-        for recurring in recurring_invoices:
-            try:
-                invoice = recurring.generate_invoice()
-                recurring.update_next_date()
-                generated_invoices.append(invoice.id)
-                
-                if recurring.auto_send:
-                    invoice.status = 'sent'
-                    invoice.save()
-                    # TODO: Implement email sending logic
-            
-            except Exception as e:
-                errors.append({
-                    'recurring_invoice_id': recurring.id,
-                    'error': str(e)
-                })
+        # Every due template of the organization, including missed periods
+        generated_invoices = recurring.generate_due_invoices(organization=organization)
         
         return Response({
             'generated_invoices': generated_invoices,
-            'errors': errors
+            'errors': []
         })
 
 class GenerateFinancialStatementsView(APIView):
@@ -1402,33 +1898,43 @@ class GenerateFinancialStatementsView(APIView):
     
     def post(self, request):
         organization = request.user.organization
-        date = request.data.get('date', date.today())
+        as_of = request.data.get('date', date.today())
+        fmt = request.data.get('format')
         report_types = request.data.get('report_types', [
             'balance_sheet',
             'income_statement',
             'cash_flow'
         ])
+        if fmt and fmt not in rendering.FORMATS:
+            return Response(
+                {'error': _("Invalid format")},
+                status=status.HTTP_400_BAD_REQUEST
+            )
         
         reports = {}
         
         if 'balance_sheet' in report_types:
             balance_sheet_view = BalanceSheetView()
-            reports['balance_sheet'] = balance_sheet_view.get(
-                request._request
-            ).data
+            reports['balance_sheet'] = balance_sheet_view.get(request).data
         
         if 'income_statement' in report_types:
             income_statement_view = IncomeStatementView()
-            reports['income_statement'] = income_statement_view.get(
-                request._request
-            ).data
+            reports['income_statement'] = income_statement_view.get(request).data
         
         if 'cash_flow' in report_types:
             cash_flow_view = CashFlowStatementView()
-            reports['cash_flow'] = cash_flow_view.get(
-                request._request
-            ).data
-        
-        # TODO: Generate PDF reports
-        
-        return Response(reports)
+            reports['cash_flow'] = cash_flow_view.get(request).data
+        
+        if not fmt:
+            return Response(reports)
+        
+        # Rendering runs on a Celery worker, not on the web process
+        from .tasks import render_financial_statements
+        task = render_financial_statements.delay(
+            organization.pk,
+            json.loads(json.dumps(reports, cls=DjangoJSONEncoder)),
+            str(as_of),
+            fmt,
+            request.user.pk
+        )
+        return Response({'reports': reports, 'task_id': task.id}, status=status.HTTP_202_ACCEPTED)
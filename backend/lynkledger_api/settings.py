@@ -14,6 +14,7 @@ import os
 from pathlib import Path
 from datetime import timedelta
 import dj_database_url
+from celery.schedules import crontab
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -56,6 +57,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
     
     # Third party apps
     'corsheaders',
@@ -219,6 +221,9 @@ STATICFILES_DIRS = []  # Removemos STATICFILES_DIRS ya que no lo necesitamos en
 MEDIA_URL = '/media/'
 MEDIA_ROOT = '/app/media'
 
+# Private files (organization exports), never served as media
+PRIVATE_MEDIA_ROOT = os.environ.get('PRIVATE_MEDIA_ROOT', '/app/private')
+
 # Static files finders
 STATICFILES_FINDERS = [
     'django.contrib.staticfiles.finders.FileSystemFinder',
@@ -358,6 +363,48 @@ CELERY_TASK_TIME_LIMIT = 30 * 60  # 30 minutes
 CELERY_TASK_SOFT_TIME_LIMIT = 25 * 60  # 25 minutes
 CELERY_WORKER_PREFETCH_MULTIPLIER = 1
 CELERY_WORKER_MAX_TASKS_PER_CHILD = 1000
+# Document rendering spreads batches over a process pool, which prefork
+# children cannot start: these tasks go to a worker running --pool=solo
+CELERY_TASK_ROUTES = {
+    'accounting.tasks.render_invoice_pdfs': {'queue': 'rendering'},
+    'accounting.tasks.render_financial_statements': {'queue': 'rendering'},
+    'accounting.tasks.send_invoice_emails': {'queue': 'rendering'},
+    'accounting.tasks.generate_customer_statements': {'queue': 'rendering'},
+}
+CELERY_BEAT_SCHEDULE = {
+    'generate-recurring-invoices': {
+        'task': 'accounting.tasks.generate_recurring_invoices',
+        'schedule': crontab(hour=2, minute=0),
+    },
+    'generate-recurring-journals': {
+        'task': 'accounting.tasks.generate_recurring_journals',
+        'schedule': crontab(hour=2, minute=30),
+    },
+    'reverse-due-transactions': {
+        'task': 'accounting.tasks.reverse_due_transactions',
+        'schedule': crontab(hour=0, minute=30),
+    },
+    'mark-overdue-invoices': {
+        'task': 'accounting.tasks.mark_overdue_invoices',
+        'schedule': crontab(hour=1, minute=0),
+    },
+    'generate-customer-statements': {
+        'task': 'accounting.tasks.generate_customer_statements',
+        'schedule': crontab(day_of_month=1, hour=3, minute=0),
+    },
+    'run-monthly-depreciation': {
+        'task': 'accounting.tasks.run_monthly_depreciation',
+        'schedule': crontab(day_of_month=1, hour=4, minute=0),
+    },
+    'run-monthly-allocations': {
+        'task': 'accounting.tasks.run_monthly_allocations',
+        'schedule': crontab(day_of_month=1, hour=4, minute=30),
+    },
+    'revalue-foreign-currency-accounts': {
+        'task': 'accounting.tasks.revalue_foreign_currency_accounts',
+        'schedule': crontab(day_of_month=1, hour=5, minute=0),
+    },
+}
 
 # Email settings
 EMAIL_BACKEND = os.environ.get('EMAIL_BACKEND', 'django.core.mail.backends.smtp.EmailBackend')
@@ -368,6 +415,10 @@ EMAIL_HOST_PASSWORD = os.environ.get('EMAIL_HOST_PASSWORD', '')
 EMAIL_USE_TLS = os.environ.get('EMAIL_USE_TLS', 'True') == 'True'
 DEFAULT_FROM_EMAIL = os.environ.get('DEFAULT_FROM_EMAIL', 'noreply@lynkledger.com')
 
+# Invoice delivery: invoices sent per SMTP connection and per organization per minute
+INVOICE_EMAIL_BATCH_SIZE = int(os.environ.get('INVOICE_EMAIL_BATCH_SIZE', 100))
+INVOICE_EMAIL_RATE_LIMIT = int(os.environ.get('INVOICE_EMAIL_RATE_LIMIT', 300))
+
 # Django REST Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': (
@@ -383,3 +434,9 @@ STRIPE_SECRET_KEY = os.environ.get("STRIPE_SECRET_KEY")
 STRIPE_WEBHOOK_SECRET = os.environ.get("STRIPE_WEBHOOK_SECRET")
 STRIPE_PLAN_ID = os.environ.get("STRIPE_PLAN_ID", "price_xxx")  # Cambia "price_xxx" por el ID real de tu plan en Stripe
 FRONTEND_URL = os.environ.get("FRONTEND_URL", "http://localhost:3000")
+BACKEND_URL = os.environ.get("BACKEND_URL", "http://localhost:8000")
+
+# Organization exports above this many rows are built by a Celery worker
+ORGANIZATION_EXPORT_SYNC_ROW_LIMIT = int(os.environ.get('ORGANIZATION_EXPORT_SYNC_ROW_LIMIT', 100000))
+# Lifetime in seconds of the signed download links emailed for background exports
+ORGANIZATION_EXPORT_LINK_MAX_AGE = int(os.environ.get('ORGANIZATION_EXPORT_LINK_MAX_AGE', 48 * 3600))
@@ -0,0 +1,339 @@
+"""
+Full organization backup and restore.
+
+An export is a ZIP archive holding one NDJSON file per model (one JSON object
+per row, as returned by ``values()``) plus a ``manifest.json``.  Rows are read
+with chunked iterators and the archive is produced incrementally, so a tenant
+of any size can be streamed without being held in memory.
+
+Restoring reads the same archive back in model dependency order, inserts rows
+with ``bulk_create`` and remaps every foreign key from the old primary keys
+to the newly assigned ones.  Many-to-many links are backed up as the rows of
+their through tables, listed after both ends, so they are remapped the same
+way.
+
+Archives built in the background are stored outside ``MEDIA_ROOT`` under an
+unguessable name and handed out through an expiring signed link, checked
+against the requester's membership on download.
+"""
+import io
+import json
+import uuid
+import zipfile
+from itertools import islice
+
+from django.apps import apps
+from django.conf import settings
+from django.core import signing
+from django.core.files.storage import FileSystemStorage
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import transaction
+from django.utils import timezone
+
+FORMAT_VERSION = 1
+CHUNK_SIZE = 2000
+
+# (model label, lookup to the organization, restorable) in dependency order:
+# every model only points at models listed before it (or at itself).
+BACKUP_MODELS = (
+    ('organizations.OrganizationMembership', 'organization', False),
+    ('organizations.OrganizationInvitation', 'organization', False),
+    ('accounting.Account', 'organization', True),
+    ('accounting.Transaction', 'organization', True),
+    ('accounting.TransactionEntry', 'transaction__organization', True),
+    ('accounting.Budget', 'organization', True),
+    ('accounting.BudgetItem', 'budget__organization', True),
+    ('accounting.TaxRate', 'organization', True),
+    ('accounting.ExchangeRate', 'organization', True),
+    ('accounting.Party', 'organization', True),
+    ('accounting.Invoice', 'organization', True),
+    ('accounting.InvoiceItem', 'invoice__organization', True),
+    ('accounting.Payment', 'organization', True),
+    ('accounting.PaymentAllocation', 'payment__organization', True),
+    ('accounting.RecurringInvoice', 'organization', True),
+    ('accounting.RecurringInvoiceItem', 'recurring_invoice__organization', True),
+    ('accounting.FixedAsset', 'organization', True),
+    ('accounting.DepreciationRun', 'organization', True),
+    ('accounting.AllocationRule', 'organization', True),
+    ('accounting.AllocationTarget', 'rule__organization', True),
+    ('accounting.AllocationRun', 'organization', True),
+    ('documents.DocumentCategory', 'organization', True),
+    ('documents.Document', 'organization', True),
+    ('documents.Document_related_documents', 'from_document__organization', True),
+    ('messaging.Conversation', 'organization', True),
+    ('messaging.ConversationMember', 'conversation__organization', True),
+    ('messaging.Message', 'conversation__organization', True),
+    ('messaging.Message_mentions', 'message__conversation__organization', True),
+)
+
+# Columns never written to an archive
+SECRET_FIELDS = {
+    'organizations.OrganizationInvitation': ('token',),
+}
+
+EXPORT_SIGNING_SALT = 'organizations.export'
+
+
+def backup_querysets(organization):
+    """Yield ``(label, queryset)`` for every model included in a backup."""
+    for label, lookup, _restorable in BACKUP_MODELS:
+        model = apps.get_model(label)
+        yield label, model.objects.filter(**{lookup: organization}).order_by('pk')
+
+
+def estimate_rows(organization):
+    """Total number of rows an export of ``organization`` would contain."""
+    return sum(queryset.count() for _label, queryset in backup_querysets(organization))
+
+
+def exported_fields(model):
+    """Columns of ``model`` included in an archive, secret ones left out."""
+    secret = SECRET_FIELDS.get(model._meta.label, ())
+    return [field.attname for field in model._meta.concrete_fields if field.name not in secret]
+
+
+def iter_ndjson(queryset, chunk_size=CHUNK_SIZE):
+    """Encode a queryset as NDJSON, one chunk of rows per yielded bytes object."""
+    rows = queryset.values(*exported_fields(queryset.model)).iterator(chunk_size=chunk_size)
+    while True:
+        chunk = list(islice(rows, chunk_size))
+        if not chunk:
+            return
+        yield ''.join(
+            json.dumps(row, cls=DjangoJSONEncoder) + '\n' for row in chunk
+        ).encode('utf-8')
+
+
+def _manifest(organization, counts):
+    return json.dumps({
+        'format_version': FORMAT_VERSION,
+        'organization': {
+            'id': organization.pk,
+            'name': organization.name,
+            'slug': organization.slug,
+            'type': organization.organization_type,
+            'currency': organization.currency,
+            'created_at': organization.created_at,
+        },
+        'exported_at': timezone.now(),
+        'counts': counts,
+    }, cls=DjangoJSONEncoder, indent=2)
+
+
+class _ZipStream:
+    """
+    Write-only file object collecting the bytes ``zipfile`` produces so they
+    can be handed out as they are written.  It has no ``tell``/``seek``, which
+    makes ``zipfile`` use data descriptors instead of seeking back.
+    """
+
+    def __init__(self):
+        self._chunks = []
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def flush(self):
+        pass
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
+def iter_archive(organization, chunk_size=CHUNK_SIZE):
+    """Yield the bytes of a backup archive of ``organization`` as it is built."""
+    stream = _ZipStream()
+    counts = {}
+    with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+        for label, queryset in backup_querysets(organization):
+            rows = 0
+            with archive.open(f'{label}.ndjson', 'w', force_zip64=True) as member:
+                for chunk in iter_ndjson(queryset, chunk_size):
+                    member.write(chunk)
+                    rows += chunk.count(b'\n')
+                    yield stream.drain()
+            counts[label] = rows
+            yield stream.drain()
+        archive.writestr('manifest.json', _manifest(organization, counts))
+    yield stream.drain()
+
+
+def write_archive(organization, fileobj, chunk_size=CHUNK_SIZE):
+    """Write a backup archive of ``organization`` to a binary file object."""
+    for data in iter_archive(organization, chunk_size):
+        if data:
+            fileobj.write(data)
+
+
+def export_storage():
+    """Storage of background exports; never served under ``MEDIA_URL``."""
+    return FileSystemStorage(location=settings.PRIVATE_MEDIA_ROOT)
+
+
+def export_path(organization):
+    """Unguessable storage path for a new export of ``organization``."""
+    return f"exports/organizations/{organization.pk}/{uuid.uuid4().hex}.zip"
+
+
+def sign_export(organization, user, path):
+    """Signed download token of a stored export, bound to ``user``."""
+    return signing.dumps(
+        {'organization': organization.pk, 'user': user.pk, 'path': path},
+        salt=EXPORT_SIGNING_SALT
+    )
+
+
+def load_export(token):
+    """
+    ``(organization id, user id, path)`` of a download token, or ``None`` if
+    it was tampered with or is older than ``ORGANIZATION_EXPORT_LINK_MAX_AGE``.
+    """
+    try:
+        data = signing.loads(
+            token,
+            salt=EXPORT_SIGNING_SALT,
+            max_age=settings.ORGANIZATION_EXPORT_LINK_MAX_AGE
+        )
+    except signing.BadSignature:
+        return None
+    return data['organization'], data['user'], data['path']
+
+
+def _iter_rows(member):
+    for line in io.TextIOWrapper(member, encoding='utf-8'):
+        if line.strip():
+            yield json.loads(line)
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+class _ExistingKeys:
+    """Cache of which primary keys of models outside the backup exist here."""
+
+    def __init__(self):
+        self._known = {}
+
+    def filter(self, model, keys):
+        known = self._known.setdefault(model, {})
+        missing = {key for key in keys if key not in known}
+        if missing:
+            found = set(
+                model._default_manager.filter(pk__in=missing)
+                .values_list('pk', flat=True)
+            )
+            for key in missing:
+                known[key] = key in found
+        return {key for key in keys if known[key]}
+
+
+@transaction.atomic
+def restore_archive(organization, fileobj, chunk_size=CHUNK_SIZE):
+    """
+    Restore a backup archive into ``organization``.
+
+    Primary keys are reassigned by the database; foreign keys to restored
+    models are remapped, keys to users and other shared tables are kept when
+    the row exists in this database and dropped (or the row skipped, for
+    required keys) otherwise.  Returns the number of rows restored per model.
+    """
+    organization_model = organization._meta.model
+    id_maps = {}
+    existing = _ExistingKeys()
+    restored = {}
+
+    with zipfile.ZipFile(fileobj) as archive:
+        names = set(archive.namelist())
+        for label, _lookup, restorable in BACKUP_MODELS:
+            member_name = f'{label}.ndjson'
+            if not restorable or member_name not in names:
+                continue
+            model = apps.get_model(label)
+            id_map = id_maps[model] = {}
+            fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+            self_refs = [
+                f for f in fields
+                if f.is_relation and f.related_model is model
+            ]
+            pending_parents = []
+            restored[label] = 0
+
+            with archive.open(member_name) as member:
+                for rows in _chunks(_iter_rows(member), chunk_size):
+                    objs, old_ids = _build_objects(
+                        model, fields, rows, organization, organization_model,
+                        id_maps, existing
+                    )
+                    created = model.objects.bulk_create(objs, batch_size=chunk_size)
+                    for old_id, obj in zip(old_ids, created):
+                        id_map[old_id] = obj.pk
+                    if self_refs:
+                        rows_by_id = {row[model._meta.pk.attname]: row for row in rows}
+                        for old_id, obj in zip(old_ids, created):
+                            pending_parents.append((obj, rows_by_id[old_id]))
+                    restored[label] += len(created)
+
+            # Self references can point forward, so they are resolved once
+            # every row of the model has its new key.
+            if self_refs:
+                changed = []
+                for obj, row in pending_parents:
+                    for field in self_refs:
+                        old_parent = row.get(field.attname)
+                        if old_parent is not None and old_parent in id_map:
+                            setattr(obj, field.attname, id_map[old_parent])
+                            changed.append(obj)
+                if changed:
+                    model.objects.bulk_update(
+                        changed, [f.name for f in self_refs], batch_size=chunk_size
+                    )
+    return restored
+
+
+def _build_objects(model, fields, rows, organization, organization_model,
+                   id_maps, existing):
+    # Look up the external keys of the whole chunk in one query per model
+    external = {}
+    for field in fields:
+        if (field.is_relation and field.related_model is not model
+                and field.related_model is not organization_model
+                and field.related_model not in id_maps):
+            keys = {row.get(field.attname) for row in rows} - {None}
+            external[field.attname] = existing.filter(field.related_model, keys)
+
+    objs, old_ids = [], []
+    for row in rows:
+        values = {}
+        skip = False
+        for field in fields:
+            value = row.get(field.attname)
+            if field.is_relation and value is not None:
+                related = field.related_model
+                if related is organization_model:
+                    value = organization.pk
+                elif related is model:
+                    value = None  # resolved after the whole model is loaded
+                elif related in id_maps:
+                    value = id_maps[related].get(value)
+                elif value not in external[field.attname]:
+                    value = None
+                if value is None and not field.null:
+                    skip = True
+                    break
+            elif value is not None:
+                value = field.to_python(value)
+            values[field.attname] = value
+        if skip:
+            continue
+        objs.append(model(**values))
+        old_ids.append(row[model._meta.pk.attname])
+    return objs, old_ids
@@ -0,0 +1,47 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+from organizations.tenant_copy import TenantCopier, TenantCopyError, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = (
+        "Copy an organization and all of its data to another database alias, "
+        "then verify row counts and the ledger checksum"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('organization', help='Organization id or slug in the source database')
+        parser.add_argument('--source', default='default', help='Source database alias')
+        parser.add_argument('--target', required=True, help='Target database alias')
+        parser.add_argument('--slug', help='Slug for the copy (defaults to the current one)')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        for alias in (options['source'], options['target']):
+            if alias not in settings.DATABASES:
+                raise CommandError(f"Unknown database alias '{alias}'")
+
+        value = options['organization']
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        try:
+            organization = Organization.objects.using(options['source']).get(**lookup)
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization '{value}' does not exist")
+
+        copier = TenantCopier(
+            organization,
+            source=options['source'],
+            target=options['target'],
+            new_slug=options['slug'],
+            chunk_size=options['chunk_size'],
+            log=self.stdout.write
+        )
+        try:
+            copied = copier.run()
+        except TenantCopyError as e:
+            raise CommandError(str(e))
+
+        self.stdout.write(self.style.SUCCESS(
+            f"Copied {organization} to '{options['target']}' as organization {copied.pk}"
+        ))
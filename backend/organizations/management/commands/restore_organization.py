@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand, CommandError
+from organizations.models import Organization
+from organizations.backup import restore_archive, CHUNK_SIZE
+
+
+class Command(BaseCommand):
+    help = "Restore an organization backup archive into an existing organization"
+
+    def add_arguments(self, parser):
+        parser.add_argument('archive', help='Path to the backup ZIP archive')
+        parser.add_argument('organization', help='Target organization id or slug')
+        parser.add_argument('--chunk-size', type=int, default=CHUNK_SIZE)
+
+    def handle(self, *args, **options):
+        value = options['organization']
+        lookup = {'pk': value} if value.isdigit() else {'slug': value}
+        try:
+            organization = Organization.objects.get(**lookup)
+        except Organization.DoesNotExist:
+            raise CommandError(f"Organization '{value}' does not exist")
+
+        with open(options['archive'], 'rb') as archive:
+            restored = restore_archive(
+                organization,
+                archive,
+                chunk_size=options['chunk_size']
+            )
+
+        for label, rows in restored.items():
+            self.stdout.write(f"{label}: {rows}")
+        self.stdout.write(self.style.SUCCESS(
+            f"Restored {sum(restored.values())} rows into {organization}"
+        ))
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.10 on 2026-10-18 22:16
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('organizations', '0009_alter_organization_owner'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='organization',
+            name='books_closed_through',
+            field=models.DateField(blank=True, help_text='Transactions dated on or before this date can no longer be changed', null=True, verbose_name='books closed through'),
+        ),
+    ]
@@ -53,6 +53,12 @@ class Organization(models.Model):
     fiscal_year_start = models.DateField(_('fiscal year start'), null=True, blank=True)
     currency = models.CharField(_('currency'), max_length=3, default='USD')
     tax_id = models.CharField(_('tax ID'), max_length=50, blank=True)
+    books_closed_through = models.DateField(
+        _('books closed through'),
+        null=True,
+        blank=True,
+        help_text=_('Transactions dated on or before this date can no longer be changed')
+    )
     
     # Metadata
     created_at = models.DateTimeField(_("Fecha de creación"), auto_now_add=True)
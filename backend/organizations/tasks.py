@@ -0,0 +1,39 @@
+from celery import shared_task
+from django.conf import settings
+from django.core.files import File
+from django.urls import reverse
+from urllib.parse import urlencode
+import tempfile
+
+
+@shared_task
+def export_organization_data(organization_id, user_id):
+    """Build a full backup archive in the background and email a signed download link."""
+    from .models import Organization
+    from .backup import export_path, export_storage, sign_export, write_archive
+    from users.models import User
+    from users.tasks import send_notification_email
+
+    try:
+        organization = Organization.objects.get(id=organization_id)
+        user = User.objects.get(id=user_id)
+    except (Organization.DoesNotExist, User.DoesNotExist):
+        return None
+
+    with tempfile.TemporaryFile() as output:
+        write_archive(organization, output)
+        output.seek(0)
+        path = export_storage().save(export_path(organization), File(output))
+
+    link = '{}{}?{}'.format(
+        settings.BACKEND_URL.rstrip('/'),
+        reverse('organizations:organization-download-export'),
+        urlencode({'token': sign_export(organization, user, path)})
+    )
+    hours = settings.ORGANIZATION_EXPORT_LINK_MAX_AGE // 3600
+    send_notification_email.delay(
+        user.email,
+        f"Export of '{organization.name}' is ready",
+        f"Your data export is ready: {link}\nThe link expires in {hours} hours."
+    )
+    return path
@@ -0,0 +1,385 @@
+"""
+Copy one organization and everything that belongs to it between databases.
+
+The set of tenant tables is not hard-coded: every model of ``TENANT_APPS``
+(including auto-created many-to-many tables) that reaches ``Organization``
+through its foreign keys is copied, in an order where referenced tables are
+loaded before the tables pointing at them.
+
+New primary keys are reserved in the target up front, one block per table,
+so every foreign key (including self references) can be rewritten before a
+row is written.  On PostgreSQL rows are then streamed in with ``COPY``; other
+backends fall back to ``bulk_create`` with explicit keys.
+"""
+import io
+from collections import OrderedDict, defaultdict
+from datetime import date, datetime, time
+from itertools import islice
+import json
+
+from django.apps import apps
+from django.contrib.contenttypes.fields import GenericForeignKey
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connections, models, transaction
+from django.db.models import Max
+
+from .models import Organization
+
+TENANT_APPS = (
+    'organizations', 'accounting', 'documents',
+    'messaging', 'notifications', 'ai_assistant',
+)
+
+# Tables shared by every tenant.  Their rows are matched in the target by
+# natural key and only inserted when missing.
+SHARED_NATURAL_KEYS = {
+    'users.User': ('username',),
+    'contenttypes.ContentType': ('app_label', 'model'),
+    'notifications.NotificationCategory': ('type', 'name'),
+}
+
+CHUNK_SIZE = 5000
+
+
+class TenantCopyError(Exception):
+    pass
+
+
+def _foreign_keys(model):
+    return [
+        field for field in model._meta.concrete_fields
+        if field.is_relation and field.many_to_one
+    ]
+
+
+def tenant_models():
+    """
+    Return an ``OrderedDict`` mapping each tenant model to the lookup that
+    filters it by organization, in dependency order.
+    """
+    candidates = [
+        model for model in apps.get_models(include_auto_created=True)
+        if model._meta.app_label in TENANT_APPS and model is not Organization
+    ]
+
+    paths = {}
+
+    def path_to_organization(model, visiting):
+        if model in paths:
+            return paths[model]
+        if model in visiting:
+            return None
+        visiting = visiting | {model}
+        fks = sorted(_foreign_keys(model), key=lambda f: (f.null, f.name))
+        for field in fks:
+            if field.related_model is Organization:
+                paths[model] = field.name
+                return field.name
+        for field in fks:
+            related = field.related_model
+            if related is model or related not in candidates:
+                continue
+            parent_path = path_to_organization(related, visiting)
+            if parent_path is not None and not field.null:
+                paths[model] = f'{field.name}__{parent_path}'
+                return paths[model]
+        return None
+
+    for model in candidates:
+        path_to_organization(model, frozenset())
+
+    # Kahn's algorithm over tenant-to-tenant foreign keys
+    pending = [model for model in candidates if model in paths]
+    depends = {
+        model: {
+            f.related_model for f in _foreign_keys(model)
+            if f.related_model in paths and f.related_model is not model
+        }
+        for model in pending
+    }
+    ordered = OrderedDict()
+    while pending:
+        ready = [model for model in pending if not depends[model] - set(ordered)]
+        if not ready:
+            raise TenantCopyError(
+                "Circular foreign keys between "
+                + ', '.join(model._meta.label for model in pending)
+            )
+        for model in ready:
+            ordered[model] = paths[model]
+            pending.remove(model)
+    return ordered
+
+
+def _chunks(iterable, size):
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def _copy_text(value):
+    """Encode a Python value for PostgreSQL's COPY text format."""
+    if value is None:
+        return '\\N'
+    if isinstance(value, bool):
+        return 't' if value else 'f'
+    if isinstance(value, (dict, list)):
+        value = json.dumps(value, cls=DjangoJSONEncoder)
+    elif isinstance(value, (datetime, date, time)):
+        value = value.isoformat()
+    else:
+        value = str(value)
+    return (
+        value.replace('\\', '\\\\').replace('\t', '\\t')
+        .replace('\n', '\\n').replace('\r', '\\r')
+    )
+
+
+class TenantCopier:
+    def __init__(self, organization, source='default', target='default',
+                 new_slug=None, chunk_size=CHUNK_SIZE, log=None):
+        self.organization = organization
+        self.source = source
+        self.target = target
+        self.new_slug = new_slug or organization.slug
+        self.chunk_size = chunk_size
+        self.log = log or (lambda message: None)
+        self.id_maps = defaultdict(dict)
+        self.target_organization = None
+        self.tenant = OrderedDict()
+        self.counts = OrderedDict()
+        self._reserved = {}
+
+    # Target key allocation -------------------------------------------------
+
+    def allocate_ids(self, model, count):
+        """Reserve ``count`` primary keys for ``model`` in the target."""
+        if not count:
+            return []
+        connection = connections[self.target]
+        table = model._meta.db_table
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT nextval(pg_get_serial_sequence(%s, %s)) "
+                    "FROM generate_series(1, %s)",
+                    [connection.ops.quote_name(table), model._meta.pk.column, count]
+                )
+                return [row[0] for row in cursor.fetchall()]
+        # Other backends: take the block after the current maximum.  The
+        # copy runs in one target transaction, so nothing else interleaves.
+        start = model._base_manager.using(self.target).aggregate(
+            top=Max('pk')
+        )['top'] or 0
+        start = max(start, self._reserved.get(model, 0))
+        self._reserved[model] = start + count
+        return list(range(start + 1, start + count + 1))
+
+    # Shared tables ---------------------------------------------------------
+
+    def map_shared(self, model, ids):
+        """Map keys of a shared table to the target, inserting missing rows."""
+        id_map = self.id_maps[model]
+        missing = [pk for pk in set(ids) if pk not in id_map and pk is not None]
+        if not missing:
+            return
+        natural_key = SHARED_NATURAL_KEYS.get(model._meta.label)
+        if natural_key is None:
+            # Unknown shared table: only keep keys that already line up
+            existing = set(
+                model._base_manager.using(self.target)
+                .filter(pk__in=missing).values_list('pk', flat=True)
+            )
+            for pk in missing:
+                id_map[pk] = pk if pk in existing else None
+            return
+
+        pk_name = model._meta.pk.attname
+        fields = [f for f in model._meta.concrete_fields if not f.primary_key]
+        source_rows = list(
+            model._base_manager.using(self.source).filter(pk__in=missing).values()
+        )
+        keys = {tuple(row[k] for k in natural_key): row for row in source_rows}
+        if not keys:
+            return
+        lookup = models.Q()
+        for key in keys:
+            lookup |= models.Q(**dict(zip(natural_key, key)))
+        for row in model._base_manager.using(self.target).filter(lookup).values(
+            'pk', *natural_key
+        ):
+            source_row = keys.pop(tuple(row[k] for k in natural_key))
+            id_map[source_row[pk_name]] = row['pk']
+
+        to_create = []
+        for key, row in keys.items():
+            values = {}
+            for field in fields:
+                value = row[field.attname]
+                if field.is_relation:
+                    value = None
+                    if not field.null:
+                        raise TenantCopyError(
+                            f"Cannot insert {model._meta.label} {key} in the target"
+                        )
+                values[field.attname] = value
+            to_create.append((row[pk_name], model(**values)))
+        if to_create:
+            created = model._base_manager.using(self.target).bulk_create(
+                [obj for _, obj in to_create]
+            )
+            for (old_pk, _), obj in zip(to_create, created):
+                id_map[old_pk] = obj.pk
+
+    # Row copying -----------------------------------------------------------
+
+    def remap(self, model, fields, rows):
+        """Rewrite primary and foreign keys of ``rows`` in place."""
+        pk_name = model._meta.pk.attname
+        for field in fields:
+            related = field.related_model
+            if field.primary_key or not field.is_relation:
+                continue
+            if related not in self.tenant and related is not Organization:
+                self.map_shared(related, [row[field.attname] for row in rows])
+
+        generic = [
+            f for f in model._meta.private_fields if isinstance(f, GenericForeignKey)
+        ]
+        content_types = apps.get_model('contenttypes', 'ContentType')
+
+        for row in rows:
+            row[pk_name] = self.id_maps[model][row[pk_name]]
+            for field in fields:
+                if not field.is_relation or field.primary_key:
+                    continue
+                value = row[field.attname]
+                if value is None:
+                    continue
+                new_value = self.id_maps[field.related_model].get(value)
+                if new_value is None and not field.null:
+                    raise TenantCopyError(
+                        f"{model._meta.label} {value} references a "
+                        f"{field.related_model._meta.label} that was not copied"
+                    )
+                row[field.attname] = new_value
+            for field in generic:
+                # Generic relations to copied rows follow their new keys.
+                # The content type was already remapped above.
+                ct_id = row[model._meta.get_field(field.ct_field).attname]
+                object_id = row[field.fk_field]
+                if ct_id is None or object_id is None:
+                    continue
+                target_model = content_types.objects.db_manager(
+                    self.target
+                ).get_for_id(ct_id).model_class()
+                if target_model in self.tenant:
+                    row[field.fk_field] = self.id_maps[target_model].get(object_id)
+
+    def write_rows(self, model, fields, rows):
+        connection = connections[self.target]
+        if connection.vendor == 'postgresql':
+            buffer = io.StringIO()
+            for row in rows:
+                buffer.write('\t'.join(
+                    _copy_text(row[f.attname]) for f in fields
+                ))
+                buffer.write('\n')
+            buffer.seek(0)
+            columns = ', '.join(connection.ops.quote_name(f.column) for f in fields)
+            with connection.cursor() as cursor:
+                cursor.copy_expert(
+                    f"COPY {connection.ops.quote_name(model._meta.db_table)} "
+                    f"({columns}) FROM STDIN",
+                    buffer
+                )
+        else:
+            model._base_manager.using(self.target).bulk_create(
+                [model(**{f.attname: row[f.attname] for f in fields}) for row in rows],
+                batch_size=self.chunk_size
+            )
+
+    def copy_model(self, model, lookup):
+        queryset = model._base_manager.using(self.source).filter(
+            **{lookup: self.organization.pk}
+        ).order_by('pk')
+        fields = list(model._meta.concrete_fields)
+
+        # Reserve every new key first, so that forward self references and
+        # later chunks can be remapped without a second pass.
+        id_map = self.id_maps[model]
+        for chunk in _chunks(
+            queryset.values_list('pk', flat=True).iterator(chunk_size=self.chunk_size),
+            self.chunk_size
+        ):
+            id_map.update(zip(chunk, self.allocate_ids(model, len(chunk))))
+
+        rows = 0
+        for chunk in _chunks(
+            queryset.values(*[f.attname for f in fields]).iterator(chunk_size=self.chunk_size),
+            self.chunk_size
+        ):
+            self.remap(model, fields, chunk)
+            self.write_rows(model, fields, chunk)
+            rows += len(chunk)
+        self.counts[model._meta.label] = rows
+        self.log(f"{model._meta.label}: {rows}")
+
+    def copy_organization(self):
+        fields = list(Organization._meta.concrete_fields)
+        row = Organization.objects.using(self.source).filter(
+            pk=self.organization.pk
+        ).values(*[f.attname for f in fields]).get()
+        if Organization.objects.using(self.target).filter(slug=self.new_slug).exists():
+            raise TenantCopyError(
+                f"An organization with slug '{self.new_slug}' already exists in '{self.target}'"
+            )
+        row['slug'] = self.new_slug
+        self.id_maps[Organization][row['id']] = self.allocate_ids(Organization, 1)[0]
+        self.remap(Organization, fields, [row])
+        self.write_rows(Organization, fields, [row])
+        self.target_organization = Organization.objects.using(self.target).get(
+            pk=row['id']
+        )
+
+    def run(self):
+        self.tenant = tenant_models()
+        with transaction.atomic(using=self.target):
+            self.copy_organization()
+            for model, lookup in self.tenant.items():
+                self.copy_model(model, lookup)
+            self.verify()
+        return self.target_organization
+
+    # Verification ----------------------------------------------------------
+
+    def verify(self):
+        """Compare row counts and ledger checksums between source and target."""
+        from accounting.integrity import ledger_checksum
+
+        mismatches = []
+        for model, lookup in self.tenant.items():
+            source_rows = model._base_manager.using(self.source).filter(
+                **{lookup: self.organization.pk}
+            ).count()
+            target_rows = model._base_manager.using(self.target).filter(
+                **{lookup: self.target_organization.pk}
+            ).count()
+            if source_rows != target_rows:
+                mismatches.append(
+                    f"{model._meta.label}: {source_rows} rows in source, {target_rows} in target"
+                )
+
+        source_checksum = ledger_checksum(self.organization, using=self.source)
+        target_checksum = ledger_checksum(self.target_organization, using=self.target)
+        if source_checksum != target_checksum:
+            mismatches.append(
+                f"ledger checksum {source_checksum} != {target_checksum}"
+            )
+
+        if mismatches:
+            raise TenantCopyError('Verification failed: ' + '; '.join(mismatches))
+        self.log(f"Verified ledger checksum {target_checksum}")
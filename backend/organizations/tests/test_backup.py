@@ -0,0 +1,194 @@
+from django.test import TestCase, override_settings
+from django.contrib.auth import get_user_model
+from django.urls import reverse
+from decimal import Decimal
+from organizations.models import Organization, OrganizationInvitation
+from organizations.backup import write_archive, restore_archive, export_storage
+from organizations.tasks import export_organization_data
+from rest_framework.test import APIClient
+from unittest.mock import patch
+from urllib.parse import parse_qs, urlparse
+from accounting.models import Account, Transaction, TransactionEntry
+from documents.models import Document
+from messaging.models import Conversation, Message
+import io
+import json
+import tempfile
+import zipfile
+
+User = get_user_model()
+
+class OrganizationBackupTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@test.com',
+            password='testpass123'
+        )
+        self.organization = Organization.objects.create(
+            name='Source Org',
+            slug='source-org',
+            owner=self.owner
+        )
+        assets = Account.objects.create(
+            organization=self.organization,
+            name='Assets',
+            code='1',
+            account_type='asset',
+            created_by=self.owner
+        )
+        self.cash = Account.objects.create(
+            organization=self.organization,
+            name='Cash',
+            code='1000',
+            account_type='asset',
+            parent=assets
+        )
+        revenue = Account.objects.create(
+            organization=self.organization,
+            name='Revenue',
+            code='4000',
+            account_type='income'
+        )
+        trans = Transaction.objects.create(
+            organization=self.organization,
+            date='2024-01-15',
+            description='Sale'
+        )
+        TransactionEntry.objects.create(transaction=trans, account=self.cash, amount=Decimal('99.95'))
+        TransactionEntry.objects.create(transaction=trans, account=revenue, amount=Decimal('-99.95'))
+
+    def test_archive_contents(self):
+        output = io.BytesIO()
+        write_archive(self.organization, output, chunk_size=1)
+
+        with zipfile.ZipFile(output) as archive:
+            manifest = json.loads(archive.read('manifest.json'))
+            self.assertEqual(manifest['counts']['accounting.Account'], 3)
+            self.assertEqual(manifest['counts']['accounting.TransactionEntry'], 2)
+            lines = archive.read('accounting.TransactionEntry.ndjson').splitlines()
+            self.assertEqual(json.loads(lines[0])['amount'], '99.95')
+
+    def test_restore_remaps_keys(self):
+        output = io.BytesIO()
+        write_archive(self.organization, output)
+        output.seek(0)
+
+        target = Organization.objects.create(
+            name='Target Org',
+            slug='target-org',
+            owner=self.owner
+        )
+        restored = restore_archive(target, output)
+
+        self.assertEqual(restored['accounting.Account'], 3)
+        self.assertEqual(restored['accounting.TransactionEntry'], 2)
+
+        cash = Account.objects.get(organization=target, code='1000')
+        self.assertNotEqual(cash.pk, self.cash.pk)
+        self.assertEqual(cash.parent.organization, target)
+        self.assertEqual(cash.parent.code, '1')
+        self.assertEqual(Account.objects.get(organization=target, code='1').created_by, self.owner)
+
+        entry = TransactionEntry.objects.get(account=cash)
+        self.assertEqual(entry.amount, Decimal('99.95'))
+        self.assertEqual(entry.transaction.organization, target)
+
+    def test_restore_keeps_many_to_many_links(self):
+        first, second = (
+            Document.objects.create(
+                organization=self.organization,
+                title=title,
+                file=f'documents/{title}.pdf',
+                original_filename=f'{title}.pdf'
+            )
+            for title in ('contract', 'amendment')
+        )
+        first.related_documents.add(second)
+        conversation = Conversation.objects.create(organization=self.organization, name='Close')
+        message = Message.objects.create(conversation=conversation, content='@owner')
+        message.mentions.add(self.owner)
+
+        output = io.BytesIO()
+        write_archive(self.organization, output)
+        output.seek(0)
+        target = Organization.objects.create(name='Target Org', slug='target-org', owner=self.owner)
+        restore_archive(target, output)
+
+        contract = Document.objects.get(organization=target, title='contract')
+        self.assertEqual(
+            [document.title for document in contract.related_documents.all()],
+            ['amendment']
+        )
+        self.assertEqual(contract.related_documents.get().organization, target)
+        restored = Message.objects.get(conversation__organization=target)
+        self.assertEqual(list(restored.mentions.all()), [self.owner])
+
+    def test_archive_leaves_out_invitation_tokens(self):
+        OrganizationInvitation.objects.create(
+            organization=self.organization,
+            email='invitee@test.com',
+            token='secret-invitation-token'
+        )
+        output = io.BytesIO()
+        write_archive(self.organization, output)
+
+        with zipfile.ZipFile(output) as archive:
+            row = json.loads(archive.read('organizations.OrganizationInvitation.ndjson'))
+        self.assertEqual(row['email'], 'invitee@test.com')
+        self.assertNotIn('token', row)
+        self.assertNotIn(b'secret-invitation-token', output.getvalue())
+
+
+class OrganizationExportDownloadTests(TestCase):
+    def setUp(self):
+        self.private_root = tempfile.TemporaryDirectory()
+        self.settings_override = override_settings(PRIVATE_MEDIA_ROOT=self.private_root.name)
+        self.settings_override.enable()
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@test.com',
+            password='testpass123'
+        )
+        self.organization = Organization.objects.create(
+            name='Source Org',
+            slug='source-org',
+            owner=self.owner
+        )
+        self.organization.add_member(self.owner, role='owner')
+        self.client = APIClient()
+
+    def tearDown(self):
+        self.settings_override.disable()
+        self.private_root.cleanup()
+
+    def export(self):
+        with patch('users.tasks.send_notification_email.delay') as send:
+            path = export_organization_data(self.organization.pk, self.owner.pk)
+        link = urlparse(send.call_args[0][2].split()[5])
+        return path, link.path, parse_qs(link.query)['token'][0]
+
+    def test_export_is_stored_privately_and_downloaded_with_the_signed_link(self):
+        path, url, token = self.export()
+
+        self.assertTrue(export_storage().exists(path))
+        self.assertNotIn(self.organization.slug, path)
+        self.assertEqual(url, reverse('organizations:organization-download-export'))
+        response = self.client.get(url, {'token': token})
+        self.assertEqual(response.status_code, 200)
+        with zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content))) as archive:
+            self.assertIn('manifest.json', archive.namelist())
+
+    def test_tampered_or_expired_links_are_refused(self):
+        _path, url, token = self.export()
+
+        self.assertEqual(self.client.get(url, {'token': token + 'x'}).status_code, 403)
+        self.assertEqual(self.client.get(url).status_code, 403)
+        with override_settings(ORGANIZATION_EXPORT_LINK_MAX_AGE=-1):
+            self.assertEqual(self.client.get(url, {'token': token}).status_code, 403)
+
+    def test_links_stop_working_when_the_user_loses_access(self):
+        _path, url, token = self.export()
+        self.organization.memberships.filter(user=self.owner).update(role='member')
+
+        self.assertEqual(self.client.get(url, {'token': token}).status_code, 403)
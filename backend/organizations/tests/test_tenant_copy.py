@@ -0,0 +1,78 @@
+from django.test import TestCase
+from django.contrib.auth import get_user_model
+from decimal import Decimal
+from organizations.models import Organization
+from organizations.tenant_copy import TenantCopier, tenant_models
+from accounting.integrity import ledger_checksum
+from accounting.models import Account, Transaction, TransactionEntry
+from messaging.models import Conversation, Message
+
+User = get_user_model()
+
+class TenantCopyTests(TestCase):
+    def setUp(self):
+        self.owner = User.objects.create_user(
+            username='owner',
+            email='owner@test.com',
+            password='testpass123'
+        )
+        self.organization = Organization.objects.create(
+            name='Noisy Tenant',
+            slug='noisy-tenant',
+            owner=self.owner
+        )
+        parent = Account.objects.create(
+            organization=self.organization,
+            name='Assets',
+            code='1',
+            account_type='asset'
+        )
+        cash = Account.objects.create(
+            organization=self.organization,
+            name='Cash',
+            code='1000',
+            account_type='asset',
+            parent=parent
+        )
+        revenue = Account.objects.create(
+            organization=self.organization,
+            name='Revenue',
+            code='4000',
+            account_type='income'
+        )
+        for amount in ('10.00', '32.50'):
+            trans = Transaction.objects.create(
+                organization=self.organization,
+                date='2024-03-01',
+                description='Sale'
+            )
+            TransactionEntry.objects.create(transaction=trans, account=cash, amount=Decimal(amount))
+            TransactionEntry.objects.create(transaction=trans, account=revenue, amount=-Decimal(amount))
+        conversation = Conversation.objects.create(organization=self.organization)
+        first = Message.objects.create(conversation=conversation, sender=self.owner, content='Hi')
+        Message.objects.create(conversation=conversation, sender=self.owner, content='Re', parent=first)
+
+    def test_dependency_order(self):
+        order = list(tenant_models())
+        self.assertLess(order.index(Account), order.index(TransactionEntry))
+        self.assertLess(order.index(Transaction), order.index(TransactionEntry))
+        self.assertLess(order.index(Conversation), order.index(Message))
+        self.assertEqual(tenant_models()[TransactionEntry].split('__')[-1], 'organization')
+
+    def test_copy_and_verify(self):
+        copy = TenantCopier(self.organization, new_slug='noisy-tenant-copy').run()
+
+        self.assertNotEqual(copy.pk, self.organization.pk)
+        self.assertEqual(copy.owner, self.owner)
+        self.assertEqual(
+            ledger_checksum(copy),
+            ledger_checksum(self.organization)
+        )
+        cash = Account.objects.get(organization=copy, code='1000')
+        self.assertEqual(cash.parent.organization, copy)
+        self.assertEqual(
+            set(cash.entries.values_list('transaction__organization', flat=True)),
+            {copy.pk}
+        )
+        reply = Message.objects.get(conversation__organization=copy, content='Re')
+        self.assertEqual(reply.parent.conversation.organization, copy)
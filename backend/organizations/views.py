@@ -5,9 +5,8 @@ from rest_framework.response import Response
 from django.shortcuts import get_object_or_404
 from django.utils.translation import gettext_lazy as _
 from django.db.models import Q
-from django.http import HttpResponse
+from django.http import FileResponse, StreamingHttpResponse
 import csv
-import json
 from datetime import datetime
 from .models import Organization, OrganizationMembership, OrganizationInvitation, Incentive
 from .serializers import (
@@ -20,6 +19,8 @@ from django.core.mail import send_mail
 import os
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from .stripe_utils import create_stripe_customer
+from .backup import estimate_rows, export_storage, iter_archive, load_export
+from .tasks import export_organization_data
 import stripe
 from django.conf import settings
 from django.template.loader import render_to_string
@@ -152,46 +153,64 @@ class OrganizationViewSet(viewsets.ModelViewSet):
                 status=status.HTTP_403_FORBIDDEN
             )
         
-        # Prepare data for export
-        data = {
-            'organization': {
-                'name': organization.name,
-                'type': organization.organization_type,
-                'created_at': organization.created_at.isoformat(),
-            },
-            'members': [],
-            'invitations': []
-        }
-        
-        # Add member data
-        for membership in organization.memberships.all():
-            data['members'].append({
-                'email': membership.user.email,
-                'role': membership.role,
-                'joined_at': membership.joined_at.isoformat()
-            })
-        
-        # Add invitation data
-        for invitation in organization.invitations.all():
-            data['invitations'].append({
-                'email': invitation.email,
-                'status': invitation.status,
-                'created_at': invitation.created_at.isoformat()
-            })
+        # Large tenants are archived by a worker and delivered by email
+        row_limit = getattr(settings, 'ORGANIZATION_EXPORT_SYNC_ROW_LIMIT', 100000)
+        if (request.query_params.get('background') == 'true'
+                or estimate_rows(organization) > row_limit):
+            task = export_organization_data.delay(organization.id, request.user.id)
+            return Response(
+                {'detail': _("Export started, a download link will be emailed"),
+                 'task_id': task.id},
+                status=status.HTTP_202_ACCEPTED
+            )
         
         # Generate filename
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-        filename = f"organization_export_{organization.slug}_{timestamp}.json"
+        filename = f"organization_export_{organization.slug}_{timestamp}.zip"
         
-        # Create the response
-        response = HttpResponse(
-            json.dumps(data, indent=2),
-            content_type='application/json'
+        # Stream the archive as it is built
+        response = StreamingHttpResponse(
+            iter_archive(organization),
+            content_type='application/zip'
         )
         response['Content-Disposition'] = f'attachment; filename="{filename}"'
         
         return response
 
+    @action(detail=False, methods=['get'], permission_classes=[AllowAny],
+            authentication_classes=[], url_path='download-export')
+    def download_export(self, request):
+        # The signed link is the credential; it expires and is bound to a
+        # user who must still be an owner or admin of the organization
+        export = load_export(request.query_params.get('token', ''))
+        if export is None:
+            return Response(
+                {'detail': _("This download link is invalid or has expired")},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        organization_id, user_id, path = export
+        if not OrganizationMembership.objects.filter(
+            organization_id=organization_id,
+            user_id=user_id,
+            role__in=['owner', 'admin']
+        ).exists():
+            return Response(
+                {'detail': _("Only owners and admins can export data")},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        storage = export_storage()
+        if not storage.exists(path):
+            return Response(
+                {'detail': _("This export is no longer available")},
+                status=status.HTTP_404_NOT_FOUND
+            )
+        return FileResponse(
+            storage.open(path, 'rb'),
+            as_attachment=True,
+            filename=f"organization_export_{organization_id}.zip",
+            content_type='application/zip'
+        )
+
     @action(detail=True, methods=['post'])
     def create_team(self, request, pk=None):
         organization = self.get_object()
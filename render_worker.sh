@@ -0,0 +1,7 @@
+#!/usr/bin/env bash
+# exit on error
+set -o errexit
+
+# Start the document rendering worker: --pool=solo keeps the worker process
+# non-daemonic so rendering batches can use a process pool
+celery -A lynkledger_api worker -l info -Q rendering --pool=solo -n render@%h